@@ -1,8 +1,15 @@
 from fastapi import FastAPI, Query, HTTPException
+from fastapi.responses import PlainTextResponse
 from typing import Optional
 import os, psycopg
-from dateutil import parser as dparse
 from calendar import monthrange
+from datetime import date
+import metrics
+import merchants
+
+SUGGEST_POOL = int(os.getenv("SUGGEST_POOL", "40"))  # nearest merchants searched for categorized neighbours
+SUGGEST_MIN_SIMILARITY = float(os.getenv("SUGGEST_MIN_SIMILARITY", "0.3"))  # cosine; below it a merchant doesn't vote
+SUGGEST_EF_SEARCH = int(os.getenv("SUGGEST_EF_SEARCH", "100"))  # HNSW candidate list; also caps the pool
 
 DB_DSN = (
     f"host={os.environ['POSTGRES_HOST']} "
@@ -12,19 +19,26 @@ DB_DSN = (
     f"password={os.environ.get('POSTGRES_RO_PASSWORD', os.environ['POSTGRES_PASSWORD'])}"
 )
 
+metrics.set_service("api")
 app = FastAPI(title="Finance OS API", version="0.1.0")
+app.middleware("http")(metrics.http_middleware)
 
 def rows(q, cur):
     cols = [d[0] for d in cur.description]
     return [dict(zip(cols, r)) for r in q]
 
+def _parse_date(s: str) -> str:
+    # dateutil is only needed once someone actually filters by date; keep it off the startup path
+    from dateutil import parser as dparse
+    return dparse.parse(s).date().isoformat()
+
 def _coerce_date_start(s: str) -> str:
     # Accept YYYY-MM or any ISO-ish date; normalize to first day when month-only
     try:
         s = s.strip()
         if len(s) == 7 and s[4] == "-":  # YYYY-MM
             s = f"{s}-01"
-        return dparse.parse(s).date().isoformat()
+        return _parse_date(s)
     except Exception:
         raise HTTPException(status_code=400, detail=f"Invalid date: {s}")
 
@@ -35,14 +49,14 @@ def _coerce_date_end(s: str) -> str:
         if len(s) == 7 and s[4] == "-":  # YYYY-MM -> last day of month
             y, m = map(int, s.split("-"))
             s = f"{s}-{monthrange(y, m)[1]}"
-        return dparse.parse(s).date().isoformat()
+        return _parse_date(s)
     except Exception:
         raise HTTPException(status_code=400, detail=f"Invalid date: {s}")
 
 @app.get("/healthz")
 def healthz():
     try:
-        with psycopg.connect(DB_DSN, connect_timeout=3) as conn:
+        with psycopg.connect(DB_DSN, cursor_factory=metrics.TimedCursor, connect_timeout=3) as conn:
             with conn.cursor() as cur:
                 cur.execute("select 1")
                 cur.fetchone()
@@ -50,9 +64,13 @@ def healthz():
     except Exception as e:
         raise HTTPException(status_code=503, detail=str(e))
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
 @app.get("/accounts")
 def accounts():
-    with psycopg.connect(DB_DSN) as conn, conn.cursor() as cur:
+    with psycopg.connect(DB_DSN, cursor_factory=metrics.TimedCursor) as conn, conn.cursor() as cur:
         cur.execute("""
           select a.id, a.name, a.type, a.currency, a.mask, i.name as institution
           from accounts a
@@ -62,30 +80,115 @@ def accounts():
         """)
         return rows(cur.fetchall(), cur)
 
+# one point per bucket of step days, labelled with its last day: the closing balance, and
+# the low / high of the end-of-day balances in it (a day without transactions carries the
+# previous one). Each lateral is a range of daily_balances' primary key.
+BALANCES_SQL = """
+  with b as (
+    select d::date as day_start, least(d::date + %(step)s - 1, %(to)s::date) as day_end
+    from generate_series(%(frm)s::date, %(to)s::date, make_interval(days => %(step)s)) d
+  )
+  select b.day_end as day, c.balance, least(o.balance, r.low) as low, greatest(o.balance, r.high) as high,
+         coalesce(r.net, 0) as net, coalesce(r.tx_count, 0) as tx_count, c.anchored
+  from b
+  cross join lateral (
+    select x.balance, x.anchored from daily_balances x
+    where x.account_id = %(account_id)s and x.day <= b.day_end
+    order by x.day desc limit 1
+  ) c
+  left join lateral (
+    select min(x.day) as first_day, min(x.balance) as low, max(x.balance) as high,
+           sum(x.net) as net, sum(x.tx_count) as tx_count
+    from daily_balances x
+    where x.account_id = %(account_id)s and x.day between b.day_start and b.day_end
+  ) r on true
+  left join lateral (
+    select x.balance from daily_balances x
+    where x.account_id = %(account_id)s and x.day < b.day_start
+      and (r.first_day is null or r.first_day > b.day_start)
+    order by x.day desc limit 1
+  ) o on true
+  order by b.day_start
+"""
+
+@app.get("/accounts/{account_id}/balances")
+def account_balances(
+    account_id: int,
+    frm: Optional[str] = None,
+    to: Optional[str] = None,
+    points: int = Query(366, ge=2, le=5000),
+):
+    """
+    End-of-day balances kept by the pipeline's balances stage (pipeline/balances.py),
+    from the account's first day (or frm) to today (or to). Longer ranges than `points`
+    days come back as `points` buckets or fewer.
+    """
+    with psycopg.connect(DB_DSN, cursor_factory=metrics.TimedCursor) as conn, conn.cursor() as cur:
+        cur.execute("""
+          select a.currency, (select min(b.day) from daily_balances b where b.account_id = a.id)
+          from accounts a where a.id = %s
+        """, (account_id,))
+        acct = cur.fetchone()
+        if not acct:
+            raise HTTPException(status_code=404, detail=f"Unknown account: {account_id}")
+        end = date.fromisoformat(_coerce_date_end(to)) if to else date.today()
+        start = date.fromisoformat(_coerce_date_start(frm)) if frm else min(acct[1] or end, end)
+        if start > end:
+            raise HTTPException(status_code=400, detail="frm is after to")
+        step = -(-((end - start).days + 1) // points)
+        cur.execute(BALANCES_SQL, {"account_id": account_id, "frm": start, "to": end, "step": step})
+        series = rows(cur.fetchall(), cur)
+    return {"account_id": account_id, "currency": acct[0], "from": start, "to": end, "step_days": step,
+            "points": series}
+
+@app.get("/reconciliation")
+def reconciliation(
+    account_id: Optional[int] = None,
+    status: str = Query("open", pattern="^(open|resolved)$"),
+    limit: int = Query(100, ge=1, le=1000),
+):
+    # intervals between balance anchors that don't add up (pipeline/reconcile.py)
+    where = ["r.status = %s"]
+    params = [status]
+    if account_id:
+        where.append("r.account_id = %s")
+        params.append(account_id)
+    sql = f"""
+      select r.id, r.account_id, a.name as account, r.start_day, r.end_day, r.opening_source, r.closing_source,
+             r.expected, r.reported, r.difference, r.kind, r.status, r.teller_job_id,
+             r.detected_at, r.checked_at, r.resolved_at
+      from reconciliation_breaks r
+      join accounts a on a.id = r.account_id
+      where {" and ".join(where)}
+      order by r.end_day desc, r.id desc
+      limit %s
+    """
+    params.append(limit)
+
+    with psycopg.connect(DB_DSN, cursor_factory=metrics.TimedCursor) as conn, conn.cursor() as cur:
+        cur.execute(sql, params)
+        return rows(cur.fetchall(), cur)
+
+SPEND_MONTHLY_SQL = "select * from monthly_spend(%s::date, %s::date) order by month desc, spend desc"
+
 @app.get("/spend/monthly")
 def spend_monthly(frm: Optional[str] = Query(None), to: Optional[str] = Query(None)):
-    where = []
-    params = []
+    # whole months, as before; bounds go to monthly_spend() as posted_at dates so only the
+    # partitions in range get scanned (0017)
+    start = end = None
     if frm:
-        frm = _coerce_date_start(frm)
-        where.append("month >= date_trunc('month', %s::date)")
-        params.append(frm)
+        start = _coerce_date_start(frm)[:8] + "01"
     if to:
-        to = _coerce_date_end(to)
-        where.append("month <= date_trunc('month', %s::date)")
-        params.append(to)
+        end = _coerce_date_end(to)
+        y, m = int(end[:4]), int(end[5:7])
+        end = f"{end[:8]}{monthrange(y, m)[1]:02d}"
 
-    sql = "select * from v_monthly_spend"
-    if where:
-        sql += " where " + " and ".join(where)
-    sql += " order by month desc, spend desc"
-
-    with psycopg.connect(DB_DSN) as conn, conn.cursor() as cur:
-        cur.execute(sql, params)
+    with psycopg.connect(DB_DSN, cursor_factory=metrics.TimedCursor) as conn, conn.cursor() as cur:
+        cur.execute(SPEND_MONTHLY_SQL, (start, end))
         return rows(cur.fetchall(), cur)
 
-@app.get("/budget/status")
-def budget_status(period: Optional[str] = Query(None, description="YYYY-MM")):
+def budget_status_query(period=None):
+    """The /budget/status statement and its parameters."""
     where = []
     params = []
     if period:
@@ -97,50 +200,217 @@ def budget_status(period: Optional[str] = Query(None, description="YYYY-MM")):
     if where:
         sql += " where " + " and ".join(where)
     sql += " order by category"
+    return sql, params
 
-    with psycopg.connect(DB_DSN) as conn, conn.cursor() as cur:
+@app.get("/budget/status")
+def budget_status(period: Optional[str] = Query(None, description="YYYY-MM")):
+    sql, params = budget_status_query(period)
+    with psycopg.connect(DB_DSN, cursor_factory=metrics.TimedCursor) as conn, conn.cursor() as cur:
         cur.execute(sql, params)
         return rows(cur.fetchall(), cur)
 
+TRANSACTIONS_SQL = """
+  select
+    t.id, t.posted_at, t.amount, t.currency, t.description, t.normalized_desc,
+    t.account_id, t.external_tx_id, t.merchant_id, t.duplicate_of, t.transfer_of,
+    coalesce(string_agg(c.code, ',' order by c.code) filter (where c.code is not null), '') as categories
+  from transactions t
+  left join tx_splits s on s.transaction_id = t.id
+  left join categories c on c.id = s.category_id
+  {where}
+  group by t.id, t.posted_at order by t.posted_at desc, t.id desc limit %s offset %s
+"""
+
+def transactions_query(account_id=None, merchant_id=None, frm=None, to=None, uncategorized=False,
+                       duplicates=False, transfers=True, limit=100, offset=0):
+    """The /transactions statement and its parameters; frm / to are already coerced."""
+    # suppressed cross-source duplicates (pipeline/dedupe.py) are hidden unless asked for
+    where = [] if duplicates else ["t.duplicate_of is null"]
+    params = []
+    if account_id:
+        where.append("t.account_id = %s")
+        params.append(account_id)
+    if merchant_id:
+        where.append("t.merchant_id = %s")
+        params.append(merchant_id)
+    if frm:
+        where.append("t.posted_at >= %s::date")
+        params.append(frm)
+    if to:
+        where.append("t.posted_at <= %s::date")
+        params.append(to)
+    if not transfers:
+        # legs of a matched transfer between our own accounts (pipeline/transfers.py)
+        where.append("t.transfer_of is null")
+    if uncategorized:
+        where.append("not exists (select 1 from tx_splits s where s.transaction_id = t.id)")
+    params.extend([limit, offset])
+    return TRANSACTIONS_SQL.format(where="where " + " and ".join(where) if where else ""), params
+
 @app.get("/transactions")
 def transactions(
     account_id: Optional[int] = None,
+    merchant_id: Optional[int] = None,
     frm: Optional[str] = None,
     to: Optional[str] = None,
     uncategorized: bool = False,
+    duplicates: bool = False,
+    transfers: bool = True,
     limit: int = Query(100, ge=1, le=1000),
     offset: int = Query(0, ge=0),
 ):
-    where = []
+    sql, params = transactions_query(account_id, merchant_id, _coerce_date_start(frm) if frm else None,
+                                     _coerce_date_end(to) if to else None, uncategorized, duplicates,
+                                     transfers, limit, offset)
+    with psycopg.connect(DB_DSN, cursor_factory=metrics.TimedCursor) as conn, conn.cursor() as cur:
+        cur.execute(sql, params)
+        return rows(cur.fetchall(), cur)
+
+MERCHANT_SPEND_SQL = """
+  select m.id, m.display_name, m.canonical_name, s.tx_count, s.spend, s.last_seen
+  from (
+    select t.merchant_id, count(*) as tx_count,
+           coalesce(sum(-t.amount) filter (where t.amount < 0), 0) as spend,
+           max(t.posted_at) as last_seen
+    from transactions t
+    where {where}
+    group by t.merchant_id
+  ) s
+  join merchants m on m.id = s.merchant_id
+  order by s.spend desc, m.id
+  limit %s
+"""
+
+def merchant_spend_query(frm=None, to=None, limit=50):
+    """The /merchants statement and its parameters; frm / to are already coerced."""
+    # grouped on the integer merchant_id filled at ingest (common/merchants.py)
+    where = ["t.merchant_id is not null", "t.duplicate_of is null", "t.transfer_of is null"]
     params = []
-    if account_id:
-        where.append("t.account_id = %s")
-        params.append(account_id)
     if frm:
-        frm = _coerce_date_start(frm)
         where.append("t.posted_at >= %s::date")
         params.append(frm)
     if to:
-        to = _coerce_date_end(to)
         where.append("t.posted_at <= %s::date")
         params.append(to)
-    if uncategorized:
-        where.append("not exists (select 1 from tx_splits s where s.transaction_id = t.id)")
+    params.append(limit)
+    return MERCHANT_SPEND_SQL.format(where=" and ".join(where)), params
 
-    sql = """
-      select
-        t.id, t.posted_at, t.amount, t.currency, t.description, t.normalized_desc,
-        t.account_id, t.external_tx_id,
-        coalesce(string_agg(c.code, ',' order by c.code) filter (where c.code is not null), '') as categories
-      from transactions t
-      left join tx_splits s on s.transaction_id = t.id
-      left join categories c on c.id = s.category_id
-    """
+@app.get("/merchants")
+def merchant_spend(
+    frm: Optional[str] = None,
+    to: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=1000),
+):
+    sql, params = merchant_spend_query(_coerce_date_start(frm) if frm else None,
+                                       _coerce_date_end(to) if to else None, limit)
+    with psycopg.connect(DB_DSN, cursor_factory=metrics.TimedCursor) as conn, conn.cursor() as cur:
+        cur.execute(sql, params)
+        return rows(cur.fetchall(), cur)
+
+RECURRING_COLUMNS = """
+  r.id, r.account_id, r.merchant_id, coalesce(m.display_name, r.normalized_desc) as name, r.cadence,
+  r.period_days, r.amount, r.occurrences, r.first_posted_at, r.last_posted_at, r.next_expected,
+  r.next_amount, r.confidence, r.active
+"""
+
+@app.get("/recurring")
+def recurring(
+    account_id: Optional[int] = None,
+    cadence: Optional[str] = Query(None, pattern="^(weekly|biweekly|monthly|quarterly|annual)$"),
+    active: bool = True,
+):
+    # series kept by the pipeline's recurring stage (pipeline/recurring.py)
+    where = ["r.active"] if active else []
+    params = []
+    if account_id:
+        where.append("r.account_id = %s")
+        params.append(account_id)
+    if cadence:
+        where.append("r.cadence = %s")
+        params.append(cadence)
+    sql = f"select {RECURRING_COLUMNS} from recurring_series r left join merchants m on m.id = r.merchant_id"
     if where:
         sql += " where " + " and ".join(where)
-    sql += " group by t.id order by t.posted_at desc, t.id desc limit %s offset %s"
-    params.extend([limit, offset])
+    sql += " order by r.next_expected, r.id"
 
-    with psycopg.connect(DB_DSN) as conn, conn.cursor() as cur:
+    with psycopg.connect(DB_DSN, cursor_factory=metrics.TimedCursor) as conn, conn.cursor() as cur:
         cur.execute(sql, params)
         return rows(cur.fetchall(), cur)
+
+@app.get("/recurring/upcoming")
+def recurring_upcoming(days: int = Query(30, ge=1, le=400)):
+    """Active series expected to charge in the next `days` days (or overdue), with their total."""
+    with psycopg.connect(DB_DSN, cursor_factory=metrics.TimedCursor) as conn, conn.cursor() as cur:
+        cur.execute(f"""
+          select {RECURRING_COLUMNS}
+          from recurring_series r
+          left join merchants m on m.id = r.merchant_id
+          where r.active and r.next_expected <= current_date + %s
+          order by r.next_expected, r.id
+        """, (days,))
+        items = rows(cur.fetchall(), cur)
+    return {"days": days, "total": sum(i["next_amount"] for i in items), "items": items}
+
+SUGGEST_SQL = """
+  with nn as (
+    select m.id, m.embedding <=> %(q)s::vector as dist
+    from merchants m
+    where m.embedding is not null
+    order by m.embedding <=> %(q)s::vector
+    limit %(pool)s
+  )
+  select x.transaction_id, x.normalized_desc, x.posted_at, nn.id as merchant_id,
+         round((1 - nn.dist)::numeric, 4) as similarity, c.id as category_id, c.code as category
+  from nn
+  cross join lateral (
+    select t.id as transaction_id, t.normalized_desc, t.posted_at, s.category_id
+    from transactions t
+    join tx_splits s on s.transaction_id = t.id
+    where t.merchant_id = nn.id and s.category_id is not null and t.id <> %(exclude)s
+    order by t.posted_at desc
+    limit %(k)s
+  ) x
+  join categories c on c.id = x.category_id
+  where nn.dist <= 1 - %(min_sim)s
+  order by nn.dist, x.posted_at desc
+  limit %(k)s
+"""
+
+def _suggest(cur, vec, k, exclude=0):
+    # nearest merchants by embedding (HNSW, 0022), then their latest categorized transactions
+    pool = max(SUGGEST_POOL, k)
+    cur.execute("select set_config('hnsw.ef_search', %s, true)", (str(max(SUGGEST_EF_SEARCH, pool)),))
+    cur.execute(SUGGEST_SQL, {"q": vec, "pool": pool, "k": k, "exclude": exclude,
+                              "min_sim": SUGGEST_MIN_SIMILARITY})
+    neighbors = rows(cur.fetchall(), cur)
+    votes = {}
+    for n in neighbors:
+        v = votes.setdefault(n["category_id"], {"category_id": n["category_id"], "category": n["category"],
+                                                "votes": 0, "score": 0})
+        v["votes"] += 1
+        v["score"] += n["similarity"]
+    categories = sorted(votes.values(), key=lambda v: (-v["score"], v["category"]))
+    return {"categories": categories, "neighbors": neighbors}
+
+@app.get("/suggestions")
+def suggestions(desc: str = Query(..., min_length=1), k: int = Query(10, ge=1, le=100)):
+    """Categories of the k categorized transactions whose merchants read most like desc."""
+    name = merchants.canonical_name(merchants.normalize_desc(desc))
+    with psycopg.connect(DB_DSN, cursor_factory=metrics.TimedCursor) as conn, conn.cursor() as cur:
+        return {"query": name, **_suggest(cur, merchants.embed(name), k)}
+
+@app.get("/transactions/{tx_id}/suggestions")
+def transaction_suggestions(tx_id: int, k: int = Query(10, ge=1, le=100)):
+    with psycopg.connect(DB_DSN, cursor_factory=metrics.TimedCursor) as conn, conn.cursor() as cur:
+        cur.execute("""
+          select t.normalized_desc, m.canonical_name, m.embedding::text
+          from transactions t
+          left join merchants m on m.id = t.merchant_id
+          where t.id = %s
+        """, (tx_id,))
+        row = cur.fetchone()
+        if not row:
+            raise HTTPException(status_code=404, detail=f"transaction {tx_id} not found")
+        desc, name, vec = row
+        name = name or merchants.canonical_name(desc or "")
+        return {"query": name, **_suggest(cur, vec or merchants.embed(name), k, exclude=tx_id)}
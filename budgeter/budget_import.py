@@ -1,5 +1,6 @@
 import os, yaml
 import psycopg
+import profiling
 from calendar import monthrange
 from datetime import date
 
@@ -19,7 +20,7 @@ def month_bounds(ym: str):
     end = date(y, m, monthrange(y, m)[1])
     return start, end
 
-def main():
+def run(conn):
     period = os.getenv("BUDGET_PERIOD", "")
     if not period:
         period = date.today().strftime("%Y-%m")
@@ -29,24 +30,28 @@ def main():
     with open(BUDGET_FILE, "r") as f:
         data = yaml.safe_load(f) or {}
 
-    with psycopg.connect(PG_DSN, autocommit=True) as conn:
-        with conn.cursor() as cur:
-            cur.execute("select id, code from categories")
-            code_to_id = {code: _id for _id, code in cur.fetchall()}
-
-            for code, amount in data.items():
-                cat_id = code_to_id.get(code)
-                if not cat_id:
-                    print(f"[budget] skip unknown category {code}")
-                    continue
-                cur.execute("""
-                  insert into budgets(category_id, period_start, period_end, amount)
-                  values (%s,%s,%s,%s)
-                  on conflict (category_id, period_start, period_end)
-                  do update set amount = excluded.amount
-                """, (cat_id, start, end, float(amount)))
+    with conn.cursor() as cur:
+        cur.execute("select id, code from categories")
+        code_to_id = {code: _id for _id, code in cur.fetchall()}
+
+        for code, amount in data.items():
+            cat_id = code_to_id.get(code)
+            if not cat_id:
+                print(f"[budget] skip unknown category {code}")
+                continue
+            cur.execute("""
+              insert into budgets(category_id, period_start, period_end, amount)
+              values (%s,%s,%s,%s)
+              on conflict (category_id, period_start, period_end)
+              do update set amount = excluded.amount
+            """, (cat_id, start, end, float(amount)))
 
     print(f"[budget] imported budgets for {period}")
 
+@profiling.profiled("budgeter")
+def main():
+    with psycopg.connect(PG_DSN, autocommit=True) as conn:
+        run(conn)
+
 if __name__ == "__main__":
     main()
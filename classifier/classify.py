@@ -1,6 +1,8 @@
-import os, yaml, re
-from datetime import date, timedelta
+import os
 import psycopg
+import metrics
+import profiling
+import rules
 
 PG_DSN = (
     f"host={os.environ['POSTGRES_HOST']} "
@@ -10,86 +12,57 @@ PG_DSN = (
     f"password={os.environ['POSTGRES_PASSWORD']}"
 )
 
-RULES_PATH = os.getenv("RULES_PATH", "/app/config/rules.yaml")
 DAYS = int(os.getenv("CLASSIFY_LOOKBACK_DAYS", "120"))
+BATCH = 5000  # candidates categorized per insert
 
-def load_rules():
-    with open(RULES_PATH, "r") as f:
-        items = yaml.safe_load(f) or []
-    # normalize
-    rules = []
-    for r in items:
-        rules.append({
-            "name": r["name"],
-            "priority": int(r.get("priority", 100)),
-            "includes": [s.upper() for s in r.get("includes", [])],
-            "excludes": [s.upper() for s in r.get("excludes", [])],
-            "category_code": r["category_code"],
-            "amount_min": float(r.get("amount_min", -1e15)),
-            "amount_max": float(r.get("amount_max",  1e15)),
-        })
-    return sorted(rules, key=lambda x: x["priority"])
+# Writers categorize new transactions inline through rules.categorize(); this stage is
+# the safety net for rows written before a rule existed.
 
-def fetch_categories(cur):
-    cur.execute("select id, code from categories")
-    return {code: _id for _id, code in cur.fetchall()}
+# uncategorized outflows of the last DAYS days
+CANDIDATES_SQL = """
+  select t.id, t.account_id, t.posted_at, t.amount, t.normalized_desc
+  from transactions t
+  left join tx_splits s on s.transaction_id = t.id
+  where s.id is null
+    and t.amount < 0
+    and t.duplicate_of is null
+    and t.posted_at >= current_date - %(days)s::int
+"""
 
 def candidates(cur):
-    cur.execute(f"""
-      select t.id, t.account_id, t.posted_at, t.amount, t.normalized_desc
-      from transactions t
-      left join tx_splits s on s.transaction_id = t.id
-      where s.id is null
-        and t.amount < 0
-        and t.posted_at >= current_date - interval '{DAYS} days'
-    """)
+    cur.execute(CANDIDATES_SQL, {"days": DAYS})
     for row in cur.fetchall():
-        yield {
-            "id": row[0],
-            "account_id": row[1],
-            "posted_at": row[2],
-            "amount": float(row[3]),
-            "desc": (row[4] or "").upper()
-        }
+        yield row[0], (row[4] or "").upper(), row[3]
 
-def match_rule(tx, rule):
-    desc = tx["desc"]
-    if not desc:
-        return False
-    if not any(substr in desc for substr in rule["includes"]):
-        return False
-    if any(substr in desc for substr in rule["excludes"]):
-        return False
-    amt = tx["amount"]
-    if amt < rule["amount_min"] or amt > rule["amount_max"]:
-        return False
-    return True
-
-def apply_rules(conn, rules, cat_map):
-    n_applied = 0
+def apply_rules(conn):
+    n_applied = n_seen = 0
     with conn.cursor() as cur:
+        batch = []
         for tx in candidates(cur):
-            for rule in rules:
-                if match_rule(tx, rule):
-                    cat_id = cat_map.get(rule["category_code"])
-                    if not cat_id:
-                        continue
-                    cur.execute("""
-                      insert into tx_splits(transaction_id, category_id, amount, note)
-                      values (%s,%s,%s,%s)
-                      on conflict do nothing
-                    """, (tx["id"], cat_id, tx["amount"], f"rule:{rule['name']}"))
-                    n_applied += 1
-                    break
+            n_seen += 1
+            batch.append(tx)
+            if len(batch) >= BATCH:
+                n_applied += rules.categorize(cur, batch)
+                batch = []
+        n_applied += rules.categorize(cur, batch)
     conn.commit()
+    metrics.count_rows(n_applied, "categorized")
+    metrics.count_rows(n_seen - n_applied, "unmatched")
     print(f"[classify] applied {n_applied} splits")
+    return n_applied
+
+@metrics.job("classify")
+def run(conn):
+    return apply_rules(conn)
 
+@profiling.profiled("classifier")
 def main():
-    rules = load_rules()
-    with psycopg.connect(PG_DSN, autocommit=False) as conn:
-        with conn.cursor() as cur:
-            cat_map = fetch_categories(cur)
-        apply_rules(conn, rules, cat_map)
+    metrics.set_service("classifier")
+    try:
+        with psycopg.connect(PG_DSN, autocommit=False, cursor_factory=metrics.TimedCursor) as conn:
+            run(conn)
+    finally:
+        metrics.push()
 
 if __name__ == "__main__":
     main()
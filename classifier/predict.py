@@ -0,0 +1,268 @@
+# predict.py
+# Category predictions for what the rules left uncategorized (runs right after classify).
+# Each run trains a linear softmax on the existing tx_splits labels (manual and rule:
+# splits, never its own ml: ones), then scores the uncategorized rows of the last
+# CLASSIFY_LOOKBACK_DAYS in batches. Outflows only, on both sides, like the rules: the
+# categories are spending categories, and a paycheck, refund or transfer in would only
+# be pushed into the nearest one. Every score is upserted into category_predictions
+# under MODEL_VERSION. One at or above ML_APPLY_THRESHOLD also becomes a tx_splits row
+# noted ml:<MODEL_VERSION>. numpy only, on the CPU.
+#
+#   docker compose run --rm classifier python /app/predict.py
+
+import os, sys, zlib, time
+import psycopg
+import metrics
+import profiling
+import merchants
+# numpy is imported inside the functions that use it: importing this module (the
+# pipeline daemon does at startup) shouldn't pay for it.
+
+PG_DSN = (
+    f"host={os.environ['POSTGRES_HOST']} "
+    f"port={os.environ['POSTGRES_PORT']} "
+    f"dbname={os.environ['POSTGRES_DB']} "
+    f"user={os.environ['POSTGRES_USER']} "
+    f"password={os.environ['POSTGRES_PASSWORD']}"
+)
+
+# bump when features or training change: predictions are keyed by it
+MODEL_VERSION = "ngram-lr-1"
+DAYS = int(os.getenv("CLASSIFY_LOOKBACK_DAYS", "120"))            # transactions scored
+APPLY_THRESHOLD = float(os.getenv("ML_APPLY_THRESHOLD", "0.9"))   # confidence that becomes a tx_splits row; >1 = never
+MIN_LABELS = int(os.getenv("ML_MIN_LABELS", "50"))
+TRAIN_MAX = int(os.getenv("ML_TRAIN_MAX", "200000"))              # most recent labelled transactions used
+EPOCHS = int(os.getenv("ML_EPOCHS", "8"))
+BATCH = int(os.getenv("ML_BATCH", "5000"))                        # transactions scored / written per round
+HASH_BITS = 18
+MINIBATCH = 512
+LEARNING_RATE = 0.5
+HOLDOUT = 10  # every 10th labelled transaction (by id) is held out for the accuracy report
+
+
+def features(desc, amount, merchant_id):
+    """
+    Hashed feature ids: char 3/4-grams and words of the canonical merchant name (store
+    numbers, dates and card suffixes carry no signal), amount sign/size, merchant id.
+    """
+    name = merchants.canonical_name(desc)
+    text = f" {name} "
+    keys = {text[i:i + n] for n in (3, 4) for i in range(len(text) - n + 1)}
+    keys.update("w:" + w for w in name.split())
+    keys.add(f"a:{'-' if amount < 0 else '+'}{min(len(str(int(abs(amount)))), 6)}")
+    if merchant_id is not None:
+        keys.add(f"m:{merchant_id}")
+    mask = (1 << HASH_BITS) - 1
+    # id 0 is the bias: every row has it, so np.add.reduceat never sees an empty row
+    return [0] + [(zlib.crc32(k.encode("utf-8")) & mask) or 1 for k in keys]
+
+
+class Featurizer:
+    """features() memoized per (description, amount bucket, merchant): descriptions repeat a lot."""
+
+    def __init__(self):
+        self.cache = {}
+
+    def __call__(self, rows):
+        import numpy as np
+        ids, starts = [], []
+        for desc, amount, merchant_id in rows:
+            key = (desc, amount < 0, min(len(str(int(abs(amount)))), 6), merchant_id)
+            f = self.cache.get(key)
+            if f is None:
+                f = self.cache[key] = features(desc, amount, merchant_id)
+            starts.append(len(ids))
+            ids.extend(f)
+        return np.asarray(ids, dtype=np.int64), np.asarray(starts, dtype=np.int64)
+
+
+def take(ids, starts, pos):
+    """Rows pos of a (feature ids, row starts) block, as a new contiguous block."""
+    import numpy as np
+    ends = np.append(starts[1:], len(ids))
+    lens = ends[pos] - starts[pos]
+    offsets = np.cumsum(lens) - lens
+    return ids[np.repeat(starts[pos] - offsets, lens) + np.arange(lens.sum())], offsets
+
+
+class Model:
+    """Multinomial logistic regression over hashed sparse features, trained with minibatch Adagrad."""
+
+    def __init__(self, classes):
+        import numpy as np
+        self.classes = np.asarray(classes, dtype=np.int64)  # category ids, one per output
+        self.W = np.zeros((1 << HASH_BITS, len(classes)), dtype=np.float32)
+        self.G = np.full(1 << HASH_BITS, 1e-6, dtype=np.float32)  # Adagrad accumulator per feature
+        self.seen = np.zeros(1 << HASH_BITS, dtype=np.float32)     # 1 = feature occurred in training
+
+    def _proba(self, ids, starts):
+        import numpy as np
+        z = np.add.reduceat(self.W[ids], starts, axis=0)
+        z -= z.max(axis=1, keepdims=True)
+        np.exp(z, out=z)
+        z /= z.sum(axis=1, keepdims=True)
+        return z
+
+    def fit(self, ids, starts, y):
+        """y: class index per row."""
+        import numpy as np
+        n = len(starts)
+        self.seen[ids] = 1.0
+        self.seen[0] = 0.0  # the bias says nothing about familiarity
+        rng = np.random.default_rng(0)
+        for _ in range(EPOCHS):
+            for chunk in np.array_split(rng.permutation(n), max(1, n // MINIBATCH)):
+                b_ids, b_starts = take(ids, starts, chunk)
+                lens = np.diff(np.append(b_starts, len(b_ids)))
+                grad = self._proba(b_ids, b_starts)
+                grad[np.arange(len(chunk)), y[chunk]] -= 1.0
+                feat, inv = np.unique(b_ids, return_inverse=True)
+                g = np.zeros((len(feat), grad.shape[1]), dtype=np.float32)
+                np.add.at(g, inv, np.repeat(grad, lens, axis=0))
+                self.G[feat] += (g * g).sum(axis=1)
+                self.W[feat] -= LEARNING_RATE * g / np.sqrt(self.G[feat])[:, None]
+        return self
+
+    def predict(self, ids, starts):
+        """
+        (category id, confidence) arrays. The softmax has no "none of these", so its top
+        probability is scaled by the share of the row's features seen in training: a
+        merchant nobody has labelled yet can't reach APPLY_THRESHOLD.
+        """
+        import numpy as np
+        p = self._proba(ids, starts)
+        best = p.argmax(axis=1)
+        lens = np.diff(np.append(starts, len(ids))) - 1
+        familiar = np.add.reduceat(self.seen[ids], starts) / np.maximum(lens, 1)
+        return self.classes[best], p[np.arange(len(best)), best] * familiar
+
+
+def labelled(cur):
+    """One category per labelled outflow (its largest split), leaving out our own ml: splits."""
+    cur.execute("""
+      select distinct on (t.id) t.id, t.normalized_desc, t.amount, t.merchant_id, s.category_id
+      from tx_splits s
+      join transactions t on t.id = s.transaction_id
+      where s.category_id is not null and coalesce(s.note, '') not like 'ml:%%'
+        and t.amount < 0
+        and t.id in (select transaction_id from tx_splits order by transaction_id desc limit %s)
+      order by t.id, abs(s.amount) desc nulls last
+    """, (TRAIN_MAX,))
+    return cur.fetchall()
+
+
+def train(cur, featurize):
+    import numpy as np
+    rows = labelled(cur)
+    classes = sorted({r[4] for r in rows})
+    if len(rows) < MIN_LABELS or len(classes) < 2:
+        print(f"[predict] {len(rows)} labelled transaction(s) in {len(classes)} categor(ies): not training")
+        return None, None
+    index = {c: i for i, c in enumerate(classes)}
+    held = np.asarray([r[0] % HOLDOUT == 0 for r in rows])
+    ids, starts = featurize([((r[1] or ""), float(r[2]), r[3]) for r in rows])
+    y = np.asarray([index[r[4]] for r in rows], dtype=np.int64)
+    cats = np.asarray([r[4] for r in rows], dtype=np.int64)
+
+    t0 = time.perf_counter()
+    model = Model(classes).fit(*take(ids, starts, np.flatnonzero(~held)), y[~held])
+    train_s = time.perf_counter() - t0
+    report = {"labels": len(rows), "classes": len(classes), "train_s": train_s}
+    if held.any():
+        pred, conf = model.predict(*take(ids, starts, np.flatnonzero(held)))
+        truth, sure = cats[held], conf >= APPLY_THRESHOLD
+        report.update(holdout=int(held.sum()), accuracy=float((pred == truth).mean()),
+                      coverage=float(sure.mean()),
+                      precision=float((pred[sure] == truth[sure]).mean()) if sure.any() else None)
+    return model, report
+
+
+def candidates(cur):
+    """Uncategorized outflows in the lookback window, streamed in BATCH-sized lists."""
+    cur.execute(f"""
+      select t.id, t.normalized_desc, t.amount, t.merchant_id
+      from transactions t
+      where not exists (select 1 from tx_splits s where s.transaction_id = t.id)
+        and t.amount < 0
+        and t.duplicate_of is null
+        and t.posted_at >= current_date - interval '{DAYS} days'
+    """)
+    while True:
+        rows = cur.fetchmany(BATCH)
+        if not rows:
+            return
+        yield rows
+
+
+def write(cur, rows, cats, conf):
+    tx_ids = [r[0] for r in rows]
+    cur.execute("""
+      insert into category_predictions(transaction_id, predicted_category_id, model_version, confidence)
+      select p.id, p.cat, %s, p.conf
+      from unnest(%s::bigint[], %s::bigint[], %s::numeric[]) as p(id, cat, conf)
+      on conflict (transaction_id, model_version) do update set
+        predicted_category_id = excluded.predicted_category_id,
+        confidence            = excluded.confidence,
+        created_at            = now()
+    """, (MODEL_VERSION, tx_ids, cats.tolist(), [round(float(c), 4) for c in conf]))
+    sure = [i for i, c in enumerate(conf) if c >= APPLY_THRESHOLD]
+    if not sure:
+        return 0
+    cur.execute("""
+      insert into tx_splits(transaction_id, category_id, amount, note)
+      select p.id, p.cat, p.amount, %s
+      from unnest(%s::bigint[], %s::bigint[], %s::numeric[]) as p(id, cat, amount)
+      on conflict do nothing
+    """, (f"ml:{MODEL_VERSION}", [tx_ids[i] for i in sure], [int(cats[i]) for i in sure],
+          [rows[i][2] for i in sure]))
+    return cur.rowcount
+
+
+@metrics.job("predict")
+def run(conn):
+    featurize = Featurizer()
+    with conn.cursor() as cur:
+        model, report = train(cur, featurize)
+    if model is None:
+        return 0
+    n_scored = n_applied = 0
+    t0 = time.perf_counter()
+    # a named (server-side) cursor streams the candidates while the other one writes
+    with conn.cursor(name="predict_candidates") as read, conn.cursor() as cur:
+        for rows in candidates(read):
+            cats, conf = model.predict(*featurize([((r[1] or ""), float(r[2]), r[3]) for r in rows]))
+            n_applied += write(cur, rows, cats, conf)
+            n_scored += len(rows)
+    conn.commit()
+    infer_s = time.perf_counter() - t0
+    metrics.count_rows(n_scored, "predicted")
+    metrics.count_rows(n_applied, "categorized")
+    acc = ""
+    if "accuracy" in report:
+        precision = "-" if report["precision"] is None else f"{report['precision']:.3f}"
+        acc = (f" holdout={report['holdout']} accuracy={report['accuracy']:.3f}"
+               f" at>={APPLY_THRESHOLD}: coverage={report['coverage']:.3f} precision={precision}")
+    print(f"[predict] {MODEL_VERSION}: trained on {report['labels']} labels / {report['classes']} categories "
+          f"in {report['train_s']:.2f}s;{acc}")
+    print(f"[predict] scored {n_scored} in {infer_s:.2f}s, applied {n_applied} splits")
+    return n_applied
+
+
+@profiling.profiled("predict")
+def main():
+    metrics.set_service("predict")
+    try:
+        with psycopg.connect(PG_DSN, autocommit=False, cursor_factory=metrics.TimedCursor) as conn:
+            run(conn)
+    finally:
+        metrics.push()
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        print(f"[predict] ERROR: {e}", file=sys.stderr)
+        sys.exit(1)
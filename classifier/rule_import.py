@@ -0,0 +1,131 @@
+# rule_import.py
+# Load a rules YAML file (config/rules.yaml format) into the rules table, which is what
+# the classifier and the transaction writers read (common/rules.py). Rules are matched
+# by name. New ones are inserted, changed ones updated, and identical ones left alone.
+# With --prune, active rules missing from the file are deactivated. The whole import is
+# one transaction, so running writers get a single NOTIFY rules and recompile once.
+#
+#   docker compose run --rm classifier python /app/rule_import.py                     # RULES_PATH
+#   docker compose run --rm classifier python /app/rule_import.py /app/config/rules.yaml --prune --dry-run
+#
+# Per rule: name, priority (100), includes, excludes, category_code, amount_min,
+# amount_max, tags (tag names, created if missing; become set_tag_ids), active (true).
+
+import os
+import sys
+import argparse
+from decimal import Decimal
+
+import psycopg
+import yaml
+
+PG_DSN = (
+    f"host={os.environ['POSTGRES_HOST']} "
+    f"port={os.environ['POSTGRES_PORT']} "
+    f"dbname={os.environ['POSTGRES_DB']} "
+    f"user={os.environ['POSTGRES_USER']} "
+    f"password={os.environ['POSTGRES_PASSWORD']}"
+)
+
+RULES_PATH = os.getenv("RULES_PATH", "/app/config/rules.yaml")
+FIELDS = ("priority", "includes", "excludes", "category_id", "set_tag_ids", "amount_min", "amount_max", "active")
+
+
+def parse(path):
+    with open(path, "r") as f:
+        items = yaml.safe_load(f) or []
+    names = [r["name"] for r in items]
+    dupes = sorted({n for n in names if names.count(n) > 1})
+    if dupes:
+        raise SystemExit(f"duplicate rule name(s) in {path}: {', '.join(dupes)}")
+    return items
+
+
+def tag_ids(cur, names):
+    """{tag name: id}, creating the tags that don't exist yet."""
+    if not names:
+        return {}
+    cur.execute("insert into tags(name) select unnest(%s::text[]) on conflict (name) do nothing", (sorted(names),))
+    cur.execute("select name, id from tags where name = any(%s)", (sorted(names),))
+    return dict(cur.fetchall())
+
+
+def to_rows(cur, items):
+    """{name: (priority, includes, ...)} in the rules table's terms; unknown category codes abort."""
+    cur.execute("select code, id from categories")
+    categories = dict(cur.fetchall())
+    unknown = sorted({r["category_code"] for r in items if r.get("category_code") not in categories})
+    if unknown:
+        raise SystemExit(f"unknown category code(s): {', '.join(map(str, unknown))}")
+    tags = tag_ids(cur, {t for r in items for t in r.get("tags") or ()})
+    rows = {}
+    for r in items:
+        amin, amax = r.get("amount_min"), r.get("amount_max")
+        rows[r["name"]] = (
+            int(r.get("priority", 100)),
+            [s.upper() for s in r.get("includes") or []],
+            [s.upper() for s in r.get("excludes") or []],
+            categories[r["category_code"]],
+            sorted(tags[t] for t in r.get("tags") or ()) or None,
+            None if amin is None else Decimal(str(amin)).quantize(Decimal("0.01")),
+            None if amax is None else Decimal(str(amax)).quantize(Decimal("0.01")),
+            bool(r.get("active", True)),
+        )
+    return rows
+
+
+def existing(cur):
+    cur.execute(f"select name, {', '.join(FIELDS)} from rules")
+    return {r[0]: (r[1], r[2] or [], r[3] or [], r[4], sorted(r[5]) if r[5] else None, r[6], r[7],
+                   r[8] is not False)
+            for r in cur.fetchall()}
+
+
+def sync(cur, items, prune=False):
+    """Write parsed rules to the table; returns the names (added, changed, pruned) and the unchanged count."""
+    wanted = to_rows(cur, items)
+    have = existing(cur)
+    added = [n for n in wanted if n not in have]
+    changed = [n for n in wanted if n in have and have[n] != wanted[n]]
+    pruned = sorted(n for n, v in have.items() if n not in wanted and v[-1]) if prune else []
+
+    for name in added + changed:
+        cur.execute(f"""
+          insert into rules(name, {', '.join(FIELDS)}) values (%s, {', '.join(['%s'] * len(FIELDS))})
+          on conflict (name) do update set {', '.join(f'{f} = excluded.{f}' for f in FIELDS)}
+        """, (name,) + wanted[name])
+    if pruned:
+        cur.execute("update rules set active = false where name = any(%s)", (pruned,))
+    return added, changed, pruned, len(wanted) - len(added) - len(changed)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Import a rules YAML file into the rules table.")
+    ap.add_argument("path", nargs="?", default=RULES_PATH)
+    ap.add_argument("--prune", action="store_true", help="deactivate active rules that aren't in the file")
+    ap.add_argument("--dry-run", action="store_true")
+    args = ap.parse_args()
+
+    items = parse(args.path)
+    with psycopg.connect(PG_DSN) as conn, conn.cursor() as cur:
+        added, changed, pruned, unchanged = sync(cur, items, args.prune)
+
+        verb = "would import" if args.dry_run else "imported"
+        print(f"[rules] {verb} {args.path}: added={len(added)} updated={len(changed)} "
+              f"unchanged={unchanged} deactivated={len(pruned)}")
+        for label, names in (("+", added), ("~", changed), ("-", pruned)):
+            for n in names:
+                print(f"  {label} {n}")
+        if args.dry_run:
+            conn.rollback()
+        else:
+            cur.execute("select version from rules_version")
+            print(f"[rules] rules_version={cur.fetchone()[0]}")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except Exception as e:
+        print(f"[rules] ERROR: {e}", file=sys.stderr)
+        sys.exit(1)
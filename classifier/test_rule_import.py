@@ -0,0 +1,72 @@
+from decimal import Decimal as D
+
+import pytest
+
+import rules
+from rule_import import parse, sync
+
+ITEMS = [
+    {"name": "test coffee", "priority": 1, "includes": ["blue bottle"], "category_code": "DINING",
+     "amount_min": -30, "amount_max": -0.5, "tags": ["test-treats"]},
+    {"name": "test fuel", "includes": ["CHEVRON"], "excludes": ["car wash"], "category_code": "TRANSPORT"},
+]
+
+
+def test_parse(tmp_path):
+    path = tmp_path / "rules.yaml"
+    path.write_text("- name: rent\n  includes: [RENT]\n  category_code: RENT\n")
+    assert parse(path) == [{"name": "rent", "includes": ["RENT"], "category_code": "RENT"}]
+    path.write_text("")
+    assert parse(path) == []
+
+
+def test_parse_duplicate_names(tmp_path):
+    path = tmp_path / "rules.yaml"
+    path.write_text("- name: rent\n  category_code: RENT\n- name: rent\n  category_code: RENT\n")
+    with pytest.raises(SystemExit, match="duplicate rule name"):
+        parse(path)
+
+
+def test_sync_adds_then_leaves_alone(db):
+    with db.cursor() as cur:
+        assert sync(cur, ITEMS) == (["test coffee", "test fuel"], [], [], 0)
+        cur.execute("""
+          select r.priority, r.includes, r.excludes, c.code, r.amount_min, r.amount_max, r.active, g.name
+          from rules r join categories c on c.id = r.category_id left join tags g on g.id = any(r.set_tag_ids)
+          where r.name = 'test coffee'
+        """)
+        assert cur.fetchone() == (1, ["BLUE BOTTLE"], [], "DINING", D(-30), D("-0.50"), True, "test-treats")
+        # read back the same: nothing to write
+        assert sync(cur, ITEMS) == ([], [], [], 2)
+
+
+def test_sync_updates_and_prunes(db):
+    with db.cursor() as cur:
+        sync(cur, ITEMS)
+        edited = [dict(ITEMS[0], amount_max=-1)]
+        added, changed, pruned, unchanged = sync(cur, edited, prune=True)
+        assert (added, changed, unchanged) == ([], ["test coffee"], 0)
+        assert "test fuel" in pruned
+        cur.execute("select active from rules where name = 'test fuel'")
+        assert cur.fetchone() == (False,)
+        # a deactivated rule is not pruned again
+        assert "test fuel" not in sync(cur, edited, prune=True)[2]
+
+
+def test_sync_unknown_category(db):
+    with db.cursor() as cur:
+        with pytest.raises(SystemExit, match="NOPE"):
+            sync(cur, [{"name": "test bad", "includes": ["X"], "category_code": "NOPE"}])
+
+
+def test_current_recompiles_when_the_version_moves(db):
+    with db.cursor() as cur:
+        rules.invalidate()
+        before = rules.current(cur)
+        sync(cur, ITEMS)
+        # no NOTIFY seen yet: the compiled set stands until RULES_CHECK_SECONDS
+        assert rules.current(cur) is before
+        rules.invalidate()
+        after = rules.current(cur)
+        assert after.version > before.version
+        assert after.match("BLUE BOTTLE COFFEE", -4.5)[0] == "test coffee"
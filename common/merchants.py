@@ -0,0 +1,254 @@
+# merchants.py
+# Description normalization and merchant canonicalization shared by every transaction
+# writer (normalizer, teller-sync, teller_ingestor). Copied into those images as
+# /app/merchants.py; also a pipeline stage that backfills transactions.merchant_id.
+#
+#   norm = merchants.normalize_desc(desc)        # what goes in transactions.normalized_desc
+#   merchant_id = merchants.resolve(norm)        # merchants.id, created on first sight
+#
+# canonical_name() strips what varies between purchases at the same merchant (processor
+# prefixes, store numbers, dates, card suffixes, a trailing state code). A canonical name
+# maps to a merchant through merchant_aliases; an unseen one is first compared against
+# already-attributed transactions through the trigram index on normalized_desc
+# (ix_tx_normdesc_trgm) and only then gets a merchants row of its own.
+#
+# Merchant and alias rows are written on a separate autocommit connection: they are
+# dimension rows, so they must survive the caller's transaction rolling back, or ids
+# cached here would point at nothing.
+#
+# Each merchant also gets embed(canonical_name) in merchants.embedding (pgvector, HNSW
+# index from 0022): a hashed character n-gram vector, computed locally, that the API's
+# category suggestions search by cosine distance. Changing embed() means re-embedding:
+#   update merchants set embedding = null;   -- the merchants stage refills it
+
+import os, re, sys, math, zlib, threading
+
+import psycopg
+
+import metrics
+
+PG_DSN = (
+    f"host={os.environ['POSTGRES_HOST']} "
+    f"port={os.environ['POSTGRES_PORT']} "
+    f"dbname={os.environ['POSTGRES_DB']} "
+    f"user={os.environ['POSTGRES_USER']} "
+    f"password={os.environ['POSTGRES_PASSWORD']}"
+)
+
+SIMILARITY = float(os.getenv("MERCHANT_SIMILARITY", "0.6"))  # trigram match needed to join a known merchant
+CACHE_MAX = int(os.getenv("MERCHANT_CACHE_MAX", "50000"))
+BACKFILL_BATCH = int(os.getenv("MERCHANT_BACKFILL_BATCH", "1000"))  # distinct descriptions per round
+EMBED_DIM = 256  # merchants.embedding is vector(256)
+
+_PREFIX = re.compile(
+    r"^(?:POS(?: DEBIT| PURCHASE)?|DEBIT(?: CARD)?(?: PURCHASE)?|CHECK ?CARD|PURCHASE(?: AUTHORIZED ON)?|"
+    r"RECURRING(?: PAYMENT)?|ACH(?: DEBIT| CREDIT)?|VISA|MC|SQ ?\*|TST ?\*|SP ?\*|PP ?\*|PAYPAL ?\*)\s*")
+_DATE = re.compile(r"\b\d{1,4}[/-]\d{1,2}(?:[/-]\d{2,4})?\b")
+_CARD = re.compile(r"(?:\bCARD\s*|\bX+|\*+)\d{2,}\b")
+_STORE = re.compile(r"(?:#|\bSTORE\s*#?|\bNO\.?\s*)\d+\b")
+_NUMBERY = re.compile(r"\S*\d\S*\d\S*\d\S*")  # any token with 3+ digits: refs, phone numbers, zips
+_PUNCT = re.compile(r"[^A-Z0-9&' ]+")
+_STATES = frozenset("""AL AK AZ AR CA CO CT DE FL GA HI ID IL IN IA KS KY LA ME MD MA MI MN MS MO MT NE NV NH NJ
+NM NY NC ND OH OK OR PA RI SC SD TN TX UT VT VA WA WV WI WY DC""".split())
+
+
+def normalize_desc(desc):
+    """The one normalized_desc: upper case, whitespace collapsed."""
+    return " ".join((desc or "").upper().split())
+
+
+def canonical_name(norm):
+    """Merchant key for a normalized description: 'SQ *BLUE BOTTLE #0412 OAKLAND CA 10/02' -> 'BLUE BOTTLE OAKLAND'."""
+    s = norm
+    while True:
+        stripped = _PREFIX.sub("", s, count=1)
+        if stripped == s:
+            break
+        s = stripped
+    s = _DATE.sub(" ", s)
+    s = _CARD.sub(" ", s)
+    s = _STORE.sub(" ", s)
+    s = _NUMBERY.sub(" ", s)
+    tokens = _PUNCT.sub(" ", s).split()
+    if len(tokens) > 1 and tokens[-1] in _STATES:
+        tokens.pop()
+    return " ".join(tokens) or norm
+
+
+def embed(name):
+    """
+    Unit-length EMBED_DIM vector (pgvector text) of a canonical name: signed feature hashing of its
+    character 3-grams and (weighted double) whole words, so names that share words or
+    spellings land close by cosine distance.
+    """
+    vec = [0.0] * EMBED_DIM
+    text = f" {name} "
+    feats = [(text[i:i + 3], 1.0) for i in range(len(text) - 2)]
+    feats += [("w:" + w, 2.0) for w in name.split()]
+    for f, weight in feats:
+        h = zlib.crc32(f.encode("utf-8"))
+        vec[h % EMBED_DIM] += weight if h & 0x80000000 else -weight
+    norm = math.sqrt(sum(x * x for x in vec)) or 1.0
+    return vec_literal(x / norm for x in vec)
+
+
+def vec_literal(xs):
+    """pgvector text form; pass with a ::vector cast."""
+    return "[" + ",".join(f"{x:.5f}" for x in xs) + "]"
+
+
+class Resolver:
+    """Canonical name -> merchants.id, cached in process."""
+
+    def __init__(self, dsn=PG_DSN):
+        self.dsn = dsn
+        self._conn = None
+        self._by_desc = {}   # normalized_desc -> id
+        self._by_name = {}   # canonical name -> id
+        self._lock = threading.Lock()
+        self.created = self.fuzzy = self.lookups = 0
+
+    def _cur(self):
+        if self._conn is None or self._conn.closed:
+            self._conn = psycopg.connect(self.dsn, autocommit=True)
+        return self._conn.cursor()
+
+    def resolve(self, norm):
+        if not norm:
+            return None
+        mid = self._by_desc.get(norm)
+        if mid is not None:
+            return mid
+        name = canonical_name(norm)
+        with self._lock:
+            mid = self._by_name.get(name)
+            if mid is None:
+                mid = self._lookup(norm, name)
+                self._remember(self._by_name, name, mid)
+            self._remember(self._by_desc, norm, mid)
+        return mid
+
+    def _remember(self, cache, key, mid):
+        if len(cache) >= CACHE_MAX:
+            cache.clear()
+        cache[key] = mid
+
+    def _lookup(self, norm, name):
+        self.lookups += 1
+        with self._cur() as cur:
+            cur.execute("select merchant_id from merchant_aliases where alias = %s", (name,))
+            row = cur.fetchone()
+            if row:
+                return row[0]
+            # merchants of attributed transactions that read alike (ix_tx_normdesc_trgm),
+            # scored on canonical names so store numbers and dates don't weigh in
+            cur.execute("""
+              select m.id
+              from merchants m
+              where m.id in (
+                select t.merchant_id from transactions t
+                where t.normalized_desc %% %(n)s and t.merchant_id is not null
+                limit 200
+              )
+                and similarity(m.canonical_name, %(name)s) >= %(min)s
+              order by similarity(m.canonical_name, %(name)s) desc, m.id
+              limit 1
+            """, {"n": norm, "name": name, "min": SIMILARITY})
+            row = cur.fetchone()
+            if row:
+                self.fuzzy += 1
+                mid = row[0]
+            else:
+                cur.execute("""
+                  insert into merchants(display_name, canonical_name, embedding) values (initcap(%s), %s, %s::vector)
+                  on conflict (canonical_name) do nothing
+                  returning id
+                """, (name, name, embed(name)))
+                row = cur.fetchone()
+                if row:
+                    self.created += 1
+                else:
+                    cur.execute("select id from merchants where canonical_name = %s", (name,))
+                    row = cur.fetchone()
+                mid = row[0]
+            cur.execute("insert into merchant_aliases(alias, merchant_id) values (%s, %s) on conflict (alias) do nothing",
+                        (name, mid))
+            cur.execute("select merchant_id from merchant_aliases where alias = %s", (name,))
+            return cur.fetchone()[0]  # a concurrent writer may have won the alias
+
+
+_resolver = None
+
+
+def resolve(norm):
+    """Process-wide Resolver().resolve()."""
+    global _resolver
+    if _resolver is None:
+        _resolver = Resolver()
+    return _resolver.resolve(norm)
+
+
+def embed_missing(conn):
+    """Fill merchants.embedding where it is null (merchants from before 0022, or after an embed() change)."""
+    n = 0
+    while True:
+        with conn.cursor() as cur:
+            cur.execute("select id, canonical_name from merchants where embedding is null order by id limit %s",
+                        (BACKFILL_BATCH,))
+            rows = cur.fetchall()
+            if not rows:
+                break
+            cur.execute("""
+              update merchants m set embedding = e.v::vector
+              from unnest(%s::bigint[], %s::text[]) as e(id, v)
+              where m.id = e.id
+            """, ([r[0] for r in rows], [embed(r[1] or "") for r in rows]))
+            n += len(rows)
+        conn.commit()
+    return n
+
+
+@metrics.job("merchants")
+def run(conn):
+    """Pipeline stage: attribute transactions written without a merchant_id, embed merchants without an embedding."""
+    total = 0
+    while True:
+        with conn.cursor() as cur:
+            cur.execute("""
+              select distinct normalized_desc from transactions
+              where merchant_id is null and normalized_desc is not null and normalized_desc <> ''
+              limit %s
+            """, (BACKFILL_BATCH,))
+            descs = [r[0] for r in cur.fetchall()]
+            if not descs:
+                break
+            ids = [resolve(d) for d in descs]
+            cur.execute("""
+              update transactions t set merchant_id = m.id
+              from unnest(%s::text[], %s::bigint[]) as m(d, id)
+              where t.normalized_desc = m.d and t.merchant_id is null
+            """, (descs, ids))
+            total += cur.rowcount
+        conn.commit()
+    embedded = embed_missing(conn)
+    metrics.count_rows(total, "attributed")
+    metrics.count_rows(embedded, "embedded")
+    r = _resolver
+    print(f"[merchants] attributed={total} embedded={embedded}"
+          + (f" lookups={r.lookups} created={r.created} fuzzy={r.fuzzy}" if r else ""))
+    return total
+
+
+def main():
+    with psycopg.connect(PG_DSN) as conn:
+        run(conn)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        print(f"[merchants] ERROR: {e}", file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,279 @@
+# metrics.py
+# Shared instrumentation for the jobs and the two HTTP services. Copied into each image
+# as /app/metrics.py (build context is the repo root); stdlib + psycopg only, so it costs
+# nothing at import.
+#
+#   counters / histograms  kept in-process, rendered as Prometheus text by render()
+#   @job("normalize")      wraps a stage's run(): one JSON log line per run with its
+#                          duration split into http / db / parse / imap time, plus rows
+#                          and bytes counted while it ran
+#   TimedCursor            cursor_factory that times every execute() as a DB round trip
+#   push()                 batch jobs: write METRICS_TEXTFILE_DIR/<service>.prom and/or
+#                          PUT to METRICS_PUSHGATEWAY; no-op when neither is set
+#   http_middleware        FastAPI middleware timing requests by route template
+
+import os, sys, json, time, threading, functools
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import psycopg
+
+TEXTFILE_DIR = os.getenv("METRICS_TEXTFILE_DIR")
+PUSHGATEWAY = (os.getenv("METRICS_PUSHGATEWAY") or "").rstrip("/")
+LOG_JSON = os.getenv("METRICS_LOG_JSON", "1") != "0"
+
+HTTP_CLIENT_SECONDS = "fin_http_client_seconds"
+HTTP_SERVER_SECONDS = "fin_http_server_seconds"
+DB_SECONDS = "fin_db_seconds"
+PARSE_SECONDS = "fin_parse_seconds"
+IMAP_SECONDS = "fin_imap_seconds"
+STAGE_SECONDS = "fin_stage_seconds"
+STAGE_RUNS = "fin_stage_runs_total"
+ROWS = "fin_rows_total"
+BYTES_READ = "fin_bytes_read_total"
+
+HELP = {
+    HTTP_CLIENT_SECONDS: "Outbound HTTP calls (Teller) by route template and status.",
+    HTTP_SERVER_SECONDS: "Inbound HTTP requests by route template and status.",
+    DB_SECONDS: "Database round trips by statement verb.",
+    PARSE_SECONDS: "Statement file parsing by format.",
+    IMAP_SECONDS: "IMAP commands by verb.",
+    STAGE_SECONDS: "Wall time of one job/stage run.",
+    STAGE_RUNS: "Job/stage runs by outcome.",
+    ROWS: "Rows processed by stage and kind.",
+    BYTES_READ: "Input bytes read by source.",
+}
+# timers whose time is attributed to the running stage's JSON log line
+SPAN_KEYS = {HTTP_CLIENT_SECONDS: "http", DB_SECONDS: "db", PARSE_SECONDS: "parse", IMAP_SECONDS: "imap"}
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+SERVICE = os.getenv("METRICS_SERVICE") or "finance"
+
+_lock = threading.Lock()
+_counters = {}    # (name, labels) -> float
+_histograms = {}  # (name, labels) -> [bucket counts..., sum, count]
+_spans = threading.local()
+
+
+def set_service(name):
+    """Name used for log lines and the push job; METRICS_SERVICE wins if set."""
+    global SERVICE
+    SERVICE = os.getenv("METRICS_SERVICE") or name
+
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _span():
+    stack = getattr(_spans, "stack", None)
+    return stack[-1] if stack else None
+
+
+def inc(name, value=1, **labels):
+    k = _key(name, labels)
+    with _lock:
+        _counters[k] = _counters.get(k, 0) + value
+
+
+def observe(name, seconds, **labels):
+    k = _key(name, labels)
+    with _lock:
+        h = _histograms.get(k)
+        if h is None:
+            h = _histograms[k] = [0] * (len(BUCKETS) + 2)
+        for i, b in enumerate(BUCKETS):
+            if seconds <= b:
+                h[i] += 1
+        h[-2] += seconds
+        h[-1] += 1
+    span, key = _span(), SPAN_KEYS.get(name)
+    if span is not None and key:
+        span[f"{key}_ms"] = span.get(f"{key}_ms", 0.0) + seconds * 1000.0
+        span[f"{key}_calls"] = span.get(f"{key}_calls", 0) + 1
+
+
+@contextmanager
+def timer(name, **labels):
+    """Observe the block's wall time, labelled status="ok"/"error" unless the block sets
+    its own (e.g. an HTTP status code) on the yielded dict."""
+    extra = {}
+    t0 = time.perf_counter()
+    status = "ok"
+    try:
+        yield extra
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        observe(name, time.perf_counter() - t0, **labels, status=extra.get("status", status))
+
+
+def count_rows(n, kind, stage=None):
+    """Rows processed (inserted, duplicate, categorized, ...), attributed to the running stage."""
+    span = _span()
+    stage = stage or (span["stage"] if span else SERVICE)
+    inc(ROWS, n, stage=stage, kind=kind)
+    if span is not None:
+        span[f"rows_{kind}"] = span.get(f"rows_{kind}", 0) + n
+
+
+def count_bytes(n, source):
+    inc(BYTES_READ, n, source=source)
+    span = _span()
+    if span is not None:
+        span["bytes_read"] = span.get("bytes_read", 0) + n
+
+
+def log(event, **fields):
+    """One structured log line on stdout."""
+    if not LOG_JSON:
+        return
+    rec = {"ts": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+           "service": SERVICE, "event": event}
+    rec.update(fields)
+    print(json.dumps(rec, default=str), flush=True)
+
+
+def job(stage):
+    """Decorator for a stage's run(): times it and logs where the time went."""
+    def wrap(fn):
+        @functools.wraps(fn)
+        def run(*args, **kwargs):
+            span = {"stage": stage}
+            stack = getattr(_spans, "stack", None)
+            if stack is None:
+                stack = _spans.stack = []
+            stack.append(span)
+            status, result = "ok", None
+            t0 = time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+                return result
+            except BaseException:
+                status = "error"
+                raise
+            finally:
+                elapsed = time.perf_counter() - t0
+                stack.pop()
+                observe(STAGE_SECONDS, elapsed, stage=stage)
+                inc(STAGE_RUNS, stage=stage, status=status)
+                accounted = sum(v for k, v in span.items() if k.endswith("_ms"))
+                fields = {k: round(v, 2) if isinstance(v, float) else v for k, v in span.items()}
+                fields.update(status=status, duration_ms=round(elapsed * 1000.0, 2),
+                              other_ms=round(max(0.0, elapsed * 1000.0 - accounted), 2))
+                if isinstance(result, int) and not isinstance(result, bool):
+                    fields["result"] = result
+                log("stage_done", **fields)
+        return run
+    return wrap
+
+
+def _verb(query):
+    if isinstance(query, bytes):
+        query = query.decode("utf-8", "replace")
+    if not isinstance(query, str):
+        return "composed"
+    word = query.lstrip(" \t\r\n(").split(None, 1)
+    return word[0].lower() if word else "empty"
+
+
+class TimedCursor(psycopg.Cursor):
+    """Times each execute()/executemany() as one DB round trip (results arrive with it)."""
+
+    def execute(self, query, params=None, **kwargs):
+        with timer(DB_SECONDS, op=_verb(query)):
+            return super().execute(query, params, **kwargs)
+
+    def executemany(self, query, params_seq, **kwargs):
+        with timer(DB_SECONDS, op=_verb(query)):
+            return super().executemany(query, params_seq, **kwargs)
+
+
+class AsyncTimedCursor(psycopg.AsyncCursor):
+    async def execute(self, query, params=None, **kwargs):
+        with timer(DB_SECONDS, op=_verb(query)):
+            return await super().execute(query, params, **kwargs)
+
+    async def executemany(self, query, params_seq, **kwargs):
+        with timer(DB_SECONDS, op=_verb(query)):
+            return await super().executemany(query, params_seq, **kwargs)
+
+
+def _fmt_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    esc = lambda v: v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in pairs) + "}"
+
+
+def _num(v):
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+def render():
+    """Everything recorded so far, in Prometheus text exposition format."""
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted((k, list(v)) for k, v in _histograms.items())
+    out, typed = [], set()
+    for (name, labels), value in counters:
+        if name not in typed:
+            typed.add(name)
+            out.append(f"# HELP {name} {HELP.get(name, name)}")
+            out.append(f"# TYPE {name} counter")
+        out.append(f"{name}{_fmt_labels(labels)} {_num(value)}")
+    for (name, labels), h in histograms:
+        if name not in typed:
+            typed.add(name)
+            out.append(f"# HELP {name} {HELP.get(name, name)}")
+            out.append(f"# TYPE {name} histogram")
+        for b, n in zip(BUCKETS, h):
+            out.append(f"{name}_bucket{_fmt_labels(labels, [('le', repr(b))])} {n}")
+        out.append(f"{name}_bucket{_fmt_labels(labels, [('le', '+Inf')])} {h[-1]}")
+        out.append(f"{name}_sum{_fmt_labels(labels)} {_num(h[-2])}")
+        out.append(f"{name}_count{_fmt_labels(labels)} {h[-1]}")
+    return "\n".join(out) + "\n"
+
+
+def push():
+    """Batch jobs: hand the metrics to a textfile collector and/or pushgateway. Never raises."""
+    if not (TEXTFILE_DIR or PUSHGATEWAY):
+        return
+    body = render()
+    if TEXTFILE_DIR:
+        try:
+            os.makedirs(TEXTFILE_DIR, exist_ok=True)
+            path = os.path.join(TEXTFILE_DIR, f"{SERVICE}.prom")
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "w") as f:
+                f.write(body)
+            os.replace(tmp, path)  # the collector must never see a half-written file
+        except OSError as e:
+            print(f"[metrics] textfile write failed: {e}", file=sys.stderr)
+    if PUSHGATEWAY:
+        import urllib.request
+        req = urllib.request.Request(f"{PUSHGATEWAY}/metrics/job/{SERVICE}", data=body.encode("utf-8"),
+                                     method="PUT", headers={"Content-Type": CONTENT_TYPE})
+        try:
+            urllib.request.urlopen(req, timeout=5).close()
+        except Exception as e:
+            print(f"[metrics] push to {PUSHGATEWAY} failed: {e}", file=sys.stderr)
+
+
+async def http_middleware(request, call_next):
+    """app.middleware("http")(metrics.http_middleware); labels by route template, not raw path."""
+    t0 = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        path = getattr(route, "path", None) or "unmatched"
+        if path != "/metrics":
+            observe(HTTP_SERVER_SECONDS, time.perf_counter() - t0,
+                    method=request.method, route=path, status=status)
@@ -0,0 +1,192 @@
+# profiling.py
+# Opt-in profiling for job entry points. Copied into each job image as /app/profiling.py.
+#
+#   @profiling.profiled("classifier")
+#   def main(): ...
+#
+# PROFILE unset/off -> main() runs untouched; cProfile/tracemalloc are never imported.
+# PROFILE=cprofile  -> deterministic cProfile, written as <run>.pstats
+# PROFILE=sample    -> stdlib sampling of the main thread every PROFILE_INTERVAL_MS
+#                      (default 5), written as collapsed stacks <run>.folded
+#                      (flamegraph.pl / speedscope), cheap enough for production runs
+# Either mode also runs tracemalloc and keeps the snapshot taken nearest the peak
+# (<run>.heap) plus a <run>.json summary. Files go to PROFILE_DIR/<job>/, one set per
+# run; ops/bench/profile_report.py summarizes the last N runs.
+
+import os, sys, json, time, threading, functools
+from datetime import datetime, timezone
+
+PROFILE = (os.getenv("PROFILE") or "off").strip().lower()
+PROFILE_DIR = os.getenv("PROFILE_DIR", "/var/log/finance/profiles")
+INTERVAL = float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000.0
+TRACE_FRAMES = int(os.getenv("PROFILE_TRACEMALLOC_FRAMES", "1"))
+KEEP = int(os.getenv("PROFILE_KEEP", "50"))  # runs kept per job; oldest pruned
+MODES = ("cprofile", "sample")
+TOP_ALLOCS = 20
+
+
+class Sampler:
+    """Samples one thread's stack on a timer; counts identical stacks."""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = {}
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            key = ";".join(reversed(stack))
+            self.stacks[key] = self.stacks.get(key, 0) + 1
+            self.samples += 1
+
+    def write(self, path):
+        with open(path, "w") as f:
+            for stack, n in sorted(self.stacks.items(), key=lambda kv: -kv[1]):
+                f.write(f"{stack} {n}\n")
+
+
+class PeakWatcher:
+    """Polls tracemalloc and re-snapshots whenever traced memory climbs past the last peak."""
+
+    def __init__(self, interval=0.1, growth=1.1):
+        self.interval = interval
+        self.growth = growth
+        self.snapshot = None
+        self.snapshot_bytes = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-peak", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.check()
+
+    def check(self):
+        import tracemalloc
+        current, _ = tracemalloc.get_traced_memory()
+        if current > self.snapshot_bytes * self.growth:
+            self.snapshot = tracemalloc.take_snapshot()
+            self.snapshot_bytes = current
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.check()
+
+
+def _prune(job_dir):
+    runs = sorted(f[:-5] for f in os.listdir(job_dir) if f.endswith(".json"))
+    for stem in runs[:-KEEP] if KEEP > 0 else []:
+        for ext in (".json", ".pstats", ".folded", ".heap"):
+            try:
+                os.remove(os.path.join(job_dir, stem + ext))
+            except FileNotFoundError:
+                pass
+
+
+def _run_profiled(job, job_dir, fn, args, kwargs):
+    import tracemalloc
+    started = datetime.now(timezone.utc)
+    stem = os.path.join(job_dir, f"{started.strftime('%Y%m%dT%H%M%SZ')}-{os.getpid()}")
+
+    tracemalloc.start(TRACE_FRAMES)
+    watcher = PeakWatcher()
+    watcher.start()
+    profiler = sampler = None
+    if PROFILE == "cprofile":
+        import cProfile
+        profiler = cProfile.Profile()
+    else:
+        sampler = Sampler(threading.get_ident(), INTERVAL)
+        sampler.start()
+    status = "ok"
+    t0 = time.perf_counter()
+    try:
+        if profiler is not None:
+            return profiler.runcall(fn, *args, **kwargs)
+        return fn(*args, **kwargs)
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        elapsed = time.perf_counter() - t0
+        if sampler is not None:
+            sampler.stop()
+        watcher.stop()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        try:
+            _write(job, job_dir, stem, started, status, elapsed, peak, profiler, sampler, watcher)
+        except OSError as e:
+            # never let the profiler turn a good run into a failed one
+            print(f"[profile] {job}: could not write profile: {e}", file=sys.stderr)
+
+
+def _write(job, job_dir, stem, started, status, elapsed, peak, profiler, sampler, watcher):
+    files = {}
+    if profiler is not None:
+        profiler.dump_stats(stem + ".pstats")
+        files["profile"] = stem + ".pstats"
+    else:
+        sampler.write(stem + ".folded")
+        files["profile"] = stem + ".folded"
+    top = []
+    if watcher.snapshot is not None:
+        watcher.snapshot.dump(stem + ".heap")
+        files["heap"] = stem + ".heap"
+        for stat in watcher.snapshot.statistics("lineno")[:TOP_ALLOCS]:
+            fr = stat.traceback[0]
+            top.append({"where": f"{fr.filename}:{fr.lineno}", "bytes": stat.size, "count": stat.count})
+    meta = {
+        "job": job, "mode": PROFILE, "status": status, "pid": os.getpid(),
+        "started": started.isoformat(timespec="seconds"), "duration_s": round(elapsed, 3),
+        "peak_traced_bytes": peak, "snapshot_bytes": watcher.snapshot_bytes,
+        "samples": sampler.samples if sampler else None,
+        "interval_ms": INTERVAL * 1000.0 if sampler else None,
+        "files": files, "top_allocations": top,
+    }
+    with open(stem + ".json", "w") as f:
+        json.dump(meta, f, indent=1)
+    _prune(job_dir)
+    print(f"[profile] {job}: {PROFILE} {elapsed:.2f}s peak={peak / 1048576:.1f}MB -> {stem}.*", file=sys.stderr)
+
+
+def profiled(job):
+    """Decorator for a job's main(): profile the call when PROFILE=cprofile|sample."""
+    def wrap(fn):
+        @functools.wraps(fn)
+        def main(*args, **kwargs):
+            if PROFILE in ("", "0", "off", "none"):
+                return fn(*args, **kwargs)
+            if PROFILE not in MODES:
+                print(f"[profile] unknown PROFILE={PROFILE!r} (want {'/'.join(MODES)}); running unprofiled", file=sys.stderr)
+                return fn(*args, **kwargs)
+            job_dir = os.path.join(PROFILE_DIR, job)
+            try:
+                os.makedirs(job_dir, exist_ok=True)
+            except OSError as e:
+                print(f"[profile] {job}: {e}; running unprofiled", file=sys.stderr)
+                return fn(*args, **kwargs)
+            return _run_profiled(job, job_dir, fn, args, kwargs)
+        return main
+    return wrap
@@ -0,0 +1,156 @@
+# rules.py
+# Category rules (the rules table, 0001 / 0023) compiled once and shared by the classifier
+# and every transaction writer (normalizer, teller-sync, teller_ingestor), so a new
+# transaction gets its tx_splits / tx_tags rows in the same transaction that inserts it.
+# Copied into those images as /app/rules.py.
+#
+#   new = []                                      # writers append (tx id, normalized_desc, amount)
+#   ... upsert_tx(cur, account_id, tx, new) ...
+#   rules.categorize(cur, new)                    # one insert per table for the whole batch
+#
+# A rule matches when the normalized description contains one of its includes, none of
+# its excludes, and the amount is within [amount_min, amount_max] (null = unbounded); the
+# lowest priority that matches wins (ties: lowest id), and only outflows (amount < 0) are
+# categorized, as the classifier always did. The winner writes a split for its category
+# and a tx_tags row for each of its set_tag_ids. Each rule's includes / excludes are
+# compiled into one regex, and one more regex over every include rejects most
+# descriptions before any rule is tried.
+#
+# The compiled set is stamped with rules_version.version, which a trigger bumps on any
+# change to rules (0023) before it sends NOTIFY rules. The pipeline daemon listens and
+# calls invalidate(); otherwise current() re-reads the version at most every
+# RULES_CHECK_SECONDS. Either way it recompiles only when the version moved. Rules are
+# edited in the table or loaded from YAML with classifier/rule_import.py. The classify
+# stage still rescans the lookback window as a safety net for rows written before a rule
+# existed.
+
+import os, re, time, threading
+
+CHECK_SECONDS = float(os.getenv("RULES_CHECK_SECONDS", "300"))  # when no NOTIFY reaches us
+CHANNEL = "rules"
+
+
+def fetch_version(cur):
+    cur.execute("select version from rules_version")
+    row = cur.fetchone()
+    return row[0] if row else 0
+
+
+def load(cur):
+    """Active rules in match order."""
+    cur.execute("""
+      select id, name, includes, excludes, category_id, set_tag_ids, amount_min, amount_max
+      from rules
+      where coalesce(active, true)
+      order by priority, id
+    """)
+    return cur.fetchall()
+
+
+def _alternation(words):
+    words = [w.upper() for w in words or () if w]
+    return re.compile("|".join(re.escape(w) for w in words)) if words else None
+
+
+class RuleSet:
+    """Compiled rules rows; match() is pure, so a RuleSet can be shared."""
+
+    def __init__(self, rows, version):
+        self.version = version
+        # (name, category id, tag ids, includes, excludes, amount_min, amount_max), match order;
+        # a rule without includes never matches and one with nothing to write is skipped
+        self.rules = []
+        gate = set()
+        for _id, name, includes, excludes, cat_id, tag_ids, amin, amax in rows:
+            inc = _alternation(includes)
+            if inc is None or (cat_id is None and not tag_ids):
+                continue
+            self.rules.append((name, cat_id, tuple(tag_ids or ()), inc, _alternation(excludes),
+                               -1e15 if amin is None else float(amin), 1e15 if amax is None else float(amax)))
+            gate.update(w.upper() for w in includes if w)
+        self.gate = _alternation(sorted(gate))
+
+    def match(self, desc, amount):
+        """(rule name, category id or None, tag ids) of the first rule matching a normalized description, or None."""
+        if not desc or self.gate is None or amount >= 0 or not self.gate.search(desc):
+            return None
+        amount = float(amount)
+        for name, cat_id, tag_ids, inc, exc, amin, amax in self.rules:
+            if not inc.search(desc):
+                continue
+            if exc is not None and exc.search(desc):
+                continue
+            if amount < amin or amount > amax:
+                continue
+            return name, cat_id, tag_ids
+        return None
+
+
+_current = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+def invalidate():
+    """A NOTIFY rules arrived: re-check the version on the next current()."""
+    global _checked_at
+    _checked_at = 0.0
+
+
+def current(cur):
+    """The process-wide RuleSet, recompiled when rules_version moved."""
+    global _current, _checked_at
+    with _lock:
+        now = time.monotonic()
+        if _current is not None and _checked_at and now - _checked_at < CHECK_SECONDS:
+            return _current
+        version = fetch_version(cur)
+        _checked_at = now
+        if _current is None or version != _current.version:
+            # read after the version: a change in between only costs one more reload
+            _current = RuleSet(load(cur), version)
+            print(f"[rules] compiled {len(_current.rules)} rule(s) at version {version}")
+        return _current
+
+
+def categorize(cur, rows):
+    """
+    Write the tx_splits (and tx_tags) rows for each (transaction id, normalized_desc,
+    amount) a rule matches, one statement per table on the caller's cursor. Returns the
+    splits written.
+    """
+    if not rows:
+        return 0
+    rs = current(cur)
+    ids, cats, amounts, notes = [], [], [], []
+    tag_tx, tag_ids = [], []
+    for tx_id, desc, amount in rows:
+        hit = rs.match(desc, amount)
+        if not hit:
+            continue
+        name, cat_id, tags = hit
+        if cat_id is not None:
+            ids.append(tx_id)
+            cats.append(cat_id)
+            amounts.append(amount)
+            notes.append(f"rule:{name}")
+        for tag in tags:
+            tag_tx.append(tx_id)
+            tag_ids.append(tag)
+    if tag_tx:
+        # set_tag_ids has no foreign key: a deleted tag is skipped, not an ingest failure
+        cur.execute("""
+          insert into tx_tags(transaction_id, tag_id)
+          select u.tx, u.tag
+          from unnest(%s::bigint[], %s::bigint[]) as u(tx, tag)
+          join tags g on g.id = u.tag
+          on conflict do nothing
+        """, (tag_tx, tag_ids))
+    if not ids:
+        return 0
+    cur.execute("""
+      insert into tx_splits(transaction_id, category_id, amount, note)
+      select * from unnest(%s::bigint[], %s::bigint[], %s::numeric[], %s::text[])
+      on conflict do nothing
+    """, (ids, cats, amounts, notes))
+    return cur.rowcount
@@ -0,0 +1,128 @@
+# teller_http.py
+# One Teller HTTP client per process. Copied into the teller images as /app/teller_http.py.
+#
+# The client certificate, key and CA bundle are loaded into a single SSLContext once, and
+# every request goes through one pooled requests.Session, so a run that touches 50
+# enrollments does one mTLS handshake instead of 50. Credentials are per request
+# (Basic token + X-Enrollment-Id), never per session, so enrollments share connections.
+#
+#   api = teller_http.client()                       # configured from TELLER_* env
+#   s = api.for_enrollment(token, "usr_...")         # cheap view, no I/O
+#   r = s.get("/accounts")                           # requests.Response
+#   print(api.stats())                               # requests / new connections / reused
+#
+# HTTP/2 is not used: every caller issues its requests one after another, so there is
+# nothing to multiplex, and keep-alive already removes the per-request handshake.
+
+import os, ssl, base64, threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+BASE_URL = os.getenv("TELLER_BASE_URL", "https://api.teller.io").rstrip("/")
+TIMEOUT = float(os.getenv("TELLER_HTTP_TIMEOUT", "30"))
+POOL_SIZE = int(os.getenv("TELLER_HTTP_POOL", "4"))
+
+
+def basic_auth_header(token: str) -> str:
+    b = base64.b64encode(f"{token}:".encode()).decode()
+    return f"Basic {b}"
+
+
+def _require_file(p):
+    if not p or not os.path.exists(p):
+        raise FileNotFoundError(f"File not found: {p}")
+    return p
+
+
+class _ContextAdapter(HTTPAdapter):
+    """HTTPAdapter whose pools all use one prebuilt SSLContext (cert chain loaded once)."""
+
+    def __init__(self, ssl_context, **kwargs):
+        self._ssl_context = ssl_context
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        pool_kwargs["ssl_context"] = self._ssl_context
+        super().init_poolmanager(connections, maxsize, block, **pool_kwargs)
+
+
+class TellerClient:
+    def __init__(self, base_url, cert_path, key_path, ca_path=None, user_agent="finance-os/0.1",
+                 timeout=TIMEOUT, pool_size=POOL_SIZE):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        ctx = ssl.create_default_context(cafile=ca_path or None)
+        ctx.load_cert_chain(_require_file(cert_path), _require_file(key_path))
+        self.session = requests.Session()
+        # REQUESTS_CA_BUNDLE & co. would otherwise replace the CA per request, and a
+        # verify path makes urllib3 reload it into the context on every new connection
+        self.session.trust_env = False
+        self.session.headers.update({"User-Agent": user_agent, "Accept": "application/json"})
+        adapter = _ContextAdapter(ctx, pool_connections=2, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", HTTPAdapter(pool_connections=2, pool_maxsize=pool_size))
+
+    def get(self, path, token=None, enrollment_id=None, params=None, timeout=None, auth=None):
+        """GET base_url + path with this call's credentials; returns the requests.Response."""
+        headers = {}
+        if token is not None:
+            headers["Authorization"] = auth or basic_auth_header(token)
+        elif auth is not None:
+            headers["Authorization"] = auth
+        if enrollment_id:
+            headers["X-Enrollment-Id"] = enrollment_id
+        return self.session.get(f"{self.base_url}{path}", params=params, headers=headers,
+                                timeout=timeout or self.timeout)
+
+    def for_enrollment(self, token, enrollment_id, auth=None):
+        return EnrollmentSession(self, token, enrollment_id, auth)
+
+    def stats(self):
+        """Requests sent and connections opened so far, summed over every pool."""
+        requests_sent = connections = 0
+        for adapter in self.session.adapters.values():
+            for pool in list(adapter.poolmanager.pools._container.values()):
+                requests_sent += pool.num_requests
+                connections += pool.num_connections
+        reused = requests_sent - connections
+        return {"requests": requests_sent, "connections": connections, "reused": max(0, reused),
+                "reuse_pct": round(100.0 * reused / requests_sent, 1) if requests_sent else 0.0}
+
+    def close(self):
+        self.session.close()
+
+
+class EnrollmentSession:
+    """An enrollment's credentials bound to the shared client; holds no connection of its own."""
+
+    def __init__(self, client, token, enrollment_id, auth=None):
+        self.client = client
+        self.token = token
+        self.enrollment_id = enrollment_id
+        self.auth = auth
+
+    def get(self, path, params=None, timeout=None):
+        return self.client.get(path, self.token, self.enrollment_id, params=params, timeout=timeout, auth=self.auth)
+
+
+_client = None
+_lock = threading.Lock()
+
+
+def client(user_agent="finance-os/0.1"):
+    """The process-wide client, built from TELLER_BASE_URL / TELLER_CERT / TELLER_KEY / TELLER_CA_PATH."""
+    global _client
+    with _lock:
+        if _client is None:
+            _client = TellerClient(
+                BASE_URL, os.environ["TELLER_CERT"], os.environ["TELLER_KEY"],
+                os.getenv("TELLER_CA_PATH", "/etc/ssl/certs/ca-certificates.crt"),
+                user_agent=user_agent,
+            )
+        return _client
+
+
+def stats():
+    """stats() of the process-wide client, or None if nothing has called Teller yet."""
+    return _client.stats() if _client is not None else None
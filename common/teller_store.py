@@ -0,0 +1,190 @@
+# teller_store.py
+# Teller institution / account persistence shared by teller-sync, teller-enroll and
+# teller_ingestor. Copied into the teller images as /app/teller_store.py.
+#
+#   inst_id = teller_store.ensure_institution(cur)
+#   ids = teller_store.upsert_accounts(cur, inst_id, accounts, enrollment_id)
+#         # {teller account id: (accounts.id, provider_accounts.id or None)}
+#   conn.commit(); teller_store.committed()      # or teller_store.discard() after a rollback
+#
+# Ids are cached in process together with a fingerprint of the fields we store, so an
+# account whose payload hasn't changed costs no statement at all; the ones that did
+# change (or are new) are written with one statement per call, accounts and
+# provider_accounts together. Entries only become visible to later lookups once the
+# caller reports its transaction committed: a rolled-back insert must not leave
+# behind an id that doesn't exist. Cached entries expire after ACCOUNT_CACHE_TTL so
+# rows changed or removed behind our back are picked up again.
+
+import os, time, hashlib
+
+ACCOUNT_CACHE_TTL = int(os.getenv("TELLER_ACCOUNT_CACHE_TTL", "3600"))
+INSTITUTION_NAME = "TELLER"
+INSTITUTION_EXTERNAL_ID = "teller"
+
+_institution_id = None
+_accounts = {}   # (enrollment_id, teller account id) -> (fingerprint, account_id, provider_account_id, expires_at)
+_pending = {}    # same, written in the caller's open transaction
+_pending_institution = None
+
+
+def map_type(t, st):
+    t = (t or "").lower()
+    st = (st or "").lower()
+    if t in ("depository", "bank", "cash"):
+        if "checking" in st:
+            return "checking"
+        if "savings" in st:
+            return "savings"
+        return "checking"
+    if t in ("credit", "card", "credit_card"):
+        return "credit"
+    if t in ("loan", "mortgage"):
+        return "loan"
+    if t in ("investment", "brokerage"):
+        return "investment"
+    return None
+
+
+def ensure_institution(cur):
+    """The TELLER institutions row's id; looked up once per process."""
+    global _pending_institution
+    if _institution_id is not None:
+        return _institution_id
+    if _pending_institution is not None:
+        return _pending_institution
+    cur.execute("""
+      insert into institutions(name, external_id)
+      values (%s, %s)
+      on conflict (name) do nothing
+      returning id
+    """, (INSTITUTION_NAME, INSTITUTION_EXTERNAL_ID))
+    row = cur.fetchone()
+    if not row:
+        cur.execute("select id from institutions where external_id = %s", (INSTITUTION_EXTERNAL_ID,))
+        row = cur.fetchone()
+    _pending_institution = row[0]
+    return _pending_institution
+
+
+def account_fields(acct):
+    """(accounts row, provider_accounts row) values for one Teller account payload."""
+    api_id = acct.get("id")
+    name = acct.get("name") or acct.get("official_name") or acct.get("account") or "Account"
+    last4 = acct.get("last_four") or acct.get("last4") or acct.get("last4_digits")
+    curr = (acct.get("currency") or "USD").upper()[:3]
+    typ = (acct.get("type") or "").lower() or None
+    sub = (acct.get("subtype") or "").lower() or None
+    inst = acct.get("institution_id") or (acct.get("institution") or {}).get("id")
+    return ((name, map_type(typ, sub), curr, last4, f"teller:{api_id}"),
+            (api_id, inst, last4, typ, sub, curr))
+
+
+def fingerprint(inst_id, fields):
+    return hashlib.sha1(repr((inst_id, fields)).encode("utf-8")).hexdigest()
+
+
+def _cached(key, fp):
+    e = _pending.get(key) or _accounts.get(key)
+    if e is None or e[0] != fp or e[3] <= time.monotonic():
+        return None
+    return e
+
+
+UPSERT_ACCOUNTS = """
+  with input as (
+    select * from unnest(%(names)s::text[], %(types)s::text[], %(currencies)s::text[], %(masks)s::text[],
+                         %(external_ids)s::text[], %(api_ids)s::text[], %(p_inst)s::text[],
+                         %(p_types)s::text[], %(p_subtypes)s::text[])
+      as u(name, type, currency, mask, external_id, api_id, p_inst, p_type, p_subtype)
+  ), acc as (
+    insert into accounts(institution_id, name, type, currency, mask, external_id, is_active)
+    select %(inst_id)s, name, type, currency, mask, external_id, true from input
+    on conflict (external_id) do update set
+      institution_id = excluded.institution_id,
+      name           = excluded.name,
+      type           = coalesce(excluded.type, accounts.type),
+      currency       = excluded.currency,
+      mask           = excluded.mask,
+      is_active      = true
+    returning id, external_id
+  ), prov as (
+    -- account_id links the provider row to its accounts row (reconcile.py refetch() joins on it)
+    insert into provider_accounts(enrollment_id, teller_account_id, institution_id, last_four, type, subtype, currency,
+                                  account_id)
+    select %(enrollment_id)s, input.api_id, input.p_inst, input.mask, input.p_type, input.p_subtype, input.currency,
+           acc.id
+    from input
+    join acc on acc.external_id = input.external_id
+    where %(enrollment_id)s::text is not null
+    on conflict (enrollment_id, teller_account_id) do update set
+      account_id     = excluded.account_id,
+      institution_id = excluded.institution_id,
+      last_four      = excluded.last_four,
+      type           = excluded.type,
+      subtype        = excluded.subtype,
+      currency       = excluded.currency
+    returning id, teller_account_id
+  )
+  select input.api_id, acc.id, prov.id
+  from input
+  join acc on acc.external_id = input.external_id
+  left join prov on prov.teller_account_id = input.api_id
+"""
+
+
+def upsert_accounts(cur, inst_id, accounts, enrollment_id=None):
+    """
+    Upsert the accounts (and, given an enrollment, their provider_accounts rows) in one
+    statement, skipping any whose stored fields are unchanged since this process last
+    wrote them. Returns {teller account id: (accounts.id, provider_accounts.id or None)}.
+    """
+    out, todo = {}, {}
+    for acct in accounts or []:
+        api_id = acct.get("id")
+        if not api_id:
+            continue
+        fields = account_fields(acct)
+        fp = fingerprint(inst_id, fields)
+        hit = _cached((enrollment_id, api_id), fp)
+        if hit is not None:
+            out[api_id] = (hit[1], hit[2])
+        else:
+            todo[api_id] = (fields, fp)
+    if not todo:
+        return out
+
+    rows = [f for f, _ in todo.values()]
+    cur.execute(UPSERT_ACCOUNTS, {
+        "inst_id": inst_id, "enrollment_id": enrollment_id,
+        "names": [a[0] for a, _ in rows], "types": [a[1] for a, _ in rows],
+        "currencies": [a[2] for a, _ in rows], "masks": [a[3] for a, _ in rows],
+        "external_ids": [a[4] for a, _ in rows], "api_ids": [p[0] for _, p in rows],
+        "p_inst": [p[1] for _, p in rows], "p_types": [p[3] for _, p in rows],
+        "p_subtypes": [p[4] for _, p in rows],
+    })
+    expires = time.monotonic() + ACCOUNT_CACHE_TTL
+    for api_id, account_id, provider_account_id in cur.fetchall():
+        _pending[(enrollment_id, api_id)] = (todo[api_id][1], account_id, provider_account_id, expires)
+        out[api_id] = (account_id, provider_account_id)
+    return out
+
+
+def upsert_account(cur, inst_id, acct, enrollment_id=None):
+    """Single-account upsert_accounts(); returns (accounts.id, provider_accounts.id or None)."""
+    return upsert_accounts(cur, inst_id, [acct], enrollment_id)[acct.get("id")]
+
+
+def committed():
+    """The caller's transaction committed: keep what it wrote."""
+    global _institution_id, _pending_institution
+    if _pending_institution is not None:
+        _institution_id, _pending_institution = _pending_institution, None
+    _accounts.update(_pending)
+    _pending.clear()
+
+
+def discard():
+    """The caller's transaction rolled back: forget what it wrote."""
+    global _pending_institution
+    _pending_institution = None
+    _pending.clear()
@@ -0,0 +1,33 @@
+from merchants import canonical_name, normalize_desc
+
+
+def test_normalize_desc():
+    assert normalize_desc("  sq *blue   bottle\t#12 ") == "SQ *BLUE BOTTLE #12"
+    assert normalize_desc(None) == ""
+
+
+def test_canonical_name_strips_what_varies_between_purchases():
+    assert canonical_name("SQ *BLUE BOTTLE #0412 OAKLAND CA 10/02") == "BLUE BOTTLE OAKLAND"
+    assert canonical_name("CHEVRON 0012") == "CHEVRON"
+    assert canonical_name("SHELL OIL 57444 TX") == "SHELL OIL"
+    assert canonical_name("TST* JOE'S PIZZA 555-123-4567") == "JOE'S PIZZA"
+
+
+def test_canonical_name_stacked_prefixes_and_card_suffixes():
+    assert canonical_name("POS DEBIT CHECK CARD STARBUCKS STORE 123") == "STARBUCKS"
+    assert canonical_name("PAYPAL *SPOTIFY XXXX1234") == "SPOTIFY"
+
+
+def test_canonical_name_same_merchant_same_key():
+    same = {"STARBUCKS STORE 123", "STARBUCKS #77 WA", "DEBIT CARD PURCHASE STARBUCKS #9", "SQ *STARBUCKS 03/14"}
+    assert {canonical_name(d) for d in same} == {"STARBUCKS"}
+
+
+def test_canonical_name_keeps_a_lone_state_like_word():
+    # a one-word name is never taken for a state code
+    assert canonical_name("IN") == "IN"
+
+
+def test_canonical_name_falls_back_to_the_description():
+    assert canonical_name("1234567") == "1234567"
+    assert canonical_name("NETFLIX.COM") == "NETFLIX COM"
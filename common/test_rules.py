@@ -0,0 +1,85 @@
+from decimal import Decimal as D
+
+import rules
+from rules import RuleSet
+
+# (id, name, includes, excludes, category_id, set_tag_ids, amount_min, amount_max), match order
+ROWS = [
+    (1, "rent", ["RENT"], [], 10, None, D("-4000"), D("-400")),
+    (2, "walmart", ["WALMART", "WM SUPERCENTER"], ["FUEL"], 11, None, None, None),
+    (3, "fuel", ["FUEL", "SHELL"], [], 12, [7], None, None),
+    (4, "tag only", ["VENMO"], [], None, [8], None, None),
+    (5, "no includes", [], [], 13, None, None, None),
+    (6, "nothing to write", ["NETFLIX"], [], None, None, None, None),
+]
+
+
+def test_match_first_rule_in_order():
+    rs = RuleSet(ROWS, 1)
+    assert rs.match("WM SUPERCENTER #123", -52.10) == ("walmart", 11, ())
+    assert rs.match("WALMART FUEL 0412", -40) == ("fuel", 12, (7,))
+
+
+def test_match_amount_bounds():
+    rs = RuleSet(ROWS, 1)
+    assert rs.match("RENT PAYMENT", D("-1500.00"))[0] == "rent"
+    assert rs.match("RENT PAYMENT", D("-4000.00"))[0] == "rent"
+    assert rs.match("RENT PAYMENT", -45) is None
+    assert rs.match("RENT PAYMENT", -4500) is None
+
+
+def test_match_outflows_only():
+    rs = RuleSet(ROWS, 1)
+    assert rs.match("WALMART", 0) is None
+    assert rs.match("WALMART REFUND", 12.5) is None
+
+
+def test_match_tag_only_rule():
+    assert RuleSet(ROWS, 1).match("VENMO PAYMENT", -20) == ("tag only", None, (8,))
+
+
+def test_rules_that_cannot_match_or_write_are_skipped():
+    rs = RuleSet(ROWS, 1)
+    assert [r[0] for r in rs.rules] == ["rent", "walmart", "fuel", "tag only"]
+    assert rs.match("NETFLIX.COM", -15.49) is None
+    assert not rs.gate.search("NETFLIX.COM")
+
+
+def test_match_no_rules_or_no_description():
+    assert RuleSet([], 1).match("WALMART", -1) is None
+    assert RuleSet(ROWS, 1).match("", -1) is None
+    assert RuleSet(ROWS, 1).match(None, -1) is None
+
+
+def test_categorize_writes_splits_and_tags(db):
+    with db.cursor() as cur:
+        cur.execute("select id from categories where code = 'GROCERIES'")
+        groceries = cur.fetchone()[0]
+        cur.execute("insert into tags(name) values ('test-household') returning id")
+        tag = cur.fetchone()[0]
+        cur.execute("""
+          insert into rules(name, priority, includes, excludes, category_id, set_tag_ids)
+          values ('test corner shop', 0, '{CORNER SHOP}', '{LOTTERY}', %s, %s)
+        """, (groceries, [tag, 999999]))
+        cur.execute("insert into accounts(name, type) values ('Rules', 'checking') returning id")
+        account_id = cur.fetchone()[0]
+        cur.execute("""
+          insert into transactions(account_id, posted_at, amount, currency, description, hash)
+          values (%s, current_date, -12.40, 'USD', 'CORNER SHOP 12', '\\x01'),
+                 (%s, current_date, -5.00, 'USD', 'CORNER SHOP LOTTERY', '\\x02'),
+                 (%s, current_date, 12.40, 'USD', 'CORNER SHOP REFUND', '\\x03')
+          returning id, description, amount
+        """, (account_id, account_id, account_id))
+        new = cur.fetchall()
+        rules.invalidate()
+        assert rules.categorize(cur, new) == 1
+        cur.execute("select transaction_id, category_id, amount, note from tx_splits where transaction_id = any(%s)",
+                    ([r[0] for r in new],))
+        assert cur.fetchall() == [(new[0][0], groceries, D("-12.40"), "rule:test corner shop")]
+        # the deleted tag is skipped
+        cur.execute("select transaction_id, tag_id from tx_tags where transaction_id = any(%s)", ([r[0] for r in new],))
+        assert cur.fetchall() == [(new[0][0], tag)]
+
+
+def test_categorize_nothing():
+    assert rules.categorize(None, []) == 0
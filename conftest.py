@@ -0,0 +1,71 @@
+# conftest.py
+# Shared by the tests next to the service modules. The modules build their DSN from
+# POSTGRES_* at import time and import each other flat, as in the images (everything is
+# copied into /app), so the service directories go on the path and POSTGRES_* get
+# defaults. The pure tests need nothing else. The `db` tests run against
+# TEST_POSTGRES_DB (migrations applied, as by db-bootstrap) and are skipped without it;
+# each runs in one transaction that is rolled back.
+#
+#   python -m pytest                                   # from the repo root
+#   TEST_POSTGRES_DB=finance_test python -m pytest
+
+import os, sys
+
+import pytest
+
+if os.getenv("TEST_POSTGRES_DB"):
+    os.environ["POSTGRES_DB"] = os.environ["TEST_POSTGRES_DB"]  # merchants.Resolver connects on its own
+for var, value in (("POSTGRES_HOST", "localhost"), ("POSTGRES_PORT", "5432"), ("POSTGRES_DB", "finance"),
+                   ("POSTGRES_USER", "finance"), ("POSTGRES_PASSWORD", "")):
+    os.environ.setdefault(var, value)
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+for d in ("common", "pipeline", "classifier", "teller-sync"):
+    sys.path.insert(0, os.path.join(ROOT, d))
+
+
+class FakeCursor:
+    """Stands in for a psycopg cursor: each execute() answers with the next canned result."""
+
+    def __init__(self, *results):
+        self.results = list(results)
+        self.executed = []
+
+    def execute(self, sql, params=None):
+        self.executed.append((sql, params))
+        self.rows = self.results.pop(0) if self.results else []
+
+    def fetchall(self):
+        return self.rows
+
+
+def teller_account(cur, api_id, mask):
+    """A Teller account written as teller-sync writes it; returns (accounts.id, provider_accounts.id)."""
+    import teller_store
+    cur.execute("""
+      insert into provider_enrollments(enrollment_id, environment, access_token_enc)
+      values ('usr_test', 'sandbox', '\\x00') on conflict do nothing
+    """)
+    inst_id = teller_store.ensure_institution(cur)
+    acct = {"id": api_id, "name": "Checking", "type": "depository", "subtype": "checking", "last_four": mask}
+    return teller_store.upsert_accounts(cur, inst_id, [acct], "usr_test")[api_id]
+
+
+@pytest.fixture
+def db():
+    """A connection to TEST_POSTGRES_DB; whatever the test wrote is rolled back."""
+    if not os.getenv("TEST_POSTGRES_DB"):
+        pytest.skip("TEST_POSTGRES_DB not set")
+    import psycopg
+    import rules
+    import teller_store
+    conn = psycopg.connect(
+        f"host={os.environ['POSTGRES_HOST']} port={os.environ['POSTGRES_PORT']} dbname={os.environ['POSTGRES_DB']} "
+        f"user={os.environ['POSTGRES_USER']} password={os.environ['POSTGRES_PASSWORD']}")
+    try:
+        yield conn
+    finally:
+        conn.rollback()
+        conn.close()
+        teller_store.discard()  # ids cached from the rolled-back writes never existed
+        rules.invalidate()  # nor did a rules_version the test bumped
@@ -0,0 +1,26 @@
+-- Wake the pipeline daemon when new work lands instead of waiting for the next cron tick.
+-- pg_notify collapses identical payloads within a transaction, so a batch insert is cheap.
+
+create or replace function notify_ingest_file() returns trigger as $$
+begin
+  perform pg_notify('ingest_files', new.id::text);
+  return new;
+end
+$$ language plpgsql;
+
+drop trigger if exists trg_ingest_files_notify on ingest_files;
+create trigger trg_ingest_files_notify
+  after insert on ingest_files
+  for each row execute function notify_ingest_file();
+
+create or replace function notify_teller_job() returns trigger as $$
+begin
+  perform pg_notify('teller_jobs', new.account_api_id);
+  return new;
+end
+$$ language plpgsql;
+
+drop trigger if exists trg_teller_jobs_notify on teller_jobs;
+create trigger trg_teller_jobs_notify
+  after insert on teller_jobs
+  for each row execute function notify_teller_job();
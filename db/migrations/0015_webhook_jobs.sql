@@ -0,0 +1,24 @@
+-- Let teller-webhook enqueue jobs it can actually insert.
+-- A webhook only knows the Teller account id: the provider account and window are
+-- resolved by drain_jobs, so those columns can't be mandatory for webhook rows.
+alter table teller_jobs add column if not exists enqueue_reason text;
+alter table teller_jobs add column if not exists start_date date;
+alter table teller_jobs add column if not exists end_date date;
+
+DO $$
+DECLARE col text;
+BEGIN
+  FOREACH col IN ARRAY array['provider_account_id','start_date','end_date'] LOOP
+    IF EXISTS (
+      SELECT 1 FROM information_schema.columns
+      WHERE table_name='teller_jobs' AND column_name=col AND is_nullable='NO'
+    ) THEN
+      EXECUTE format('alter table teller_jobs alter column %I drop not null', col);
+    END IF;
+  END LOOP;
+END $$;
+
+-- At most one open webhook job per account; the batched upsert conflicts on this.
+create unique index if not exists uq_teller_jobs_webhook_account
+  on teller_jobs(account_api_id)
+  where start_date is null;
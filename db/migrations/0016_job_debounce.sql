@@ -0,0 +1,15 @@
+-- Debounce noisy accounts: webhook events for an account that already has an open job
+-- merge into it (union of reasons, run_after pushed out until the account goes quiet)
+-- instead of queueing another full fetch. coalesced_events counts the merged-away
+-- events so drain_jobs can report how many upstream calls that saved.
+alter table teller_jobs add column if not exists coalesced_events int not null default 0;
+
+-- union of two comma-separated reason lists, sorted, nulls ignored
+create or replace function merge_reasons(a text, b text) returns text as $$
+  select nullif(array_to_string(array(
+    select distinct r
+      from unnest(string_to_array(coalesce(a, ''), ',') || string_to_array(coalesce(b, ''), ',')) as r
+     where r <> ''
+     order by r
+  ), ','), '')
+$$ language sql immutable;
@@ -0,0 +1,335 @@
+-- Range-partition transactions by posting month.
+--
+-- Every reporting path scans by posted_at range, so monthly partitions let the planner
+-- prune to the months asked for and let vacuum work one month at a time.
+--
+-- Postgres only allows unique indexes on a partitioned table if they include the
+-- partition key, and a Teller transaction's posted_at can change when it posts, so the
+-- global keys move to a small unpartitioned identity table, tx_keys:
+--   * a BEFORE INSERT trigger claims (account_id, external_tx_id) / (account_id, hash);
+--     a duplicate is skipped (the insert returns no row, same as ON CONFLICT DO NOTHING)
+--   * updates keep the claim in step; rows moving partitions keep their claim
+--   * tx_splits / tx_tags / category_predictions reference tx_keys(transaction_id),
+--     so "on delete cascade" still follows a transaction being deleted
+--
+-- The move is online; writers only wait for the final swap:
+--   1) create tx_keys and the partitioned copy (empty, with its indexes and foreign keys)
+--      and a capture trigger that logs the id of every row written to the heap from then on
+--   2) tx_move_copy() copies by id range in batches of 10k, one commit per batch, then
+--      re-syncs the logged ids in rounds until a round finds less than a batch of work
+--   3) the swap takes an ACCESS EXCLUSIVE lock on the heap, re-syncs what the last round
+--      left, drops the heap and renames the copy: a few hundred rows, not the table
+--   4) the foreign keys repointed at tx_keys in the swap are NOT VALID; they are
+--      validated afterwards under a lock that lets writers through
+-- Writers and readers keep running throughout. If the copy is interrupted, drop
+-- transactions_p, tx_keys, tx_move_log and trg_tx_move_capture and run the file again.
+
+-- 1) identity table, partitioned copy, capture trigger
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS tx_keys (
+  transaction_id bigint PRIMARY KEY,
+  account_id     bigint NOT NULL,
+  posted_at      date   NOT NULL,
+  external_tx_id text,
+  hash           bytea
+);
+CREATE UNIQUE INDEX IF NOT EXISTS ux_tx_keys_external
+  ON tx_keys(account_id, external_tx_id) WHERE external_tx_id IS NOT NULL;
+CREATE UNIQUE INDEX IF NOT EXISTS ux_tx_keys_hash
+  ON tx_keys(account_id, hash) WHERE hash IS NOT NULL;
+
+-- one partition per month present plus a default catch-all
+CREATE TABLE transactions_p (LIKE transactions INCLUDING DEFAULTS INCLUDING CONSTRAINTS)
+  PARTITION BY RANGE (posted_at);
+ALTER TABLE transactions_p ADD PRIMARY KEY (id, posted_at);
+CREATE TABLE transactions_default PARTITION OF transactions_p DEFAULT;
+
+DO $$
+DECLARE m date;
+BEGIN
+  FOR m IN
+    SELECT generate_series(
+             date_trunc('month', coalesce(min(posted_at), current_date)),
+             date_trunc('month', greatest(coalesce(max(posted_at), current_date), current_date)),
+             interval '1 month')::date
+    FROM transactions
+  LOOP
+    EXECUTE format('CREATE TABLE %I PARTITION OF transactions_p FOR VALUES FROM (%L) TO (%L)',
+                   'transactions_' || to_char(m, 'YYYY_MM'), m, (m + interval '1 month')::date);
+  END LOOP;
+END $$;
+
+-- index names are taken by the heap's until the swap
+CREATE INDEX ix_tx_account_date_p ON transactions_p(account_id, posted_at);
+CREATE INDEX idx_transactions_posted_at_p ON transactions_p(posted_at DESC);
+CREATE INDEX ix_tx_normdesc_trgm_p ON transactions_p USING gin (normalized_desc gin_trgm_ops);
+
+ALTER TABLE transactions_p
+  ADD CONSTRAINT transactions_account_id_fkey FOREIGN KEY (account_id) REFERENCES accounts(id),
+  ADD CONSTRAINT transactions_merchant_id_fkey FOREIGN KEY (merchant_id) REFERENCES merchants(id);
+
+CREATE TABLE tx_move_log (
+  seq bigserial PRIMARY KEY,
+  id  bigint NOT NULL
+);
+
+CREATE OR REPLACE FUNCTION tx_move_capture() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP <> 'INSERT' THEN
+    INSERT INTO tx_move_log(id) VALUES (OLD.id);
+  END IF;
+  IF TG_OP = 'INSERT' OR (TG_OP = 'UPDATE' AND NEW.id <> OLD.id) THEN
+    INSERT INTO tx_move_log(id) VALUES (NEW.id);
+  END IF;
+  RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+-- CREATE TRIGGER waits for writers already running, so every later write is logged
+CREATE TRIGGER trg_tx_move_capture AFTER INSERT OR UPDATE OR DELETE ON transactions
+  FOR EACH ROW EXECUTE FUNCTION tx_move_capture();
+
+COMMIT;
+
+-- 2) batch copy and catch-up
+-- The heap rows for p_ids are read once into tx_move_rows, so the copy and its keys come
+-- from one snapshot. A key still held in tx_keys by another id is stale: the heap's own
+-- unique indexes say that id has let go of it since, so the id is in the log and gets
+-- its keys back when its turn comes.
+CREATE TEMP TABLE tx_move_rows (LIKE transactions);
+
+-- p_fresh: ids never copied before (the range copy), nothing to clear first.
+CREATE OR REPLACE FUNCTION tx_move_sync(p_ids bigint[], p_fresh boolean) RETURNS int AS $$
+DECLARE
+  r record;
+BEGIN
+  TRUNCATE tx_move_rows;
+  INSERT INTO tx_move_rows SELECT * FROM transactions WHERE id = ANY(p_ids);
+  IF NOT p_fresh THEN
+    DELETE FROM transactions_p t USING unnest(p_ids) AS u(id) WHERE t.id = u.id;
+    DELETE FROM tx_keys WHERE transaction_id = ANY(p_ids);
+  END IF;
+  INSERT INTO transactions_p SELECT * FROM tx_move_rows;
+  INSERT INTO tx_keys(transaction_id, account_id, posted_at, external_tx_id, hash)
+  SELECT id, account_id, posted_at, external_tx_id, hash FROM tx_move_rows
+  ON CONFLICT DO NOTHING;
+  FOR r IN SELECT * FROM tx_move_rows m WHERE NOT EXISTS (SELECT 1 FROM tx_keys WHERE transaction_id = m.id) LOOP
+    DELETE FROM tx_keys WHERE account_id = r.account_id AND external_tx_id = r.external_tx_id;
+    DELETE FROM tx_keys WHERE account_id = r.account_id AND hash = r.hash;
+    INSERT INTO tx_keys(transaction_id, account_id, posted_at, external_tx_id, hash)
+    VALUES (r.id, r.account_id, r.posted_at, r.external_tx_id, r.hash);
+  END LOOP;
+  RETURN cardinality(p_ids);
+END
+$$ LANGUAGE plpgsql;
+
+-- Take up to p_limit entries off the log (only the ones this snapshot sees; a write still
+-- in flight keeps its entry for the next round) and re-sync their ids.
+CREATE OR REPLACE FUNCTION tx_move_catch_up(p_limit int) RETURNS int AS $$
+DECLARE ids bigint[];
+BEGIN
+  WITH taken AS (
+    DELETE FROM tx_move_log
+     WHERE seq IN (SELECT seq FROM tx_move_log ORDER BY seq LIMIT p_limit)
+    RETURNING id
+  )
+  SELECT array_agg(DISTINCT id) INTO ids FROM taken;
+  RETURN coalesce(tx_move_sync(ids, false), 0);
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE PROCEDURE tx_move_copy(p_batch int) AS $$
+DECLARE
+  lo bigint;
+  hi bigint;
+BEGIN
+  -- rows inserted after this read are in the log
+  SELECT min(id), max(id) INTO lo, hi FROM transactions;
+  WHILE lo <= hi LOOP
+    PERFORM tx_move_sync(ARRAY(SELECT id FROM transactions WHERE id >= lo AND id < lo + p_batch), true);
+    COMMIT;
+    lo := lo + p_batch;
+  END LOOP;
+  LOOP
+    EXIT WHEN tx_move_catch_up(p_batch) < p_batch;
+    COMMIT;
+  END LOOP;
+  COMMIT;
+END
+$$ LANGUAGE plpgsql;
+
+CALL tx_move_copy(10000);
+
+-- 3) swap: catch up the last writes, repoint dependants, drop the heap, take its name
+BEGIN;
+
+LOCK TABLE transactions IN ACCESS EXCLUSIVE MODE;
+SELECT tx_move_catch_up(2147483647);
+DROP TRIGGER trg_tx_move_capture ON transactions;
+
+DROP VIEW IF EXISTS v_monthly_spend;
+DROP VIEW IF EXISTS v_budget_status;
+
+ALTER TABLE tx_splits DROP CONSTRAINT IF EXISTS tx_splits_transaction_id_fkey;
+ALTER TABLE tx_tags DROP CONSTRAINT IF EXISTS fk_txtags_tx;
+ALTER TABLE category_predictions DROP CONSTRAINT IF EXISTS category_predictions_transaction_id_fkey;
+
+ALTER SEQUENCE transactions_id_seq OWNED BY transactions_p.id;
+DROP TABLE transactions;
+ALTER TABLE transactions_p RENAME TO transactions;
+ALTER INDEX transactions_p_pkey RENAME TO transactions_pkey;
+ALTER INDEX ix_tx_account_date_p RENAME TO ix_tx_account_date;
+ALTER INDEX idx_transactions_posted_at_p RENAME TO idx_transactions_posted_at;
+ALTER INDEX ix_tx_normdesc_trgm_p RENAME TO ix_tx_normdesc_trgm;
+
+ALTER TABLE tx_splits ADD CONSTRAINT tx_splits_transaction_id_fkey
+  FOREIGN KEY (transaction_id) REFERENCES tx_keys(transaction_id) ON DELETE CASCADE NOT VALID;
+ALTER TABLE tx_tags ADD CONSTRAINT fk_txtags_tx
+  FOREIGN KEY (transaction_id) REFERENCES tx_keys(transaction_id) ON DELETE CASCADE NOT VALID;
+ALTER TABLE category_predictions ADD CONSTRAINT category_predictions_transaction_id_fkey
+  FOREIGN KEY (transaction_id) REFERENCES tx_keys(transaction_id) ON DELETE CASCADE NOT VALID;
+
+-- 4) key maintenance
+CREATE OR REPLACE FUNCTION tx_keys_claim() RETURNS trigger AS $$
+BEGIN
+  INSERT INTO tx_keys(transaction_id, account_id, posted_at, external_tx_id, hash)
+  VALUES (NEW.id, NEW.account_id, NEW.posted_at, NEW.external_tx_id, NEW.hash)
+  ON CONFLICT DO NOTHING;
+  IF FOUND THEN
+    RETURN NEW;
+  END IF;
+  -- same id already holds the claim: a row moving partitions, or a default-partition split
+  IF EXISTS (SELECT 1 FROM tx_keys WHERE transaction_id = NEW.id) THEN
+    RETURN NEW;
+  END IF;
+  RETURN NULL;  -- duplicate of an existing transaction
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION tx_keys_update() RETURNS trigger AS $$
+BEGIN
+  UPDATE tx_keys
+     SET account_id = NEW.account_id, posted_at = NEW.posted_at,
+         external_tx_id = NEW.external_tx_id, hash = NEW.hash
+   WHERE transaction_id = OLD.id;
+  RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION tx_keys_release() RETURNS trigger AS $$
+BEGIN
+  -- moving rows out of the default partition (tx_ensure_partition) is not a delete
+  IF current_setting('finance.tx_moving', true) = 'on' THEN
+    RETURN NULL;
+  END IF;
+  -- after-row triggers run at end of statement, so a row that moved partitions is back
+  DELETE FROM tx_keys k
+   WHERE k.transaction_id = OLD.id
+     AND NOT EXISTS (SELECT 1 FROM transactions t WHERE t.id = OLD.id);
+  RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_tx_keys_claim BEFORE INSERT ON transactions
+  FOR EACH ROW EXECUTE FUNCTION tx_keys_claim();
+CREATE TRIGGER trg_tx_keys_update BEFORE UPDATE OF account_id, posted_at, external_tx_id, hash ON transactions
+  FOR EACH ROW EXECUTE FUNCTION tx_keys_update();
+CREATE TRIGGER trg_tx_keys_release AFTER DELETE ON transactions
+  FOR EACH ROW EXECUTE FUNCTION tx_keys_release();
+
+-- 5) future partitions
+-- Create the partition for p_month if missing, first moving any rows that already
+-- landed in the default partition for that month (a late statement import).
+CREATE OR REPLACE FUNCTION tx_ensure_partition(p_month date) RETURNS text AS $$
+DECLARE
+  start_d date := date_trunc('month', p_month)::date;
+  end_d   date := (date_trunc('month', p_month) + interval '1 month')::date;
+  part    text := 'transactions_' || to_char(start_d, 'YYYY_MM');
+BEGIN
+  IF to_regclass(part) IS NOT NULL THEN
+    RETURN part;
+  END IF;
+  EXECUTE format('CREATE TABLE %I (LIKE transactions INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', part);
+  PERFORM set_config('finance.tx_moving', 'on', true);
+  EXECUTE format('INSERT INTO %I SELECT * FROM transactions_default WHERE posted_at >= %L AND posted_at < %L',
+                 part, start_d, end_d);
+  EXECUTE format('DELETE FROM transactions_default WHERE posted_at >= %L AND posted_at < %L', start_d, end_d);
+  PERFORM set_config('finance.tx_moving', 'off', true);
+  EXECUTE format('ALTER TABLE transactions ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)', part, start_d, end_d);
+  RETURN part;
+END
+$$ LANGUAGE plpgsql;
+
+-- Called daily by the pipeline daemon: next p_months_ahead months, plus any month that
+-- has collected rows in the default partition. Returns the partitions created.
+CREATE OR REPLACE FUNCTION tx_partition_maintenance(p_months_ahead int DEFAULT 3) RETURNS int AS $$
+DECLARE
+  m date;
+  n int := 0;
+BEGIN
+  FOR m IN
+    SELECT generate_series(date_trunc('month', current_date),
+                           date_trunc('month', current_date) + make_interval(months => p_months_ahead),
+                           interval '1 month')::date
+    UNION
+    SELECT DISTINCT date_trunc('month', posted_at)::date FROM transactions_default
+  LOOP
+    IF to_regclass('transactions_' || to_char(m, 'YYYY_MM')) IS NULL THEN
+      PERFORM tx_ensure_partition(m);
+      n := n + 1;
+    END IF;
+  END LOOP;
+  RETURN n;
+END
+$$ LANGUAGE plpgsql;
+
+SELECT tx_partition_maintenance(3);
+
+-- 6) views: same definitions as 0002; monthly spend is a function first so the API can
+-- pass a posted_at range the planner can prune on (a filter on date_trunc() can't)
+CREATE OR REPLACE FUNCTION monthly_spend(p_from date, p_to date)
+RETURNS TABLE(month date, category text, spend numeric) AS $$
+  select
+    date_trunc('month', t.posted_at)::date as month,
+    coalesce(c.code, 'UNCATEGORIZED') as category,
+    sum(case when s.amount is not null then s.amount else t.amount end) * -1 as spend
+  from transactions t
+  left join tx_splits s on s.transaction_id = t.id
+  left join categories c on c.id = s.category_id
+  where ((s.amount is not null and s.amount < 0) or (s.amount is null and t.amount < 0))
+    and (p_from is null or t.posted_at >= p_from)
+    and (p_to is null or t.posted_at <= p_to)
+  group by 1,2
+$$ LANGUAGE sql STABLE;
+
+CREATE OR REPLACE VIEW v_monthly_spend AS
+SELECT * FROM monthly_spend(null, null);
+
+create or replace view v_budget_status as
+select
+  b.category_id,
+  c.code as category,
+  b.period_start, b.period_end,
+  b.amount as budget,
+  coalesce(sum(case when s.amount < 0 then s.amount else 0 end) * -1, 0) as actual_spend,
+  b.amount - (coalesce(sum(case when s.amount < 0 then s.amount else 0 end) * -1, 0)) as remaining
+from budgets b
+left join categories c on c.id = b.category_id
+left join tx_splits s on s.category_id = b.category_id
+left join transactions t on t.id = s.transaction_id
+  and t.posted_at between b.period_start and b.period_end
+group by 1,2,3,4,5;
+
+COMMIT;
+
+-- 7) validate the repointed foreign keys (SHARE UPDATE EXCLUSIVE: writers keep going) and clean up
+ALTER TABLE tx_splits VALIDATE CONSTRAINT tx_splits_transaction_id_fkey;
+ALTER TABLE tx_tags VALIDATE CONSTRAINT fk_txtags_tx;
+ALTER TABLE category_predictions VALIDATE CONSTRAINT category_predictions_transaction_id_fkey;
+
+DROP PROCEDURE tx_move_copy(int);
+DROP FUNCTION tx_move_catch_up(int);
+DROP FUNCTION tx_move_sync(bigint[], boolean);
+DROP FUNCTION tx_move_capture();
+DROP TABLE tx_move_log;
@@ -0,0 +1,15 @@
+-- Indexes for the hot queries catalogued in ops/bench/explain_queries.py.
+--
+--   tx_splits(transaction_id)            /transactions joins + uncategorized anti-join,
+--                                        classifier candidates(), monthly_spend(), and
+--                                        the ON DELETE CASCADE from tx_keys
+--   tx_splits(category_id)               v_budget_status
+--   provider_accounts(teller_account_id) sync.drain_jobs() join
+--
+-- CONCURRENTLY keeps tx_splits writable while it builds, so no BEGIN/COMMIT here
+-- (bootstrap runs each statement on its own). If a build is interrupted, drop the
+-- INVALID index and re-run.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_tx_splits_transaction ON tx_splits(transaction_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_tx_splits_category ON tx_splits(category_id);
+CREATE INDEX IF NOT EXISTS ix_provider_accounts_teller_account ON provider_accounts(teller_account_id);
@@ -0,0 +1,20 @@
+-- Version each enrollment's encrypted access token so teller-sync can keep decrypted
+-- tokens in memory and decrypt again only when the token actually changes.
+-- Any write to access_token_enc (enroll.py's upsert, a manual rotation) bumps the version;
+-- pgp_sym_encrypt is salted, so re-enrolling with the same token bumps it too.
+
+alter table provider_enrollments add column if not exists token_version bigint not null default 1;
+
+create or replace function bump_token_version() returns trigger as $$
+begin
+  if new.access_token_enc is distinct from old.access_token_enc then
+    new.token_version := old.token_version + 1;
+  end if;
+  return new;
+end
+$$ language plpgsql;
+
+drop trigger if exists trg_provider_enrollments_token_version on provider_enrollments;
+create trigger trg_provider_enrollments_token_version
+  before update of access_token_enc on provider_enrollments
+  for each row execute function bump_token_version();
@@ -0,0 +1,10 @@
+-- Retry policy for teller_jobs (teller-sync/sync.py fail_jobs): failures back off
+-- exponentially per attempt and, past the limit for their error class, are dead-lettered
+-- as status = 'failed' instead of being retried forever. teller-sync/jobs.py lists and
+-- requeues them.
+alter table teller_jobs add column if not exists error_class text;  -- auth | rate_limit | client | transient
+
+-- drain_jobs and next_due only ever look at queued rows
+create index if not exists idx_teller_jobs_queued_run_after
+  on teller_jobs(run_after, id)
+  where status = 'queued';
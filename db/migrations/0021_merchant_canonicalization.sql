@@ -0,0 +1,21 @@
+-- Merchant canonicalization (common/merchants.py): every transaction writer resolves its
+-- normalized_desc to a merchants row at insert time, and the pipeline's merchants stage
+-- backfills rows written before that (or by a writer that couldn't resolve).
+--
+--   merchants.canonical_name   description with store numbers, dates, card suffixes and
+--                              processor prefixes stripped; one row per canonical name
+--   merchant_aliases           canonical names folded into an existing merchant (the
+--                              merchant's own name included); the resolver's first lookup
+
+create unique index if not exists ux_merchants_canonical_name on merchants(canonical_name);
+
+create table if not exists merchant_aliases (
+  alias text primary key,
+  merchant_id bigint not null references merchants(id) on delete cascade,
+  created_at timestamptz not null default now()
+);
+create index if not exists ix_merchant_aliases_merchant on merchant_aliases(merchant_id);
+
+-- group / filter by merchant, and the backfill's "what's left" scan
+create index if not exists ix_tx_merchant on transactions(merchant_id, posted_at);
+create index if not exists ix_tx_merchant_missing on transactions(normalized_desc) where merchant_id is null;
@@ -0,0 +1,12 @@
+-- Description embeddings for category suggestions (api/app.py /suggestions).
+-- One vector per merchant (merchants.embed() over the canonical name, computed locally in
+-- Python): transactions of a merchant share it, so the index stays as small as the
+-- merchants table instead of growing with history. The merchants pipeline stage fills
+-- rows that predate this migration.
+
+create extension if not exists vector;
+
+alter table merchants add column if not exists embedding vector(256);
+
+create index if not exists ix_merchants_embedding_hnsw
+  on merchants using hnsw (embedding vector_cosine_ops);
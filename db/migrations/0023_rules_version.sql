@@ -0,0 +1,46 @@
+-- Category rules come from the rules table (0001) instead of config/rules.yaml
+-- (common/rules.py). Any statement that changes rules bumps rules_version.version and
+-- sends NOTIFY rules. Long-running writers recompile on that notify, and one-shot ones
+-- compare the version when they start. classifier/rule_import.py loads a rules YAML file.
+
+-- the importer upserts by name
+create unique index if not exists ux_rules_name on rules(name);
+
+create table if not exists rules_version (
+  id boolean primary key default true check (id),  -- single row
+  version bigint not null default 0,
+  updated_at timestamptz not null default now()
+);
+insert into rules_version(id) values (true) on conflict do nothing;
+
+create or replace function bump_rules_version() returns trigger as $$
+begin
+  update rules_version set version = version + 1, updated_at = now();
+  -- constant payload: one notify per transaction however many statements touched rules
+  perform pg_notify('rules', '');
+  return null;
+end
+$$ language plpgsql;
+
+drop trigger if exists trg_rules_version on rules;
+create trigger trg_rules_version
+  after insert or update or delete or truncate on rules
+  for each statement execute function bump_rules_version();
+
+-- the rules config/rules.yaml shipped with; rule_import.py replaces them with your own
+insert into rules(name, priority, includes, excludes, category_id, amount_min, amount_max)
+select r.name, r.priority, r.includes, r.excludes, c.id, r.amount_min, r.amount_max
+from (values
+  (1, 'rent',              5,  array['RENT'], array[]::text[], 'RENT', -4000::numeric, -400::numeric),
+  (2, 'walmart groceries', 10, array['WALMART', 'WM SUPERCENTER'], array['FUEL', 'MONEY CENTER'], 'GROCERIES', null, null),
+  (3, 'spotify',           10, array['SPOTIFY'], array[]::text[], 'SUBSCRIPTIONS', -20, -5),
+  (4, 'amazon shopping',   20, array['AMAZON'], array['AWS', 'AMZN WEB SERVICES'], 'SHOPPING', null, null),
+  (5, 'coffee',            30, array['STARBUCKS', 'COFFEE'], array[]::text[], 'DINING', null, null),
+  (6, 'fuel',              30, array['SHELL', 'CHEVRON', 'EXXON', 'BP', 'GAS STATION'], array[]::text[], 'TRANSPORT', null, null),
+  (7, 'utilities',         30, array['ELECTRIC', 'UTILITY', 'POWER', 'WATER', 'SEWER'], array[]::text[], 'UTILITIES', null, null),
+  (8, 'atm cash',          40, array['ATM WITHDRAWAL'], array[]::text[], 'CASH', null, null),
+  (9, 'transfers',         50, array['TRANSFER FROM', 'TRANSFER TO', 'INTERNAL TRANSFER'], array[]::text[], 'TRANSFERS', null, null)
+) as r(ord, name, priority, includes, excludes, code, amount_min, amount_max)
+join categories c on c.code = r.code
+order by r.ord
+on conflict (name) do nothing;
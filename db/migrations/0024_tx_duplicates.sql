@@ -0,0 +1,57 @@
+-- Cross-source duplicates (pipeline/dedupe.py). A purchase can arrive from Teller
+-- (external_tx_id, no hash) and again from a statement (hash over a different
+-- description), and neither tx_keys claim catches that. Every inserted transaction is
+-- queued. The dedupe stage looks for a counterpart from the other source on the same
+-- account, with the same amount, within a few days, and scores the descriptions.
+--
+--   tx_duplicates            one row per transaction found to duplicate another:
+--                            'suppressed' (sure; transactions.duplicate_of is set) or
+--                            'possible' (kept, listed for review)
+--   transactions.duplicate_of  the surviving transaction; spend views skip these rows
+
+alter table transactions add column if not exists duplicate_of bigint;
+
+create table if not exists tx_duplicates (
+  transaction_id bigint primary key references tx_keys(transaction_id) on delete cascade,
+  duplicate_of   bigint not null references tx_keys(transaction_id) on delete cascade,
+  score          real not null,
+  status         text not null check (status in ('suppressed', 'possible')),
+  created_at     timestamptz not null default now()
+);
+create index if not exists ix_tx_duplicates_of on tx_duplicates(duplicate_of);
+
+create table if not exists tx_dedupe_queue (
+  transaction_id bigint primary key
+);
+
+create or replace function tx_dedupe_enqueue() returns trigger as $$
+begin
+  insert into tx_dedupe_queue(transaction_id) values (new.id) on conflict do nothing;
+  return null;
+end
+$$ language plpgsql;
+
+drop trigger if exists trg_tx_dedupe_enqueue on transactions;
+create trigger trg_tx_dedupe_enqueue
+  after insert on transactions
+  for each row execute function tx_dedupe_enqueue();
+
+-- blocking: one index range per new row (account, exact amount, posted_at window)
+create index if not exists ix_tx_dedupe_block on transactions(account_id, amount, posted_at);
+
+-- same as 0017, minus suppressed duplicates
+create or replace function monthly_spend(p_from date, p_to date)
+returns table(month date, category text, spend numeric) as $$
+  select
+    date_trunc('month', t.posted_at)::date as month,
+    coalesce(c.code, 'UNCATEGORIZED') as category,
+    sum(case when s.amount is not null then s.amount else t.amount end) * -1 as spend
+  from transactions t
+  left join tx_splits s on s.transaction_id = t.id
+  left join categories c on c.id = s.category_id
+  where ((s.amount is not null and s.amount < 0) or (s.amount is null and t.amount < 0))
+    and t.duplicate_of is null
+    and (p_from is null or t.posted_at >= p_from)
+    and (p_to is null or t.posted_at <= p_to)
+  group by 1,2
+$$ language sql stable;
@@ -0,0 +1,83 @@
+-- Transfers between our own accounts (pipeline/transfers.py). A card payment or a move
+-- to savings shows up twice: once as an outflow on one account and once as an equal
+-- inflow on another. Both legs used to count as spend. Every inserted transaction is
+-- queued. The transfers stage looks for the opposite amount on a different account
+-- within a few days.
+--
+--   tx_transfers               one row per leg (both directions of a pair):
+--                              'matched' (transfer_of is set on both legs) or
+--                              'possible' (no transfer wording on either side; kept, listed for review)
+--   transactions.transfer_of   the other leg; spend views and budgets skip these rows
+
+alter table transactions add column if not exists transfer_of bigint;
+
+create table if not exists tx_transfers (
+  transaction_id bigint primary key references tx_keys(transaction_id) on delete cascade,
+  counterpart_id bigint not null references tx_keys(transaction_id) on delete cascade,
+  days           int not null,
+  status         text not null check (status in ('matched', 'possible')),
+  created_at     timestamptz not null default now()
+);
+create index if not exists ix_tx_transfers_counterpart on tx_transfers(counterpart_id);
+
+create table if not exists tx_transfer_queue (
+  transaction_id bigint primary key
+);
+
+create or replace function tx_transfer_enqueue() returns trigger as $$
+begin
+  insert into tx_transfer_queue(transaction_id) values (new.id) on conflict do nothing;
+  return null;
+end
+$$ language plpgsql;
+
+drop trigger if exists trg_tx_transfer_enqueue on transactions;
+create trigger trg_tx_transfer_enqueue
+  after insert on transactions
+  for each row execute function tx_transfer_enqueue();
+
+-- blocking: one index range per new row (exact opposite amount, posted_at window), any account
+create index if not exists ix_tx_transfer_block on transactions(amount, posted_at);
+
+-- same as 0024, minus matched transfers
+create or replace function monthly_spend(p_from date, p_to date)
+returns table(month date, category text, spend numeric) as $$
+  select
+    date_trunc('month', t.posted_at)::date as month,
+    coalesce(c.code, 'UNCATEGORIZED') as category,
+    sum(case when s.amount is not null then s.amount else t.amount end) * -1 as spend
+  from transactions t
+  left join tx_splits s on s.transaction_id = t.id
+  left join categories c on c.id = s.category_id
+  where ((s.amount is not null and s.amount < 0) or (s.amount is null and t.amount < 0))
+    and t.duplicate_of is null
+    and t.transfer_of is null
+    and (p_from is null or t.posted_at >= p_from)
+    and (p_to is null or t.posted_at <= p_to)
+  group by 1,2
+$$ language sql stable;
+
+-- as in 0017, but only splits of transactions posted in the budget's period count (the
+-- old left join summed the category's splits from every period), and transfers and
+-- suppressed duplicates don't. Spend is grouped once per budget period, not rescanned
+-- per budget row; a period_start filter on the view reaches the transactions scan.
+create or replace view v_budget_status as
+select
+  b.category_id,
+  c.code as category,
+  b.period_start, b.period_end,
+  b.amount as budget,
+  coalesce(x.spent, 0) as actual_spend,
+  b.amount - coalesce(x.spent, 0) as remaining
+from budgets b
+left join categories c on c.id = b.category_id
+left join (
+  select p.period_start, p.period_end, s.category_id, sum(s.amount) * -1 as spent
+  from (select distinct period_start, period_end from budgets) p
+  join transactions t on t.posted_at between p.period_start and p.period_end
+  join tx_splits s on s.transaction_id = t.id
+  where s.amount < 0
+    and t.transfer_of is null
+    and t.duplicate_of is null
+  group by 1, 2, 3
+) x on x.period_start = b.period_start and x.period_end = b.period_end and x.category_id = b.category_id;
@@ -0,0 +1,50 @@
+-- Recurring payments and subscriptions (pipeline/recurring.py). Outflows are grouped
+-- per account by merchant_id, or by normalized_desc when no merchant was resolved. The
+-- series found in a group are stored with their cadence and the next expected charge.
+-- Every inserted transaction is queued, and the recurring stage recomputes only the
+-- groups that queued rows belong to. A group's latest charges are read through
+-- ix_tx_account_merchant, or ix_tx_merchant_missing (0021) when no merchant was resolved.
+--
+--   series_key   'm:<merchant_id>' or 'd:<normalized_desc>'; a group is replaced as a whole
+--   active       false once the next expected date has passed by more than the cadence allows
+
+create table if not exists recurring_series (
+  id              bigserial primary key,
+  account_id      bigint not null references accounts(id),
+  series_key      text not null,
+  merchant_id     bigint references merchants(id),
+  normalized_desc text not null,  -- latest description in the series
+  cadence         text not null check (cadence in ('weekly', 'biweekly', 'monthly', 'quarterly', 'annual')),
+  period_days     real not null,  -- median interval seen
+  amount          numeric(14,2) not null,  -- median charge, signed like transactions.amount
+  occurrences     int not null,
+  first_posted_at date not null,
+  last_posted_at  date not null,
+  last_transaction_id bigint not null,
+  next_expected   date not null,
+  next_amount     numeric(14,2) not null,  -- the latest charge: price changes carry forward
+  confidence      real not null,
+  active          boolean not null,
+  updated_at      timestamptz not null default now()
+);
+create index if not exists ix_recurring_series_key on recurring_series(account_id, series_key);
+create index if not exists ix_recurring_series_next on recurring_series(next_expected) where active;
+
+create table if not exists tx_recurring_queue (
+  transaction_id bigint primary key
+);
+
+create or replace function tx_recurring_enqueue() returns trigger as $$
+begin
+  insert into tx_recurring_queue(transaction_id) values (new.id) on conflict do nothing;
+  return null;
+end
+$$ language plpgsql;
+
+drop trigger if exists trg_tx_recurring_enqueue on transactions;
+create trigger trg_tx_recurring_enqueue
+  after insert on transactions
+  for each row execute function tx_recurring_enqueue();
+
+-- one (account, merchant) group newest first; ix_tx_merchant spans every account
+create index if not exists ix_tx_account_merchant on transactions(account_id, merchant_id, posted_at);
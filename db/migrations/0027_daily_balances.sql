@@ -0,0 +1,53 @@
+-- End-of-day balances per account (pipeline/balances.py), so /accounts/{id}/balances reads
+-- one row per day instead of summing every transaction since the account opened. A day is
+-- stored only when the account has transactions on it; a day without any carries the
+-- previous row forward.
+--
+--   balance    the bank's balance_after on that day when one was reported (the latest row
+--              that has one), else the previous day's balance plus the day's net amount
+--   anchored   the balance goes back to a reported balance on or before this day. Days
+--              before an account's first reported balance are derived backwards from it.
+--              With no reported balance at all, they are a running total.
+--
+-- Writes that change an account's history queue (account, day) in tx_balance_queue, one
+-- row per change: a row drained while another write lands on the same day must not swallow
+-- it. The balances stage recomputes each queued account from its earliest queued day
+-- onwards. Suppressed duplicates (0024) don't count.
+
+create table if not exists daily_balances (
+  account_id bigint not null references accounts(id),
+  day        date not null,
+  balance    numeric(14,2) not null,
+  net        numeric(14,2) not null,  -- sum of the day's amounts
+  tx_count   int not null,
+  anchored   boolean not null,
+  updated_at timestamptz not null default now(),
+  primary key (account_id, day)
+);
+
+create table if not exists tx_balance_queue (
+  id         bigserial primary key,
+  account_id bigint not null,
+  day        date not null
+);
+
+create or replace function tx_balance_enqueue() returns trigger as $$
+begin
+  if tg_op <> 'INSERT' then
+    insert into tx_balance_queue(account_id, day) values (old.account_id, old.posted_at);
+  end if;
+  if tg_op <> 'DELETE' then
+    insert into tx_balance_queue(account_id, day) values (new.account_id, new.posted_at);
+  end if;
+  return null;
+end
+$$ language plpgsql;
+
+drop trigger if exists trg_tx_balance_enqueue on transactions;
+create trigger trg_tx_balance_enqueue
+  after insert or delete or update of account_id, posted_at, amount, balance_after, duplicate_of on transactions
+  for each row execute function tx_balance_enqueue();
+
+-- existing history: every account from its first day
+insert into tx_balance_queue(account_id, day)
+select account_id, min(posted_at) from transactions group by account_id;
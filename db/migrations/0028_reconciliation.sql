@@ -0,0 +1,92 @@
+-- Reconciliation against the bank's own balances (pipeline/reconcile.py). teller-sync pulls
+-- rolling windows and the normalizer takes whatever rows a statement has, so a missed sync
+-- day or a statement imported twice went unnoticed. Between two consecutive anchors of an
+-- account (a reported balance_after, or a statement's closing balance), the opening anchor
+-- plus our rows in between has to come to the closing one. An interval that doesn't is a
+-- break: rows are missing from it, or one is in it twice.
+--
+--   daily_balances.reported   the bank's closing balance that day (balances.py closing())
+--   statement_balances        OFX/QFX LEDGERBAL, one per statement file
+--   reconcile_queue           daily_balances / statement_balances writes, as day ranges
+--   reconciliation_breaks     'open' until a recheck of the interval reconciles. A refetch
+--                             of the window is queued in teller_jobs once per break.
+
+alter table daily_balances add column if not exists reported numeric(14,2);
+create index if not exists ix_daily_balances_reported on daily_balances(account_id, day) where reported is not null;
+
+create table if not exists statement_balances (
+  id             bigserial primary key,
+  account_id     bigint not null references accounts(id),
+  ingest_file_id bigint references ingest_files(id) on delete cascade,
+  as_of          date not null,
+  balance        numeric(14,2) not null,
+  created_at     timestamptz not null default now(),
+  unique (ingest_file_id, account_id)
+);
+create index if not exists ix_statement_balances_account on statement_balances(account_id, as_of);
+
+create table if not exists reconcile_queue (
+  id         bigserial primary key,
+  account_id bigint not null,
+  first_day  date not null,
+  last_day   date not null
+);
+
+-- statement-level: a rebuild rewrites thousands of days, the queue gets one range per account
+create or replace function daily_balances_reconcile_enqueue() returns trigger as $$
+begin
+  insert into reconcile_queue(account_id, first_day, last_day)
+  select account_id, min(day), max(day) from changed group by account_id;
+  return null;
+end
+$$ language plpgsql;
+
+create or replace function statement_balances_reconcile_enqueue() returns trigger as $$
+begin
+  insert into reconcile_queue(account_id, first_day, last_day)
+  select account_id, min(as_of), max(as_of) from changed group by account_id;
+  return null;
+end
+$$ language plpgsql;
+
+drop trigger if exists trg_daily_balances_reconcile_ins on daily_balances;
+create trigger trg_daily_balances_reconcile_ins
+  after insert on daily_balances referencing new table as changed
+  for each statement execute function daily_balances_reconcile_enqueue();
+drop trigger if exists trg_daily_balances_reconcile_upd on daily_balances;
+create trigger trg_daily_balances_reconcile_upd
+  after update on daily_balances referencing new table as changed
+  for each statement execute function daily_balances_reconcile_enqueue();
+drop trigger if exists trg_daily_balances_reconcile_del on daily_balances;
+create trigger trg_daily_balances_reconcile_del
+  after delete on daily_balances referencing old table as changed
+  for each statement execute function daily_balances_reconcile_enqueue();
+drop trigger if exists trg_statement_balances_reconcile on statement_balances;
+create trigger trg_statement_balances_reconcile
+  after insert on statement_balances referencing new table as changed
+  for each statement execute function statement_balances_reconcile_enqueue();
+
+create table if not exists reconciliation_breaks (
+  id             bigserial primary key,
+  account_id     bigint not null references accounts(id),
+  start_day      date not null,  -- the opening anchor's day (the day after, for a statement)
+  end_day        date not null,  -- the closing anchor's day
+  opening_source text not null check (opening_source in ('transaction', 'statement')),
+  closing_source text not null check (closing_source in ('transaction', 'statement')),
+  expected       numeric(14,2) not null,  -- opening anchor + our rows in between
+  reported       numeric(14,2) not null,  -- closing anchor
+  difference     numeric(14,2) not null,  -- reported - expected
+  kind           text not null check (kind in ('missing', 'duplicated')),  -- 'duplicated': a row in the interval is -difference
+  status         text not null default 'open' check (status in ('open', 'resolved')),
+  teller_job_id  bigint,  -- the refetch queued for it, if the account is linked to Teller
+  detected_at    timestamptz not null default now(),
+  checked_at     timestamptz not null default now(),
+  resolved_at    timestamptz
+);
+create unique index if not exists ux_reconciliation_breaks_open
+  on reconciliation_breaks(account_id, start_day, end_day) where status = 'open';
+
+-- fill daily_balances.reported: every account is walked again, and its rewritten days queue
+-- the first reconciliation
+insert into tx_balance_queue(account_id, day)
+select account_id, min(day) from daily_balances group by account_id;
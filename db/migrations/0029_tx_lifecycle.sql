@@ -0,0 +1,55 @@
+-- Pending -> posted (teller-sync/sync.py store_transactions()). A Teller row is first
+-- seen pending and re-read on every overlapping window until it posts, often with a new
+-- amount, date or description. The claim trigger used to turn every re-read into a
+-- no-op insert, so the pending values stayed forever.
+--
+--   transactions.status        'pending' / 'posted' as Teller reported it; null for
+--                              statement rows
+--   transactions.fingerprint   sha1 of the fields we store from the payload. A re-read row
+--                              whose fingerprint matches costs no write; one that doesn't
+--                              updates only the columns that changed.
+--
+-- status and fingerprint stay out of every index, so a row that only posts (status,
+-- balance_after) is a HOT update when its page has room. That is what the fillfactor
+-- on the current and future partitions is for: those are the pages pending rows live on.
+-- A pending row that a fetch no longer returns was released and is deleted.
+
+alter table transactions add column if not exists fingerprint bytea;
+
+do $$
+declare
+  part text;
+begin
+  for part in
+    select c.relname
+    from pg_inherits i
+    join pg_class c on c.oid = i.inhrelid
+    where i.inhparent = 'transactions'::regclass
+      and c.relname ~ '^transactions_\d{4}_\d{2}$'
+      and to_date(substr(c.relname, 14), 'YYYY_MM') >= date_trunc('month', current_date)
+  loop
+    execute format('alter table %I set (fillfactor = 90)', part);
+  end loop;
+end
+$$;
+
+-- as in 0017, with room on every page for the row to be updated in place
+create or replace function tx_ensure_partition(p_month date) returns text as $$
+declare
+  start_d date := date_trunc('month', p_month)::date;
+  end_d   date := (date_trunc('month', p_month) + interval '1 month')::date;
+  part    text := 'transactions_' || to_char(start_d, 'YYYY_MM');
+begin
+  if to_regclass(part) is not null then
+    return part;
+  end if;
+  execute format('create table %I (like transactions including defaults including constraints) with (fillfactor = 90)', part);
+  perform set_config('finance.tx_moving', 'on', true);
+  execute format('insert into %I select * from transactions_default where posted_at >= %L and posted_at < %L',
+                 part, start_d, end_d);
+  execute format('delete from transactions_default where posted_at >= %L and posted_at < %L', start_d, end_d);
+  perform set_config('finance.tx_moving', 'off', true);
+  execute format('alter table transactions attach partition %I for values from (%L) to (%L)', part, start_d, end_d);
+  return part;
+end
+$$ language plpgsql;
@@ -0,0 +1,10 @@
+-- provider_accounts.account_id links a Teller account to its accounts row. 0007 filled it
+-- once, but nothing kept it filled: accounts linked since have it null, and reconcile.py
+-- refetch() (which joins on it) queued no Teller refetch for their breaks.
+-- common/teller_store.py upsert_accounts() writes it from now on; this fills the gap.
+
+update provider_accounts pa
+set account_id = a.id
+from accounts a
+where a.external_id = 'teller:' || pa.teller_account_id
+  and pa.account_id is distinct from a.id;
@@ -0,0 +1,10 @@
+-- uq_teller_jobs_webhook_account (0015) held one webhook job per account whatever its
+-- status, so once drain_jobs dead-lettered an account's webhook job every later webhook
+-- merged into the dead row and never ran. Only open jobs take the slot now: a webhook
+-- after a dead letter queues a fresh job, and the dead one stays for teller-sync/jobs.py.
+-- teller-webhook's upsert names the same predicate.
+
+drop index if exists uq_teller_jobs_webhook_account;
+create unique index if not exists uq_teller_jobs_webhook_account
+  on teller_jobs(account_api_id)
+  where start_date is null and status in ('queued', 'running');
@@ -3,6 +3,8 @@ from datetime import datetime
 from imaplib import IMAP4_SSL
 import psycopg
 from email.parser import BytesParser
+import metrics
+import profiling
 
 IMAP_HOST = os.environ["IMAP_HOST"]
 IMAP_USER = os.environ["IMAP_USER"]
@@ -14,7 +16,6 @@ BANK_NAME = os.getenv("BANK_NAME", None)  # optional default bank label
 PG_DSN = f"host={os.environ['POSTGRES_HOST']} port={os.environ['POSTGRES_PORT']} dbname={os.environ['POSTGRES_DB']} user={os.environ['POSTGRES_USER']} password={os.environ['POSTGRES_PASSWORD']}"
 
 os.makedirs(RAW_DIR, exist_ok=True)
-ctx = ssl.create_default_context()
 
 def sha256_bytes(b: bytes) -> str:
     return hashlib.sha256(b).hexdigest()
@@ -41,39 +42,60 @@ def upsert_ingest_file(cur, source, bank, path, h, size, mime):
         (source, bank, path, h, size, mime)
     )
 
-def main():
-    with IMAP4_SSL(IMAP_HOST, ssl_context=ctx) as M:
-        M.login(IMAP_USER, IMAP_PASS)
-        M.select(IMAP_FOLDER)
-        typ, data = M.search(None, 'UNSEEN')
+@metrics.job("email")
+def run(conn):
+    """Pull unseen attachments into ingest_files on an autocommit connection; returns messages handled."""
+    # built per run, not at import: loading the CA bundle is most of this module's startup
+    ctx = ssl.create_default_context()
+    with metrics.timer(metrics.IMAP_SECONDS, op="connect"):
+        M = IMAP4_SSL(IMAP_HOST, ssl_context=ctx)
+    with M:
+        with metrics.timer(metrics.IMAP_SECONDS, op="login"):
+            M.login(IMAP_USER, IMAP_PASS)
+            M.select(IMAP_FOLDER)
+        with metrics.timer(metrics.IMAP_SECONDS, op="search"):
+            typ, data = M.search(None, 'UNSEEN')
         ids = data[0].split()
         if not ids:
             print("[email] nothing new")
-            return
-        with psycopg.connect(PG_DSN, autocommit=True) as conn:
-            with conn.cursor() as cur:
-                for num in ids:
+            return 0
+        with conn.cursor() as cur:
+            for num in ids:
+                with metrics.timer(metrics.IMAP_SECONDS, op="fetch"):
                     typ, msgdata = M.fetch(num, '(RFC822)')
-                    if typ != 'OK': continue
-                    msg = BytesParser().parsebytes(msgdata[0][1])
-                    bank_guess = BANK_NAME
-                    subj = msg.get('Subject', '')
-                    frm = msg.get('From','')
-                    if bank_guess is None:
-                        # naive guess: domain of From header
-                        bank_guess = (frm.split('@')[-1].split('>')[0].split()[-1] if '@' in frm else 'unknown').split('.')[-2]
+                if typ != 'OK': continue
+                metrics.count_bytes(len(msgdata[0][1]), "imap")
+                msg = BytesParser().parsebytes(msgdata[0][1])
+                bank_guess = BANK_NAME
+                subj = msg.get('Subject', '')
+                frm = msg.get('From','')
+                if bank_guess is None:
+                    # naive guess: domain of From header
+                    bank_guess = (frm.split('@')[-1].split('>')[0].split()[-1] if '@' in frm else 'unknown').split('.')[-2]
 
-                    for part in msg.walk():
-                        if part.get_content_disposition() == 'attachment':
-                            fname = part.get_filename() or 'attachment.bin'
-                            payload = part.get_payload(decode=True) or b''
-                            if not payload:
-                                continue
-                            path, h, size, mime = save_attachment(bank_guess, fname, payload)
-                            upsert_ingest_file(cur, 'email', bank_guess, path, h, size, mime)
-                    # mark seen
+                for part in msg.walk():
+                    if part.get_content_disposition() == 'attachment':
+                        fname = part.get_filename() or 'attachment.bin'
+                        payload = part.get_payload(decode=True) or b''
+                        if not payload:
+                            continue
+                        path, h, size, mime = save_attachment(bank_guess, fname, payload)
+                        upsert_ingest_file(cur, 'email', bank_guess, path, h, size, mime)
+                        metrics.count_rows(1, "attachment")
+                # mark seen
+                with metrics.timer(metrics.IMAP_SECONDS, op="store"):
                     M.store(num, '+FLAGS', '\\Seen')
         print(f"[email] processed {len(ids)} messages")
+        return len(ids)
+
+@profiling.profiled("email")
+def main():
+    metrics.set_service("email")
+    try:
+        with psycopg.connect(PG_DSN, autocommit=True, cursor_factory=metrics.TimedCursor) as conn:
+            run(conn)
+    finally:
+        metrics.push()
 
 if __name__ == "__main__":
     main()
@@ -1,10 +1,12 @@
-import os, csv, hashlib, json, glob
+import os, io, csv, hashlib, json, glob
 from datetime import datetime
-from dateutil import parser as dparse
-import chardet
 import psycopg
-import pandas as pd
-from ofxparse import OfxParser
+import metrics
+import profiling
+import merchants
+import rules
+# pandas, chardet, ofxparse and dateutil are imported inside the functions that use
+# them: most runs find nothing to do and shouldn't pay ~0.5s of imports for it.
 
 PG_DSN = f"host={os.environ['POSTGRES_HOST']} port={os.environ['POSTGRES_PORT']} dbname={os.environ['POSTGRES_DB']} user={os.environ['POSTGRES_USER']} password={os.environ['POSTGRES_PASSWORD']}"
 RAW_DIR = os.getenv("RAW_DIR", "/data/raw")
@@ -13,6 +15,7 @@ def sha256_text(s: str) -> bytes:
     return hashlib.sha256(s.encode('utf-8')).digest()
 
 def detect_encoding(path):
+    import chardet
     with open(path, 'rb') as f:
         return chardet.detect(f.read(4096))['encoding'] or 'utf-8'
 
@@ -31,26 +34,28 @@ def mark_processed(conn, ingest_file_id):
     with conn.cursor() as cur:
         cur.execute("update ingest_files set status='processed', processed_at=now() where id=%s", (ingest_file_id,))
 
-def upsert_transaction(cur, acct_id, posted_at, amount, currency, desc, ext_id, balance_after):
-    norm = ' '.join(desc.upper().split())
+def upsert_transaction(cur, acct_id, posted_at, amount, currency, desc, ext_id, balance_after, new=None):
+    norm = merchants.normalize_desc(desc)
     h = sha256_text(f"{acct_id}|{posted_at.isoformat()}|{amount:.2f}|{norm}")
+    # dedupe on (account_id, external_tx_id) or (account_id, hash) happens in the tx_keys
+    # trigger (0017): a duplicate inserts nothing and returns no id
     cur.execute("""
-        insert into transactions(account_id, posted_at, amount, currency, description, normalized_desc, external_tx_id, hash, balance_after)
-        values (%s,%s,%s,%s,%s,%s,%s,%s,%s)
-        on conflict (account_id, external_tx_id) where external_tx_id is not null do update
-          set updated_at = now()
+        insert into transactions(account_id, posted_at, amount, currency, description, normalized_desc, external_tx_id, hash, balance_after, merchant_id)
+        values (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
         returning id
-    """, (acct_id, posted_at, amount, currency, desc, norm, ext_id, psycopg.Binary(h), balance_after))
-    if cur.rowcount == 0:
-        # fallback to hash-based dedupe if no external id
-        cur.execute("""
-            insert into transactions(account_id, posted_at, amount, currency, description, normalized_desc, external_tx_id, hash, balance_after)
-            values (%s,%s,%s,%s,%s,%s,%s,%s,%s)
-            on conflict (account_id, hash) do update
-              set updated_at = now()
-            returning id
-        """, (acct_id, posted_at, amount, currency, desc, norm, ext_id, psycopg.Binary(h), balance_after))
-    return cur.fetchone()[0]
+    """, (acct_id, posted_at, amount, currency, desc, norm, ext_id, psycopg.Binary(h), balance_after, merchants.resolve(norm)))
+    row = cur.fetchone()
+    if row and new is not None:
+        new.append((row[0], norm, amount))  # for rules.categorize()
+    return row[0] if row else None
+
+def record_statement_balance(cur, ingest_file_id, acct_id, as_of, balance):
+    # anchors reconciliation (pipeline/reconcile.py)
+    cur.execute("""
+      insert into statement_balances(account_id, ingest_file_id, as_of, balance)
+      values (%s,%s,%s,%s)
+      on conflict (ingest_file_id, account_id) do nothing
+    """, (acct_id, ingest_file_id, as_of, balance))
 
 def resolve_account(cur, bank:str, mask:str, currency:str):
     # naive: match by mask; in practice you’ll seed accounts table once.
@@ -83,13 +88,20 @@ def parse_csv_bytes(b:bytes):
     return rows
 
 def detect_encoding_bytes(b):
+    import chardet
     return chardet.detect(b)['encoding'] or 'utf-8'
 
 def parse_ofx_bytes(b:bytes):
-    ofx = OfxParser.parse_bytes(b)
-    rows = []
+    # returns (rows, [(as_of, closing balance)] per account that states one)
+    from ofxparse import OfxParser
+    ofx = OfxParser.parse(io.BytesIO(b))
+    rows, closing = [], []
     for acct in ofx.accounts:
-        for tx in acct.statement.transactions:
+        st = acct.statement
+        if getattr(st, "balance", None) is not None:
+            as_of = getattr(st, "balance_date", None) or st.end_date
+            closing.append((as_of.date(), st.balance))
+        for tx in st.transactions:
             rows.append({
                 "date": tx.date.strftime("%Y-%m-%d"),
                 "amount": f"{tx.amount:.2f}",
@@ -97,9 +109,10 @@ def parse_ofx_bytes(b:bytes):
                 "name": tx.payee or tx.memo or "",
                 "balance": ""
             })
-    return rows
+    return rows, closing
 
 def normalize_row(row, bank):
+    from dateutil import parser as dparse
     # Try common column names; adjust as you learn each bank
     date_val = row.get("date") or row.get("posted date") or row.get("posting date") or row.get("transaction date")
     desc = row.get("description") or row.get("name") or row.get("memo") or ""
@@ -124,16 +137,20 @@ def process_file(conn, ingest_file):
     fid, source, bank, path = ingest_file
     with open(path, 'rb') as f:
         data = f.read()
+    metrics.count_bytes(len(data), "statement")
 
-    rows = []
+    rows, closing = [], []
     if path.lower().endswith((".ofx",".qfx")):
-        rows = parse_ofx_bytes(data)
+        with metrics.timer(metrics.PARSE_SECONDS, format="ofx"):
+            rows, closing = parse_ofx_bytes(data)
         stage_payload(conn, fid, 'ofx', rows)
     elif path.lower().endswith(".csv"):
-        enc = detect_encoding(path)
-        with open(path, 'r', encoding=enc, errors='ignore') as f:
-            df = pd.read_csv(f)
-        rows = df.to_dict(orient="records")
+        with metrics.timer(metrics.PARSE_SECONDS, format="csv"):
+            import pandas as pd
+            enc = detect_encoding(path)
+            with open(path, 'r', encoding=enc, errors='ignore') as f:
+                df = pd.read_csv(f)
+            rows = df.to_dict(orient="records")
         stage_payload(conn, fid, 'csv', rows)
     else:
         # unsupported
@@ -141,23 +158,44 @@ def process_file(conn, ingest_file):
             cur.execute("update ingest_files set status='error', error='unsupported file type' where id=%s", (fid,))
         return
 
+    inserted = 0
+    new = []
     with conn.cursor() as cur:
         for r in rows:
             norm = normalize_row({k.lower(): ("" if v is None else str(v)) for k,v in r.items()}, bank or "unknown")
             acct_id = resolve_account(cur, norm["bank"], norm["mask"], norm["currency"])
-            upsert_transaction(cur, acct_id, norm["posted_at"], norm["amount"], norm["currency"], norm["description"], norm["external_tx_id"], norm["balance_after"])
+            if upsert_transaction(cur, acct_id, norm["posted_at"], norm["amount"], norm["currency"], norm["description"], norm["external_tx_id"], norm["balance_after"], new):
+                inserted += 1
+        # rows don't say which account of a multi-account file they came from
+        if rows and len(closing) == 1:
+            record_statement_balance(cur, fid, acct_id, *closing[0])
+        categorized = rules.categorize(cur, new)
+    metrics.count_rows(inserted, "inserted")
+    metrics.count_rows(categorized, "categorized")
+    metrics.count_rows(len(rows) - inserted, "duplicate")
     mark_processed(conn, fid)
     print(f"[normalize] processed {path}")
 
+@metrics.job("normalize")
+def run(conn):
+    """Normalize every received ingest file on an autocommit connection; returns files processed."""
+    with conn.cursor() as cur:
+        cur.execute("select id, source, bank, filename from ingest_files where status='received' order by id asc")
+        files = cur.fetchall()
+    if not files:
+        print("[normalize] nothing to do"); return 0
+    for ingest_file in files:
+        process_file(conn, ingest_file)
+    return len(files)
+
+@profiling.profiled("normalizer")
 def main():
-    with psycopg.connect(PG_DSN, autocommit=True) as conn:
-        with conn.cursor() as cur:
-            cur.execute("select id, source, bank, filename from ingest_files where status='received' order by id asc")
-            files = cur.fetchall()
-        if not files:
-            print("[normalize] nothing to do"); return
-        for ingest_file in files:
-            process_file(conn, ingest_file)
+    metrics.set_service("normalizer")
+    try:
+        with psycopg.connect(PG_DSN, autocommit=True, cursor_factory=metrics.TimedCursor) as conn:
+            run(conn)
+    finally:
+        metrics.push()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,417 @@
+#!/usr/bin/env python3
+"""
+Query plan suite for the hot queries in api/, classifier/, teller-sync/ and pipeline/.
+
+Loads a synthetic dataset into a throwaway Postgres, runs EXPLAIN (ANALYZE, BUFFERS)
+on every catalogued query and compares each plan with ops/bench/plan_baseline.json:
+
+    # fresh db, migrations applied (db-bootstrap), nothing else in it
+    python ops/bench/explain_queries.py --seed 5000000          # ~5 min on a laptop
+    python ops/bench/explain_queries.py --check                  # exit 1 on plan regressions
+    python ops/bench/explain_queries.py --update-baseline        # after an intended change
+
+A plan regresses when
+  * a table the baseline reached through an index is now only seq scanned (tables
+    under SMALL_TABLE_PAGES pages are exempt),
+  * more transactions partitions are scanned than before (pruning lost), or
+  * shared buffers touched grow past --buffer-slack x baseline (only checked when the
+    dataset is within 2x of the baseline's scale; timings are reported, never checked).
+
+Around a schema change, --label saves the raw plans and timings for a diff:
+
+    python ops/bench/explain_queries.py --label before --out bench_plans
+    (apply migration)
+    python ops/bench/explain_queries.py --label after --out bench_plans
+    diff -r bench_plans/before bench_plans/after
+
+Uses the usual POSTGRES_* env.
+"""
+import argparse, json, os, re, statistics, sys, time
+from datetime import date, timedelta
+
+import psycopg
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+for d in ("common", "pipeline", "classifier", "teller-sync", "api"):
+    sys.path.insert(0, os.path.join(ROOT, d))
+import merchants
+import app as api
+import balances, classify, dedupe, reconcile, recurring, sync, transfers
+
+PG_DSN = (
+    f"host={os.environ['POSTGRES_HOST']} "
+    f"port={os.environ['POSTGRES_PORT']} "
+    f"dbname={os.environ['POSTGRES_DB']} "
+    f"user={os.environ['POSTGRES_USER']} "
+    f"password={os.environ['POSTGRES_PASSWORD']}"
+)
+
+SMALL_TABLE_PAGES = 64  # below this, a seq scan is not a regression
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "plan_baseline.json")
+
+# name -> (params -> (sql, bind parameters), function it needs or None). The statements are
+# the callers' own constants and query builders; only the bind values are chosen here.
+QUERIES = {
+    # api/app.py /transactions?frm=&to=
+    "transactions_month": (lambda p: api.transactions_query(frm=p["start"], to=p["end"]), None),
+    # api/app.py /transactions?uncategorized=true
+    "transactions_uncategorized": (lambda p: api.transactions_query(uncategorized=True), None),
+    # api/app.py /transactions?account_id=&frm=&to=
+    "transactions_account": (lambda p: api.transactions_query(account_id=p["account_id"], frm=p["start"],
+                                                              to=p["end"]), None),
+    # api/app.py /transactions?merchant_id=
+    "transactions_merchant": (lambda p: api.transactions_query(merchant_id=p["merchant_id"]), None),
+    # api/app.py /merchants?frm=&to=
+    "merchant_spend": (lambda p: api.merchant_spend_query(p["start"], p["end"]), None),
+    # api/app.py /suggestions
+    "suggestions": (lambda p: (api.SUGGEST_SQL, {"q": p["embedding"], "pool": api.SUGGEST_POOL, "k": 10,
+                                                 "exclude": 0, "min_sim": api.SUGGEST_MIN_SIMILARITY}), None),
+    # api/app.py /spend/monthly?frm=&to=
+    "spend_monthly_range": (lambda p: (api.SPEND_MONTHLY_SQL, (p["start"], p["end"])), "monthly_spend"),
+    # api/app.py /spend/monthly
+    "spend_monthly_all": (lambda p: (api.SPEND_MONTHLY_SQL, (None, None)), "monthly_spend"),
+    # api/app.py /budget/status?period=
+    "budget_status": (lambda p: api.budget_status_query(p["start"].strftime("%Y-%m")), None),
+    # classifier/classify.py candidates()
+    "classify_candidates": (lambda p: (classify.CANDIDATES_SQL, {"days": classify.DAYS}), None),
+    # pipeline/dedupe.py match(), one queue batch
+    "dedupe_candidates": (lambda p: (dedupe.CANDIDATES_SQL, {"ids": p["queue_ids"], "window": dedupe.WINDOW_DAYS,
+                                                             "limit": dedupe.CANDIDATES}), None),
+    # pipeline/transfers.py match(), one queue batch
+    "transfer_candidates": (lambda p: (transfers.CANDIDATES_SQL, {"ids": p["queue_ids"],
+                                                                  "window": transfers.WINDOW_DAYS,
+                                                                  "limit": transfers.CANDIDATES}), None),
+    # pipeline/recurring.py, the merchant groups of one queue batch
+    "recurring_history": (lambda p: (recurring.MERCHANT_HISTORY_SQL, {
+        "accounts": p["group_accounts"], "keys": p["group_merchants"],
+        "since": date.today() - timedelta(days=recurring.LOOKBACK_DAYS), "limit": recurring.GROUP_MAX}), None),
+    # pipeline/balances.py, one account from the start of the month
+    "balance_days": (lambda p: (balances.DAYS_SQL, {"accounts": [p["account_id"]], "since": [p["start"]]}), None),
+    # api/app.py /accounts/{id}/balances, three years in 3-day buckets
+    "account_balances": (lambda p: (api.BALANCES_SQL, {"account_id": p["account_id"], "step": 3,
+                                                       "frm": p["end"] - timedelta(days=1095), "to": p["end"]}), None),
+    # pipeline/reconcile.py, one account over the last year
+    "reconcile_check": (lambda p: (reconcile.CHECK_SQL, {"accounts": [p["account_id"]],
+                                                         "lo": [p["end"] - timedelta(days=365)],
+                                                         "hi": [p["end"]]}), None),
+    # teller-sync/sync.py drain_jobs()
+    "drain_jobs": (lambda p: (sync.DRAIN_JOBS_SQL, (sync.RETRY_SLOTS, sync.DRAIN_BATCH)), "merge_reasons"),
+    # teller-sync/sync.py next_due()
+    "next_due": (lambda p: (sync.NEXT_DUE_SQL, None), None),
+    # teller-sync/sync.py sync_window_start()
+    "sync_window_start": (lambda p: (sync.SYNC_WINDOW_SQL, (p["external_id"],)), None),
+    # teller-sync/sync.py known_tx_ids()
+    "known_tx_ids": (lambda p: (sync.KNOWN_TX_SQL, (p["account_id"], p["ext_ids"])), None),
+    # teller-sync/sync.py store_transactions()
+    "stored_txs": (lambda p: (sync.STORED_TX_SQL, (p["account_id"], p["ext_ids"])), None),
+    # teller-sync/sync.py drop_pending(), over the re-read overlap
+    "stale_pending": (lambda p: (sync.PENDING_SQL, (p["account_id"], p["end"] - timedelta(days=sync.OVERLAP_DAYS),
+                                                   p["ext_ids"])), None),
+}
+
+# Synthetic household: a few enrollments, ~1 in 32 rows is income, ~70% of spend
+# categorized, an open webhook job per account plus a backlog of windowed jobs.
+SEED_DAYS = 3 * 365
+MERCHANTS = [
+    "WHOLEFDS", "TRADER JOE S", "SAFEWAY", "COSTCO WHSE", "AMAZON MKTPLACE", "AMZN DIGITAL",
+    "NETFLIX.COM", "SPOTIFY USA", "APPLE.COM/BILL", "UBER TRIP", "LYFT RIDE", "SHELL OIL",
+    "CHEVRON", "STARBUCKS", "CHIPOTLE", "DOORDASH", "PG&E", "COMCAST", "VERIZON WRLS",
+    "CVS PHARMACY", "WALGREENS", "TARGET", "HOME DEPOT", "IKEA", "DELTA AIR", "MARRIOTT",
+    "VENMO", "ZELLE TO", "ATM WITHDRAWAL", "MONTHLY SERVICE FEE", "RENT PAYMENT", "PAYROLL ACME INC",
+]
+
+SEED_SETUP = """
+  select tx_ensure_partition(m::date)
+  from generate_series(date_trunc('month', current_date - %(days)s), date_trunc('month', current_date),
+                       interval '1 month') m;
+  insert into institutions(name) values ('Bench Bank') on conflict do nothing;
+  insert into merchants(display_name, canonical_name, embedding)
+  select initcap(m), m, e::vector from unnest(%(merchants)s::text[], %(embeddings)s::text[]) as u(m, e)
+  on conflict do nothing;
+  insert into provider_enrollments(enrollment_id, environment, access_token_enc, institution_name)
+  select 'enr_bench_' || e, 'sandbox', '\\x00'::bytea, 'Bench Bank'
+  from generate_series(1, %(enrollments)s) e;
+  insert into accounts(institution_id, name, type, currency, mask, external_id)
+  select (select id from institutions where name = 'Bench Bank'), 'Bench ' || a,
+         (array['checking','savings','credit'])[1 + a %% 3], 'USD', lpad(a::text, 4, '0'),
+         'teller:acc_bench_' || a
+  from generate_series(1, %(accounts)s) a;
+  insert into provider_accounts(enrollment_id, teller_account_id, account_id, type, currency)
+  select 'enr_bench_' || (1 + a.id %% %(enrollments)s), substring(a.external_id from 8), a.id, a.type, 'USD'
+  from accounts a where a.external_id like 'teller:acc_bench_%%';
+  insert into teller_sync(account_id, last_polled_at, last_window_start, last_window_end)
+  select id, now(), current_date - 32, current_date - 2
+  from accounts where external_id like 'teller:acc_bench_%%';
+"""
+
+SEED_TRANSACTIONS = """
+  insert into transactions(account_id, posted_at, amount, currency, description, normalized_desc, external_tx_id, hash,
+                           merchant_id)
+  select a.id,
+         current_date - (random() * %(days)s)::int,
+         case when x.m = %(n_merchants)s then round((1500 + random() * 3000)::numeric, 2)
+              else round((-(1 + random() * random() * 400))::numeric, 2) end,
+         'USD', x.d, upper(x.d), 'txn_bench_' || x.g, decode(md5('bench' || x.g), 'hex'), mc.id
+  from (
+    select g, m, (%(merchants)s::text[])[m] || ' #' || (g %% 997) as d
+    from (select g, 1 + floor(random() * %(n_merchants)s)::int as m
+          from generate_series(%(lo)s, %(hi)s) g) gm
+  ) x
+  join accounts a on a.external_id = 'teller:acc_bench_' || (1 + x.g %% %(accounts)s)
+  left join merchants mc on mc.canonical_name = (%(merchants)s::text[])[x.m]
+"""
+
+SEED_REST = """
+  insert into tx_splits(transaction_id, category_id, amount, note)
+  select t.id, c.id, t.amount, 'bench'
+  from transactions t
+  join categories c on c.code = (array['GROCERIES','DINING','SHOPPING','TRANSPORT','UTILITIES',
+                                       'SUBSCRIPTIONS','ENTERTAINMENT','OTHER'])[1 + t.id %% 8]
+  where t.amount < 0 and t.id %% 10 < 7;
+  insert into budgets(category_id, period_start, period_end, amount)
+  select c.id, m::date, (m + interval '1 month - 1 day')::date, 100 + c.id * 50
+  from categories c, generate_series(date_trunc('month', current_date) - interval '11 months',
+                                     date_trunc('month', current_date), interval '1 month') m
+  on conflict do nothing;
+  insert into teller_jobs(account_api_id, enqueue_reason, run_after)
+  select pa.teller_account_id, 'transactions.processed', now() + (random() * 120 - 60) * interval '1 second'
+  from provider_accounts pa where pa.teller_account_id like 'acc_bench_%%';
+  insert into teller_jobs(provider_account_id, account_api_id, start_date, end_date, enqueue_reason, run_after)
+  select pa.id, pa.teller_account_id, current_date - 7 * k, current_date - 7 * (k - 1), 'backfill',
+         now() + (k - 20) * interval '1 hour'
+  from provider_accounts pa, generate_series(1, %(windows)s) k
+  where pa.teller_account_id like 'acc_bench_%%';
+  insert into daily_balances(account_id, day, balance, net, tx_count, anchored)
+  select account_id, posted_at, sum(net) over (partition by account_id order by posted_at), net, n, false
+  from (select account_id, posted_at, sum(amount) as net, count(*) as n from transactions group by 1, 2) d;
+  truncate tx_balance_queue;
+"""
+
+
+def run_script(cur, script, params):
+    # one statement per execute: server-side parameters don't allow multi-statement strings
+    for stmt in script.split(";\n"):
+        if stmt.strip():
+            cur.execute(stmt, params)
+
+
+def seed(conn, n, accounts, enrollments, chunk, rnd):
+    with conn.cursor() as cur:
+        cur.execute("select exists (select 1 from transactions)")
+        if cur.fetchone()[0]:
+            raise SystemExit("[plans] refusing to seed: transactions is not empty (use a throwaway db)")
+        cur.execute("select setseed(%s)", (rnd,))
+        run_script(cur, SEED_SETUP, {"enrollments": enrollments, "accounts": accounts, "days": SEED_DAYS,
+                                     "merchants": MERCHANTS, "embeddings": [merchants.embed(m) for m in MERCHANTS]})
+        conn.commit()
+        t0 = time.monotonic()
+        for lo in range(1, n + 1, chunk):
+            hi = min(n, lo + chunk - 1)
+            cur.execute(SEED_TRANSACTIONS, {"lo": lo, "hi": hi, "days": SEED_DAYS, "accounts": accounts,
+                                            "merchants": MERCHANTS, "n_merchants": len(MERCHANTS)})
+            conn.commit()
+            rate = hi / max(1e-9, time.monotonic() - t0)
+            print(f"[plans] seeded {hi:,}/{n:,} transactions ({rate:,.0f} rows/s)")
+        run_script(cur, SEED_REST, {"windows": 40})
+        conn.commit()
+    conn.autocommit = True
+    conn.execute("vacuum analyze")
+    conn.autocommit = False
+    print(f"[plans] seed done in {time.monotonic() - t0:.0f}s")
+
+
+def query_params(cur):
+    cur.execute("select max(posted_at) from transactions")
+    newest = cur.fetchone()[0] or date.today()
+    cur.execute("select account_id from tx_keys order by transaction_id desc limit 1")
+    row = cur.fetchone()
+    account_id = row[0] if row else 0
+    cur.execute("select external_id from accounts where external_id like 'teller:%' order by id limit 1")
+    row = cur.fetchone()
+    external_id = row[0] if row else ""
+    cur.execute("select external_tx_id from tx_keys where account_id = %s and external_tx_id is not null "
+                "order by transaction_id desc limit 100", (account_id,))
+    ext_ids = [r[0] for r in cur.fetchall()]
+    cur.execute("select transaction_id from tx_keys order by transaction_id desc limit 2000")
+    queue_ids = [r[0] for r in cur.fetchall()]
+    cur.execute("""
+      select distinct account_id, merchant_id from (
+        select account_id, merchant_id from transactions
+        where merchant_id is not null and posted_at >= %s - 7
+        order by id desc limit 2000
+      ) t
+    """, (newest,))
+    groups = cur.fetchall()
+    cur.execute("select merchant_id from transactions where merchant_id is not null order by posted_at desc limit 1")
+    row = cur.fetchone()
+    merchant_id = row[0] if row else 0
+    cur.execute("select embedding::text from merchants where embedding is not null order by id limit 1")
+    row = cur.fetchone()
+    embedding = row[0] if row else None
+    start = newest.replace(day=1)
+    end = (start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    return {"start": start, "end": end, "account_id": account_id,
+            "external_id": external_id, "ext_ids": ext_ids, "merchant_id": merchant_id,
+            "embedding": embedding, "queue_ids": queue_ids,
+            "group_accounts": [g[0] for g in groups], "group_merchants": [g[1] for g in groups]}
+
+
+def has_function(cur, name):
+    cur.execute("select 1 from pg_proc where proname = %s", (name,))
+    return cur.fetchone() is not None
+
+
+# monthly partitions (and their per-partition indexes) collapse to one name
+_PARTITION = re.compile(r"^transactions_(\d{4}_\d{2}|default)(?=$|_)")
+
+
+def summarize(plan):
+    """Reduce a JSON plan to what the regression check compares."""
+    scans = {}
+    partitions = set()
+
+    def walk(node):
+        rel = node.get("Relation Name")
+        if rel:
+            if _PARTITION.match(rel):
+                partitions.add(rel)
+                rel = "transactions"
+            kind = node["Node Type"]
+            if node.get("Index Name"):
+                kind += " using " + _PARTITION.sub("transactions_*", node["Index Name"])
+            scans.setdefault(rel, set()).add(kind)
+        for child in node.get("Plans", []):
+            walk(child)
+
+    root = plan["Plan"]
+    walk(root)
+    return {
+        "scans": {rel: sorted(kinds) for rel, kinds in sorted(scans.items())},
+        "partitions": len(partitions),
+        "buffers": root.get("Shared Hit Blocks", 0) + root.get("Shared Read Blocks", 0),
+        "ms": round(plan.get("Execution Time", 0.0), 2),
+    }
+
+
+def _indexed(kinds):
+    return any("Index" in k or "Bitmap" in k for k in kinds)
+
+
+def compare(name, base, now, total, small, same_scale, slack):
+    problems = []
+    for rel, kinds in base["scans"].items():
+        cur = now["scans"].get(rel, [])
+        if rel in small:
+            continue  # lookup tables flip between index and seq scan freely
+        if _indexed(kinds) and cur and not _indexed(cur):
+            problems.append(f"{rel}: {', '.join(kinds)} -> {', '.join(cur)}")
+    # only for queries that pruned at baseline; full scans grow by a partition every month
+    if base["partitions"] < total and now["partitions"] > base["partitions"]:
+        problems.append(f"transactions partitions scanned {base['partitions']} -> {now['partitions']}")
+    if same_scale and base["buffers"] and now["buffers"] > slack * base["buffers"]:
+        problems.append(f"buffers {base['buffers']} -> {now['buffers']}")
+    return [f"{name}: {p}" for p in problems]
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--seed", type=int, metavar="N", help="load N synthetic transactions first (empty db only)")
+    ap.add_argument("--accounts", type=int, default=40)
+    ap.add_argument("--enrollments", type=int, default=8)
+    ap.add_argument("--chunk", type=int, default=250000)
+    ap.add_argument("--seed-random", type=float, default=0.42)
+    ap.add_argument("--check", action="store_true", help="compare with the baseline, exit 1 on regressions")
+    ap.add_argument("--update-baseline", action="store_true")
+    ap.add_argument("--baseline", default=BASELINE)
+    ap.add_argument("--buffer-slack", type=float, default=2.0)
+    ap.add_argument("--only", help="comma-separated query names")
+    ap.add_argument("--label", help="save raw plans + timings under --out/<label>")
+    ap.add_argument("--out", default="bench_plans")
+    ap.add_argument("--runs", type=int, default=5, help="timed runs per query (after the EXPLAIN run)")
+    args = ap.parse_args()
+
+    names = [q.strip() for q in args.only.split(",")] if args.only else list(QUERIES)
+    unknown = [q for q in names if q not in QUERIES]
+    if unknown:
+        raise SystemExit(f"unknown queries: {', '.join(unknown)}")
+
+    outdir = None
+    if args.label:
+        outdir = os.path.join(args.out, args.label)
+        os.makedirs(outdir, exist_ok=True)
+
+    results = {}
+    with psycopg.connect(PG_DSN) as conn:
+        if args.seed:
+            seed(conn, args.seed, args.accounts, args.enrollments, args.chunk, args.seed_random)
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute("select count(*) from tx_keys")
+            scale = cur.fetchone()[0]
+            cur.execute("select count(*) from pg_inherits where inhparent = 'transactions'::regclass")
+            partitions_total = cur.fetchone()[0]
+            cur.execute("select relname from pg_class where relkind = 'r' and relpages < %s "
+                        "and relnamespace = 'public'::regnamespace and relname not like 'transactions%%'",
+                        (SMALL_TABLE_PAGES,))
+            small = {r[0] for r in cur.fetchall()}
+            values = query_params(cur)
+            for name in names:
+                build, needs = QUERIES[name]
+                if needs and not has_function(cur, needs):
+                    print(f"[plans] {name:28s} skipped (no {needs}())")
+                    continue
+                sql, params = build(values)
+                cur.execute("explain (analyze, buffers, format json) " + sql, params)
+                plan = cur.fetchone()[0][0]
+                if outdir:
+                    cur.execute("explain (analyze, buffers) " + sql, params)
+                    with open(os.path.join(outdir, f"{name}.txt"), "w") as f:
+                        f.write("\n".join(r[0] for r in cur.fetchall()) + "\n")
+                times = []
+                for _ in range(args.runs):
+                    t0 = time.perf_counter()
+                    cur.execute(sql, params)
+                    cur.fetchall()
+                    times.append((time.perf_counter() - t0) * 1000)
+                summary = summarize(plan)
+                summary["median_ms"] = round(statistics.median(times), 2) if times else None
+                results[name] = summary
+                print(f"[plans] {name:28s} median {summary['median_ms'] or 0:8.2f} ms  "
+                      f"buffers {summary['buffers']:>8}  partitions {summary['partitions']:>3}")
+
+    if outdir:
+        with open(os.path.join(outdir, "timings.tsv"), "w") as f:
+            f.write("query\tmedian_ms\tbuffers\n")
+            for name, s in results.items():
+                f.write(f"{name}\t{s['median_ms']}\t{s['buffers']}\n")
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({"scale": scale, "partitions_total": partitions_total, "queries": results}, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"[plans] baseline written to {args.baseline} (scale {scale:,})")
+
+    if args.check:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        base_scale = baseline.get("scale") or 0
+        same_scale = bool(base_scale) and 0.5 <= scale / base_scale <= 2.0
+        if not same_scale:
+            print(f"[plans] scale {scale:,} vs baseline {base_scale:,}: buffer check skipped")
+        problems = []
+        for name, s in results.items():
+            base = baseline["queries"].get(name)
+            if base is None:
+                print(f"[plans] {name}: not in baseline")
+                continue
+            problems += compare(name, base, s, baseline.get("partitions_total", 0), small,
+                                same_scale, args.buffer_slack)
+        for p in problems:
+            print(f"[plans] REGRESSION {p}")
+        if problems:
+            sys.exit(1)
+        print(f"[plans] {len(results)} plans match the baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Teller API, serving ops/bench/synth.py's teller.json over plain HTTP,
+or over mutual TLS like the real API when given a server certificate and a client CA.
+
+    python ops/bench/fake_teller.py --data /tmp/bench_data/teller.json --port 8099 --latency-ms 40
+    python ops/bench/fake_teller.py --data /tmp/bench_data/teller.json \
+        --tls-cert server.pem --tls-key server.key --client-ca ca.pem
+
+Point teller-sync at it with TELLER_BASE_URL=http://127.0.0.1:8099 (https:// with TLS,
+plus TELLER_CA_PATH=ca.pem) and TELLER_ACCESS_TOKEN=<anything>. The client certificate
+teller-sync always loads is ignored over plain HTTP, but TELLER_CERT / TELLER_KEY must
+still name existing files. With --client-ca a connection without a client certificate
+signed by that CA fails the handshake.
+
+Implements what sync.py calls: GET /accounts, /accounts/{id} and /accounts/{id}/transactions
+with Teller's newest-first count + from_id paging. Basic auth must be present; the token
+is not checked. Prints a request count per path and the number of connections on exit.
+"""
+import argparse, json, os, ssl, subprocess, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class FakeTeller:
+    def __init__(self, data, latency):
+        self.accounts = {a["id"]: a for a in data["accounts"]}
+        self.transactions = data["transactions"]
+        self.index = {acc: {tx["id"]: i for i, tx in enumerate(txs)} for acc, txs in self.transactions.items()}
+        self.latency = latency
+        self.calls = {}
+        self.connections = 0  # accepted connections, i.e. (m)TLS handshakes when serving TLS
+        self.lock = threading.Lock()
+
+    def count(self, key):
+        with self.lock:
+            self.calls[key] = self.calls.get(key, 0) + 1
+
+    def transactions_page(self, acc_id, query):
+        txs = self.transactions.get(acc_id, [])
+        lo = 0
+        from_id = query.get("from_id", [None])[0]
+        if from_id is not None:
+            # Teller returns the transactions after from_id (older ones)
+            lo = self.index[acc_id].get(from_id, -1) + 1
+        since = query.get("from", [None])[0]
+        count = int(query.get("count", [0])[0] or 0)
+        page = txs[lo:lo + count] if count else txs[lo:]
+        if since:
+            page = [tx for tx in page if tx["date"] >= since]
+        return page
+
+
+def make_handler(api, tls=None):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # headers and body go out as separate writes; without this, Nagle + delayed ACK
+        # adds ~40ms to every keep-alive response and swamps what we're measuring
+        disable_nagle_algorithm = True
+
+        def log_message(self, fmt, *args):
+            pass
+
+        def setup(self):
+            if tls is not None:
+                # handshake here, in the connection's own thread, not in the accept loop
+                self.request = tls.wrap_socket(self.request, server_side=True)
+            super().setup()
+            with api.lock:
+                api.connections += 1
+
+        def send_json(self, status, body):
+            raw = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(raw)))
+            self.end_headers()
+            self.wfile.write(raw)
+
+        def do_GET(self):
+            if api.latency:
+                time.sleep(api.latency)
+            url = urlparse(self.path)
+            parts = [p for p in url.path.split("/") if p]
+            if not (self.headers.get("Authorization") or "").startswith("Basic "):
+                return self.send_json(401, {"error": {"code": "missing_credentials"}})
+            if parts == ["accounts"]:
+                api.count("/accounts")
+                return self.send_json(200, list(api.accounts.values()))
+            if len(parts) >= 2 and parts[0] == "accounts" and parts[1] in api.accounts:
+                if len(parts) == 2:
+                    api.count("/accounts/{id}")
+                    return self.send_json(200, api.accounts[parts[1]])
+                if parts[2:] == ["transactions"]:
+                    api.count("/accounts/{id}/transactions")
+                    return self.send_json(200, api.transactions_page(parts[1], parse_qs(url.query)))
+            api.count("404")
+            return self.send_json(404, {"error": {"code": "not_found", "message": url.path}})
+
+    return Handler
+
+
+def _openssl(*args):
+    subprocess.run(["openssl", *args], check=True, capture_output=True)
+
+
+def make_certs(d):
+    """Throwaway CA + server cert (127.0.0.1 / localhost) + client cert in d, via openssl."""
+    p = lambda name: os.path.join(d, name)
+    _openssl("req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=bench-ca",
+             "-keyout", p("ca.key"), "-out", p("ca.pem"))
+    ext = p("server.ext")
+    with open(ext, "w") as f:
+        f.write("subjectAltName=IP:127.0.0.1,DNS:localhost\n")
+    for name, extra in (("server", ["-extfile", ext]), ("client", [])):
+        _openssl("req", "-newkey", "rsa:2048", "-nodes", "-subj", f"/CN=bench-{name}",
+                 "-keyout", p(f"{name}.key"), "-out", p(f"{name}.csr"))
+        _openssl("x509", "-req", "-in", p(f"{name}.csr"), "-CA", p("ca.pem"), "-CAkey", p("ca.key"),
+                 "-CAcreateserial", "-days", "1", "-out", p(f"{name}.pem"), *extra)
+    return {"ca": p("ca.pem"), "server_cert": p("server.pem"), "server_key": p("server.key"),
+            "client_cert": p("client.pem"), "client_key": p("client.key")}
+
+
+def tls_context(cert, key, client_ca=None):
+    ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    ctx.load_cert_chain(cert, key)
+    if client_ca:
+        ctx.load_verify_locations(client_ca)
+        ctx.verify_mode = ssl.CERT_REQUIRED
+    return ctx
+
+
+def serve(data_path, host="127.0.0.1", port=8099, latency_ms=0.0, tls=None):
+    """Start the server on a daemon thread; returns (server, api). Used by the bench scripts.
+    tls is an SSLContext from tls_context(), or None for plain HTTP."""
+    with open(data_path) as f:
+        api = FakeTeller(json.load(f), latency_ms / 1000.0)
+    server = ThreadingHTTPServer((host, port), make_handler(api, tls))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, api
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--data", required=True, help="teller.json from synth.py")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8099)
+    ap.add_argument("--latency-ms", type=float, default=0.0, help="added to every response")
+    ap.add_argument("--tls-cert", help="server certificate (PEM); serve https")
+    ap.add_argument("--tls-key", help="server private key (PEM)")
+    ap.add_argument("--client-ca", help="require client certificates signed by this CA (mTLS)")
+    args = ap.parse_args()
+
+    tls = tls_context(args.tls_cert, args.tls_key, args.client_ca) if args.tls_cert else None
+    server, api = serve(args.data, args.host, args.port, args.latency_ms, tls)
+    scheme = "https" if tls else "http"
+    print(f"[fake-teller] {len(api.accounts)} accounts on {scheme}://{args.host}:{server.server_port}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        print(f"[fake-teller] calls={json.dumps(api.calls, sort_keys=True)} connections={api.connections}")
+
+
+if __name__ == "__main__":
+    main()
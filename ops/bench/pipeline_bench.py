@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+"""
+End-to-end throughput benchmark: drives normalizer, teller-sync, dedupe, transfers,
+recurring, balances, reconcile, classifier, budgeter and the API against a throwaway
+Postgres, using inputs from ops/bench/synth.py and a local fake Teller
+(ops/bench/fake_teller.py, over mTLS) started in-process.
+
+    python ops/bench/synth.py --out /tmp/bench_data
+    POSTGRES_DB=finance_bench python ops/bench/pipeline_bench.py --data /tmp/bench_data
+
+The database must have the migrations applied and no transactions yet. Each stage runs
+in its own subprocess so peak RSS is per stage. Reported per stage:
+
+    rows/s      new rows the stage wrote (transactions, tx_duplicates, tx_transfers,
+                recurring_series, daily_balances, reconciliation_breaks, tx_splits, category_predictions, budgets, API responses)
+    p50 / p99   per item: a statement file (normalize), a Teller HTTP call (teller), a
+                queue batch (dedupe, transfers, recurring, balances, reconcile), a candidate transaction (classify), a scored batch
+                (predict), one period import (budget), a request (api)
+    rss         peak resident set of the stage process
+
+Results are appended to --history (JSON lines). Each run is compared with the last
+one that used the same data and stages; --fail-on-regression turns a rows/s drop or
+a p99 / RSS rise past --tolerance into exit 1.
+"""
+import argparse, json, os, resource, statistics, subprocess, sys, tempfile, time
+from datetime import date, datetime, timezone
+
+import psycopg
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.abspath(os.path.join(HERE, "..", ".."))
+
+PG_DSN = (
+    f"host={os.environ['POSTGRES_HOST']} "
+    f"port={os.environ['POSTGRES_PORT']} "
+    f"dbname={os.environ['POSTGRES_DB']} "
+    f"user={os.environ['POSTGRES_USER']} "
+    f"password={os.environ['POSTGRES_PASSWORD']}"
+)
+
+STAGES = ["normalize", "teller", "dedupe", "transfers", "recurring", "balances", "reconcile", "classify", "predict",
+          "budget", "api"]
+SERVICE_DIRS = ["common", "normalizer", "teller-sync", "pipeline", "classifier", "budgeter", "api"]
+
+
+def percentile(xs, p):
+    xs = sorted(xs)
+    if not xs:
+        return 0.0
+    k = max(0, min(len(xs) - 1, int(round(p / 100.0 * (len(xs) - 1)))))
+    return xs[k]
+
+
+def count(conn, table):
+    with conn.cursor() as cur:
+        cur.execute(f"select count(*) from {table}")
+        return cur.fetchone()[0]
+
+
+class Timer:
+    """Wraps a module function and records each call's wall time."""
+
+    def __init__(self, module, name):
+        self.module, self.name = module, name
+        self.fn = getattr(module, name)
+        self.ms = []
+        setattr(module, name, self)
+
+    def __call__(self, *a, **kw):
+        t0 = time.perf_counter()
+        try:
+            return self.fn(*a, **kw)
+        finally:
+            self.ms.append((time.perf_counter() - t0) * 1000.0)
+
+
+def timed_generator(module, name, ms):
+    """Wrap a generator function so each item's time, from yield to the next request, lands in ms."""
+    fn = getattr(module, name)
+
+    def wrapper(*a, **kw):
+        t0 = None
+        for item in fn(*a, **kw):
+            if t0 is not None:
+                ms.append((time.perf_counter() - t0) * 1000.0)
+            t0 = time.perf_counter()
+            yield item
+        if t0 is not None:
+            ms.append((time.perf_counter() - t0) * 1000.0)
+
+    setattr(module, name, wrapper)
+
+
+# ---- stage workers (run in a subprocess: --worker <stage>) ----
+
+def work_normalize(conn, args):
+    import hashlib, normalizer
+    stmt_dir = os.path.join(args.data, "statements")
+    with conn.cursor() as cur:
+        for name in sorted(os.listdir(stmt_dir)):
+            path = os.path.join(stmt_dir, name)
+            with open(path, "rb") as f:
+                digest = hashlib.sha256(f.read()).hexdigest()
+            cur.execute("""
+              insert into ingest_files(source, bank, filename, content_sha256, size_bytes, mime_type, status)
+              values ('bench', 'Bench Bank', %s, %s, %s, null, 'received')
+              on conflict (content_sha256) do nothing
+            """, (path, digest, os.path.getsize(path)))
+    timer = Timer(normalizer, "process_file")
+    before = count(conn, "transactions")
+    t0 = time.perf_counter()
+    normalizer.run(conn)
+    return time.perf_counter() - t0, count(conn, "transactions") - before, timer.ms
+
+
+def work_teller(conn, args):
+    import sync
+    conn.autocommit = False
+    timer = Timer(sync, "jget")
+    before = count(conn, "transactions")
+    conn.commit()
+    t0 = time.perf_counter()
+    sync.run(conn)
+    return time.perf_counter() - t0, count(conn, "transactions") - before, timer.ms
+
+
+def work_dedupe(conn, args):
+    import dedupe
+    conn.autocommit = False
+    timer = Timer(dedupe, "match")
+    before = count(conn, "tx_duplicates")
+    conn.commit()
+    t0 = time.perf_counter()
+    dedupe.run(conn)
+    return time.perf_counter() - t0, count(conn, "tx_duplicates") - before, timer.ms
+
+
+def work_transfers(conn, args):
+    import transfers
+    conn.autocommit = False
+    timer = Timer(transfers, "match")
+    before = count(conn, "tx_transfers")
+    conn.commit()
+    t0 = time.perf_counter()
+    transfers.run(conn)
+    return time.perf_counter() - t0, count(conn, "tx_transfers") - before, timer.ms
+
+
+def work_recurring(conn, args):
+    import recurring
+    conn.autocommit = False
+    timer = Timer(recurring, "refresh")
+    before = count(conn, "recurring_series")
+    conn.commit()
+    t0 = time.perf_counter()
+    recurring.run(conn)
+    return time.perf_counter() - t0, count(conn, "recurring_series") - before, timer.ms
+
+
+def work_balances(conn, args):
+    import balances
+    conn.autocommit = False
+    timer = Timer(balances, "refresh")
+    before = count(conn, "daily_balances")
+    conn.commit()
+    t0 = time.perf_counter()
+    balances.run(conn)
+    return time.perf_counter() - t0, count(conn, "daily_balances") - before, timer.ms
+
+
+def work_reconcile(conn, args):
+    import reconcile
+    conn.autocommit = False
+    timer = Timer(reconcile, "check")
+    # rows: queued ranges checked; breaks are only there if synth.py --ofx-breaks planted them
+    before = count(conn, "reconcile_queue")
+    conn.commit()
+    t0 = time.perf_counter()
+    reconcile.run(conn)
+    return time.perf_counter() - t0, before - count(conn, "reconcile_queue"), timer.ms
+
+
+def work_classify(conn, args):
+    import classify
+    conn.autocommit = False
+    ms = []
+    timed_generator(classify, "candidates", ms)
+    before = count(conn, "tx_splits")
+    conn.commit()
+    t0 = time.perf_counter()
+    classify.run(conn)
+    return time.perf_counter() - t0, count(conn, "tx_splits") - before, ms
+
+
+def work_predict(conn, args):
+    import predict
+    conn.autocommit = False
+    ms = []
+    timed_generator(predict, "candidates", ms)
+    before = count(conn, "category_predictions")
+    conn.commit()
+    t0 = time.perf_counter()
+    predict.run(conn)
+    return time.perf_counter() - t0, count(conn, "category_predictions") - before, ms
+
+
+def work_budget(conn, args):
+    import budget_import
+    before = count(conn, "budgets")
+    ms = []
+    t0 = time.perf_counter()
+    year, month = date.today().year, date.today().month
+    for i in range(args.budget_periods):
+        y, m = divmod((year * 12 + month - 1) - i, 12)
+        os.environ["BUDGET_PERIOD"] = f"{y}-{m + 1:02d}"
+        t1 = time.perf_counter()
+        budget_import.run(conn)
+        ms.append((time.perf_counter() - t1) * 1000.0)
+    return time.perf_counter() - t0, count(conn, "budgets") - before, ms
+
+
+def work_api(conn, args):
+    from fastapi.testclient import TestClient
+    import app as api_app
+    month = date.today().strftime("%Y-%m")
+    paths = [
+        "/accounts",
+        "/transactions?limit=100",
+        "/transactions?uncategorized=true&limit=100",
+        f"/transactions?frm={month}&to={month}",
+        f"/spend/monthly?frm={month}&to={month}",
+        "/spend/monthly",
+        f"/budget/status?period={month}",
+        "/suggestions?desc=STARBUCKS%20RESERVE&k=10",
+        "/recurring/upcoming?days=30",
+        "/accounts/1/balances",
+        "/reconciliation",
+    ]
+    ms, ok = [], 0
+    client = TestClient(api_app.app)
+    t0 = time.perf_counter()
+    for i in range(args.api_requests):
+        t1 = time.perf_counter()
+        r = client.get(paths[i % len(paths)])
+        ms.append((time.perf_counter() - t1) * 1000.0)
+        ok += r.status_code == 200
+    return time.perf_counter() - t0, ok, ms
+
+
+WORKERS = {"normalize": work_normalize, "teller": work_teller, "dedupe": work_dedupe,
+           "transfers": work_transfers, "recurring": work_recurring, "balances": work_balances,
+           "reconcile": work_reconcile, "classify": work_classify, "predict": work_predict, "budget": work_budget, "api": work_api}
+
+
+def worker(args):
+    for d in SERVICE_DIRS:
+        sys.path.insert(0, os.path.join(ROOT, d))
+    with psycopg.connect(PG_DSN, autocommit=True) as conn:
+        seconds, rows, ms = WORKERS[args.worker](conn, args)
+    rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({
+        "stage": args.worker, "rows": rows, "items": len(ms), "seconds": round(seconds, 3),
+        "rows_per_s": round(rows / seconds, 1) if seconds else 0.0,
+        "p50_ms": round(statistics.median(ms), 2) if ms else 0.0,
+        "p99_ms": round(percentile(ms, 99), 2),
+        "rss_mb": round(rss_kb / 1024.0, 1),
+    }))
+
+
+# ---- parent ----
+
+def stage_env(args, certs, teller_url):
+    env = dict(os.environ)
+    env.update({
+        # teller-sync: mTLS to the fake with throwaway certs, like the real API
+        "TELLER_BASE_URL": teller_url, "TELLER_ACCESS_TOKEN": "bench-token",
+        "TELLER_ENROLLMENT_ID": "enr_bench", "TELLER_CERT": certs["client_cert"],
+        "TELLER_KEY": certs["client_key"], "TELLER_CA_PATH": certs["ca"],
+        "TELLER_SINCE_DAYS": "3650",
+        # classifier: every synthetic row is a candidate
+        "CLASSIFY_LOOKBACK_DAYS": "3650",
+        "BUDGET_FILE": os.path.join(ROOT, "config", "budgets.yaml"),
+        "PYTHONUNBUFFERED": "1",
+    })
+    return env
+
+
+def run_stage(stage, args, env):
+    cmd = [sys.executable, os.path.abspath(__file__), "--worker", stage, "--data", args.data,
+           "--api-requests", str(args.api_requests), "--budget-periods", str(args.budget_periods)]
+    proc = subprocess.run(cmd, env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        sys.stderr.write(proc.stdout[-2000:] + proc.stderr[-4000:])
+        raise SystemExit(f"[bench] stage {stage} failed (exit {proc.returncode})")
+    lines = proc.stdout.strip().splitlines()
+    if stage == "predict":
+        # training / inference times and holdout accuracy, as the stage logs them
+        for line in lines:
+            if line.startswith("[predict] "):
+                print(f"[bench] {line}")
+    return json.loads(lines[-1])
+
+
+def git_rev():
+    try:
+        return subprocess.run(["git", "-C", ROOT, "rev-parse", "--short", "HEAD"],
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def previous_run(path, key):
+    if not os.path.exists(path):
+        return None
+    last = None
+    with open(path) as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue
+            if rec.get("key") == key:
+                last = rec
+    return last
+
+
+def regressions(prev, cur, tolerance):
+    out = []
+    for stage, now in cur.items():
+        old = prev.get(stage)
+        if not old:
+            continue
+        if old["rows_per_s"] and now["rows_per_s"] < old["rows_per_s"] * (1 - tolerance):
+            out.append(f"{stage}: rows/s {old['rows_per_s']} -> {now['rows_per_s']}")
+        for k in ("p99_ms", "rss_mb"):
+            if old[k] and now[k] > old[k] * (1 + tolerance):
+                out.append(f"{stage}: {k} {old[k]} -> {now[k]}")
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--data", required=True, help="output dir of synth.py")
+    ap.add_argument("--stages", default=",".join(STAGES))
+    ap.add_argument("--teller-latency-ms", type=float, default=0.0)
+    ap.add_argument("--api-requests", type=int, default=500)
+    ap.add_argument("--budget-periods", type=int, default=24)
+    ap.add_argument("--history", default="bench_history.jsonl")
+    ap.add_argument("--tolerance", type=float, default=0.2)
+    ap.add_argument("--fail-on-regression", action="store_true")
+    ap.add_argument("--worker", choices=STAGES, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.worker:
+        return worker(args)
+
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = [s for s in stages if s not in STAGES]
+    if unknown:
+        raise SystemExit(f"unknown stages: {', '.join(unknown)}")
+
+    with psycopg.connect(PG_DSN) as conn:
+        if count(conn, "transactions"):
+            raise SystemExit("[bench] refusing to run: transactions is not empty (use a throwaway db)")
+
+    sys.path.insert(0, HERE)
+    import fake_teller
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        certs = fake_teller.make_certs(tmp)
+        tls = fake_teller.tls_context(certs["server_cert"], certs["server_key"], certs["ca"])
+        server, teller = fake_teller.serve(os.path.join(args.data, "teller.json"), port=0,
+                                           latency_ms=args.teller_latency_ms, tls=tls)
+        try:
+            env = stage_env(args, certs, f"https://127.0.0.1:{server.server_port}")
+            for stage in stages:
+                r = run_stage(stage, args, env)
+                results[stage] = r
+                print(f"[bench] {stage:9s} rows={r['rows']:>8} {r['rows_per_s']:>10.1f} rows/s  "
+                      f"p50={r['p50_ms']:8.2f}ms p99={r['p99_ms']:8.2f}ms  rss={r['rss_mb']:7.1f}MB  "
+                      f"({r['items']} items, {r['seconds']:.2f}s)")
+        finally:
+            server.shutdown()
+    print(f"[bench] fake teller calls={json.dumps(teller.calls, sort_keys=True)} connections={teller.connections}")
+
+    with open(os.path.join(args.data, "teller.json")) as f:
+        n_accounts = len(json.load(f)["accounts"])
+    key = {"data": os.path.basename(os.path.normpath(args.data)), "stages": stages,
+           "statements": len(os.listdir(os.path.join(args.data, "statements"))),
+           "teller_accounts": n_accounts, "teller_latency_ms": args.teller_latency_ms, "teller_tls": True,
+           "api_requests": args.api_requests}
+    prev = previous_run(args.history, key)
+    record = {"at": datetime.now(timezone.utc).isoformat(timespec="seconds"), "rev": git_rev(),
+              "key": key, "stages": results}
+    with open(args.history, "a") as f:
+        f.write(json.dumps(record, sort_keys=True) + "\n")
+
+    if prev:
+        found = regressions(prev["stages"], results, args.tolerance)
+        for r in found:
+            print(f"[bench] REGRESSION vs {prev.get('rev') or prev['at']}: {r}")
+        if not found:
+            print(f"[bench] within {args.tolerance:.0%} of {prev.get('rev') or prev['at']}")
+        if found and args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Summarize the profiles written by common/profiling.py (PROFILE=cprofile|sample) across
+the last N runs of each job: run durations and peak memory, the hottest functions
+(self and inclusive time, merged over runs) and the largest allocation sites.
+
+    docker compose run --rm --no-deps -v "$PWD/ops/bench:/bench:ro" classifier \
+        python /bench/profile_report.py --job classifier --last 10
+    python ops/bench/profile_report.py --dir ./profiles --last 5 --top 15
+
+cProfile runs (.pstats) and sampled runs (.folded) are reported separately; sampled
+time is samples x the run's interval, so it is wall time on the main thread (I/O
+waits included), while cProfile's is CPU-ish call time with its own overhead.
+"""
+import argparse, json, os, pstats, sys
+
+
+def load_runs(job_dir, last):
+    metas = []
+    for name in sorted(os.listdir(job_dir)):
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(job_dir, name)) as f:
+                metas.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return metas[-last:] if last > 0 else metas
+
+
+def short(path):
+    parts = path.replace("\\", "/").split("/")
+    return "/".join(parts[-2:]) if len(parts) > 1 else path
+
+
+def cprofile_hotspots(paths):
+    """{func label: (self s, cumulative s, calls)} merged over every .pstats file."""
+    stats = pstats.Stats(*paths)
+    out = {}
+    for (filename, line, name), (cc, nc, tt, ct, callers) in stats.stats.items():
+        label = f"{name} ({short(filename)}:{line})" if line else name
+        out[label] = (tt, ct, nc)
+    return out, sum(v[0] for v in out.values())
+
+
+def folded_hotspots(runs):
+    """{frame: (self s, inclusive s, samples)} from collapsed stacks, merged over runs."""
+    out = {}
+    total = 0.0
+    for meta in runs:
+        interval = (meta.get("interval_ms") or 5.0) / 1000.0
+        with open(meta["files"]["profile"]) as f:
+            for line in f:
+                stack, _, n = line.rstrip("\n").rpartition(" ")
+                if not stack:
+                    continue
+                n = int(n)
+                secs = n * interval
+                total += secs
+                frames = stack.split(";")
+                for fr in set(frames):  # a recursive frame counts once per stack
+                    s, c, k = out.get(fr, (0.0, 0.0, 0))
+                    out[fr] = (s + (secs if fr == frames[-1] else 0.0), c + secs, k + n)
+    return out, total
+
+
+def print_hotspots(title, hot, total, top, count_label):
+    if not hot:
+        return
+    print(f"  {title} (total {total:.2f}s)")
+    print(f"    {'self s':>9} {'self%':>6} {'incl s':>9} {count_label:>9}  function")
+    for label, (s, c, n) in sorted(hot.items(), key=lambda kv: -kv[1][0])[:top]:
+        pct = 100.0 * s / total if total else 0.0
+        print(f"    {s:9.3f} {pct:5.1f}% {c:9.3f} {n:9d}  {label}")
+
+
+def report(job, runs, top):
+    print(f"[profile] {job}: {len(runs)} run(s)")
+    for m in runs:
+        print(f"  {m['started']}  {m['mode']:8s} {m['status']:5s} {m['duration_s']:8.2f}s  "
+              f"peak={m['peak_traced_bytes'] / 1048576:7.1f}MB")
+
+    pst = [m for m in runs if m["mode"] == "cprofile" and os.path.exists(m["files"].get("profile", ""))]
+    if pst:
+        hot, total = cprofile_hotspots([m["files"]["profile"] for m in pst])
+        print_hotspots(f"cProfile hotspots over {len(pst)} run(s)", hot, total, top, "calls")
+    smp = [m for m in runs if m["mode"] == "sample" and os.path.exists(m["files"].get("profile", ""))]
+    if smp:
+        hot, total = folded_hotspots(smp)
+        print_hotspots(f"sampled hotspots over {len(smp)} run(s)", hot, total, top, "samples")
+
+    allocs = {}
+    for m in runs:
+        for a in m.get("top_allocations") or []:
+            size, seen = allocs.get(a["where"], (0, 0))
+            allocs[a["where"]] = (max(size, a["bytes"]), seen + 1)
+    if allocs:
+        print("  largest allocation sites near peak (max over runs)")
+        for where, (size, seen) in sorted(allocs.items(), key=lambda kv: -kv[1][0])[:top]:
+            print(f"    {size / 1048576:9.2f}MB  in {seen}/{len(runs)} runs  {short(where)}")
+    print()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--dir", default=os.getenv("PROFILE_DIR", "/var/log/finance/profiles"))
+    ap.add_argument("--job", action="append", help="job name (subdirectory); default all")
+    ap.add_argument("--last", type=int, default=10, help="runs per job (0 = all)")
+    ap.add_argument("--top", type=int, default=20)
+    args = ap.parse_args()
+
+    if not os.path.isdir(args.dir):
+        raise SystemExit(f"[profile] no profile directory at {args.dir}")
+    jobs = args.job or sorted(d for d in os.listdir(args.dir) if os.path.isdir(os.path.join(args.dir, d)))
+    found = False
+    for job in jobs:
+        job_dir = os.path.join(args.dir, job)
+        runs = load_runs(job_dir, args.last) if os.path.isdir(job_dir) else []
+        if not runs:
+            print(f"[profile] {job}: no runs in {job_dir}", file=sys.stderr)
+            continue
+        found = True
+        report(job, runs, args.top)
+    if not found:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# startup_budget.py
+# Import-time budget for every job entry point. Each scheduled job used to be a fresh
+# process, and the daemon still cold-starts on deploy, so a module that drags in pandas
+# at import turns a "nothing to do" run into a half-second one.
+#
+# For each entry point this runs `python -X importtime -c "import <module>"` from the
+# service directory (after one warm-up to populate __pycache__), takes the median of the
+# entry module's cumulative import time, and fails if it exceeds the budget.
+#
+# Run it with an interpreter that has the service's requirements installed, either from a
+# dev venv at the repo root:
+#   python ops/bench/startup_budget.py
+# or inside a service image, where the module sits in /app:
+#   docker compose run --rm --no-deps -v "$PWD/ops/bench:/bench:ro" -w /app normalizer \
+#     python /bench/startup_budget.py --flat --only normalizer
+#
+# Budgets are milliseconds of cumulative import time for the entry module only; the
+# interpreter's own startup is reported (wall) but not budgeted.
+
+import os, sys, argparse, statistics, subprocess, tempfile, time
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+
+# name: (service dir, module, budget ms)
+ENTRY_POINTS = {
+    "normalizer":  ("normalizer",     "normalizer",    200),
+    "classifier":  ("classifier",     "classify",      200),
+    "predict":     ("classifier",     "predict",       200),
+    "budgeter":    ("budgeter",       "budget_import", 200),
+    "teller-sync": ("teller-sync",    "sync",          200),
+    "email":       ("ingestor-email", "email_puller",  200),
+    "api":         ("api",            "app",           750),
+    "webhook":     ("teller-webhook", "webhook",       750),
+}
+
+# every entry point reads its config from os.environ at import; give it harmless values
+DUMMY_ENV = {
+    "POSTGRES_HOST": "localhost", "POSTGRES_PORT": "5432", "POSTGRES_DB": "finance",
+    "POSTGRES_USER": "bench", "POSTGRES_PASSWORD": "bench",
+    "TELLER_CERT": "/dev/null", "TELLER_KEY": "/dev/null",
+    "IMAP_HOST": "localhost", "IMAP_USER": "bench", "IMAP_PASS": "bench",
+    "TELLER_WEBHOOK_SECRET": "bench",
+}
+
+
+def parse_importtime(stderr: str, module: str) -> float:
+    """Return cumulative microseconds for the top-level import of `module`."""
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3 or parts[2].rstrip() != f" {module}":
+            continue
+        return float(parts[1])
+    raise RuntimeError(f"no importtime line for {module}")
+
+
+def measure(service_dir: str, module: str, env: dict) -> tuple[float, float]:
+    cmd = [sys.executable, "-X", "importtime", "-c", f"import {module}"]
+    t0 = time.perf_counter()
+    proc = subprocess.run(cmd, cwd=service_dir, env=env, capture_output=True, text=True)
+    wall = time.perf_counter() - t0
+    if proc.returncode != 0:
+        tail = proc.stderr.strip().splitlines()[-1:] or ["?"]
+        raise RuntimeError(f"import {module} failed: {tail[0]}")
+    return parse_importtime(proc.stderr, module) / 1000.0, wall * 1000.0
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Fail if an entry point's import time exceeds its budget.")
+    ap.add_argument("--only", action="append", choices=sorted(ENTRY_POINTS), help="limit to these entry points")
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--slack", type=float, default=float(os.getenv("STARTUP_BUDGET_SLACK", "1.0")),
+                    help="multiply every budget (e.g. 1.5 on a slow CI box)")
+    ap.add_argument("--flat", action="store_true",
+                    help="modules sit in the current directory (inside a service container)")
+    args = ap.parse_args()
+
+    raw_dir = tempfile.mkdtemp(prefix="startup-budget-")
+    env = {**os.environ, **DUMMY_ENV, "RAW_DIR": raw_dir, "PYTHONDONTWRITEBYTECODE": ""}
+    if not args.flat:
+        # images copy common/metrics.py next to the entry module; from the repo, put it on the path
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [os.path.join(REPO_ROOT, "common"), env.get("PYTHONPATH")]))
+
+    failed = []
+    for name in args.only or ENTRY_POINTS:
+        service, module, budget = ENTRY_POINTS[name]
+        service_dir = os.getcwd() if args.flat else os.path.join(REPO_ROOT, service)
+        limit = budget * args.slack
+        try:
+            measure(service_dir, module, env)  # warm-up: compile .pyc
+            samples = [measure(service_dir, module, env) for _ in range(args.runs)]
+        except RuntimeError as e:
+            # a missing dependency is a broken entry point, not a pass
+            print(f"[startup] {name:12s} FAIL  {e}")
+            failed.append(name)
+            continue
+        imp = statistics.median(s[0] for s in samples)
+        wall = statistics.median(s[1] for s in samples)
+        ok = imp <= limit
+        print(f"[startup] {name:12s} {'ok  ' if ok else 'FAIL'}  import={imp:7.1f}ms  wall={wall:7.1f}ms  budget={limit:.0f}ms")
+        if not ok:
+            failed.append(name)
+
+    if failed:
+        print(f"[startup] over budget: {', '.join(failed)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Synthetic inputs for the pipeline benchmarks. Writes into --out:
+
+    statements/*.csv         bank CSV exports (Date, Description, Amount, Balance, Account)
+    statements/*.ofx|.qfx    OFX 1.02 SGML statements with FITIDs
+    teller.json              accounts + transactions served by ops/bench/fake_teller.py
+    webhook_events.jsonl     Teller webhook bodies, one per line, for webhook_load.py --replay
+
+Everything is derived from --seed, so two runs with the same flags produce the same bytes.
+
+    python ops/bench/synth.py --out /tmp/bench_data --files 40 --rows-per-file 500 \
+        --accounts 20 --tx-per-account 2000 --events 5000
+"""
+import argparse, json, os, random
+from datetime import date, timedelta
+
+MERCHANTS = [
+    ("WHOLEFDS MKT", 20, 180), ("TRADER JOE S", 15, 120), ("SAFEWAY", 10, 160), ("COSTCO WHSE", 60, 400),
+    ("AMAZON MKTPLACE PMTS", 8, 250), ("NETFLIX.COM", 15.49, 15.49), ("SPOTIFY USA", 11.99, 11.99),
+    ("UBER TRIP", 9, 60), ("LYFT RIDE", 8, 55), ("SHELL OIL", 30, 90), ("STARBUCKS", 4, 18),
+    ("CHIPOTLE", 11, 35), ("DOORDASH", 18, 80), ("PG&E WEB ONLINE", 60, 220), ("COMCAST CABLE", 80, 120),
+    ("CVS PHARMACY", 6, 70), ("TARGET", 12, 200), ("HOME DEPOT", 15, 400), ("DELTA AIR LINES", 180, 700),
+    ("VENMO PAYMENT", 10, 300), ("ATM WITHDRAWAL", 40, 200), ("MONTHLY SERVICE FEE", 12, 12),
+]
+PAYROLL = ("PAYROLL ACME INC DIR DEP", 2400, 4200)
+OFX_OPENING = 1000.00  # the OFX/QFX account's balance before its oldest statement
+OFX_BREAK = 25.00      # what a planted break puts LEDGERBAL off by
+# mostly transaction updates, as in production; the rest still enqueue a job
+WEBHOOK_TYPES = ["transactions.processed"] * 8 + ["transactions.updated", "enrollment.disconnected"]
+
+
+def pick_amount(rnd, lo, hi):
+    return round(rnd.uniform(lo, hi), 2)
+
+
+def gen_rows(rnd, n, start, days):
+    """n statement lines over `days` days from `start`, oldest first, every 40th a payroll credit."""
+    rows = []
+    for i in range(n):
+        d = start + timedelta(days=int(i * days / max(1, n)))
+        if i % 40 == 0:
+            name, lo, hi = PAYROLL
+            amt = pick_amount(rnd, lo, hi)
+        else:
+            name, lo, hi = rnd.choice(MERCHANTS)
+            amt = -pick_amount(rnd, lo, hi)
+        rows.append((d, f"{name} #{rnd.randint(100, 9999)}", amt))
+    return rows
+
+
+def write_csv(path, rows, mask, opening):
+    bal = opening
+    with open(path, "w", newline="") as f:
+        f.write("Date,Description,Amount,Balance,Account\n")
+        for d, desc, amt in rows:
+            bal = round(bal + amt, 2)
+            f.write(f"{d.isoformat()},\"{desc}\",{amt:.2f},{bal:.2f},{mask}\n")
+    return bal
+
+
+def write_ofx(path, rows, acct_no, file_no, ledger):
+    lines = []
+    for i, (d, desc, amt) in enumerate(rows):
+        lines.append(
+            "<STMTTRN>\n"
+            f"<TRNTYPE>{'CREDIT' if amt > 0 else 'DEBIT'}\n"
+            f"<DTPOSTED>{d.strftime('%Y%m%d')}120000\n"
+            f"<TRNAMT>{amt:.2f}\n"
+            f"<FITID>OFX{file_no:04d}{i:06d}\n"
+            f"<NAME>{desc[:32]}\n"
+            "</STMTTRN>\n"
+        )
+    start, end = rows[0][0], rows[-1][0]
+    body = (
+        "OFXHEADER:100\nDATA:OFXSGML\nVERSION:102\nSECURITY:NONE\nENCODING:USASCII\n"
+        "CHARSET:1252\nCOMPRESSION:NONE\nOLDFILEUID:NONE\nNEWFILEUID:NONE\n\n"
+        "<OFX>\n<SIGNONMSGSRSV1>\n<SONRS>\n<STATUS>\n<CODE>0\n<SEVERITY>INFO\n</STATUS>\n"
+        "<DTSERVER>20240101120000\n<LANGUAGE>ENG\n</SONRS>\n</SIGNONMSGSRSV1>\n"
+        "<BANKMSGSRSV1>\n<STMTTRNRS>\n<TRNUID>1\n<STATUS>\n<CODE>0\n<SEVERITY>INFO\n</STATUS>\n"
+        "<STMTRS>\n<CURDEF>USD\n<BANKACCTFROM>\n<BANKID>121000248\n"
+        f"<ACCTID>{acct_no}\n<ACCTTYPE>CHECKING\n</BANKACCTFROM>\n"
+        f"<BANKTRANLIST>\n<DTSTART>{start.strftime('%Y%m%d')}\n<DTEND>{end.strftime('%Y%m%d')}\n"
+        + "".join(lines) +
+        f"</BANKTRANLIST>\n<LEDGERBAL>\n<BALAMT>{ledger:.2f}\n<DTASOF>{end.strftime('%Y%m%d')}\n</LEDGERBAL>\n"
+        "</STMTRS>\n</STMTTRNRS>\n</BANKMSGSRSV1>\n</OFX>\n"
+    )
+    with open(path, "w") as f:
+        f.write(body)
+
+
+def gen_teller(rnd, accounts, per_account, enrollment_id, end):
+    """Teller-shaped accounts and transactions (newest first, as the API returns them)."""
+    out = {"enrollment_id": enrollment_id, "accounts": [], "transactions": {}}
+    for a in range(1, accounts + 1):
+        acc_id = f"acc_bench{a:04d}"
+        out["accounts"].append({
+            "id": acc_id, "enrollment_id": enrollment_id, "name": f"Bench Checking {a}",
+            "type": "depository", "subtype": "checking", "currency": "USD",
+            "last_four": f"{7000 + a:04d}", "status": "open",
+            "institution": {"id": "bench_bank", "name": "Bench Bank"},
+        })
+        txs = []
+        days = max(1, per_account // 3)
+        for i, (d, desc, amt) in enumerate(gen_rows(rnd, per_account, end - timedelta(days=days), days)):
+            txs.append({
+                "id": f"txn_{acc_id}_{i:07d}", "account_id": acc_id, "date": d.isoformat(),
+                "amount": f"{amt:.2f}", "description": desc,
+                "status": "pending" if d > end - timedelta(days=2) else "posted",
+                "type": "card_payment", "details": {"counterparty": {"name": desc.split(" #")[0]}},
+            })
+        out["transactions"][acc_id] = list(reversed(txs))
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--out", required=True)
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--files", type=int, default=20, help="statement files; alternating CSV / OFX / QFX")
+    ap.add_argument("--rows-per-file", type=int, default=500)
+    ap.add_argument("--accounts", type=int, default=10, help="Teller accounts served by fake_teller.py")
+    ap.add_argument("--tx-per-account", type=int, default=1000)
+    ap.add_argument("--events", type=int, default=1000, help="webhook events")
+    ap.add_argument("--ofx-breaks", type=int, default=0,
+                    help="newest OFX/QFX statements whose LEDGERBAL is off by OFX_BREAK (reconcile breaks)")
+    ap.add_argument("--end", default=date.today().isoformat(), help="newest transaction date")
+    ap.add_argument("--enrollment-id", default="enr_bench")
+    args = ap.parse_args()
+
+    rnd = random.Random(args.seed)
+    end = date.fromisoformat(args.end)
+    stmt_dir = os.path.join(args.out, "statements")
+    os.makedirs(stmt_dir, exist_ok=True)
+
+    days = 60
+    files = []
+    for n in range(args.files):
+        rows = gen_rows(rnd, args.rows_per_file, end - timedelta(days=days * (n // 3 + 1)), days)
+        kind = ("csv", "ofx", "qfx")[n % 3]
+        opening = rnd.uniform(500, 5000) if kind == "csv" else None
+        files.append((n, kind, os.path.join(stmt_dir, f"stmt_{n:04d}.{kind}"), rows, opening))
+    # balances have to reconcile (pipeline/reconcile.py) unless a break is planted
+    # (--ofx-breaks). The normalizer keys CSV accounts by the Account column, whose
+    # statements cover disjoint windows, so each carries its balance from the one before.
+    # OFX/QFX carry no mask and land in one account: LEDGERBAL is the running balance
+    # of every OFX/QFX row up to DTEND.
+    files.sort(key=lambda f: f[3][0][0])
+    carried = {}
+    ofx_rows = sorted((r for f in files if f[1] != "csv" for r in f[3]), key=lambda r: r[0])
+    planted = {f[0] for f in [f for f in files if f[1] != "csv"][::-1][:args.ofx_breaks]}
+    for n, kind, path, rows, opening in files:
+        if kind == "csv":
+            mask = f"{1000 + n % 5:04d}"
+            carried[mask] = write_csv(path, rows, mask=mask, opening=carried.get(mask, opening))
+        else:
+            ledger = round(OFX_OPENING + sum(r[2] for r in ofx_rows if r[0] <= rows[-1][0]), 2)
+            if n in planted:
+                ledger += OFX_BREAK
+            write_ofx(path, rows, acct_no=f"98765{n % 5:04d}", file_no=n, ledger=ledger)
+
+    teller = gen_teller(rnd, args.accounts, args.tx_per_account, args.enrollment_id, end)
+    with open(os.path.join(args.out, "teller.json"), "w") as f:
+        json.dump(teller, f)
+
+    ids = [a["id"] for a in teller["accounts"]] or ["acc_bench0001"]
+    with open(os.path.join(args.out, "webhook_events.jsonl"), "w") as f:
+        for i in range(args.events):
+            # skewed like real traffic: a few noisy accounts get most of the events
+            acc = ids[min(len(ids) - 1, int(rnd.paretovariate(1.2)) - 1)]
+            ts = f"{end.isoformat()}T{i // 3600 % 24:02d}:{i // 60 % 60:02d}:{i % 60:02d}Z"
+            f.write(json.dumps({"id": f"wh_{i:08d}", "type": rnd.choice(WEBHOOK_TYPES), "timestamp": ts,
+                                "payload": {"account_id": acc}, "account_id": acc}) + "\n")
+
+    n_tx = args.accounts * args.tx_per_account
+    print(f"[synth] {args.files} statements x {args.rows_per_file} rows, {args.accounts} Teller accounts "
+          f"({n_tx} tx), {args.events} webhook events -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Teller client connection reuse: replays a sync's request pattern against a local mTLS
+stand-in (fake_teller.py with a client CA) and compares
+
+    per-enrollment  a fresh requests.Session per enrollment with session.cert set, which
+                    is what teller-sync did before common/teller_http.py: one mTLS
+                    handshake (and one cert-chain load) per enrollment per run
+    shared          one teller_http.TellerClient for the whole run: the cert chain is
+                    loaded once and every enrollment rides the same pooled connection
+
+    python ops/bench/synth.py --out /tmp/bench_data
+    python ops/bench/teller_http_bench.py --data /tmp/bench_data/teller.json --enrollments 25
+
+Certificates come from fake_teller.make_certs() in a temporary directory. Reported per mode: requests, server-side
+connections (= handshakes), wall time and per-request p50 / p99.
+"""
+import argparse, json, os, statistics, sys, tempfile, time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, "..", "..", "common"))
+
+import requests
+import fake_teller
+import teller_http
+
+
+def sync_pattern(get, accounts, page_size):
+    """What sync.py does for one enrollment: list accounts, then account + first page each."""
+    lat = []
+    def timed(path, params=None):
+        t0 = time.perf_counter()
+        r = get(path, params)
+        lat.append(time.perf_counter() - t0)
+        if r.status_code != 200:
+            raise RuntimeError(f"HTTP {r.status_code} GET {path}: {r.text[:200]}")
+        return r.json()
+    timed("/accounts")
+    for acc_id in accounts:
+        timed(f"/accounts/{acc_id}")
+        timed(f"/accounts/{acc_id}/transactions", {"count": page_size})
+    return lat
+
+
+def run_per_enrollment(base, certs, accounts, args):
+    lat = []
+    for i in range(args.enrollments):
+        s = requests.Session()
+        s.headers.update({"User-Agent": "bench", "Accept": "application/json",
+                          "Authorization": teller_http.basic_auth_header(f"tok_{i}"),
+                          "X-Enrollment-Id": f"usr_{i}"})
+        s.cert = (certs["client_cert"], certs["client_key"])
+        s.verify = certs["ca"]
+        s.trust_env = False  # a REQUESTS_CA_BUNDLE in this shell would override s.verify
+        lat += sync_pattern(lambda path, params: s.get(base + path, params=params, timeout=30), accounts, args.page_size)
+        s.close()
+    return lat, None
+
+
+def run_shared(base, certs, accounts, args):
+    api = teller_http.TellerClient(base, certs["client_cert"], certs["client_key"], certs["ca"], user_agent="bench")
+    lat = []
+    for i in range(args.enrollments):
+        s = api.for_enrollment(f"tok_{i}", f"usr_{i}")
+        lat += sync_pattern(lambda path, params: s.get(path, params=params), accounts, args.page_size)
+    stats = api.stats()
+    api.close()
+    return lat, stats
+
+
+MODES = {"per-enrollment": run_per_enrollment, "shared": run_shared}
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--data", required=True, help="teller.json from synth.py")
+    ap.add_argument("--enrollments", type=int, default=25)
+    ap.add_argument("--page-size", type=int, default=100)
+    ap.add_argument("--latency-ms", type=float, default=0.0, help="server think time per response")
+    ap.add_argument("--json", action="store_true", help="print results as one JSON object")
+    args = ap.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as d:
+        certs = fake_teller.make_certs(d)
+        tls = fake_teller.tls_context(certs["server_cert"], certs["server_key"], certs["ca"])
+        for mode, fn in MODES.items():
+            server, teller = fake_teller.serve(args.data, port=0, latency_ms=args.latency_ms, tls=tls)
+            base = f"https://127.0.0.1:{server.server_port}"
+            accounts = sorted(teller.accounts)
+            t0 = time.perf_counter()
+            lat, stats = fn(base, certs, accounts, args)
+            wall = time.perf_counter() - t0
+            server.shutdown()
+            server.server_close()
+            ms = sorted(x * 1000.0 for x in lat)
+            results[mode] = {
+                "requests": len(ms), "connections": teller.connections, "wall_s": round(wall, 3),
+                "p50_ms": round(statistics.median(ms), 2), "p99_ms": round(ms[int(0.99 * (len(ms) - 1))], 2),
+                "client_stats": stats,
+            }
+
+    if args.json:
+        print(json.dumps(results, indent=1))
+        return
+    print(f"[bench] {args.enrollments} enrollments, mTLS, latency={args.latency_ms}ms")
+    print(f"  {'mode':16s} {'requests':>8} {'conns':>6} {'wall s':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    for mode, r in results.items():
+        print(f"  {mode:16s} {r['requests']:8d} {r['connections']:6d} {r['wall_s']:8.3f} {r['p50_ms']:8.2f} {r['p99_ms']:8.2f}")
+    a, b = results["per-enrollment"], results["shared"]
+    print(f"  shared: {a['connections'] - b['connections']} fewer handshakes, "
+          f"wall {100.0 * (1 - b['wall_s'] / a['wall_s']):.0f}% lower")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Nearest-neighbour latency for merchant embeddings (0022, api/app.py /suggestions) at
+a scale no real merchants table reaches: loads N synthetic merchant names embedded with
+merchants.embed() into a scratch table, builds the same index as 0022 and compares
+
+    exact   brute-force cosine distance over every row (index scans off)
+    hnsw    the HNSW index at each --ef-search, with recall@k against exact (a result
+            counts when it is no farther than exact's k-th: synthetic names tie a lot)
+
+    POSTGRES_DB=finance_bench python ops/bench/vector_bench.py --rows 1000000
+    POSTGRES_DB=finance_bench python ops/bench/vector_bench.py --rows 1000000 --reuse   # skip load + build
+
+The scratch table (bench_merchant_vectors) is left in place for --reuse; --drop removes
+it. Use a throwaway database: the load and index build take a while at 1M rows.
+"""
+import argparse, json, os, random, sys, time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "..", "common"))
+
+import psycopg
+import merchants
+
+PG_DSN = (
+    f"host={os.environ['POSTGRES_HOST']} "
+    f"port={os.environ['POSTGRES_PORT']} "
+    f"dbname={os.environ['POSTGRES_DB']} "
+    f"user={os.environ['POSTGRES_USER']} "
+    f"password={os.environ['POSTGRES_PASSWORD']}"
+)
+
+TABLE = "bench_merchant_vectors"
+WORDS = """ACME BLUE BOTTLE CAFE COFFEE ROASTERS MARKET FOODS GROCERY DELI PIZZA TACO SUSHI THAI
+GRILL KITCHEN BAKERY BURGER NOODLE PHARMACY DRUG HARDWARE HOME SUPPLY AUTO PARTS TIRE FUEL GAS
+OIL STATION PARKING GARAGE TRANSIT RIDE TAXI AIR LINES HOTEL INN SUITES BOOKS MUSIC GAMES
+SPORTS OUTDOOR PET VET CLINIC DENTAL MEDICAL FITNESS GYM YOGA SALON BARBER SPA CLEANERS
+LAUNDRY INSURANCE MOBILE WIRELESS CABLE ENERGY WATER POWER ELECTRIC STREAMING DIGITAL STORE
+SHOP OUTLET WAREHOUSE WHOLESALE CLUB DEPOT EXPRESS MART PLAZA CENTER""".split()
+PLACES = """OAKLAND BERKELEY SEATTLE PORTLAND AUSTIN DENVER BOSTON CHICAGO MIAMI PHOENIX DALLAS
+ATLANTA HOUSTON TAMPA OMAHA TUCSON FRESNO RENO BOISE""".split()
+
+
+def name(rnd):
+    brand = "".join(rnd.choice("ABCDEFGHIJKLMNOPRSTUVWY") for _ in range(rnd.randint(4, 9)))
+    parts = [brand] + rnd.sample(WORDS, rnd.randint(1, 2))
+    if rnd.random() < 0.5:
+        parts.append(rnd.choice(PLACES))
+    return " ".join(parts)
+
+
+def perturb(rnd, n):
+    """A query that reads like an existing merchant: drop or swap a word, or add a place."""
+    words = n.split()
+    r = rnd.random()
+    if r < 0.3 and len(words) > 2:
+        words.pop(rnd.randrange(1, len(words)))
+    elif r < 0.6:
+        words[rnd.randrange(1, len(words))] = rnd.choice(WORDS)
+    else:
+        words.append(rnd.choice(PLACES))
+    return " ".join(words)
+
+
+def load(conn, n, chunk, rnd):
+    with conn.cursor() as cur:
+        cur.execute(f"drop table if exists {TABLE}")
+        cur.execute(f"create table {TABLE} (id bigserial primary key, name text, embedding vector({merchants.EMBED_DIM}))")
+        conn.commit()
+        t0 = time.monotonic()
+        done = 0
+        while done < n:
+            with cur.copy(f"copy {TABLE} (name, embedding) from stdin") as copy:
+                for _ in range(min(chunk, n - done)):
+                    nm = name(rnd)
+                    copy.write_row((nm, merchants.embed(nm)))
+                    done += 1
+            conn.commit()
+            print(f"[vectors] loaded {done:,}/{n:,} ({done / max(1e-9, time.monotonic() - t0):,.0f} rows/s)")
+    return time.monotonic() - t0
+
+
+def build_index(conn, mwm):
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(f"set maintenance_work_mem = '{mwm}'")
+        t0 = time.monotonic()
+        cur.execute(f"create index {TABLE}_hnsw on {TABLE} using hnsw (embedding vector_cosine_ops)")
+        took = time.monotonic() - t0
+        cur.execute(f"analyze {TABLE}")
+        cur.execute(f"select pg_size_pretty(pg_relation_size('{TABLE}')), pg_size_pretty(pg_relation_size('{TABLE}_hnsw'))")
+        sizes = cur.fetchone()
+    conn.autocommit = False
+    return took, sizes
+
+
+def knn(cur, vec, k):
+    t0 = time.perf_counter()
+    cur.execute(f"select embedding <=> %s::vector as d from {TABLE} order by embedding <=> %s::vector limit %s",
+                (vec, vec, k))
+    dists = [r[0] for r in cur.fetchall()]
+    return (time.perf_counter() - t0) * 1000.0, dists
+
+
+def pct(ms, p):
+    ms = sorted(ms)
+    return ms[min(len(ms) - 1, int(p / 100.0 * (len(ms) - 1)))]
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--rows", type=int, default=1_000_000)
+    ap.add_argument("--queries", type=int, default=200, help="HNSW queries per ef_search")
+    ap.add_argument("--exact-queries", type=int, default=20, help="brute-force queries (slow at 1M)")
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--ef-search", default="40,100", help="comma list; 40 is pgvector's default")
+    ap.add_argument("--chunk", type=int, default=50_000)
+    ap.add_argument("--maintenance-work-mem", default="2GB")
+    ap.add_argument("--reuse", action="store_true", help="keep the loaded table and index")
+    ap.add_argument("--drop", action="store_true", help="drop the scratch table at the end")
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--json", action="store_true")
+    args = ap.parse_args()
+
+    rnd = random.Random(args.seed)
+    out = {"rows": args.rows, "k": args.k}
+    with psycopg.connect(PG_DSN) as conn:
+        if not args.reuse:
+            out["load_s"] = round(load(conn, args.rows, args.chunk, rnd), 1)
+            took, (table_size, index_size) = build_index(conn, args.maintenance_work_mem)
+            out.update(index_build_s=round(took, 1), table_size=table_size, index_size=index_size)
+            print(f"[vectors] hnsw built in {took:.1f}s (table {table_size}, index {index_size})")
+        with conn.cursor() as cur:
+            cur.execute(f"select count(*) from {TABLE}")
+            out["rows"] = cur.fetchone()[0]
+            cur.execute(f"select name from {TABLE} tablesample system (1) limit %s", (args.queries,))
+            queries = [merchants.embed(perturb(rnd, r[0])) for r in cur.fetchall()]
+
+            cur.execute("set enable_indexscan = off")
+            exact_ms, truth = [], []  # truth: exact k-th distance per query
+            for q in queries[:args.exact_queries]:
+                ms, dists = knn(cur, q, args.k)
+                exact_ms.append(ms)
+                truth.append(dists[-1] if dists else 0.0)
+            cur.execute("reset enable_indexscan")
+            out["exact"] = {"queries": len(exact_ms), "p50_ms": round(pct(exact_ms, 50), 2),
+                            "p99_ms": round(pct(exact_ms, 99), 2)}
+
+            out["hnsw"] = {}
+            for ef in [int(x) for x in args.ef_search.split(",") if x.strip()]:
+                cur.execute(f"set hnsw.ef_search = {ef}")
+                ms_all, hits = [], 0
+                for i, q in enumerate(queries):
+                    ms, dists = knn(cur, q, args.k)
+                    ms_all.append(ms)
+                    if i < len(truth):
+                        hits += sum(1 for d in dists if d <= truth[i] + 1e-9)
+                out["hnsw"][ef] = {"queries": len(ms_all), "p50_ms": round(pct(ms_all, 50), 2),
+                                   "p99_ms": round(pct(ms_all, 99), 2),
+                                   "recall": round(hits / max(1, args.k * len(truth)), 3)}
+            conn.rollback()
+        if args.drop:
+            conn.execute(f"drop table {TABLE}")
+            conn.commit()
+
+    if args.json:
+        print(json.dumps(out, indent=1))
+        return
+    print(f"[vectors] {out['rows']:,} x {merchants.EMBED_DIM}-d, k={args.k}")
+    e = out["exact"]
+    print(f"  {'exact':14s} p50={e['p50_ms']:9.2f}ms p99={e['p99_ms']:9.2f}ms  ({e['queries']} queries)")
+    for ef, h in out["hnsw"].items():
+        print(f"  {'hnsw ef=' + str(ef):14s} p50={h['p50_ms']:9.2f}ms p99={h['p99_ms']:9.2f}ms  "
+              f"recall@{args.k}={h['recall']:.3f}  ({h['queries']} queries)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# webhook_load.py
+# Load test for teller-webhook. Generates locally signed Teller-style events (HMAC-SHA256
+# of the raw body with TELLER_WEBHOOK_SECRET, same as verify_sig) and fires them at the
+# webhook with bounded concurrency, then reports events/sec and ack latency percentiles.
+#
+#   pip install httpx
+#   TELLER_WEBHOOK_SECRET=... python ops/bench/webhook_load.py --url http://localhost:8081/teller/webhook \
+#       --events 5000 --concurrency 200 --accounts 20
+#
+# --accounts controls how bursty the traffic is: few accounts means many events per
+# account, which is what the batched upsert is supposed to coalesce.
+# --replay sends the bodies from a file instead (ops/bench/synth.py webhook_events.jsonl),
+# signed at send time.
+
+import os, sys, json, hmac, hashlib, time, argparse, asyncio, random, statistics
+
+
+def signed_event(secret: bytes, account_id: str, typ: str = "transactions.updated"):
+    """Return (body, headers) for one webhook delivery."""
+    body = json.dumps({
+        "id": f"wh_{random.getrandbits(64):016x}",
+        "type": typ,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "payload": {"account_id": account_id},
+        "account_id": account_id,
+    }).encode("utf-8")
+    sig = hmac.new(secret, body, hashlib.sha256).hexdigest()
+    return body, {"Content-Type": "application/json", "Teller-Signature": sig}
+
+
+def replayed_events(secret: bytes, path: str, limit: int):
+    """(body, headers) for each JSON line of a synth.py events file, up to limit."""
+    out = []
+    with open(path) as f:
+        for line in f:
+            if limit and len(out) >= limit:
+                break
+            body = line.strip().encode("utf-8")
+            if body:
+                sig = hmac.new(secret, body, hashlib.sha256).hexdigest()
+                out.append((body, {"Content-Type": "application/json", "Teller-Signature": sig}))
+    return out
+
+
+def percentile(xs, p):
+    xs = sorted(xs)
+    k = max(0, min(len(xs) - 1, int(round(p / 100.0 * (len(xs) - 1)))))
+    return xs[k]
+
+
+async def run(args, secret):
+    import httpx
+
+    if args.replay:
+        events = replayed_events(secret, args.replay, args.events)
+    else:
+        accounts = [f"acc_load{i:05d}" for i in range(args.accounts)]
+        events = [signed_event(secret, random.choice(accounts), args.type) for _ in range(args.events)]
+    latencies, statuses = [], {}
+    sem = asyncio.Semaphore(args.concurrency)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+
+    async with httpx.AsyncClient(limits=limits, timeout=args.timeout) as client:
+        async def fire(body, headers):
+            async with sem:
+                t0 = time.perf_counter()
+                try:
+                    r = await client.post(args.url, content=body, headers=headers)
+                    code = r.status_code
+                except httpx.HTTPError as e:
+                    code = type(e).__name__
+                latencies.append(time.perf_counter() - t0)
+                statuses[code] = statuses.get(code, 0) + 1
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(fire(b, h) for b, h in events))
+        elapsed = time.perf_counter() - t0
+
+    ms = [x * 1000.0 for x in latencies]
+    source = args.replay or f"accounts={args.accounts}"
+    print(f"[load] events={len(events)} {source} concurrency={args.concurrency}")
+    print(f"[load] elapsed={elapsed:.2f}s  rate={len(events) / elapsed:.0f} events/s")
+    print(f"[load] ack p50={statistics.median(ms):.1f}ms  p99={percentile(ms, 99):.1f}ms  max={max(ms):.1f}ms")
+    print(f"[load] statuses={json.dumps({str(k): v for k, v in sorted(statuses.items(), key=str)})}")
+    return statuses
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Fire signed Teller webhook events and report throughput/latency.")
+    ap.add_argument("--url", default="http://localhost:8081/teller/webhook")
+    ap.add_argument("--events", type=int, default=2000, help="with --replay: max events to send (0 = all)")
+    ap.add_argument("--concurrency", type=int, default=100)
+    ap.add_argument("--accounts", type=int, default=20)
+    ap.add_argument("--type", default="transactions.updated")
+    ap.add_argument("--timeout", type=float, default=10.0)
+    ap.add_argument("--replay", help="JSONL of event bodies (ops/bench/synth.py) to send instead")
+    args = ap.parse_args()
+
+    secret = os.getenv("TELLER_WEBHOOK_SECRET")
+    if not secret:
+        raise SystemExit("TELLER_WEBHOOK_SECRET is required to sign events")
+    statuses = asyncio.run(run(args, secret.encode("utf-8")))
+    if any(k != 200 for k in statuses):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+# balances.py
+# End-of-day balances per account (0027_daily_balances.sql). Every insert, delete or
+# amount / date / duplicate change on transactions queues (account, day) in
+# tx_balance_queue. This stage drains the queue in batches. For each account it starts
+# from the stored balance of the day before the earliest queued day, and walks the
+# account's days from there onwards, one group-by range of ix_tx_account_date. Only rows
+# whose values changed are written back. A new row today touches one day; a backdated
+# row rewrites the days after it.
+#
+#   a day with a reported balance_after   the day's closing one (closing()), anchored
+#   otherwise                             previous balance + the day's net amount
+#
+# Days before an account's first reported balance are derived backwards from it. When
+# the first reported balance arrives, or a row before it changes, those earlier days
+# shift by the difference in one update. Suppressed duplicates (0024) don't count.
+#
+#   docker compose run --rm pipeline python /app/balances.py
+#   docker compose run --rm pipeline python /app/balances.py --rebuild   # every account from its first day
+
+import os, sys, argparse
+from decimal import Decimal
+
+import psycopg
+
+import metrics
+
+PG_DSN = (
+    f"host={os.environ['POSTGRES_HOST']} "
+    f"port={os.environ['POSTGRES_PORT']} "
+    f"dbname={os.environ['POSTGRES_DB']} "
+    f"user={os.environ['POSTGRES_USER']} "
+    f"password={os.environ['POSTGRES_PASSWORD']}"
+)
+
+BATCH = int(os.getenv("BALANCES_BATCH", "5000"))  # queue rows per batch
+
+# the stored balance each walk starts from
+PREV_SQL = """
+  select q.account_id, b.balance, b.anchored
+  from unnest(%(accounts)s::bigint[], %(since)s::date[]) as q(account_id, since)
+  cross join lateral (
+    select b.balance, b.anchored
+    from daily_balances b
+    where b.account_id = q.account_id and b.day < q.since
+    order by b.day desc
+    limit 1
+  ) b
+"""
+
+# the account's days from the earliest queued one, with the rows that reported a balance
+DAYS_SQL = """
+  select q.account_id, d.posted_at, d.net, d.tx_count, d.amounts, d.balances
+  from unnest(%(accounts)s::bigint[], %(since)s::date[]) as q(account_id, since)
+  cross join lateral (
+    select t.posted_at, sum(t.amount) as net, count(*) as tx_count,
+           array_agg(t.amount order by t.id) filter (where t.balance_after is not null) as amounts,
+           array_agg(t.balance_after order by t.id) filter (where t.balance_after is not null) as balances
+    from transactions t
+    where t.account_id = q.account_id
+      and t.posted_at >= q.since
+      and t.duplicate_of is null
+    group by t.posted_at
+  ) d
+  order by q.account_id, d.posted_at
+"""
+
+STORED_SQL = """
+  select b.account_id, b.day, b.balance, b.net, b.tx_count, b.anchored, b.reported
+  from unnest(%(accounts)s::bigint[], %(since)s::date[]) as q(account_id, since)
+  join daily_balances b on b.account_id = q.account_id and b.day >= q.since
+"""
+
+
+def closing(amounts, balances):
+    """
+    A day's closing balance from its rows that reported one, in id order. Rows don't
+    arrive in the order they posted (Teller pages newest first), so the closing row is
+    the one no other row continues from: no balance_after - amount equals its balance.
+    Falls back to the last row when that is ambiguous.
+    """
+    if not balances:
+        return None
+    opens = {}
+    for a, b in zip(amounts, balances):
+        opens[b - a] = opens.get(b - a, 0) + 1
+    ends = [b for a, b in zip(amounts, balances) if opens.get(b, 0) - (a == 0) == 0]
+    return ends[0] if len(ends) == 1 else balances[-1]
+
+
+def walk(prev, days):
+    """
+    Balances for one account's days [(day, net, tx_count, reported)] in date order,
+    starting from prev (balance, anchored) or None. Returns the rows
+    [(day, balance, net, tx_count, anchored, reported)] and how much the stored days
+    before them have to move (nonzero only when they weren't anchored and a reported
+    balance turned up).
+    """
+    bal, anchored = prev if prev else (Decimal(0), False)
+    out = []
+    shift = Decimal(0)
+    for day, net, n, reported in days:
+        carried = bal + net
+        if reported is None:
+            bal = carried
+        else:
+            if not anchored:
+                # the first reported balance: everything before it was relative
+                shift = reported - carried
+                out = [(r[0], r[1] + shift) + r[2:] for r in out]
+            bal, anchored = reported, True
+        out.append((day, bal, net, n, anchored, reported))
+    return out, shift
+
+
+def refresh(cur, since):
+    """Recompute the accounts in since {account_id: earliest queued day}; returns rows written."""
+    params = {"accounts": list(since), "since": [since[a] for a in since]}
+    cur.execute(PREV_SQL, params)
+    prev = {a: (bal, anchored) for a, bal, anchored in cur.fetchall()}
+    cur.execute(DAYS_SQL, params)
+    days = {}
+    for account_id, day, net, n, amounts, balances in cur.fetchall():
+        days.setdefault(account_id, []).append((day, net, n, closing(amounts, balances)))
+    cur.execute(STORED_SQL, params)
+    stored = {(r[0], r[1]): r[2:] for r in cur.fetchall()}
+
+    upserts, shifts = [], []
+    for account_id in since:
+        rows, shift = walk(prev.get(account_id), days.get(account_id, []))
+        if shift and account_id in prev:
+            shifts.append((account_id, since[account_id], shift))
+        for row in rows:
+            if stored.pop((account_id, row[0]), None) != row[1:]:
+                upserts.append((account_id,) + row)
+    gone = list(stored)  # days left with no transactions
+
+    if upserts:
+        cur.execute("""
+          insert into daily_balances(account_id, day, balance, net, tx_count, anchored, reported)
+          select * from unnest(%s::bigint[], %s::date[], %s::numeric[], %s::numeric[], %s::int[], %s::boolean[],
+                               %s::numeric[])
+          on conflict (account_id, day) do update set
+            balance = excluded.balance, net = excluded.net, tx_count = excluded.tx_count,
+            anchored = excluded.anchored, reported = excluded.reported, updated_at = now()
+        """, tuple(list(col) for col in zip(*upserts)))
+    if gone:
+        cur.execute("""
+          delete from daily_balances b
+          using unnest(%s::bigint[], %s::date[]) as g(account_id, day)
+          where b.account_id = g.account_id and b.day = g.day
+        """, ([g[0] for g in gone], [g[1] for g in gone]))
+    shifted = 0
+    for account_id, day, shift in shifts:
+        cur.execute("""
+          update daily_balances set balance = balance + %s, updated_at = now()
+          where account_id = %s and day < %s
+        """, (shift, account_id, day))
+        shifted += cur.rowcount
+    return len(upserts) + len(gone) + shifted
+
+
+def rebuild(conn):
+    """Queue every account from its first day; returns accounts queued."""
+    with conn.cursor() as cur:
+        cur.execute("""
+          insert into tx_balance_queue(account_id, day)
+          select a.id, t.posted_at
+          from accounts a
+          cross join lateral (
+            select t.posted_at from transactions t where t.account_id = a.id order by t.posted_at limit 1
+          ) t
+        """)
+        n = cur.rowcount
+    conn.commit()
+    return n
+
+
+@metrics.job("balances")
+def run(conn):
+    checked = accounts = written = 0
+    while True:
+        with conn.cursor() as cur:
+            cur.execute("""
+              select id, account_id, day from tx_balance_queue
+              order by id
+              limit %s
+              for update skip locked
+            """, (BATCH,))
+            queued = cur.fetchall()
+            if not queued:
+                break
+            since = {}
+            for _, account_id, day in queued:
+                if account_id not in since or day < since[account_id]:
+                    since[account_id] = day
+            written += refresh(cur, since)
+            cur.execute("delete from tx_balance_queue where id = any(%s)", ([q[0] for q in queued],))
+        conn.commit()
+        checked += len(queued)
+        accounts += len(since)
+    metrics.count_rows(checked, "checked")
+    metrics.count_rows(written, "written")
+    print(f"[balances] checked={checked} accounts={accounts} written={written}")
+    return written
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Maintain end-of-day account balances.")
+    ap.add_argument("--rebuild", action="store_true", help="recompute every account from its first day")
+    args = ap.parse_args()
+    metrics.set_service("balances")
+    try:
+        with psycopg.connect(PG_DSN, autocommit=False, cursor_factory=metrics.TimedCursor) as conn:
+            if args.rebuild:
+                print(f"[balances] queued {rebuild(conn)} account(s)")
+            run(conn)
+    finally:
+        metrics.push()
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        print(f"[balances] ERROR: {e}", file=sys.stderr)
+        sys.exit(1)
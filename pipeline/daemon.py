@@ -0,0 +1,208 @@
+# daemon.py
+# Long-lived host for the ingest pipeline. Replaces the per-run `docker compose run --rm`
+# containers from scheduler/crontab: stage modules are imported once, DB work goes through
+# a small connection pool, Teller sessions stay warm, and Postgres NOTIFY wakes the
+# downstream stages as soon as new work lands instead of waiting for the next cron tick.
+
+import os, sys, time, signal, importlib
+
+import psycopg
+from psycopg_pool import ConnectionPool
+
+import metrics
+import rules
+
+PG_DSN = (
+    f"host={os.environ['POSTGRES_HOST']} "
+    f"port={os.environ['POSTGRES_PORT']} "
+    f"dbname={os.environ['POSTGRES_DB']} "
+    f"user={os.environ['POSTGRES_USER']} "
+    f"password={os.environ['POSTGRES_PASSWORD']}"
+)
+
+# comma-separated subset of STAGES to host; teller-sync needs certs, email needs IMAP creds
+ENABLED = [s.strip() for s in os.getenv("PIPELINE_STAGES", "email,normalize,dedupe,transfers,recurring,balances,reconcile,classify,predict,budget,teller,merchants,partitions").split(",") if s.strip()]
+POOL_MAX = int(os.getenv("PIPELINE_POOL_MAX", "4"))
+# after a NOTIFY, keep collecting for this long so a burst of rows triggers one run
+DEBOUNCE_SECONDS = float(os.getenv("PIPELINE_DEBOUNCE_SECONDS", "1.0"))
+RECONNECT_SECONDS = 5
+
+
+class Stage:
+    def __init__(self, name, module, interval, autocommit, channels=(), then=(), notify_kwargs=None):
+        self.name = name
+        self.module = module          # importable module exposing run(conn, ...)
+        self.interval = int(os.getenv(f"PIPELINE_{name.upper()}_INTERVAL", str(interval)))
+        self.autocommit = autocommit  # what the stage's own main() would have used
+        self.channels = channels      # NOTIFY channels that make this stage due immediately
+        self.then = then              # stages to run right after this one did work
+        self.notify_kwargs = notify_kwargs or {}  # passed to run() on NOTIFY wake-ups only
+        self.run = None
+        self.next_due = None          # optional module hook: seconds until queued work is due
+        self.next_at = 0.0            # monotonic; 0 = due now (first pass runs everything)
+        self.wake_at = None           # monotonic; one-shot notify-style rerun for held work
+
+    def load(self):
+        mod = importlib.import_module(self.module)
+        self.run = mod.run
+        self.next_due = getattr(mod, "next_due", None)
+
+
+# Intervals are the safety net; NOTIFY carries the latency-sensitive paths.
+STAGES = {
+    "email":     Stage("email", "email_puller", 60, autocommit=True),
+    "normalize": Stage("normalize", "normalizer", 900, autocommit=True,
+                       channels=("ingest_files",),
+                       then=("dedupe", "transfers", "recurring", "balances", "reconcile", "predict")),
+    # drains tx_dedupe_queue (filled by trigger); runs before predict so suppressed rows aren't scored
+    "dedupe":    Stage("dedupe", "dedupe", 3600, autocommit=False),
+    # pairs outflows with inflows on our other accounts (tx_transfer_queue); after dedupe
+    "transfers": Stage("transfers", "transfers", 3600, autocommit=False),
+    # recomputes the recurring series of groups with new rows (tx_recurring_queue); after transfers
+    "recurring": Stage("recurring", "recurring", 3600, autocommit=False),
+    # rewrites daily_balances from the earliest day each account has queued (tx_balance_queue); after dedupe
+    "balances":  Stage("balances", "balances", 3600, autocommit=False),
+    # checks the anchor intervals around rewritten balances (reconcile_queue); after balances
+    "reconcile": Stage("reconcile", "reconcile", 3600, autocommit=False),
+    # writers apply the rules inline (rules.categorize); this rescans for what they missed
+    "classify":  Stage("classify", "classify", 3600, autocommit=False),
+    # scores what the rules left uncategorized; runs after them
+    "predict":   Stage("predict", "predict", 3600, autocommit=False),
+    "budget":    Stage("budget", "budget_import", 86400, autocommit=True),
+    "teller":    Stage("teller", "sync", 86400, autocommit=False,
+                       channels=("teller_jobs",),
+                       then=("dedupe", "transfers", "recurring", "balances", "reconcile", "predict"),
+                       notify_kwargs={"sweep": False}),
+    # ingest fills merchant_id itself; this catches rows written before 0021
+    "merchants": Stage("merchants", "merchants", 3600, autocommit=False),
+    "partitions": Stage("partitions", "partitions", 86400, autocommit=True),
+}
+
+
+def run_stage(pool, stage, **kwargs):
+    t0 = time.monotonic()
+    try:
+        with pool.connection() as conn:
+            conn.autocommit = stage.autocommit
+            result = stage.run(conn, **kwargs)
+    except Exception as e:
+        print(f"[pipeline] {stage.name} failed: {e}", file=sys.stderr)
+        result = None
+    print(f"[pipeline] {stage.name} done in {time.monotonic() - t0:.2f}s")
+    return result
+
+
+def run_chain(pool, stages, name, reschedule=True, **kwargs):
+    """Run a stage, then any downstream stages if it reported work (a truthy count)."""
+    stage = stages[name]
+    if reschedule:
+        stage.next_at = time.monotonic() + stage.interval
+    stage.wake_at = None
+    if run_stage(pool, stage, **kwargs):
+        for nxt in stage.then:
+            if nxt in stages:
+                run_chain(pool, stages, nxt)
+    if stage.next_due:
+        schedule_wake(pool, stage)
+
+
+def schedule_wake(pool, stage):
+    """Work that is queued but held (debounced or backing off) has no NOTIFY coming; set a timer for it."""
+    try:
+        with pool.connection() as conn:
+            conn.autocommit = stage.autocommit
+            delay = stage.next_due(conn)
+    except Exception as e:
+        print(f"[pipeline] {stage.name} next_due failed: {e}", file=sys.stderr)
+        return
+    if delay is not None:
+        stage.wake_at = time.monotonic() + delay
+
+
+def listen(stages):
+    conn = psycopg.connect(PG_DSN, autocommit=True)
+    # rules: the compiled rule set (rules.py) is stale; writers recompile on next use
+    channels = sorted({ch for st in stages.values() for ch in st.channels} | {rules.CHANNEL})
+    for ch in channels:
+        conn.execute(f"listen {ch}")
+    print(f"[pipeline] listening on {', '.join(channels) or '(nothing)'}")
+    return conn
+
+
+def wait_for_notifies(listener, timeout):
+    """Block until a NOTIFY arrives or timeout passes; return the set of channels that fired."""
+    fired = set()
+    for n in listener.notifies(timeout=timeout, stop_after=1):
+        fired.add(n.channel)
+    if fired:
+        for n in listener.notifies(timeout=DEBOUNCE_SECONDS):
+            fired.add(n.channel)
+    return fired
+
+
+def _terminate(signum, frame):
+    raise SystemExit(0)
+
+
+def main():
+    unknown = [s for s in ENABLED if s not in STAGES]
+    if unknown:
+        raise SystemExit(f"unknown PIPELINE_STAGES: {', '.join(unknown)}")
+    stages = {name: STAGES[name] for name in STAGES if name in ENABLED}
+    metrics.set_service("pipeline")
+    for st in stages.values():
+        st.load()
+    print(f"[pipeline] stages: {', '.join(stages)}")
+
+    signal.signal(signal.SIGTERM, _terminate)
+    pool = ConnectionPool(PG_DSN, min_size=1, max_size=POOL_MAX, open=True,
+                          kwargs={"cursor_factory": metrics.TimedCursor})
+    listener = None
+    try:
+        while True:
+            now = time.monotonic()
+            for name, st in stages.items():
+                if st.next_at <= now:
+                    run_chain(pool, stages, name)
+                elif st.wake_at is not None and st.wake_at <= now:
+                    run_chain(pool, stages, name, reschedule=not st.notify_kwargs, **st.notify_kwargs)
+            # covers the notify-driven runs from the previous pass too
+            metrics.push()
+
+            if listener is None or listener.closed:
+                try:
+                    listener = listen(stages)
+                except psycopg.OperationalError as e:
+                    print(f"[pipeline] listen failed: {e}", file=sys.stderr)
+                    time.sleep(RECONNECT_SECONDS)
+                    continue
+
+            deadlines = [st.next_at for st in stages.values()]
+            deadlines += [st.wake_at for st in stages.values() if st.wake_at is not None]
+            timeout = max(0.0, min(deadlines) - time.monotonic())
+            try:
+                fired = wait_for_notifies(listener, timeout)
+            except psycopg.OperationalError as e:
+                print(f"[pipeline] listener lost: {e}", file=sys.stderr)
+                listener.close()
+                continue
+
+            if rules.CHANNEL in fired:
+                print("[pipeline] notify -> rules changed")
+                rules.invalidate()
+            for name, st in stages.items():
+                if fired.intersection(st.channels):
+                    print(f"[pipeline] notify -> {name}")
+                    # a partial run (e.g. teller drain without sweep) keeps the timer as is
+                    run_chain(pool, stages, name, reschedule=not st.notify_kwargs, **st.notify_kwargs)
+    finally:
+        if listener is not None:
+            listener.close()
+        pool.close()
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
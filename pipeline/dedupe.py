@@ -0,0 +1,243 @@
+# dedupe.py
+# Cross-source duplicate detection (0024_tx_duplicates.sql). Every inserted transaction
+# lands in tx_dedupe_queue; this stage drains it in batches. For each queued row it
+# looks for a transaction from the other source: Teller rows have no hash, statement
+# rows always do. The counterpart must be on the same account, have the same amount,
+# and be posted within DEDUPE_WINDOW_DAYS. That is one range of ix_tx_dedupe_block per
+# row, in the one or two partitions the window touches, however long the history is.
+# Each candidate is scored on its description. The same merchant_id scores 1. Otherwise
+# the score is the better of trigram similarity and word overlap between the canonical
+# names (merchants.canonical_name).
+#
+#   score >= DEDUPE_SUPPRESS_SCORE   the queued row is suppressed: duplicate_of is set,
+#                                    its rule / classifier splits are removed, manual
+#                                    ones move to the survivor, spend views skip it
+#   score >= DEDUPE_POSSIBLE_SCORE   recorded as 'possible' for review, still counted
+#
+# The row that arrived first survives. A survivor pairs with at most one suppressed row,
+# so two real $4.50 coffees on one day stay two when both sources report them.
+#
+#   docker compose run --rm pipeline python /app/dedupe.py
+#   docker compose run --rm pipeline python /app/dedupe.py --backfill-days 90   # queue existing rows first
+
+import os, sys, argparse
+
+import psycopg
+
+import metrics
+import merchants
+
+PG_DSN = (
+    f"host={os.environ['POSTGRES_HOST']} "
+    f"port={os.environ['POSTGRES_PORT']} "
+    f"dbname={os.environ['POSTGRES_DB']} "
+    f"user={os.environ['POSTGRES_USER']} "
+    f"password={os.environ['POSTGRES_PASSWORD']}"
+)
+
+WINDOW_DAYS = int(os.getenv("DEDUPE_WINDOW_DAYS", "3"))
+SUPPRESS_SCORE = float(os.getenv("DEDUPE_SUPPRESS_SCORE", "0.6"))
+POSSIBLE_SCORE = float(os.getenv("DEDUPE_POSSIBLE_SCORE", "0.3"))
+BATCH = int(os.getenv("DEDUPE_BATCH", "2000"))
+CANDIDATES = 10  # per queued row, nearest dates first
+
+# queued rows with their counterpart candidates; the lateral is the blocking step
+CANDIDATES_SQL = """
+  select n.id, n.normalized_desc, n.merchant_id, c.id, c.normalized_desc, c.merchant_id,
+         abs(c.posted_at - n.posted_at) as days
+  from (
+    select t.*
+    from tx_keys k
+    -- limit 1 keeps this a per-id probe of one partition; as a plain join the planner
+    -- costs the probe against every partition and hash joins a seq scan instead
+    cross join lateral (
+      select t.id, t.account_id, t.posted_at, t.amount, t.normalized_desc, t.merchant_id, t.hash is null as teller
+      from transactions t
+      where t.id = k.transaction_id and t.posted_at = k.posted_at and t.duplicate_of is null
+      limit 1
+    ) t
+    where k.transaction_id = any(%(ids)s::bigint[])
+  ) n
+  cross join lateral (
+    select c.id, c.posted_at, c.normalized_desc, c.merchant_id
+    from transactions c
+    where c.account_id = n.account_id
+      and c.amount = n.amount
+      and c.posted_at between n.posted_at - %(window)s and n.posted_at + %(window)s
+      and c.id <> n.id
+      and (c.hash is null) <> n.teller
+      and c.duplicate_of is null
+    order by abs(c.posted_at - n.posted_at), c.id
+    limit %(limit)s
+  ) c
+  order by n.id, days, c.id
+"""
+
+
+def _trigrams(name):
+    grams = set()
+    for w in name.split():
+        w = f"  {w} "
+        grams.update(w[i:i + 3] for i in range(len(w) - 2))
+    return grams
+
+
+def score(desc_a, merchant_a, desc_b, merchant_b):
+    """How alike two descriptions of the same amount are, 0..1."""
+    if merchant_a is not None and merchant_a == merchant_b:
+        return 1.0
+    a = merchants.canonical_name(desc_a or "")
+    b = merchants.canonical_name(desc_b or "")
+    if not a or not b:
+        return 0.0
+    ta, tb = _trigrams(a), _trigrams(b)
+    trigram = len(ta & tb) / len(ta | tb)  # pg_trgm's similarity()
+    wa, wb = set(a.split()), set(b.split())
+    overlap = len(wa & wb) / min(len(wa), len(wb))
+    return max(trigram, overlap)
+
+
+def match(cur, ids):
+    """tx_duplicates rows (transaction id, duplicate_of, score, status) for one batch of queued rows."""
+    cur.execute(CANDIDATES_SQL, {"ids": ids, "window": WINDOW_DAYS, "limit": CANDIDATES})
+    by_row = {}
+    for n_id, n_desc, n_merchant, c_id, c_desc, c_merchant, days in cur.fetchall():
+        by_row.setdefault(n_id, []).append((c_id, score(n_desc, n_merchant, c_desc, c_merchant), days))
+    if not by_row:
+        return []
+    # survivors that already have their suppressed counterpart
+    cur.execute("select duplicate_of from tx_duplicates where duplicate_of = any(%s) and status = 'suppressed'",
+                (sorted({c for cands in by_row.values() for c, _, _ in cands} | set(by_row)),))
+    taken = {r[0] for r in cur.fetchall()}
+
+    out = {}  # loser -> row; a sure match beats a possible one
+    for n_id in sorted(by_row):
+        if n_id in taken:
+            continue
+        best = None
+        for c_id, s, days in by_row[n_id]:
+            if c_id in taken or s < POSSIBLE_SCORE:
+                continue
+            if best is None or (s, -days) > (best[1], -best[2]):
+                best = (c_id, s, days)
+        if best is None:
+            continue
+        # the row that arrived first survives
+        loser, keeper = (n_id, best[0]) if n_id > best[0] else (best[0], n_id)
+        if best[1] >= SUPPRESS_SCORE:
+            out[loser] = (loser, keeper, round(best[1], 3), "suppressed")
+            taken.update((loser, keeper))
+        elif loser not in out:
+            out[loser] = (loser, keeper, round(best[1], 3), "possible")
+    return list(out.values())
+
+
+def apply(cur, found):
+    if not found:
+        return
+    cur.execute("""
+      insert into tx_duplicates(transaction_id, duplicate_of, score, status)
+      select * from unnest(%s::bigint[], %s::bigint[], %s::real[], %s::text[])
+      on conflict (transaction_id) do update set
+        duplicate_of = excluded.duplicate_of, score = excluded.score, status = excluded.status, created_at = now()
+      where tx_duplicates.status = 'possible'
+    """, ([f[0] for f in found], [f[1] for f in found], [f[2] for f in found], [f[3] for f in found]))
+    sup = [f for f in found if f[3] == "suppressed"]
+    if not sup:
+        return
+    cur.execute("""
+      update transactions t set duplicate_of = d.duplicate_of, updated_at = now()
+      from tx_duplicates d
+      where d.transaction_id = any(%s) and d.status = 'suppressed'
+        and t.id = d.transaction_id and t.duplicate_of is null
+    """, ([f[0] for f in sup],))
+    # its spend now counts through the survivor. A manual split (no rule: / ml: note) is
+    # the user's call: it moves to the survivor, replacing the survivor's automatic ones,
+    # unless the survivor has a manual split of its own; then it stays with the hidden row.
+    ids = [f[0] for f in sup]
+    cur.execute("""
+      with moved as (
+        update tx_splits s set transaction_id = d.duplicate_of
+        from tx_duplicates d
+        where d.transaction_id = any(%s) and d.status = 'suppressed'
+          and s.transaction_id = d.transaction_id
+          and coalesce(s.note, '') not like 'rule:%%' and coalesce(s.note, '') not like 'ml:%%'
+          and not exists (
+            select 1 from tx_splits m
+            where m.transaction_id = d.duplicate_of
+              and coalesce(m.note, '') not like 'rule:%%' and coalesce(m.note, '') not like 'ml:%%'
+          )
+        returning s.transaction_id
+      )
+      delete from tx_splits s
+      where s.transaction_id in (select transaction_id from moved)
+        and (s.note like 'rule:%%' or s.note like 'ml:%%')
+    """, (ids,))
+    cur.execute("delete from tx_splits where transaction_id = any(%s) and (note like 'rule:%%' or note like 'ml:%%')",
+                (ids,))
+
+
+def backfill(conn, days):
+    """Queue existing rows posted in the last `days` days; returns rows queued."""
+    with conn.cursor() as cur:
+        cur.execute("""
+          insert into tx_dedupe_queue(transaction_id)
+          select t.id from transactions t
+          where t.posted_at >= current_date - %s and t.duplicate_of is null
+          on conflict do nothing
+        """, (days,))
+        n = cur.rowcount
+    conn.commit()
+    return n
+
+
+@metrics.job("dedupe")
+def run(conn):
+    checked = suppressed = possible = 0
+    while True:
+        with conn.cursor() as cur:
+            cur.execute("""
+              select transaction_id from tx_dedupe_queue
+              order by transaction_id
+              limit %s
+              for update skip locked
+            """, (BATCH,))
+            queued = cur.fetchall()
+            if not queued:
+                break
+            ids = [r[0] for r in queued]
+            found = match(cur, ids)
+            apply(cur, found)
+            cur.execute("delete from tx_dedupe_queue where transaction_id = any(%s)", (ids,))
+        conn.commit()
+        checked += len(ids)
+        suppressed += sum(1 for f in found if f[3] == "suppressed")
+        possible += sum(1 for f in found if f[3] == "possible")
+    metrics.count_rows(checked, "checked")
+    metrics.count_rows(suppressed, "suppressed")
+    print(f"[dedupe] checked={checked} suppressed={suppressed} possible={possible}")
+    return suppressed
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Find and suppress cross-source duplicate transactions.")
+    ap.add_argument("--backfill-days", type=int, help="queue existing rows posted in the last N days first")
+    args = ap.parse_args()
+    metrics.set_service("dedupe")
+    try:
+        with psycopg.connect(PG_DSN, autocommit=False, cursor_factory=metrics.TimedCursor) as conn:
+            if args.backfill_days:
+                print(f"[dedupe] queued {backfill(conn, args.backfill_days)} existing row(s)")
+            run(conn)
+    finally:
+        metrics.push()
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        print(f"[dedupe] ERROR: {e}", file=sys.stderr)
+        sys.exit(1)
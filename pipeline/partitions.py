@@ -0,0 +1,33 @@
+# partitions.py
+# Keeps monthly transactions partitions ahead of the calendar (0017_partition_transactions.sql).
+# Rows for a month with no partition land in transactions_default; the maintenance function
+# splits them out into their own partition the next time this runs.
+
+import os
+import psycopg
+
+PG_DSN = (
+    f"host={os.environ['POSTGRES_HOST']} "
+    f"port={os.environ['POSTGRES_PORT']} "
+    f"dbname={os.environ['POSTGRES_DB']} "
+    f"user={os.environ['POSTGRES_USER']} "
+    f"password={os.environ['POSTGRES_PASSWORD']}"
+)
+
+MONTHS_AHEAD = int(os.getenv("TX_PARTITION_MONTHS_AHEAD", "3"))
+
+def run(conn):
+    with conn.cursor() as cur:
+        cur.execute("select tx_partition_maintenance(%s)", (MONTHS_AHEAD,))
+        created = cur.fetchone()[0]
+        cur.execute("select count(*) from transactions_default")
+        stray = cur.fetchone()[0]
+    print(f"[partitions] created={created} default_rows={stray}")
+    return created
+
+def main():
+    with psycopg.connect(PG_DSN, autocommit=True) as conn:
+        run(conn)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+# reconcile.py
+# Reconciliation against the bank's own balances (0028_reconciliation.sql). An account's
+# anchors are the days the bank reported a closing balance (daily_balances.reported) and
+# its statements' closing balances (statement_balances). Between two consecutive
+# anchors, the opening one plus the day nets in between has to come to the closing one;
+# an interval that doesn't is a break, reported as the days it covers.
+#
+# Writes to daily_balances and statement_balances queue the day ranges they touched in
+# reconcile_queue. For each queued account this stage widens the range to the anchors
+# either side of it and runs one pass of window functions over that range of
+# daily_balances' primary key. Intervals nothing touched are not looked at again.
+#
+#   a break's interval has a row of exactly -difference   'duplicated' (likely one row too many)
+#   otherwise                                            'missing'
+#
+# A new break on a Teller-linked account queues a teller_jobs window over its days,
+# once, within RECONCILE_REFETCH_DAYS. The refetched rows come back through balances
+# and the queue, and the recheck resolves the break.
+#
+#   docker compose run --rm pipeline python /app/reconcile.py
+#   docker compose run --rm pipeline python /app/reconcile.py --all   # every account, whole history
+
+import os, sys, argparse
+
+import psycopg
+
+import metrics
+
+PG_DSN = (
+    f"host={os.environ['POSTGRES_HOST']} "
+    f"port={os.environ['POSTGRES_PORT']} "
+    f"dbname={os.environ['POSTGRES_DB']} "
+    f"user={os.environ['POSTGRES_USER']} "
+    f"password={os.environ['POSTGRES_PASSWORD']}"
+)
+
+REFETCH_DAYS = int(os.getenv("RECONCILE_REFETCH_DAYS", "365"))  # older breaks are only reported
+BATCH = int(os.getenv("RECONCILE_BATCH", "1000"))
+
+# the anchors either side of each queued range: an anchor on last_day opens the next interval
+BOUNDS_SQL = """
+  select q.account_id,
+         coalesce(greatest(lo_d.day, lo_s.as_of), q.first_day) as lo,
+         coalesce(least(hi_d.day, hi_s.as_of), q.last_day) as hi
+  from unnest(%(accounts)s::bigint[], %(first)s::date[], %(last)s::date[]) as q(account_id, first_day, last_day)
+  left join lateral (
+    select d.day from daily_balances d
+    where d.account_id = q.account_id and d.reported is not null and d.day < q.first_day
+    order by d.day desc limit 1
+  ) lo_d on true
+  left join lateral (
+    select s.as_of from statement_balances s
+    where s.account_id = q.account_id and s.as_of < q.first_day
+    order by s.as_of desc limit 1
+  ) lo_s on true
+  left join lateral (
+    select d.day from daily_balances d
+    where d.account_id = q.account_id and d.reported is not null and d.day > q.last_day
+    order by d.day limit 1
+  ) hi_d on true
+  left join lateral (
+    select s.as_of from statement_balances s
+    where s.account_id = q.account_id and s.as_of > q.last_day
+    order by s.as_of limit 1
+  ) hi_s on true
+"""
+
+# consecutive anchors within each range whose interval doesn't add up; statement rows sort
+# after the day's transactions and carry no net. A statement closes its day, a reported
+# balance_after may not (later rows that day can be the missing ones), so the interval
+# starts on the opening day for those.
+CHECK_SQL = """
+  with b as (
+    select * from unnest(%(accounts)s::bigint[], %(lo)s::date[], %(hi)s::date[]) as b(account_id, lo, hi)
+  ), points as (
+    select d.account_id, d.day, 0 as ord, d.net, d.reported, 'transaction' as source
+    from b join daily_balances d on d.account_id = b.account_id and d.day between b.lo and b.hi
+    union all
+    select s.account_id, s.as_of, 1, 0, s.balance, 'statement'
+    from b join statement_balances s on s.account_id = b.account_id and s.as_of between b.lo and b.hi
+  ), running as (
+    select *, sum(net) over (partition by account_id order by day, ord rows unbounded preceding) as cum
+    from points
+  ), pairs as (
+    select account_id, day, reported, source, cum,
+           lag(day) over w as open_day, lag(reported) over w as open_balance,
+           lag(source) over w as open_source, lag(cum) over w as open_cum
+    from running
+    where reported is not null
+    window w as (partition by account_id order by day, ord)
+  )
+  select account_id,
+         case when open_source = 'statement' then least(open_day + 1, day) else open_day end as start_day,
+         day as end_day, open_source, source,
+         open_balance + cum - open_cum as expected, reported
+  from pairs
+  where open_day is not null and open_balance + cum - open_cum <> reported
+  order by account_id, day
+"""
+
+# which breaks have a row of exactly -difference in their interval
+DUPLICATED_SQL = """
+  select f.ord
+  from unnest(%s::bigint[], %s::date[], %s::date[], %s::numeric[]) with ordinality as f(account_id, start_day, end_day, difference, ord)
+  where exists (
+    select 1 from transactions t
+    where t.account_id = f.account_id
+      and t.posted_at between f.start_day and f.end_day
+      and t.amount = -f.difference
+      and t.duplicate_of is null
+  )
+"""
+
+
+def check(cur, ranges):
+    """
+    Breaks in the intervals around ranges {account_id: (first_day, last_day)}.
+    Returns (bounds {account_id: (lo, hi)}, [(account_id, start_day, end_day,
+    opening_source, closing_source, expected, reported, difference, kind)]).
+    """
+    accounts = list(ranges)
+    cur.execute(BOUNDS_SQL, {"accounts": accounts, "first": [ranges[a][0] for a in accounts],
+                             "last": [ranges[a][1] for a in accounts]})
+    bounds = {a: (lo, hi) for a, lo, hi in cur.fetchall()}
+    cur.execute(CHECK_SQL, {"accounts": accounts, "lo": [bounds[a][0] for a in accounts],
+                            "hi": [bounds[a][1] for a in accounts]})
+    found = [r + (r[6] - r[5],) for r in cur.fetchall()]
+    dup = set()
+    if found:
+        cur.execute(DUPLICATED_SQL, ([f[0] for f in found], [f[1] for f in found], [f[2] for f in found],
+                                     [f[7] for f in found]))
+        dup = {r[0] - 1 for r in cur.fetchall()}
+    return bounds, [f + ("duplicated" if i in dup else "missing",) for i, f in enumerate(found)]
+
+
+def apply(cur, bounds, found):
+    """Record found breaks, resolve the open ones in the checked ranges that are gone; returns (new ids, resolved)."""
+    new = []
+    if found:
+        cur.execute("""
+          insert into reconciliation_breaks(account_id, start_day, end_day, opening_source, closing_source,
+                                            expected, reported, difference, kind)
+          select * from unnest(%s::bigint[], %s::date[], %s::date[], %s::text[], %s::text[],
+                               %s::numeric[], %s::numeric[], %s::numeric[], %s::text[])
+          on conflict (account_id, start_day, end_day) where status = 'open' do update set
+            opening_source = excluded.opening_source, closing_source = excluded.closing_source,
+            expected = excluded.expected, reported = excluded.reported, difference = excluded.difference,
+            kind = excluded.kind, checked_at = now()
+          returning id, (xmax = 0) as inserted
+        """, tuple(list(col) for col in zip(*found)))
+        new = [r[0] for r in cur.fetchall() if r[1]]
+    accounts = list(bounds)
+    cur.execute("""
+      update reconciliation_breaks r set status = 'resolved', resolved_at = now(), checked_at = now()
+      from unnest(%s::bigint[], %s::date[], %s::date[]) as b(account_id, lo, hi)
+      where r.account_id = b.account_id and r.status = 'open'
+        and r.end_day > b.lo and r.end_day <= b.hi
+        and (r.account_id, r.start_day, r.end_day) not in (
+          select * from unnest(%s::bigint[], %s::date[], %s::date[]))
+    """, (accounts, [bounds[a][0] for a in accounts], [bounds[a][1] for a in accounts],
+          [f[0] for f in found], [f[1] for f in found], [f[2] for f in found]))
+    return new, cur.rowcount
+
+
+def refetch(cur, ids):
+    """Queue a Teller refetch of each new break's days (linked accounts, recent enough); returns jobs queued."""
+    if not ids:
+        return 0
+    cur.execute("""
+      with j as (
+        insert into teller_jobs(provider_account_id, account_api_id, start_date, end_date, enqueue_reason, run_after)
+        select pa.id, pa.teller_account_id, r.start_day, r.end_day, 'reconcile', now()
+        from reconciliation_breaks r
+        join provider_accounts pa on pa.account_id = r.account_id
+        where r.id = any(%s) and r.end_day >= current_date - %s
+        on conflict do nothing
+        returning id, provider_account_id, start_date, end_date
+      )
+      update reconciliation_breaks r set teller_job_id = j.id
+      from j join provider_accounts pa on pa.id = j.provider_account_id
+      where r.id = any(%s) and r.account_id = pa.account_id
+        and r.start_day = j.start_date and r.end_day = j.end_date
+    """, (ids, REFETCH_DAYS, ids))
+    return cur.rowcount
+
+
+def queue_all(conn):
+    """Queue every account's whole history; returns accounts queued."""
+    with conn.cursor() as cur:
+        cur.execute("""
+          insert into reconcile_queue(account_id, first_day, last_day)
+          select account_id, min(day), max(day) from (
+            select account_id, day from daily_balances where reported is not null
+            union all
+            select account_id, as_of from statement_balances
+          ) a
+          group by account_id
+        """)
+        n = cur.rowcount
+    conn.commit()
+    return n
+
+
+@metrics.job("reconcile")
+def run(conn):
+    checked = accounts = breaks = resolved = refetched = 0
+    while True:
+        with conn.cursor() as cur:
+            cur.execute("""
+              select id, account_id, first_day, last_day from reconcile_queue
+              order by id
+              limit %s
+              for update skip locked
+            """, (BATCH,))
+            queued = cur.fetchall()
+            if not queued:
+                break
+            ranges = {}
+            for _, account_id, first, last in queued:
+                lo, hi = ranges.get(account_id, (first, last))
+                ranges[account_id] = (min(lo, first), max(hi, last))
+            bounds, found = check(cur, ranges)
+            new, r = apply(cur, bounds, found)
+            refetched += refetch(cur, new)
+            cur.execute("delete from reconcile_queue where id = any(%s)", ([q[0] for q in queued],))
+        conn.commit()
+        checked += len(queued)
+        accounts += len(ranges)
+        breaks += len(new)
+        resolved += r
+    with conn.cursor() as cur:
+        cur.execute("select count(*) from reconciliation_breaks where status = 'open'")
+        still_open = cur.fetchone()[0]
+    conn.commit()
+    metrics.count_rows(checked, "checked")
+    metrics.count_rows(breaks, "breaks")
+    print(f"[reconcile] checked={checked} accounts={accounts} breaks={breaks} resolved={resolved} "
+          f"refetch={refetched} open={still_open}")
+    return breaks + resolved
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Reconcile transactions against reported and statement balances.")
+    ap.add_argument("--all", action="store_true", help="queue every account's whole history first")
+    args = ap.parse_args()
+    metrics.set_service("reconcile")
+    try:
+        with psycopg.connect(PG_DSN, autocommit=False, cursor_factory=metrics.TimedCursor) as conn:
+            if args.all:
+                print(f"[reconcile] queued {queue_all(conn)} account(s)")
+            run(conn)
+    finally:
+        metrics.push()
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        print(f"[reconcile] ERROR: {e}", file=sys.stderr)
+        sys.exit(1)
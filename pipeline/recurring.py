@@ -0,0 +1,297 @@
+# recurring.py
+# Recurring payments and subscriptions (0026_recurring_series.sql). Every inserted
+# transaction lands in tx_recurring_queue. This stage maps the queued rows to their
+# groups: (account, merchant_id), or (account, normalized_desc) when no merchant was
+# resolved. It reads only those groups' outflows from the last RECURRING_LOOKBACK_DAYS
+# (at most RECURRING_GROUP_MAX of the latest) and replaces their recurring_series rows.
+# Groups nothing new arrived in are not touched, so a run costs the same however much
+# history there is.
+#
+# In a group, charges are clustered by amount: each cluster spans at most
+# RECURRING_AMOUNT_TOLERANCE above its smallest charge, so a price rise stays in the
+# series. A cluster is a series when
+#   * it has at least RECURRING_MIN_OCCURRENCES charges (one per day), twice that
+#     when fewer than half of them are the same amount (a utility bill, or chance),
+#   * the median gap between them is within a cadence's tolerance (weekly, biweekly,
+#     monthly, quarterly, annual),
+#   * at least RECURRING_MIN_REGULAR of the gaps are a whole number of periods (a
+#     skipped month still counts), and
+#   * the charges fill at least RECURRING_MIN_REGULAR of the periods they span.
+# The next charge is expected one period after the last one (calendar months for
+# monthly and longer), at the last amount. A series goes inactive when that date is
+# more than half a period overdue; every run re-checks that, queue or not.
+#
+#   docker compose run --rm pipeline python /app/recurring.py
+#   docker compose run --rm pipeline python /app/recurring.py --backfill-days 1100   # queue existing rows first
+
+import os, sys, argparse
+from datetime import date, timedelta
+from calendar import monthrange
+
+import psycopg
+
+import metrics
+# numpy is imported inside detect(): the pipeline daemon imports this module at startup
+
+PG_DSN = (
+    f"host={os.environ['POSTGRES_HOST']} "
+    f"port={os.environ['POSTGRES_PORT']} "
+    f"dbname={os.environ['POSTGRES_DB']} "
+    f"user={os.environ['POSTGRES_USER']} "
+    f"password={os.environ['POSTGRES_PASSWORD']}"
+)
+
+LOOKBACK_DAYS = int(os.getenv("RECURRING_LOOKBACK_DAYS", "1100"))  # three annual charges
+AMOUNT_TOLERANCE = float(os.getenv("RECURRING_AMOUNT_TOLERANCE", "0.15"))
+MIN_OCCURRENCES = int(os.getenv("RECURRING_MIN_OCCURRENCES", "3"))
+MIN_REGULAR = float(os.getenv("RECURRING_MIN_REGULAR", "0.75"))
+GROUP_MAX = int(os.getenv("RECURRING_GROUP_MAX", "400"))  # latest charges read per group
+BATCH = int(os.getenv("RECURRING_BATCH", "2000"))
+
+# name, period in days, tolerance in days, months added for the next date (0 = add days)
+CADENCES = (
+    ("weekly", 7.0, 1.0, 0),
+    ("biweekly", 14.0, 2.0, 0),
+    ("monthly", 30.44, 4.0, 1),
+    ("quarterly", 91.31, 10.0, 3),
+    ("annual", 365.25, 20.0, 12),
+)
+
+# the groups queued rows belong to; same per-id probe as dedupe.py
+GROUPS_SQL = """
+  select distinct t.account_id, t.merchant_id, case when t.merchant_id is null then t.normalized_desc end
+  from tx_keys k
+  cross join lateral (
+    select t.account_id, t.merchant_id, t.normalized_desc
+    from transactions t
+    where t.id = k.transaction_id and t.posted_at = k.posted_at and t.amount < 0
+    limit 1
+  ) t
+  where k.transaction_id = any(%(ids)s::bigint[])
+"""
+
+# a group's latest outflows that aren't suppressed duplicates or transfer legs
+HISTORY_TAIL = """
+      and t.posted_at >= %(since)s::date
+      and t.amount < 0
+      and t.duplicate_of is null
+      and t.transfer_of is null
+    order by t.posted_at desc, t.id desc
+    limit %(limit)s
+"""
+
+MERCHANT_HISTORY_SQL = """
+  select g.ord, t.id, t.posted_at, t.amount, t.normalized_desc
+  from unnest(%(accounts)s::bigint[], %(keys)s::bigint[]) with ordinality as g(account_id, merchant_id, ord)
+  cross join lateral (
+    select t.id, t.posted_at, t.amount, t.normalized_desc
+    from transactions t
+    where t.merchant_id = g.merchant_id
+      and t.account_id = g.account_id""" + HISTORY_TAIL + """  ) t
+  order by g.ord, t.posted_at, t.id
+"""
+
+DESC_HISTORY_SQL = """
+  select g.ord, t.id, t.posted_at, t.amount, t.normalized_desc
+  from unnest(%(accounts)s::bigint[], %(keys)s::text[]) with ordinality as g(account_id, normalized_desc, ord)
+  cross join lateral (
+    select t.id, t.posted_at, t.amount, t.normalized_desc
+    from transactions t
+    where t.merchant_id is null
+      and t.normalized_desc = g.normalized_desc
+      and t.account_id = g.account_id""" + HISTORY_TAIL + """  ) t
+  order by g.ord, t.posted_at, t.id
+"""
+
+
+def add_months(d, n):
+    y, m = divmod(d.year * 12 + d.month - 1 + n, 12)
+    return date(y, m + 1, min(d.day, monthrange(y, m + 1)[1]))
+
+
+def detect(history):
+    """
+    Series in one group's history, [(id, posted_at, amount, normalized_desc)] in date
+    order. Returns dicts in recurring_series' terms (no account / key).
+    """
+    import numpy as np
+    if len(history) < MIN_OCCURRENCES:
+        return []
+    days = np.array([h[1].toordinal() for h in history], dtype=np.int64)
+    charges = np.array([-float(h[2]) for h in history])
+    order = np.argsort(charges, kind="stable")
+    sorted_charges = charges[order]
+
+    found = []
+    start = 0
+    while start < len(order):
+        # one cluster: every charge within AMOUNT_TOLERANCE above the smallest
+        end = int(np.searchsorted(sorted_charges, sorted_charges[start] * (1 + AMOUNT_TOLERANCE) + 0.005, "right"))
+        idx = np.sort(order[start:end])  # back to date order
+        start = end
+        idx = idx[np.concatenate(([True], np.diff(days[idx]) > 0))]  # one charge per day
+        if len(idx) < MIN_OCCURRENCES:
+            continue
+        _, same = np.unique(np.round(charges[idx], 2), return_counts=True)
+        fixed = same.max() * 2 >= len(idx)
+        if not fixed and len(idx) < 2 * MIN_OCCURRENCES:
+            continue
+        gaps = np.diff(days[idx]).astype(float)
+        median_gap = float(np.median(gaps))
+        for name, period, tol, months in CADENCES:
+            if abs(median_gap - period) <= tol:
+                break
+        else:
+            continue
+        periods = np.maximum(np.rint(gaps / period), 1)
+        regular = np.abs(gaps - periods * period) <= tol
+        share = float(regular.mean())
+        coverage = len(idx) / (periods.sum() + 1)
+        if share < MIN_REGULAR or coverage < MIN_REGULAR or int((regular & (periods == 1)).sum()) < MIN_OCCURRENCES - 1:
+            continue
+        first, last = history[idx[0]], history[idx[-1]]
+        next_expected = add_months(last[1], months) if months else last[1] + timedelta(days=int(period))
+        found.append({
+            "normalized_desc": last[3],
+            "cadence": name,
+            "period_days": round(median_gap, 2),
+            "amount": -round(float(np.median(charges[idx])), 2),
+            "occurrences": len(idx),
+            "first_posted_at": first[1],
+            "last_posted_at": last[1],
+            "last_transaction_id": last[0],
+            "next_expected": next_expected,
+            "next_amount": last[2],
+            "confidence": round(share * coverage * min(1.0, len(idx) / 6), 3),
+            "active": date.today() <= next_expected + timedelta(days=int(np.ceil(median_gap / 2))),  # as expire()
+        })
+    return found
+
+
+def _histories(cur, sql, groups, since):
+    """{group index: [(id, posted_at, amount, normalized_desc)]} for one kind of group."""
+    if not groups:
+        return {}
+    cur.execute(sql, {"accounts": [g[0] for g in groups], "keys": [g[1] for g in groups], "since": since,
+                      "limit": GROUP_MAX})
+    out = {}
+    for ord_, tx_id, posted_at, amount, desc in cur.fetchall():
+        out.setdefault(ord_ - 1, []).append((tx_id, posted_at, amount, desc))
+    return out
+
+
+def refresh(cur, ids):
+    """Recompute the series of every group the queued ids belong to; returns (groups, series)."""
+    cur.execute(GROUPS_SQL, {"ids": ids})
+    by_merchant, by_desc = [], []
+    for account_id, merchant_id, desc in cur.fetchall():
+        if merchant_id is not None:
+            by_merchant.append((account_id, merchant_id))
+        elif desc:
+            by_desc.append((account_id, desc))
+    if not by_merchant and not by_desc:
+        return 0, 0
+    since = date.today() - timedelta(days=LOOKBACK_DAYS)
+
+    rows = []
+    for groups, sql, prefix in ((by_merchant, MERCHANT_HISTORY_SQL, "m"), (by_desc, DESC_HISTORY_SQL, "d")):
+        for i, history in _histories(cur, sql, groups, since).items():
+            account_id, key = groups[i]
+            merchant_id = key if prefix == "m" else None
+            for s in detect(history):
+                rows.append((account_id, f"{prefix}:{key}", merchant_id, s["normalized_desc"], s["cadence"],
+                             s["period_days"], s["amount"], s["occurrences"], s["first_posted_at"],
+                             s["last_posted_at"], s["last_transaction_id"], s["next_expected"],
+                             s["next_amount"], s["confidence"], s["active"]))
+
+    keys = [(a, f"m:{m}") for a, m in by_merchant] + [(a, f"d:{d}") for a, d in by_desc]
+    cur.execute("""
+      delete from recurring_series r
+      using unnest(%s::bigint[], %s::text[]) as g(account_id, series_key)
+      where r.account_id = g.account_id and r.series_key = g.series_key
+    """, ([k[0] for k in keys], [k[1] for k in keys]))
+    if rows:
+        cur.executemany("""
+          insert into recurring_series(account_id, series_key, merchant_id, normalized_desc, cadence,
+                                       period_days, amount, occurrences, first_posted_at, last_posted_at,
+                                       last_transaction_id, next_expected, next_amount, confidence, active)
+          values (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        """, rows)
+    return len(keys), len(rows)
+
+
+def expire(cur):
+    """Series whose next charge is over half a period late; returns how many went inactive."""
+    cur.execute("""
+      update recurring_series set active = false, updated_at = now()
+      where active and next_expected + ceil(period_days / 2)::int < current_date
+    """)
+    return cur.rowcount
+
+
+def backfill(conn, days):
+    """Queue existing rows posted in the last `days` days; returns rows queued."""
+    with conn.cursor() as cur:
+        cur.execute("""
+          insert into tx_recurring_queue(transaction_id)
+          select t.id from transactions t
+          where t.posted_at >= current_date - %s and t.amount < 0
+          on conflict do nothing
+        """, (days,))
+        n = cur.rowcount
+    conn.commit()
+    return n
+
+
+@metrics.job("recurring")
+def run(conn):
+    checked = groups = series = 0
+    while True:
+        with conn.cursor() as cur:
+            cur.execute("""
+              select transaction_id from tx_recurring_queue
+              order by transaction_id
+              limit %s
+              for update skip locked
+            """, (BATCH,))
+            queued = cur.fetchall()
+            if not queued:
+                break
+            ids = [r[0] for r in queued]
+            g, s = refresh(cur, ids)
+            cur.execute("delete from tx_recurring_queue where transaction_id = any(%s)", (ids,))
+        conn.commit()
+        checked += len(ids)
+        groups += g
+        series += s
+    with conn.cursor() as cur:
+        expired = expire(cur)
+    conn.commit()
+    metrics.count_rows(checked, "checked")
+    metrics.count_rows(series, "series")
+    print(f"[recurring] checked={checked} groups={groups} series={series} expired={expired}")
+    return series
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Detect recurring payments and subscriptions.")
+    ap.add_argument("--backfill-days", type=int, help="queue existing rows posted in the last N days first")
+    args = ap.parse_args()
+    metrics.set_service("recurring")
+    try:
+        with psycopg.connect(PG_DSN, autocommit=False, cursor_factory=metrics.TimedCursor) as conn:
+            if args.backfill_days:
+                print(f"[recurring] queued {backfill(conn, args.backfill_days)} existing row(s)")
+            run(conn)
+    finally:
+        metrics.push()
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        print(f"[recurring] ERROR: {e}", file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,78 @@
+from datetime import date
+from decimal import Decimal as D
+
+from balances import closing, walk
+
+D1, D2, D3, D4 = (date(2025, 3, d) for d in (1, 2, 3, 4))
+
+
+def test_closing_no_reported_rows():
+    assert closing(None, None) is None
+    assert closing([], []) is None
+
+
+def test_closing_rows_out_of_id_order():
+    # posted 100 -> 90 -> 85 -> 65, but paged newest first so the ids run backwards
+    assert closing([D(-20), D(-5), D(-10)], [D(65), D(85), D(90)]) == D(65)
+    assert closing([D(-5), D(-20), D(-10)], [D(85), D(65), D(90)]) == D(65)
+
+
+def test_closing_zero_amount_rows():
+    # a zero row after the last charge repeats the closing balance
+    assert closing([D(0), D(-20), D(-10)], [D(70), D(70), D(90)]) == D(70)
+    # and one before the first charge repeats the opening one
+    assert closing([D(-10), D(0), D(-20)], [D(90), D(100), D(70)]) == D(70)
+
+
+def test_closing_ambiguous_day_takes_the_last_row():
+    # two rows from the same opening balance: either could have posted last
+    assert closing([D(-10), D(-20)], [D(90), D(80)]) == D(80)
+    assert closing([D(-20), D(-10)], [D(80), D(90)]) == D(90)
+    # a charge and its refund: each continues from the other
+    assert closing([D(10), D(-10)], [D(110), D(100)]) == D(100)
+
+
+def test_walk_from_an_anchored_balance():
+    rows, shift = walk((D(100), True), [(D1, D(-10), 1, None), (D2, D(-5), 2, None)])
+    assert rows == [(D1, D(90), D(-10), 1, True, None), (D2, D(85), D(-5), 2, True, None)]
+    assert shift == 0
+
+
+def test_walk_reported_balance_wins_over_the_carried_one():
+    rows, shift = walk((D(100), True), [(D1, D(-10), 1, D(80)), (D2, D(-5), 1, None)])
+    assert [r[1] for r in rows] == [D(80), D(75)]
+    # only the first reported balance moves the days before it
+    assert shift == 0
+
+
+def test_walk_first_reported_balance_after_unanchored_days():
+    rows, shift = walk(None, [(D1, D(-10), 1, None), (D2, D(-5), 1, None), (D3, D(-20), 1, D(65))])
+    assert shift == D(100)
+    assert rows == [
+        (D1, D(90), D(-10), 1, False, None),
+        (D2, D(85), D(-5), 1, False, None),
+        (D3, D(65), D(-20), 1, True, D(65)),
+    ]
+
+
+def test_walk_unanchored_prev_shifts_the_stored_days_too():
+    # stored: day before D1 at -15 (relative), then D1 brings the first report
+    rows, shift = walk((D(-15), False), [(D1, D(-20), 1, D(65))])
+    assert rows == [(D1, D(65), D(-20), 1, True, D(65))]
+    assert shift == D(100)  # refresh() adds it to every stored day before D1
+
+
+def test_walk_backdated_row_before_the_first_anchor():
+    # stored 80 / 70 / 65 (anchored on D3); a -3 row lands on D2, which is queued from D2
+    rows, shift = walk((D(80), False), [(D2, D(-13), 2, None), (D3, D(-5), 1, D(65))])
+    assert [r[1] for r in rows] == [D(70), D(65)]
+    assert shift == D(3)  # D1 becomes 83: the new row was spent before D3 closed at 65
+    # the same row on an account walked from its first day
+    rows, shift = walk(None, [(D1, D(-7), 1, None), (D2, D(-13), 2, None), (D3, D(-5), 1, D(65))])
+    assert [r[1] for r in rows] == [D(83), D(70), D(65)]
+
+
+def test_walk_backdated_row_after_the_anchor_carries_forward():
+    rows, shift = walk((D(65), True), [(D3, D(-8), 2, None), (D4, D(0), 0, None)])
+    assert [r[1] for r in rows] == [D(57), D(57)]
+    assert shift == 0
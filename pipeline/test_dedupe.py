@@ -0,0 +1,105 @@
+from conftest import FakeCursor
+from dedupe import POSSIBLE_SCORE, SUPPRESS_SCORE, apply, score, match
+
+
+def test_score_same_merchant():
+    assert score("SQ *BLUE BOTTLE", 7, "ANYTHING ELSE", 7) == 1.0
+
+
+def test_score_compares_canonical_names():
+    # store numbers and card prefixes don't count; one name inside the other is a sure match
+    assert score("STARBUCKS STORE 123", None, "STARBUCKS", None) == 1.0
+    assert score("SQ *BLUE BOTTLE #0412 OAKLAND CA", None, "BLUE BOTTLE COFFEE", None) >= SUPPRESS_SCORE
+    assert POSSIBLE_SCORE <= score("COSTCO WHSE", None, "COSTCO GAS", None) < SUPPRESS_SCORE
+    assert score("CHEVRON 0012", None, "SHELL OIL 57", None) == 0.0
+
+
+def test_score_missing_description():
+    assert score("", None, "STARBUCKS", None) == 0.0
+    assert score(None, None, None, None) == 0.0
+
+
+def test_score_different_merchants_fall_back_to_names():
+    assert score("STARBUCKS", 1, "STARBUCKS #12", 2) == 1.0
+
+
+def test_match_suppresses_the_later_row():
+    cur = FakeCursor([(20, "STARBUCKS STORE 123", None, 10, "STARBUCKS", None, 1)], [])
+    assert match(cur, [20]) == [(20, 10, 1.0, "suppressed")]
+    cur = FakeCursor([(10, "STARBUCKS", None, 20, "STARBUCKS STORE 123", None, 1)], [])
+    assert match(cur, [10]) == [(20, 10, 1.0, "suppressed")]
+
+
+def test_match_possible_and_no_match():
+    cur = FakeCursor([(20, "COSTCO WHSE", None, 10, "COSTCO GAS", None, 0),
+                      (21, "CHEVRON 0012", None, 11, "SHELL OIL 57", None, 0)], [])
+    assert match(cur, [20, 21]) == [(20, 10, 0.5, "possible")]
+
+
+def test_match_without_candidates_reads_nothing_else():
+    cur = FakeCursor([])
+    assert match(cur, [20]) == []
+    assert len(cur.executed) == 1
+
+
+def test_match_best_score_then_nearest_day():
+    cur = FakeCursor([(20, "COSTCO WHSE", None, 11, "COSTCO GAS", None, 0),
+                      (20, "COSTCO WHSE", None, 12, "COSTCO WHSE", None, 2),
+                      (20, "COSTCO WHSE", None, 13, "COSTCO WHSE", None, 1)], [])
+    assert match(cur, [20]) == [(20, 13, 1.0, "suppressed")]
+
+
+def test_match_skips_survivors_already_paired():
+    # 10 already has its suppressed duplicate, so 20 pairs with 11
+    cur = FakeCursor([(20, "STARBUCKS", None, 10, "STARBUCKS", None, 0),
+                      (20, "STARBUCKS", None, 11, "STARBUCKS", None, 2)], [(10,)])
+    assert match(cur, [20]) == [(20, 11, 1.0, "suppressed")]
+
+
+def test_match_one_pair_per_row():
+    # both legs queued, and a third copy that would pair with the same survivor
+    cur = FakeCursor([(10, "STARBUCKS", None, 20, "STARBUCKS", None, 0),
+                      (20, "STARBUCKS", None, 10, "STARBUCKS", None, 0),
+                      (30, "STARBUCKS", None, 10, "STARBUCKS", None, 1)], [])
+    assert match(cur, [10, 20, 30]) == [(20, 10, 1.0, "suppressed")]
+
+
+def pair(cur):
+    cur.execute("insert into accounts(name, type) values ('Dedupe', 'checking') returning id")
+    account_id = cur.fetchone()[0]
+    cur.execute("""
+      insert into transactions(account_id, posted_at, amount, currency, description, external_tx_id, hash)
+      values (%s, current_date, -4.50, 'USD', 'BLUE BOTTLE', 'txn_dedupe_1', null),
+             (%s, current_date, -4.50, 'USD', 'SQ *BLUE BOTTLE', null, '\\x02')
+      returning id
+    """, (account_id, account_id))
+    return [r[0] for r in cur.fetchall()]
+
+
+def splits(cur, *rows):
+    cur.executemany("insert into tx_splits(transaction_id, amount, note) values (%s, -4.50, %s)", rows)
+
+
+def split_notes(cur, transaction_id):
+    cur.execute("select note from tx_splits where transaction_id = %s order by note nulls first", (transaction_id,))
+    return [r[0] for r in cur.fetchall()]
+
+
+def test_apply_moves_manual_splits_to_the_survivor(db):
+    with db.cursor() as cur:
+        survivor, dup = pair(cur)
+        splits(cur, (survivor, "rule:7"), (dup, "ml:0.91"), (dup, None), (dup, "lunch with Sam"))
+        apply(cur, [(dup, survivor, 1.0, "suppressed")])
+        assert split_notes(cur, dup) == []
+        assert split_notes(cur, survivor) == [None, "lunch with Sam"]
+        cur.execute("select duplicate_of from transactions where id = %s", (dup,))
+        assert cur.fetchone()[0] == survivor
+
+
+def test_apply_keeps_the_survivors_own_manual_split(db):
+    with db.cursor() as cur:
+        survivor, dup = pair(cur)
+        splits(cur, (survivor, "mine"), (dup, "rule:7"), (dup, "theirs"))
+        apply(cur, [(dup, survivor, 1.0, "suppressed")])
+        assert split_notes(cur, survivor) == ["mine"]
+        assert split_notes(cur, dup) == ["theirs"]
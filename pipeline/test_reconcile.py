@@ -0,0 +1,107 @@
+from datetime import date, timedelta
+from decimal import Decimal as D
+
+from conftest import teller_account
+from reconcile import REFETCH_DAYS, apply, check, refetch
+
+TODAY = date.today()
+D0, D1, D2 = (TODAY - timedelta(days=n) for n in (10, 9, 8))
+
+
+def plain_account(cur):
+    cur.execute("insert into accounts(name, type) values ('Statement only', 'checking') returning id")
+    return cur.fetchone()[0]
+
+
+def days(cur, account_id, rows):
+    """daily_balances rows [(day, net, reported)]; balance is whatever the walk would say."""
+    bal = D(0)
+    for day, net, reported in rows:
+        bal = reported if reported is not None else bal + net
+        cur.execute("""
+          insert into daily_balances(account_id, day, balance, net, tx_count, anchored, reported)
+          values (%s, %s, %s, %s, 1, true, %s)
+        """, (account_id, day, bal, net, reported))
+
+
+def one_break(cur, account_id, first=D0, last=D2):
+    bounds, found = check(cur, {account_id: (first, last)})
+    new, resolved = apply(cur, bounds, found)
+    return found, new, resolved
+
+
+def test_check_finds_a_missing_row(db):
+    with db.cursor() as cur:
+        account_id = plain_account(cur)
+        # 100 reported on D0, then -20 and -10 of rows, but the bank says 50 on D2
+        days(cur, account_id, [(D0, D(0), D(100)), (D1, D(-20), None), (D2, D(-10), D(50))])
+        bounds, found = check(cur, {account_id: (D1, D1)})
+    assert bounds == {account_id: (D0, D2)}
+    assert found == [(account_id, D0, D2, "transaction", "transaction", D(70), D(50), D(-20), "missing")]
+
+
+def test_check_clean_interval(db):
+    with db.cursor() as cur:
+        account_id = plain_account(cur)
+        days(cur, account_id, [(D0, D(0), D(100)), (D1, D(-20), None), (D2, D(-10), D(70))])
+        assert check(cur, {account_id: (D0, D2)})[1] == []
+
+
+def test_check_duplicated_row(db):
+    with db.cursor() as cur:
+        account_id = plain_account(cur)
+        cur.execute("""
+          insert into transactions(account_id, posted_at, amount, currency, description, hash)
+          values (%s, %s, -20, 'USD', 'COFFEE', '\\x01')
+        """, (account_id, D1))
+        days(cur, account_id, [(D0, D(0), D(100)), (D1, D(-40), None), (D2, D(0), D(80))])
+        found = check(cur, {account_id: (D0, D2)})[1]
+    assert [(f[7], f[8]) for f in found] == [(D(20), "duplicated")]
+
+
+def test_apply_records_once_and_resolves(db):
+    with db.cursor() as cur:
+        account_id = plain_account(cur)
+        days(cur, account_id, [(D0, D(0), D(100)), (D1, D(-20), None), (D2, D(-10), D(50))])
+        found, new, resolved = one_break(cur, account_id)
+        assert len(new) == 1 and resolved == 0
+        # the same break on a recheck is not new
+        assert one_break(cur, account_id)[1:] == ([], 0)
+        # the missing -20 turned up
+        cur.execute("update daily_balances set net = -40 where account_id = %s and day = %s", (account_id, D1))
+        found, new, resolved = one_break(cur, account_id)
+        assert (found, new, resolved) == ([], [], 1)
+        cur.execute("select status from reconciliation_breaks where account_id = %s", (account_id,))
+        assert cur.fetchall() == [("resolved",)]
+
+
+def test_refetch_queues_a_teller_job_for_a_linked_account(db):
+    with db.cursor() as cur:
+        account_id, provider_account_id = teller_account(cur, "acc_reconcile_1", "9001")
+        days(cur, account_id, [(D0, D(0), D(100)), (D1, D(-20), None), (D2, D(-10), D(50))])
+        _, new, _ = one_break(cur, account_id)
+        assert refetch(cur, new) == 1
+        cur.execute("""
+          select j.id, j.provider_account_id, j.account_api_id, j.start_date, j.end_date, j.enqueue_reason, j.status
+          from teller_jobs j where j.account_api_id = 'acc_reconcile_1'
+        """)
+        (job_id, *job), = cur.fetchall()
+        assert job == [provider_account_id, "acc_reconcile_1", D0, D2, "reconcile", "queued"]
+        cur.execute("select teller_job_id from reconciliation_breaks where id = %s", (new[0],))
+        assert cur.fetchone()[0] == job_id
+
+
+def test_refetch_skips_unlinked_and_old_breaks(db):
+    with db.cursor() as cur:
+        account_id = plain_account(cur)
+        days(cur, account_id, [(D0, D(0), D(100)), (D1, D(-20), None), (D2, D(-10), D(50))])
+        _, new, _ = one_break(cur, account_id)
+        assert refetch(cur, new) == 0
+
+        linked, _ = teller_account(cur, "acc_reconcile_2", "9002")
+        old = [TODAY - timedelta(days=REFETCH_DAYS + n) for n in (12, 11, 10)]
+        days(cur, linked, [(old[0], D(0), D(100)), (old[1], D(-20), None), (old[2], D(-10), D(50))])
+        _, new, _ = one_break(cur, linked, old[0], old[2])
+        assert len(new) == 1 and refetch(cur, new) == 0
+        cur.execute("select count(*) from teller_jobs")
+        assert cur.fetchone()[0] == 0
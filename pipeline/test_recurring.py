@@ -0,0 +1,80 @@
+from datetime import date, timedelta
+from decimal import Decimal as D
+
+from recurring import add_months, detect
+
+START = date(2025, 1, 15)
+MONTHLY = [add_months(START, i) for i in range(6)]
+
+
+def history(days, amounts, desc="NETFLIX"):
+    return [(i + 1, d, a, desc) for i, (d, a) in enumerate(zip(days, amounts))]
+
+
+def test_add_months_clamps_to_the_month_end():
+    assert add_months(date(2025, 1, 31), 1) == date(2025, 2, 28)
+    assert add_months(date(2024, 11, 30), 3) == date(2025, 2, 28)
+    assert add_months(date(2025, 12, 15), 1) == date(2026, 1, 15)
+
+
+def test_detect_monthly_fixed_charge():
+    (s,) = detect(history(MONTHLY, [D("-15.49")] * 6))
+    assert s["cadence"] == "monthly"
+    assert s["amount"] == -15.49
+    assert s["occurrences"] == 6
+    assert (s["first_posted_at"], s["last_posted_at"]) == (MONTHLY[0], MONTHLY[-1])
+    assert s["last_transaction_id"] == 6
+    assert s["next_expected"] == date(2025, 7, 15)
+    assert s["next_amount"] == D("-15.49")
+    assert s["confidence"] == 1.0
+
+
+def test_detect_weekly():
+    days = [date(2025, 1, 6) + timedelta(days=7 * i) for i in range(8)]
+    (s,) = detect(history(days, [D("-9.99")] * 8))
+    assert (s["cadence"], s["occurrences"], s["next_expected"]) == ("weekly", 8, days[-1] + timedelta(days=7))
+
+
+def test_detect_too_few_charges():
+    assert detect(history(MONTHLY[:2], [D("-15.49")] * 2)) == []
+
+
+def test_detect_irregular_dates():
+    days = [date(2025, 1, 1), date(2025, 1, 9), date(2025, 2, 28), date(2025, 3, 3), date(2025, 5, 20),
+            date(2025, 6, 1)]
+    assert detect(history(days, [D("-15.49")] * 6)) == []
+
+
+def test_detect_splits_a_group_by_amount():
+    rows = sorted([(d, D("-15.49")) for d in MONTHLY] + [(d + timedelta(days=3), D("-60.00")) for d in MONTHLY])
+    found = detect(history([r[0] for r in rows], [r[1] for r in rows]))
+    assert [(s["cadence"], s["amount"], s["occurrences"]) for s in found] == [
+        ("monthly", -15.49, 6), ("monthly", -60.0, 6)]
+
+
+def test_detect_counts_one_charge_per_day():
+    days = sorted(MONTHLY + [MONTHLY[2]])
+    (s,) = detect(history(days, [D("-15.49")] * 7))
+    assert s["occurrences"] == 6
+
+
+def test_detect_varying_amount_needs_more_charges():
+    amounts = [D("-100"), D("-104"), D("-98.50"), D("-110"), D("-101"), D("-107")]
+    (s,) = detect(history(MONTHLY, amounts))
+    assert (s["cadence"], s["occurrences"]) == ("monthly", 6)
+    assert detect(history(MONTHLY[:5], amounts[:5])) == []
+
+
+def test_detect_missed_month_lowers_confidence():
+    days = MONTHLY[:2] + MONTHLY[3:]
+    (s,) = detect(history(days, [D("-15.49")] * 5))
+    assert s["cadence"] == "monthly"
+    assert 0 < s["confidence"] < 1
+
+
+def test_detect_active_until_half_a_period_past_due():
+    today = date.today()
+    recent = [add_months(today, i - 5) for i in range(6)]
+    assert detect(history(recent, [D("-15.49")] * 6))[0]["active"]
+    old = [add_months(today, i - 8) for i in range(6)]
+    assert not detect(history(old, [D("-15.49")] * 6))[0]["active"]
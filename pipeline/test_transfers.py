@@ -0,0 +1,45 @@
+from conftest import FakeCursor
+from transfers import match, worded
+
+
+def test_worded():
+    assert worded("online transfer to sav 1234")
+    assert worded("CHASE CREDIT CRD AUTOPAY")
+    assert not worded("STARBUCKS")
+    assert not worded(None)
+
+
+def test_match_worded_pair_both_legs():
+    cur = FakeCursor([(10, "ONLINE TRANSFER TO SAV", 20, "DEPOSIT", 1)])
+    assert sorted(match(cur, [10])) == [(10, 20, 1, "matched"), (20, 10, 1, "matched")]
+
+
+def test_match_unworded_pair_is_possible():
+    cur = FakeCursor([(10, "VENMO", 20, "DEPOSIT", 0)])
+    assert sorted(match(cur, [10])) == [(10, 20, 0, "possible"), (20, 10, 0, "possible")]
+
+
+def test_match_prefers_worded_then_nearest_then_lowest_id():
+    cur = FakeCursor([(10, "DEPOSIT", 21, "VENMO", 0), (10, "DEPOSIT", 22, "XFER FROM CHK", 3)])
+    assert sorted(match(cur, [10]))[0] == (10, 22, 3, "matched")
+    cur = FakeCursor([(10, "TRANSFER", 23, "X", 2), (10, "TRANSFER", 22, "X", 1), (10, "TRANSFER", 21, "X", 1)])
+    assert sorted(match(cur, [10]))[0] == (10, 21, 1, "matched")
+
+
+def test_match_legs_are_not_reused():
+    # both legs queued, and a second outflow of the same amount wanting the same deposit
+    cur = FakeCursor([(10, "TRANSFER", 20, "DEPOSIT", 0),
+                      (11, "TRANSFER", 20, "DEPOSIT", 0),
+                      (20, "DEPOSIT", 10, "TRANSFER", 0),
+                      (20, "DEPOSIT", 11, "TRANSFER", 0)])
+    assert sorted(match(cur, [10, 11, 20])) == [(10, 20, 0, "matched"), (20, 10, 0, "matched")]
+
+
+def test_match_sure_pair_replaces_a_possible_one():
+    cur = FakeCursor([(10, "VENMO", 20, "DEPOSIT", 0), (15, "XFER", 20, "DEPOSIT", 1)])
+    assert sorted(match(cur, [10, 15])) == [(10, 20, 0, "possible"), (15, 20, 1, "matched"),
+                                            (20, 15, 1, "matched")]
+
+
+def test_match_nothing_queued():
+    assert match(FakeCursor([]), []) == []
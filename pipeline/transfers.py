@@ -0,0 +1,186 @@
+# transfers.py
+# Transfers between our own accounts (0025_tx_transfers.sql). Every inserted transaction
+# lands in tx_transfer_queue; this stage drains it in batches. For each queued row it
+# looks for the opposite amount on a different account, posted within
+# TRANSFER_WINDOW_DAYS: one range of ix_tx_transfer_block (amount, posted_at) per row,
+# however many accounts and months there are. Rows already paired, and suppressed
+# duplicates (0024), are left out.
+#
+#   either leg's description matches TRANSFER_WORDS   'matched': transfer_of is set on
+#                                                     both legs, spend views and budgets skip them
+#   otherwise                                         'possible', listed for review, still counted
+#
+# An equal refund and purchase on two cards a day apart is the false positive the
+# wording check guards against. Each leg pairs once; of several candidates the one with
+# transfer wording wins, then the nearest date, then the row that arrived first.
+#
+#   docker compose run --rm pipeline python /app/transfers.py
+#   docker compose run --rm pipeline python /app/transfers.py --backfill-days 90   # queue existing rows first
+
+import os, re, sys, argparse
+
+import psycopg
+
+import metrics
+
+PG_DSN = (
+    f"host={os.environ['POSTGRES_HOST']} "
+    f"port={os.environ['POSTGRES_PORT']} "
+    f"dbname={os.environ['POSTGRES_DB']} "
+    f"user={os.environ['POSTGRES_USER']} "
+    f"password={os.environ['POSTGRES_PASSWORD']}"
+)
+
+WINDOW_DAYS = int(os.getenv("TRANSFER_WINDOW_DAYS", "3"))
+WORDS = re.compile(os.getenv(
+    "TRANSFER_WORDS",
+    r"TRANSFER|XFER|PAYMENT|PMT|AUTOPAY|AUTO PAY|ONLINE BANKING|CREDIT CARD|SAVINGS|CHECKING"))
+BATCH = int(os.getenv("TRANSFER_BATCH", "2000"))
+CANDIDATES = 10  # per queued row, nearest dates first
+
+# queued rows with their counterpart candidates; the second lateral is the blocking step
+CANDIDATES_SQL = """
+  select n.id, n.normalized_desc, c.id, c.normalized_desc, abs(c.posted_at - n.posted_at) as days
+  from (
+    select t.*
+    from tx_keys k
+    -- limit 1: a per-id probe of one partition, as in dedupe.py
+    cross join lateral (
+      select t.id, t.account_id, t.posted_at, t.amount, t.normalized_desc
+      from transactions t
+      where t.id = k.transaction_id and t.posted_at = k.posted_at
+        and t.amount <> 0 and t.transfer_of is null and t.duplicate_of is null
+      limit 1
+    ) t
+    where k.transaction_id = any(%(ids)s::bigint[])
+  ) n
+  cross join lateral (
+    select c.id, c.posted_at, c.normalized_desc
+    from transactions c
+    where c.amount = -n.amount
+      and c.posted_at between n.posted_at - %(window)s and n.posted_at + %(window)s
+      and c.account_id <> n.account_id
+      and c.transfer_of is null
+      and c.duplicate_of is null
+    order by abs(c.posted_at - n.posted_at), c.id
+    limit %(limit)s
+  ) c
+  order by n.id, days, c.id
+"""
+
+
+def worded(desc):
+    return bool(desc) and WORDS.search(desc.upper()) is not None
+
+
+def match(cur, ids):
+    """tx_transfers rows (transaction id, counterpart id, days, status), both legs of each pair, for one batch."""
+    cur.execute(CANDIDATES_SQL, {"ids": ids, "window": WINDOW_DAYS, "limit": CANDIDATES})
+    by_row = {}
+    for n_id, n_desc, c_id, c_desc, days in cur.fetchall():
+        by_row.setdefault(n_id, []).append((c_id, worded(n_desc) or worded(c_desc), days))
+
+    taken = set()
+    out = {}  # leg -> row; a match beats a possible pairing
+    for n_id in sorted(by_row):
+        if n_id in taken:
+            continue
+        cands = [c for c in by_row[n_id] if c[0] not in taken]
+        if not cands:
+            continue
+        c_id, sure, days = min(cands, key=lambda c: (not c[1], c[2], c[0]))
+        if sure:
+            out[n_id] = (n_id, c_id, days, "matched")
+            out[c_id] = (c_id, n_id, days, "matched")
+            taken.update((n_id, c_id))
+        else:
+            out.setdefault(n_id, (n_id, c_id, days, "possible"))
+            out.setdefault(c_id, (c_id, n_id, days, "possible"))
+    return list(out.values())
+
+
+def apply(cur, found):
+    if not found:
+        return
+    cur.execute("""
+      insert into tx_transfers(transaction_id, counterpart_id, days, status)
+      select * from unnest(%s::bigint[], %s::bigint[], %s::int[], %s::text[])
+      on conflict (transaction_id) do update set
+        counterpart_id = excluded.counterpart_id, days = excluded.days, status = excluded.status, created_at = now()
+      where tx_transfers.status = 'possible'
+    """, ([f[0] for f in found], [f[1] for f in found], [f[2] for f in found], [f[3] for f in found]))
+    legs = [f[0] for f in found if f[3] == "matched"]
+    if legs:
+        cur.execute("""
+          update transactions t set transfer_of = x.counterpart_id, updated_at = now()
+          from tx_transfers x
+          where x.transaction_id = any(%s) and x.status = 'matched'
+            and t.id = x.transaction_id and t.transfer_of is null
+        """, (legs,))
+
+
+def backfill(conn, days):
+    """Queue existing rows posted in the last `days` days; returns rows queued."""
+    with conn.cursor() as cur:
+        cur.execute("""
+          insert into tx_transfer_queue(transaction_id)
+          select t.id from transactions t
+          where t.posted_at >= current_date - %s and t.transfer_of is null
+          on conflict do nothing
+        """, (days,))
+        n = cur.rowcount
+    conn.commit()
+    return n
+
+
+@metrics.job("transfers")
+def run(conn):
+    checked = matched = possible = 0
+    while True:
+        with conn.cursor() as cur:
+            cur.execute("""
+              select transaction_id from tx_transfer_queue
+              order by transaction_id
+              limit %s
+              for update skip locked
+            """, (BATCH,))
+            queued = cur.fetchall()
+            if not queued:
+                break
+            ids = [r[0] for r in queued]
+            found = match(cur, ids)
+            apply(cur, found)
+            cur.execute("delete from tx_transfer_queue where transaction_id = any(%s)", (ids,))
+        conn.commit()
+        checked += len(ids)
+        # pairs, not legs
+        matched += sum(1 for f in found if f[3] == "matched") // 2
+        possible += sum(1 for f in found if f[3] == "possible" and f[0] < f[1])
+    metrics.count_rows(checked, "checked")
+    metrics.count_rows(matched, "matched")
+    print(f"[transfers] checked={checked} matched={matched} possible={possible}")
+    return matched
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Pair transfers between our own accounts.")
+    ap.add_argument("--backfill-days", type=int, help="queue existing rows posted in the last N days first")
+    args = ap.parse_args()
+    metrics.set_service("transfers")
+    try:
+        with psycopg.connect(PG_DSN, autocommit=False, cursor_factory=metrics.TimedCursor) as conn:
+            if args.backfill_days:
+                print(f"[transfers] queued {backfill(conn, args.backfill_days)} existing row(s)")
+            run(conn)
+    finally:
+        metrics.push()
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        print(f"[transfers] ERROR: {e}", file=sys.stderr)
+        sys.exit(1)
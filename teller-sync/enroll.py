@@ -8,8 +8,8 @@ import sys
 from datetime import date, timedelta
 
 import psycopg
-import requests
-from requests.auth import HTTPBasicAuth
+import teller_http
+import teller_store
 
 # ---------- Config ----------
 DB_DSN = (
@@ -50,27 +50,18 @@ def http():
     if not ACCESS_TOKEN:
         raise SystemExit("TELLER_ACCESS_TOKEN is required")
 
-    s = requests.Session()
-    s.headers.update({"User-Agent": UA, "Accept": "application/json"})
-    s.cert = (CERT_PATH, KEY_PATH)
-    s.verify = CA_PATH if CA_PATH else True
-    s.headers["X-Enrollment-Id"] = ENROLLMENT_ID
+    api = teller_http.TellerClient(BASE_URL, CERT_PATH, KEY_PATH, CA_PATH, user_agent=UA, timeout=20)
+    auth = f"Bearer {ACCESS_TOKEN}" if AUTH_STYLE == "bearer" else None  # None -> Basic
+    return api.for_enrollment(ACCESS_TOKEN, ENROLLMENT_ID, auth=auth)
 
-    if AUTH_STYLE == "basic":
-        s.auth = HTTPBasicAuth(ACCESS_TOKEN, "")
-    else:
-        s.headers["Authorization"] = f"Bearer {ACCESS_TOKEN}"
-    return s
 
-
-def jget(s: requests.Session, path: str, params=None):
-    url = f"{BASE_URL}{path}"
-    r = s.get(url, params=params, timeout=20)
+def jget(s: teller_http.EnrollmentSession, path: str, params=None):
+    r = s.get(path, params=params)
     if r.status_code >= 400:
         raise RuntimeError(
-            f"HTTP {r.status_code} GET {url} resp={r.text[:500]} "
-            f"auth_style={AUTH_STYLE} have_auth={'Authorization' in s.headers or s.auth is not None} "
-            f"enrollment={s.headers.get('X-Enrollment-Id')}"
+            f"HTTP {r.status_code} GET {s.client.base_url}{path} resp={r.text[:500]} "
+            f"auth_style={AUTH_STYLE} have_auth={bool(s.token or s.auth)} "
+            f"enrollment={s.enrollment_id}"
         )
     return r.json()
 
@@ -99,6 +90,8 @@ def has_column(cur, table_name: str, column_name: str) -> bool:
 def upsert_enrollment(cur):
     """
     Store or refresh the enrollment row. Encrypt the access token with pgcrypto.
+    Rewriting access_token_enc bumps token_version (0019), which is what tells
+    teller-sync's in-memory token cache to decrypt this enrollment again.
     Required table columns (your current schema):
       provider, enrollment_id, user_ref, institution_name, environment, access_token_enc, status
     Optional columns we set if present:
@@ -134,90 +127,6 @@ def upsert_enrollment(cur):
     return row_id
 
 
-def map_type(t, st):
-    t = (t or "").lower()
-    st = (st or "").lower()
-    if t in ("depository", "bank", "cash"):
-        if "checking" in st:
-            return "checking"
-        if "savings" in st:
-            return "savings"
-        return "checking"
-    if t in ("credit", "card", "credit_card"):
-        return "credit"
-    if t in ("loan", "mortgage"):
-        return "loan"
-    if t in ("investment", "brokerage"):
-        return "investment"
-    return None
-
-
-def ensure_institution(cur):
-    cur.execute(
-        """
-        insert into institutions(name, external_id)
-        values ('TELLER','teller')
-        on conflict (name) do nothing
-        returning id
-        """
-    )
-    row = cur.fetchone()
-    if row:
-        return row[0]
-    cur.execute("select id from institutions where external_id='teller'")
-    return cur.fetchone()[0]
-
-
-def upsert_app_account(cur, inst_id, acct):
-    api_id = acct.get("id")
-    name = acct.get("name") or acct.get("official_name") or acct.get("account") or "Account"
-    last4 = acct.get("last_four") or acct.get("last4") or acct.get("last4_digits")
-    typ = map_type(acct.get("type"), acct.get("subtype"))
-    curr = (acct.get("currency") or "USD").upper()[:3]
-
-    cur.execute(
-        """
-        insert into accounts(institution_id, name, type, currency, mask, external_id, is_active)
-        values (%s,%s,%s,%s,%s,%s,true)
-        on conflict (external_id) do update set
-          institution_id = excluded.institution_id,
-          name           = excluded.name,
-          type           = coalesce(excluded.type, accounts.type),
-          currency       = excluded.currency,
-          mask           = excluded.mask,
-          is_active      = true
-        returning id
-        """,
-        (inst_id, name, typ, curr, last4, f"teller:{api_id}"),
-    )
-    return cur.fetchone()[0]
-
-
-def upsert_provider_account(cur, acct):
-    teller_acct_id = acct.get("id")
-    last4 = acct.get("last_four") or acct.get("last4") or acct.get("last4_digits")
-    typ = (acct.get("type") or "").lower()
-    sub = (acct.get("subtype") or "").lower()
-    curr = (acct.get("currency") or "USD").upper()[:3]
-
-    cur.execute(
-        """
-        insert into provider_accounts
-            (enrollment_id, teller_account_id, institution_id, last_four, type, subtype, currency)
-        values (%s,%s,%s,%s,%s,%s,%s)
-        on conflict (enrollment_id, teller_account_id) do update set
-            institution_id = excluded.institution_id,
-            last_four      = excluded.last_four,
-            type           = excluded.type,
-            subtype        = excluded.subtype,
-            currency       = excluded.currency
-        returning id
-        """,
-        (ENROLLMENT_ID, teller_acct_id, None, last4, typ, sub, curr),
-    )
-    return cur.fetchone()[0]
-
-
 def seed_initial_job(cur, provider_account_id, account_api_id, start_date, end_date):
     # Idempotent insert guarded by a unique constraint on (provider_account_id, start_date, end_date)
     cur.execute(
@@ -237,7 +146,7 @@ def main():
 
     with pg() as conn, conn.cursor() as cur:
         ensure_extensions(cur)
-        inst_id = ensure_institution(cur)
+        inst_id = teller_store.ensure_institution(cur)
 
         # 1) Upsert enrollment and encrypted token
         enroll_row_id = upsert_enrollment(cur)
@@ -247,7 +156,8 @@ def main():
         if isinstance(accounts, dict) and "data" in accounts:
             accounts = accounts["data"]
 
-        # 3) Persist and seed jobs
+        # 3) Persist (one statement for all accounts) and seed jobs
+        ids = teller_store.upsert_accounts(cur, inst_id, accounts, ENROLLMENT_ID)
         count = 0
         enr_seen = None
         for acct in accounts or []:
@@ -265,8 +175,7 @@ def main():
                         (enr, enroll_row_id),
                     )
 
-            prov_id = upsert_provider_account(cur, acct)
-            _ = upsert_app_account(cur, inst_id, acct)
+            _, prov_id = ids[api_id]
             seed_initial_job(cur, prov_id, api_id, window_start, window_end)
             count += 1
 
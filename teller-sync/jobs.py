@@ -0,0 +1,167 @@
+# jobs.py
+# Inspect and requeue dead-lettered Teller sync jobs (teller_jobs.status = 'failed').
+# sync.py dead-letters an account's jobs once they fail TELLER_MAX_ATTEMPTS times
+# (TELLER_PERMANENT_MAX_ATTEMPTS for auth / other 4xx errors); they stay put until requeued.
+#
+#   docker compose run --rm teller-sync python /app/jobs.py                 # queue summary + dead letters
+#   docker compose run --rm teller-sync python /app/jobs.py --class auth    # only auth failures
+#   docker compose run --rm teller-sync python /app/jobs.py requeue --enrollment usr_abc
+#   docker compose run --rm teller-sync python /app/jobs.py requeue --all --dry-run
+#
+# Requeued jobs start over at attempt 0 and are due at once; a running pipeline daemon is
+# woken through the teller_jobs channel. A dead windowed job whose window is already
+# queued again (e.g. by a re-enroll) is deleted instead of requeued, and so is a dead
+# webhook job whose account already has an open one or a newer dead one being requeued.
+
+import os
+import sys
+import argparse
+
+import psycopg
+
+DB_DSN = (
+    f"host={os.environ['POSTGRES_HOST']} "
+    f"port={os.environ['POSTGRES_PORT']} "
+    f"dbname={os.environ['POSTGRES_DB']} "
+    f"user={os.environ['POSTGRES_USER']} "
+    f"password={os.environ['POSTGRES_PASSWORD']}"
+)
+
+
+def pg():
+    return psycopg.connect(DB_DSN)
+
+
+def dead_filter(args):
+    """WHERE clause (over teller_jobs j / provider_accounts pa) selecting the dead letters asked for."""
+    where, params = ["j.status = 'failed'"], []
+    if args.account:
+        where.append("j.account_api_id = any(%s)")
+        params.append(args.account)
+    if args.enrollment:
+        where.append("pa.enrollment_id = any(%s)")
+        params.append(args.enrollment)
+    if args.error_class:
+        where.append("j.error_class = any(%s)")
+        params.append(args.error_class)
+    return " and ".join(where), params
+
+
+def summary(cur):
+    cur.execute("""
+      select case when status = 'failed' then 'dead'
+                  when status <> 'queued' then status
+                  when attempts > 0 then 'retrying' else 'queued' end as state,
+             count(*), count(distinct account_api_id),
+             min(run_after) filter (where status = 'queued')
+      from teller_jobs
+      group by 1
+      order by 1
+    """)
+    rows = cur.fetchall()
+    if not rows:
+        print("[jobs] queue is empty")
+    for state, jobs, accounts, next_run in rows:
+        due = f" next_run={next_run:%Y-%m-%d %H:%M:%S}" if next_run else ""
+        print(f"[jobs] {state:9s} jobs={jobs} accounts={accounts}{due}")
+
+
+def list_dead(cur, args):
+    where, params = dead_filter(args)
+    cur.execute(f"""
+      select j.account_api_id, pa.enrollment_id, count(*), max(j.attempts),
+             string_agg(distinct coalesce(j.error_class, '?'), ','), max(j.updated_at),
+             (array_agg(j.last_error order by j.updated_at desc))[1],
+             sum(j.coalesced_events)
+      from teller_jobs j
+      left join provider_accounts pa on pa.teller_account_id = j.account_api_id
+      where {where}
+      group by j.account_api_id, pa.enrollment_id
+      order by max(j.updated_at) desc
+      limit %s
+    """, params + [args.limit])
+    rows = cur.fetchall()
+    if not rows:
+        print("[jobs] no dead letters match")
+        return
+    print(f"[jobs] dead letters ({len(rows)} account(s)):")
+    for api_id, enrollment_id, jobs, attempts, classes, at, last_error, events in rows:
+        print(f"  {api_id}  enrollment={enrollment_id or '-'}  jobs={jobs} attempts={attempts} "
+              f"class={classes} since={at:%Y-%m-%d %H:%M:%S} events_held={events or 0}")
+        first_line = ((last_error or "").splitlines() or ["-"])[0]
+        print(f"      {first_line[:160]}")
+
+
+def requeue(cur, args):
+    if not (args.all or args.account or args.enrollment or args.error_class):
+        raise SystemExit("requeue needs --account, --enrollment, --class or --all")
+    where, params = dead_filter(args)
+    cur.execute(f"""
+      select j.id, j.account_api_id, j.start_date is null,
+             exists (
+               select 1 from teller_jobs q
+               where q.status in ('queued', 'running') and q.id <> j.id
+                 and q.account_api_id = j.account_api_id
+                 and case when j.start_date is null then q.start_date is null
+                          else q.provider_account_id is not distinct from j.provider_account_id
+                               and q.start_date = j.start_date and q.end_date = j.end_date end
+             ) as superseded
+      from teller_jobs j
+      left join provider_accounts pa on pa.teller_account_id = j.account_api_id
+      where {where}
+      order by j.id desc
+    """, params)
+    revive, drop, revived, webhook = [], [], set(), set()
+    for job_id, api_id, is_webhook, superseded in cur.fetchall():
+        # one open webhook job per account: the newest dead one is revived, the rest go
+        if superseded or (is_webhook and api_id in webhook):
+            drop.append(job_id)
+            continue
+        revive.append(job_id)
+        revived.add(api_id)
+        if is_webhook:
+            webhook.add(api_id)
+    accounts = sorted(revived)
+    verb = "would requeue" if args.dry_run else "requeued"
+    print(f"[jobs] {verb} {len(revive)} job(s) across {len(accounts)} account(s); "
+          f"{len(drop)} superseded dead job(s) {'would be ' if args.dry_run else ''}deleted")
+    if args.dry_run:
+        return
+    if drop:
+        cur.execute("delete from teller_jobs where id = any(%s)", (drop,))
+    if revive:
+        cur.execute("""
+          update teller_jobs
+             set status = 'queued', attempts = 0, error_class = null, run_after = now()
+           where id = any(%s)
+        """, (revive,))
+        # the insert trigger is what normally wakes the daemon; a requeue is an update
+        cur.execute("select pg_notify('teller_jobs', a) from unnest(%s::text[]) as a", (accounts,))
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Inspect and requeue dead-lettered Teller sync jobs.")
+    ap.add_argument("command", nargs="?", choices=("list", "requeue"), default="list")
+    ap.add_argument("--account", action="append", help="Teller account id (acc_...); repeatable")
+    ap.add_argument("--enrollment", action="append", help="enrollment id (usr_...); repeatable")
+    ap.add_argument("--class", dest="error_class", action="append",
+                    choices=("auth", "rate_limit", "client", "transient"), help="error class; repeatable")
+    ap.add_argument("--all", action="store_true", help="requeue every dead letter")
+    ap.add_argument("--dry-run", action="store_true")
+    ap.add_argument("--limit", type=int, default=100, help="accounts listed")
+    args = ap.parse_args()
+
+    with pg() as conn, conn.cursor() as cur:
+        if args.command == "requeue":
+            requeue(cur, args)
+        else:
+            summary(cur)
+            list_dead(cur, args)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except Exception as e:
+        print(f"[jobs] ERROR: {e}", file=sys.stderr)
+        sys.exit(1)
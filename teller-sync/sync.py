@@ -1,7 +1,13 @@
-import os, sys, base64
-from datetime import date, timedelta
+import os, re, sys, time, random, hashlib
+from datetime import date, datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
 from decimal import Decimal, InvalidOperation
-import psycopg, requests
+import psycopg
+import metrics
+import profiling
+import teller_store
+import merchants
+import rules
 
 DB_DSN = (
     f"host={os.environ['POSTGRES_HOST']} "
@@ -11,120 +17,71 @@ DB_DSN = (
     f"password={os.environ['POSTGRES_PASSWORD']}"
 )
 
-BASE_URL    = os.getenv("TELLER_BASE_URL", "https://api.teller.io").rstrip("/")
-CERT_PATH   = os.environ["TELLER_CERT"]
-KEY_PATH    = os.environ["TELLER_KEY"]
-CA_PATH     = os.getenv("TELLER_CA_PATH", "/etc/ssl/certs/ca-certificates.crt")
-SINCE_DAYS  = int(os.getenv("TELLER_SINCE_DAYS", "30"))
+SINCE_DAYS  = int(os.getenv("TELLER_SINCE_DAYS", "30"))    # first sync of an account with no cursor
+OVERLAP_DAYS = int(os.getenv("TELLER_OVERLAP_DAYS", "5"))  # re-read this much before the cursor (pending -> posted)
+PAGE_SIZE   = int(os.getenv("TELLER_PAGE_SIZE", "100"))    # 0 = ask for everything in one call
 FIN_ENC_KEY = os.getenv("FIN_ENC_KEY")
 ENV_TOKEN   = os.getenv("TELLER_ACCESS_TOKEN")  # optional one-off
+TOKEN_TTL   = int(os.getenv("TELLER_TOKEN_TTL", "900"))  # seconds a decrypted token stays in memory
+# failed jobs: exponential backoff from RETRY_BASE, capped, then dead-lettered (status='failed')
+RETRY_BASE   = int(os.getenv("TELLER_RETRY_BASE_SECONDS", "60"))
+RETRY_CAP    = int(os.getenv("TELLER_RETRY_CAP_SECONDS", "21600"))
+MAX_ATTEMPTS = int(os.getenv("TELLER_MAX_ATTEMPTS", "8"))            # transient / rate-limited
+PERMANENT_MAX_ATTEMPTS = int(os.getenv("TELLER_PERMANENT_MAX_ATTEMPTS", "3"))  # auth / other 4xx
+DRAIN_BATCH  = 50
+RETRY_SLOTS  = int(os.getenv("TELLER_RETRY_SLOTS", "10"))  # at most this many retried accounts per batch
 UA = "finance-os/0.1 (teller-sync)"
 
 def pg():
-    return psycopg.connect(DB_DSN)
-
-def _require_file(p):
-    if not os.path.exists(p):
-        raise FileNotFoundError(f"File not found: {p}")
-    return p
-
-def http_base():
-    s = requests.Session()
-    s.headers.update({"User-Agent": UA, "Accept": "application/json"})
-    s.cert = (_require_file(CERT_PATH), _require_file(KEY_PATH))
-    s.verify = CA_PATH if CA_PATH else True
-    return s
-
-def _basic_auth_header(token: str) -> str:
-    b = base64.b64encode(f"{token}:".encode()).decode()
-    return f"Basic {b}"
+    return psycopg.connect(DB_DSN, cursor_factory=metrics.TimedCursor)
 
 def http_for_token(token: str, enrollment_header: str):
     """
-    Build a session for a specific enrollment (usr_...) using Basic auth.
-    Teller expects X-Enrollment-Id on these endpoints.
+    Bind an enrollment (usr_...) and its token to the process-wide Teller client.
+    Teller expects X-Enrollment-Id on these endpoints; auth is Basic and sent per
+    request, so every enrollment shares the same pooled mTLS connections.
     """
-    s = http_base()
-    s.headers["Authorization"] = _basic_auth_header(token)
+    import teller_http  # deferred: a run with no jobs and no sweep never touches HTTP
     if not enrollment_header:
         raise RuntimeError("missing enrollment header for Teller request")
-    s.headers["X-Enrollment-Id"] = enrollment_header
-    return s
+    return teller_http.client(UA).for_enrollment(token, enrollment_header)
+
+_ROUTE_ID = re.compile(r"/accounts/[^/]+")
+
+class TellerError(RuntimeError):
+    """A Teller response with status >= 400; retry_after is in seconds when the server sent one."""
+
+    def __init__(self, status, path, body, retry_after=None):
+        label = "401 Unauthorized" if status == 401 else f"HTTP {status}"
+        super().__init__(f"{label} GET {path}: {body[:300]}")
+        self.status = status
+        self.retry_after = retry_after
+
+def _retry_after(value):
+    """Seconds from a Retry-After header (delta-seconds or HTTP-date), or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
 
 def jget(s, path, params=None):
-    url = f"{BASE_URL}{path}"
-    r = s.get(url, params=params, timeout=30)
-    if r.status_code == 401:
-        raise RuntimeError(f"401 Unauthorized GET {path}: {r.text[:300]}")
+    with metrics.timer(metrics.HTTP_CLIENT_SECONDS, target="teller", route=_ROUTE_ID.sub("/accounts/{id}", path)) as t:
+        r = s.get(path, params=params)
+        t["status"] = r.status_code
+    metrics.count_bytes(len(r.content), "teller")
     if r.status_code >= 400:
-        raise RuntimeError(f"HTTP {r.status_code} GET {path}: {r.text[:300]}")
+        raise TellerError(r.status_code, path, r.text, _retry_after(r.headers.get("Retry-After")))
     return r.json()
 
-def ensure_institution(cur):
-    cur.execute("""
-      insert into institutions(name, external_id)
-      values ('TELLER','teller')
-      on conflict (name) do nothing
-      returning id
-    """)
-    row = cur.fetchone()
-    if row: return row[0]
-    cur.execute("select id from institutions where external_id='teller'")
-    return cur.fetchone()[0]
-
-def map_type(t, st):
-    t = (t or "").lower(); st = (st or "").lower()
-    if t in ("depository","bank","cash"):
-        if "checking" in st: return "checking"
-        if "savings" in st:  return "savings"
-        return "checking"
-    if t in ("credit","card","credit_card"): return "credit"
-    if t in ("loan","mortgage"): return "loan"
-    if t in ("investment","brokerage"): return "investment"
-    return None
-
-def upsert_account(cur, inst_id, acct):
-    api_id = acct.get("id")
-    name = acct.get("name") or acct.get("official_name") or acct.get("account") or "Account"
-    last4 = acct.get("last_four") or acct.get("last4") or acct.get("last4_digits")
-    typ = map_type(acct.get("type"), acct.get("subtype"))
-    curr = (acct.get("currency") or "USD").upper()[:3]
-    cur.execute("""
-      insert into accounts(institution_id, name, type, currency, mask, external_id, is_active)
-      values (%s,%s,%s,%s,%s,%s,true)
-      on conflict (external_id) do update set
-        institution_id=excluded.institution_id,
-        name=excluded.name,
-        type=coalesce(excluded.type, accounts.type),
-        currency=excluded.currency,
-        mask=excluded.mask,
-        is_active=true
-      returning id
-    """, (inst_id, name, typ, curr, last4, f"teller:{api_id}"))
-    return cur.fetchone()[0]
-
-def upsert_provider_account(cur, enrollment_id: str, acct: dict):
-    cur.execute("""
-      insert into provider_accounts(enrollment_id, teller_account_id, institution_id, last_four, type, subtype, currency)
-      values (%s, %s, %s, %s, %s, %s, %s)
-      on conflict (enrollment_id, teller_account_id) do update set
-        institution_id = excluded.institution_id,
-        last_four = excluded.last_four,
-        type = excluded.type,
-        subtype = excluded.subtype,
-        currency = excluded.currency
-      returning id
-    """, (
-        enrollment_id,
-        acct.get("id"),
-        acct.get("institution_id"),
-        acct.get("last_four") or acct.get("last4") or acct.get("last4_digits"),
-        (acct.get("type") or "").lower() or None,
-        (acct.get("subtype") or "").lower() or None,
-        (acct.get("currency") or "USD").upper()[:3],
-    ))
-    return cur.fetchone()[0]
-
 def parse_amount(v):
     if isinstance(v,(int,float)): return Decimal(str(v)).quantize(Decimal("0.01"))
     if isinstance(v,str):
@@ -133,9 +90,8 @@ def parse_amount(v):
             if v.isdigit(): return (Decimal(v)/Decimal(100)).quantize(Decimal("0.01"))
     raise ValueError(f"bad amount {v!r}")
 
-def ndesc(s): return " ".join((s or "").strip().split()).upper()
-
-def upsert_tx(cur, account_id, tx):
+def tx_fields(tx):
+    """(external id, posted_at, amount, currency, description, balance_after, status) of one Teller payload."""
     ext = tx.get("id")
     d = tx.get("date") or tx.get("posted") or tx.get("timestamp") or tx.get("booked")
     if not d: raise ValueError(f"missing date in tx {ext}")
@@ -143,80 +99,471 @@ def upsert_tx(cur, account_id, tx):
     desc = tx.get("description") or (tx.get("counterparty") or {}).get("name") or tx.get("name") or "Transaction"
     amt  = parse_amount(tx.get("amount"))
     curr = (tx.get("currency") or "USD").upper()[:3]
+    # null while pending; anchors daily_balances (pipeline/balances.py) once posted
+    bal = tx.get("running_balance")
+    bal = parse_amount(bal) if bal not in (None, "") else None
+    status = (tx.get("status") or "").lower() or None
+    return ext, posted, amt, curr, desc, bal, status
+
+def tx_fingerprint(posted, amt, desc, bal, status):
+    return hashlib.sha1(repr((posted, amt, desc, bal, status)).encode("utf-8")).digest()
+
+# what we stored for the fetched ids; tx_keys carries posted_at, so each lookup hits one partition
+STORED_TX_SQL = """
+  select k.external_tx_id, t.id, t.posted_at, t.amount, t.description, t.balance_after, t.status, t.fingerprint
+  from tx_keys k
+  join transactions t on t.id = k.transaction_id and t.posted_at = k.posted_at
+  where k.account_id = %s and k.external_tx_id = any(%s)
+"""
+
+def store_transactions(cur, account_id, txs, new=None):
+    """
+    Write one account's fetched transactions. A row we don't have is inserted. A row we
+    have is compared by fingerprint (0029): the same one costs no write, a changed one
+    (a pending row that posted) updates only the columns that differ, so a row that only
+    changed status and balance_after stays HOT-eligible. New rows go to `new` for
+    rules.categorize(). Returns (inserted, updated, unchanged).
+    """
+    rows, seen = [], set()
+    for tx in txs:
+        f = tx_fields(tx)
+        if f[0] is None or f[0] not in seen:  # consecutive pages can repeat the from_id row
+            seen.add(f[0])
+            rows.append(f)
+    cur.execute(STORED_TX_SQL, (account_id, [f[0] for f in rows if f[0]]))
+    stored = {r[0]: r[1:] for r in cur.fetchall()}
+
+    inserted = updated = unchanged = 0
+    moved, amounts, renamed = [], {}, {}  # moved: amount or date changed; renamed: id -> (norm, amount)
+    for ext, posted, amt, curr, desc, bal, status in rows:
+        fp = tx_fingerprint(posted, amt, desc, bal, status)
+        old = stored.get(ext)
+        if old is None:
+            norm = merchants.normalize_desc(desc)
+            cur.execute("""
+              insert into transactions(account_id, posted_at, amount, currency, description, normalized_desc, external_tx_id,
+                                       balance_after, merchant_id, status, fingerprint)
+              values (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
+              returning id
+            """, (account_id, posted, amt, curr, desc, norm, ext, bal, merchants.resolve(norm), status, fp))
+            row = cur.fetchone()
+            if row:
+                inserted += 1
+                if new is not None:
+                    new.append((row[0], norm, amt))  # for rules.categorize()
+            continue
+        tx_id, old_posted, old_amt, old_desc, old_bal, old_status, old_fp = old
+        if old_fp == fp:
+            unchanged += 1
+            continue
+        # rows from before 0029 have no fingerprint yet: the first re-read only stores it
+        changes = {c: v for c, v, o in (("posted_at", posted, old_posted), ("amount", amt, old_amt),
+                                         ("description", desc, old_desc), ("balance_after", bal, old_bal),
+                                         ("status", status, old_status)) if v != o}
+        if "description" in changes:
+            norm = merchants.normalize_desc(desc)
+            changes["normalized_desc"] = norm
+            changes["merchant_id"] = merchants.resolve(norm)
+            renamed[tx_id] = (norm, amt)
+        if "amount" in changes:
+            amounts[tx_id] = amt
+        if "amount" in changes or "posted_at" in changes:
+            moved.append(tx_id)
+        changes["fingerprint"] = fp
+        # only the changed columns are set: the keys / balances triggers fire on the ones named
+        cur.execute(f"update transactions set {', '.join(f'{c} = %s' for c in changes)}, updated_at = now() "
+                    "where id = %s and posted_at = %s", (*changes.values(), tx_id, old_posted))
+        updated += 1
+    resplit(cur, amounts, renamed, new)
+    if moved:
+        # pairings need equal / opposite amounts a few days apart: look again
+        release(cur, moved)
+        cur.execute("insert into tx_recurring_queue(transaction_id) select unnest(%s::bigint[]) on conflict do nothing",
+                    (moved,))
+    return inserted, updated, unchanged
+
+def resplit(cur, amounts, renamed, new=None):
+    """
+    Bring the rule (rule:) and classifier (ml:) splits of updated rows along: a new amount
+    {id: amount} moves to their splits, a new description {id: (normalized_desc, amount)}
+    drops them and, unless a manual split is left, puts the row in `new` for
+    rules.categorize() again (predict picks up what no rule matches). Manual splits are
+    not touched.
+    """
+    if amounts:
+        cur.execute("""
+          update tx_splits s set amount = u.amount
+          from unnest(%s::bigint[], %s::numeric[]) as u(id, amount)
+          where s.transaction_id = u.id and (s.note like 'rule:%%' or s.note like 'ml:%%')
+        """, (list(amounts), list(amounts.values())))
+    if renamed:
+        ids = list(renamed)
+        cur.execute("delete from tx_splits where transaction_id = any(%s) and (note like 'rule:%%' or note like 'ml:%%')",
+                    (ids,))
+        cur.execute("select distinct transaction_id from tx_splits where transaction_id = any(%s)", (ids,))
+        manual = {r[0] for r in cur.fetchall()}
+        if new is not None:
+            new.extend((i, norm, amt) for i, (norm, amt) in renamed.items() if i not in manual)
+
+def release(cur, ids):
+    """
+    Undo the dedupe and transfer pairings rows ids take part in, on either side, and
+    queue every row involved for dedupe / transfers again.
+    """
+    cur.execute("""
+      with d as (
+        delete from tx_duplicates where transaction_id = any(%(ids)s) or duplicate_of = any(%(ids)s)
+        returning transaction_id, duplicate_of, status
+      ), freed as (
+        update transactions t set duplicate_of = null, updated_at = now()
+        from tx_keys k
+        where k.transaction_id in (select transaction_id from d where status = 'suppressed')
+          and t.id = k.transaction_id and t.posted_at = k.posted_at
+      )
+      insert into tx_dedupe_queue(transaction_id)
+      select transaction_id from d union select duplicate_of from d union select unnest(%(ids)s::bigint[])
+      on conflict do nothing
+    """, {"ids": ids})
+    cur.execute("""
+      with x as (
+        delete from tx_transfers where transaction_id = any(%(ids)s) or counterpart_id = any(%(ids)s)
+        returning transaction_id, counterpart_id, status
+      ), freed as (
+        update transactions t set transfer_of = null, updated_at = now()
+        from tx_keys k
+        where k.transaction_id in (select transaction_id from x where status = 'matched')
+          and t.id = k.transaction_id and t.posted_at = k.posted_at
+      )
+      insert into tx_transfer_queue(transaction_id)
+      select transaction_id from x union select counterpart_id from x union select unnest(%(ids)s::bigint[])
+      on conflict do nothing
+    """, {"ids": ids})
+
+# the account's pending rows from `since` on that a fetch did not return
+PENDING_SQL = """
+  select id from transactions
+  where account_id = %s and posted_at >= %s and status = 'pending' and external_tx_id <> all(%s)
+"""
+
+def drop_pending(cur, account_id, since, ext_ids):
+    """
+    Delete the account's pending rows posted on or after `since` that the fetch covering
+    them no longer returned: holds that were released instead of posting. Rows suppressed
+    as their duplicate or paired with them as a transfer are let go first (release()).
+    Returns rows deleted.
+    """
+    cur.execute(PENDING_SQL, (account_id, since, ext_ids))
+    gone = [r[0] for r in cur.fetchall()]
+    if not gone:
+        return 0
+    release(cur, gone)
+    cur.execute("delete from transactions where account_id = %s and posted_at >= %s and id = any(%s)",
+                (account_id, since, gone))
+    return cur.rowcount
+
+def store_account(cur, account_id, txs, covered):
+    """
+    store_transactions() plus drop_pending() over the days the fetch covered (skipped
+    when it returned no rows), and the rules for the new rows. Returns (inserted, updated, unchanged, dropped, categorized).
+    """
+    new = []
+    inserted, updated, unchanged = store_transactions(cur, account_id, txs, new)
+    ext_ids = [tx.get("id") for tx in txs if tx.get("id")]
+    # an empty (or id-less) answer says nothing about the holds: never read it as "all gone"
+    dropped = drop_pending(cur, account_id, covered, ext_ids) if ext_ids and covered else 0
+    categorized = rules.categorize(cur, new)
+    metrics.count_rows(inserted, "inserted")
+    metrics.count_rows(updated, "updated")
+    metrics.count_rows(unchanged, "unchanged")  # re-read rows that cost no write
+    metrics.count_rows(dropped, "dropped")
+    metrics.count_rows(categorized, "categorized")
+    return inserted, updated, unchanged, dropped, categorized
+
+SYNC_WINDOW_SQL = """
+  select ts.last_window_end
+  from teller_sync ts
+  join accounts a on a.id = ts.account_id
+  where a.external_id = %s
+"""
+
+def sync_window_start(cur, api_id, default_start):
+    """
+    Where to start fetching for an account: its last successful window end minus
+    OVERLAP_DAYS, so pending rows that posted since are re-read. Accounts never synced
+    fall back to default_start (TELLER_SINCE_DAYS).
+    """
+    cur.execute(SYNC_WINDOW_SQL, (f"teller:{api_id}",))
+    row = cur.fetchone()
+    if not row or row[0] is None:
+        return default_start
+    return row[0] - timedelta(days=OVERLAP_DAYS)
+
+KNOWN_TX_SQL = "select external_tx_id from tx_keys where account_id = %s and external_tx_id = any(%s)"
+
+def known_tx_ids(cur, account_id, ext_ids):
+    cur.execute(KNOWN_TX_SQL, (account_id, ext_ids))
+    return {r[0] for r in cur.fetchall()}
+
+def fetch_transactions(cur, s, api_id, account_id, start, stop_at_known=True):
+    """
+    Page through /transactions newest-first (count + from_id) and stop at the first page
+    whose ids are all already stored, or once a page reaches back past `start`. That page
+    is still returned so the overlap gets re-upserted. A refetch of a window that doesn't
+    reconcile (stop_at_known=False) pages past stored ids down to `start`. Returns
+    (transactions, pages, covered): every transaction posted on or after `covered` is
+    in the list (`start` when the pages ran out, else the day after the oldest one read,
+    None when no row had a date).
+    """
+    path = f"/accounts/{api_id}/transactions"
+    params = {"from": start.isoformat()}
+    if PAGE_SIZE:
+        params["count"] = PAGE_SIZE
+    out, pages = [], 0
+    while True:
+        page = jget(s, path, params=params)
+        if isinstance(page, dict) and "data" in page:
+            page = page["data"]
+        pages += 1
+        out.extend(page or [])
+        if not PAGE_SIZE or not page or len(page) < PAGE_SIZE:
+            return out, pages, start
+        ids = [tx.get("id") for tx in page if tx.get("id")]
+        if not ids or ids[-1] == params.get("from_id"):
+            break  # API ignored from_id; don't loop on the same page
+        if stop_at_known and len(known_tx_ids(cur, account_id, ids)) == len(ids):
+            break
+        oldest = min(str(tx.get("date") or "")[:10] for tx in page)
+        if oldest and oldest < start.isoformat():
+            break
+        params["from_id"] = ids[-1]
+    # the oldest day read may go on past the last page
+    days = [d for d in (str(tx.get("date") or "")[:10] for tx in out) if d]
+    return out, pages, date.fromisoformat(min(days)) + timedelta(days=1) if days else None
+
+def record_sync(cur, account_id, window_start, window_end):
     cur.execute("""
-      insert into transactions(account_id, posted_at, amount, currency, description, normalized_desc, external_tx_id)
-      values (%s,%s,%s,%s,%s,%s,%s)
-      on conflict (account_id, external_tx_id) do nothing
-      returning id
-    """, (account_id, posted, amt, curr, desc, ndesc(desc), ext))
-    return cur.fetchone() is not None
+      insert into teller_sync(account_id, last_polled_at, last_window_start, last_window_end)
+      values (%s, now(), %s, %s)
+      on conflict (account_id) do update set last_polled_at=excluded.last_polled_at,
+                                            last_window_start=excluded.last_window_start,
+                                            last_window_end=excluded.last_window_end
+    """, (account_id, window_start, window_end))
+
+class TokenCache:
+    """
+    Decrypted access tokens keyed by enrollment_id, each tagged with the token_version it
+    was decrypted from (0019 bumps it on every write to access_token_enc). A token is
+    decrypted again only when its version moves or after TOKEN_TTL. Plaintext is kept in
+    a bytearray and overwritten with zeros when the entry is evicted; the str handed to
+    the HTTP layer is short-lived, but Python gives no guarantee it is wiped.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._entries = {}  # enrollment_id -> (version, bytearray, expires_at)
+
+    def get(self, enrollment_id, version):
+        e = self._entries.get(enrollment_id)
+        if e is None:
+            return None
+        if e[0] != version or e[2] <= time.monotonic():
+            self.evict(enrollment_id)
+            return None
+        return e[1].decode("utf-8")
+
+    def put(self, enrollment_id, version, raw):
+        self.evict(enrollment_id)
+        self._entries[enrollment_id] = (version, bytearray(raw), time.monotonic() + self.ttl)
+
+    def evict(self, enrollment_id):
+        e = self._entries.pop(enrollment_id, None)
+        if e is not None:
+            buf = e[1]
+            buf[:] = bytes(len(buf))
+
+    def retain(self, enrollment_ids):
+        """Drop every enrollment not in enrollment_ids (deactivated or deleted)."""
+        for eid in [k for k in self._entries if k not in enrollment_ids]:
+            self.evict(eid)
+
+_TOKENS = TokenCache(TOKEN_TTL)
 
 def _load_tokens(cur):
-    """Return list of (enrollment_id_usr, access_token)."""
+    """
+    Return list of (enrollment_id_usr, access_token). Only tokens that are new, rotated or
+    past their TTL are decrypted; the rest come from _TOKENS.
+    """
     if ENV_TOKEN:
         return [("env", ENV_TOKEN)]
     if not FIN_ENC_KEY:
         raise RuntimeError("FIN_ENC_KEY is required to decrypt tokens from provider_enrollments.")
+    cur.execute("select enrollment_id, token_version from provider_enrollments where status='active'")
+    versions = dict(cur.fetchall())
+    _TOKENS.retain(versions)
+    tokens = {eid: _TOKENS.get(eid, v) for eid, v in versions.items()}
+    stale = [eid for eid, tok in tokens.items() if tok is None]
+    if stale:
+        cur.execute("""
+          select enrollment_id, token_version, pgp_sym_decrypt_bytea(access_token_enc, %s)
+          from provider_enrollments
+          where enrollment_id = any(%s) and status='active'
+        """, (FIN_ENC_KEY, stale))
+        for eid, version, raw in cur.fetchall():
+            _TOKENS.put(eid, version, raw)
+            tokens[eid] = _TOKENS.get(eid, version)
+        print(f"[sync] decrypted {len(stale)} of {len(versions)} enrollment token(s)")
+    return [(eid, tok) for eid, tok in tokens.items() if tok is not None]
+
+def classify_error(e):
+    """auth (401/403), rate_limit (429), client (other 4xx) or transient (5xx, network, anything else)."""
+    if isinstance(e, TellerError):
+        if e.status in (401, 403):
+            return "auth"
+        if e.status == 429:
+            return "rate_limit"
+        if e.status < 500:
+            return "client"
+    return "transient"
+
+def retry_delay(attempts, retry_after=None):
+    """
+    Seconds before try number attempts+1: RETRY_BASE doubled per failure up to RETRY_CAP,
+    with equal jitter so accounts that failed together don't retry together. A longer
+    Retry-After from the server wins.
+    """
+    delay = min(RETRY_CAP, RETRY_BASE * 2 ** max(0, attempts - 1))
+    delay = delay / 2 + random.uniform(0, delay / 2)
+    return max(delay, retry_after or 0.0)
+
+def fail_jobs(cur, api_id, job_ids, attempts, error_class, message, retry_after=None):
+    """Record a failed try for an account's jobs: back off, or dead-letter past the class's limit."""
+    attempts += 1
+    limit = PERMANENT_MAX_ATTEMPTS if error_class in ("auth", "client") else MAX_ATTEMPTS
+    dead = attempts >= limit
+    delay = 0.0 if dead else retry_delay(attempts, retry_after)
     cur.execute("""
-      select enrollment_id,
-             convert_from(pgp_sym_decrypt(access_token_enc, %s), 'utf8') as access_token
-      from provider_enrollments
-      where status='active'
-    """, (FIN_ENC_KEY,))
-    return [(r[0], r[1]) for r in cur.fetchall()]
+      update teller_jobs
+         set attempts = attempts + 1, last_error = %s, error_class = %s,
+             status = case when %s then 'failed' else status end,
+             run_after = now() + make_interval(secs => %s)
+       where id = any(%s)
+    """, (message[:500], error_class, dead, delay, job_ids))
+    metrics.count_rows(len(job_ids), "dead_lettered" if dead else "retried")
+    if dead:
+        print(f"[sync] dead-lettered {len(job_ids)} job(s) for {api_id} after {attempts} attempts ({error_class}): {message[:200]}",
+              file=sys.stderr)
+    else:
+        print(f"[sync] jobs {job_ids} failed ({error_class}, attempt {attempts}/{limit}), retry in {delay:.0f}s: {message[:200]}",
+              file=sys.stderr)
+
+# due jobs coalesced per account: never-failed accounts first, then at most RETRY_SLOTS retries
+DRAIN_JOBS_SQL = """
+  with due as (
+    select j.account_api_id, pa.enrollment_id,
+           array_agg(j.id order by j.id) as job_ids,
+           min(j.start_date) as start_date, max(j.end_date) as end_date,
+           merge_reasons(string_agg(j.enqueue_reason, ','), null) as reasons,
+           count(*) + coalesce(sum(j.coalesced_events), 0) as events,
+           max(j.attempts) as attempts, min(j.id) as first_id
+    from teller_jobs j
+    left join provider_accounts pa on pa.teller_account_id = j.account_api_id
+    where j.status = 'queued' and j.run_after <= now()
+    group by j.account_api_id, pa.enrollment_id
+  ), ranked as (
+    select *, row_number() over (partition by attempts > 0 order by attempts, first_id) as rn
+    from due
+  )
+  select account_api_id, enrollment_id, job_ids, start_date, end_date, reasons, events, attempts
+  from ranked
+  where attempts = 0 or rn <= %s
+  order by attempts > 0, attempts, first_id
+  limit %s
+"""
 
 def drain_jobs(cur, inst_id, window_start, window_end):
     """
-    Drain up to 50 jobs. Each job is tied to an enrollment (usr_...) via provider_accounts.
-    We must send X-Enrollment-Id for that usr_* on every Teller request.
+    Drain up to DRAIN_BATCH accounts' worth of due jobs. Each job is tied to an enrollment (usr_...)
+    via provider_accounts. We must send X-Enrollment-Id for that usr_* on every Teller request.
+
+    Due jobs for the same account are coalesced: one /accounts + transactions fetch covers
+    the widest window any of them asked for, and all of them are deleted on success.
+    Together with the webhook's debounced upsert (coalesced_events) this is what keeps a
+    noisy account from costing a full fetch per event.
+
+    Accounts that have never failed go first; accounts being retried fill what is left,
+    fewest attempts first and at most RETRY_SLOTS of them, so a handful of broken
+    enrollments can't take the batch. Failures back off per fail_jobs(); a 429 also
+    holds the rest of that enrollment's accounts until its Retry-After.
+    Returns (inserted, jobs drained).
     """
-    cur.execute("""
-      select j.id, j.account_api_id, pa.enrollment_id
-      from teller_jobs j
-      left join provider_accounts pa on pa.teller_account_id = j.account_api_id
-      where j.run_after <= now()
-      order by j.id
-      limit 50
-    """)
-    jobs = cur.fetchall()
-    if not jobs:
+    cur.execute(DRAIN_JOBS_SQL, (RETRY_SLOTS, DRAIN_BATCH))
+    groups = cur.fetchall()
+    if not groups:
         return 0, 0
 
     tokens = dict(_load_tokens(cur))
     inserted_total = 0
-    for job_id, api_id, enrollment_id in jobs:
+    job_count = 0
+    events_total = 0
+    held = {}  # enrollment_id -> seconds, after a 429 for that enrollment
+    for api_id, enrollment_id, job_ids, start, end, reasons, events, attempts in groups:
+        job_count += len(job_ids)
+        events_total += events
+        if enrollment_id in held:
+            cur.execute("update teller_jobs set run_after = greatest(run_after, now() + make_interval(secs => %s)) where id = any(%s)",
+                        (held[enrollment_id], job_ids))
+            continue
         token = tokens.get(enrollment_id) or tokens.get("env")
         if not token:
-            cur.execute("update teller_jobs set attempts=attempts+1, last_error=%s, run_after=now()+interval '10 minutes' where id=%s",
-                        ("no token found for enrollment", job_id))
+            fail_jobs(cur, api_id, job_ids, attempts, "auth", "no token found for enrollment")
             continue
 
-        s = http_for_token(token, enrollment_id)
+        # an explicit job window (enroll seed, backfill) can only widen the incremental one
+        cursor_start = sync_window_start(cur, api_id, window_start)
+        start = min(start, cursor_start) if start else cursor_start
+        end = max(end, window_end) if end else window_end
         try:
-            acct = jget(s, f"/accounts/{api_id}")
-            db_acct_id = upsert_account(cur, inst_id, acct)
-            if enrollment_id:
-                upsert_provider_account(cur, enrollment_id, acct)
+            # a savepoint per account: a failed statement rolls back this account's writes
+            # only, and fail_jobs() below still runs in a live transaction
+            with cur.connection.transaction():
+                # env-token jobs have no provider_accounts row; the sweep uses the same fallback
+                s = http_for_token(token, enrollment_id or os.getenv("TELLER_ENROLLMENT_ID", ""))
+                acct = jget(s, f"/accounts/{api_id}")
+                db_acct_id, _ = teller_store.upsert_account(cur, inst_id, acct, enrollment_id)
 
-            txs = jget(s, f"/accounts/{api_id}/transactions", params={"from": window_start.isoformat()})
-            inserted = sum(1 for tx in txs if upsert_tx(cur, db_acct_id, tx))
-            inserted_total += inserted
+                # pipeline/reconcile.py queues 'reconcile' windows: rows are missing behind stored ones
+                refetch = "reconcile" in (reasons or "").split(",")
+                txs, pages, covered = fetch_transactions(cur, s, api_id, db_acct_id, start, stop_at_known=not refetch)
+                inserted, updated, unchanged, dropped, categorized = store_account(cur, db_acct_id, txs, covered)
 
-            cur.execute("delete from teller_jobs where id=%s", (job_id,))
-            cur.execute("""
-              insert into teller_sync(account_id, last_polled_at, last_window_start, last_window_end)
-              values (%s, now(), %s, %s)
-              on conflict (account_id) do update set last_polled_at=excluded.last_polled_at,
-                                                    last_window_start=excluded.last_window_start,
-                                                    last_window_end=excluded.last_window_end
-            """, (db_acct_id, window_start, window_end))
-            print(f"[sync] drained job {job_id} for {api_id}: +{inserted}")
+                cur.execute("delete from teller_jobs where id = any(%s)", (job_ids,))
+                record_sync(cur, db_acct_id, start, end)
+            inserted_total += inserted
+            print(f"[sync] drained {len(job_ids)} job(s) ({events} events, {reasons or 'seeded'}) for {api_id}: "
+                  f"from={start} pages={pages} seen={len(txs)} +{inserted} ~{updated} -{dropped} "
+                  f"writes_avoided={unchanged} categorized={categorized}")
         except Exception as e:
-            cur.execute("update teller_jobs set attempts=attempts+1, last_error=%s, run_after=now()+interval '5 minutes' where id=%s",
-                        (str(e)[:500], job_id))
-            print(f"[sync] job {job_id} failed: {e}", file=sys.stderr)
+            teller_store.discard()  # ids cached by the rolled-back savepoint may not exist
+            error_class = classify_error(e)
+            retry_after = getattr(e, "retry_after", None)
+            fail_jobs(cur, api_id, job_ids, attempts, error_class, str(e), retry_after)
+            if error_class == "rate_limit":
+                held[enrollment_id] = retry_after or retry_delay(attempts + 1)
+
+    # every event would have cost an /accounts + /transactions pair without coalescing
+    saved = 2 * (events_total - len(groups))
+    print(f"[sync] coalesced events={events_total} jobs={job_count} fetches={len(groups)} upstream_calls_saved={saved}")
+    return inserted_total, job_count
 
-    return inserted_total, len(jobs)
+NEXT_DUE_SQL = "select extract(epoch from min(run_after) - now()) from teller_jobs where status = 'queued'"
+
+def next_due(conn):
+    """Seconds until the earliest queued job is due (0 if overdue), or None when the queue is empty."""
+    with conn.cursor() as cur:
+        cur.execute(NEXT_DUE_SQL)
+        delay = cur.fetchone()[0]
+    conn.commit()
+    return None if delay is None else max(0.0, float(delay))
 
 def sweep_all_enrollments(cur, inst_id, window_start, window_end):
     """
@@ -236,43 +583,70 @@ def sweep_all_enrollments(cur, inst_id, window_start, window_end):
         if isinstance(accounts, dict) and "data" in accounts:
             accounts = accounts["data"]
 
+        # one statement for the enrollment's changed accounts; unchanged ones are cached
+        ids = teller_store.upsert_accounts(cur, inst_id, accounts, enrollment_id if enrollment_id != "env" else None)
         for acct in accounts or []:
             api_id = acct.get("id")
             if not api_id:
                 continue
-            db_acct_id = upsert_account(cur, inst_id, acct)
-            if enrollment_id != "env":
-                upsert_provider_account(cur, enrollment_id, acct)
+            db_acct_id = ids[api_id][0]
             touched_total += 1
+            start = sync_window_start(cur, api_id, window_start)
             try:
-                txs = jget(s, f"/accounts/{api_id}/transactions", params={"from": window_start.isoformat()})
+                txs, pages, covered = fetch_transactions(cur, s, api_id, db_acct_id, start)
             except Exception as e:
                 print(f"[sync] warn fetch {api_id}: {e}", file=sys.stderr)
                 continue
-            inserted = sum(1 for tx in txs if upsert_tx(cur, db_acct_id, tx))
+            inserted, updated, unchanged, dropped, categorized = store_account(cur, db_acct_id, txs, covered)
             inserted_total += inserted
-            cur.execute("""
-              insert into teller_sync(account_id, last_polled_at, last_window_start, last_window_end)
-              values (%s, now(), %s, %s)
-              on conflict (account_id) do update set last_polled_at=excluded.last_polled_at,
-                                                    last_window_start=excluded.last_window_start,
-                                                    last_window_end=excluded.last_window_end
-            """, (db_acct_id, window_start, window_end))
-            print(f"[sync] sweep {api_id}: +{inserted}")
+            record_sync(cur, db_acct_id, start, window_end)
+            print(f"[sync] sweep {api_id}: from={start} pages={pages} seen={len(txs)} +{inserted} ~{updated} -{dropped} "
+                  f"writes_avoided={unchanged} categorized={categorized}")
     return touched_total, inserted_total
 
-def main():
+def log_http_reuse():
+    """Connection reuse of the shared Teller client since the process started."""
+    import teller_http
+    st = teller_http.stats()
+    if st and st["requests"]:
+        print(f"[sync] teller http requests={st['requests']} connections={st['connections']} "
+              f"reused={st['reused']} ({st['reuse_pct']}%)")
+
+@metrics.job("teller")
+def run(conn, sweep=True):
+    """
+    Drain queued jobs; when the queue is empty, fall back to a full sweep unless
+    sweep=False (the pipeline daemon drains on NOTIFY and sweeps on its own timer).
+    Returns the number of new transactions.
+    """
     window_end = date.today()
     window_start = window_end - timedelta(days=SINCE_DAYS)
-    with pg() as conn, conn.cursor() as cur:
-        inst_id = ensure_institution(cur)
-        inserted, job_count = drain_jobs(cur, inst_id, window_start, window_end)
-        if job_count == 0:
-            touched, ins = sweep_all_enrollments(cur, inst_id, window_start, window_end)
-            print(f"[sync] sweep done: accounts={touched}, new={ins}")
-        else:
-            print(f"[sync] drained jobs: new={inserted}, jobs={job_count}")
-        conn.commit()
+    try:
+        with conn.cursor() as cur:
+            inst_id = teller_store.ensure_institution(cur)
+            inserted, job_count = drain_jobs(cur, inst_id, window_start, window_end)
+            if job_count:
+                print(f"[sync] drained jobs: new={inserted}, jobs={job_count}")
+            elif sweep:
+                touched, inserted = sweep_all_enrollments(cur, inst_id, window_start, window_end)
+                print(f"[sync] sweep done: accounts={touched}, new={inserted}")
+            conn.commit()
+    except BaseException:
+        teller_store.discard()  # the caller rolls back; cached ids from this run never existed
+        raise
+    teller_store.committed()
+    if job_count or sweep:
+        log_http_reuse()
+    return inserted
+
+@profiling.profiled("teller-sync")
+def main():
+    metrics.set_service("teller-sync")
+    try:
+        with pg() as conn:
+            run(conn)
+    finally:
+        metrics.push()
 
 if __name__ == "__main__":
     try:
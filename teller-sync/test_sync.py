@@ -0,0 +1,257 @@
+from datetime import date, timedelta
+from decimal import Decimal as D
+
+import pytest
+
+import sync
+import teller_store
+from conftest import teller_account
+from sync import TellerError, TokenCache, classify_error, retry_delay
+
+TODAY = date.today()
+
+
+def test_classify_error():
+    assert classify_error(TellerError(401, "/accounts", "")) == "auth"
+    assert classify_error(TellerError(403, "/accounts", "")) == "auth"
+    assert classify_error(TellerError(429, "/accounts", "", retry_after=30)) == "rate_limit"
+    assert classify_error(TellerError(404, "/accounts", "")) == "client"
+    assert classify_error(TellerError(502, "/accounts", "")) == "transient"
+    assert classify_error(ConnectionError("reset")) == "transient"
+    assert classify_error(ZeroDivisionError()) == "transient"
+
+
+def test_retry_delay_doubles_with_jitter_up_to_the_cap(monkeypatch):
+    monkeypatch.setattr(sync, "RETRY_BASE", 60)
+    monkeypatch.setattr(sync, "RETRY_CAP", 600)
+    for attempts, full in ((1, 60), (2, 120), (3, 240), (4, 480), (5, 600), (20, 600)):
+        for _ in range(20):
+            assert full / 2 <= retry_delay(attempts) <= full
+    assert 30 <= retry_delay(0) <= 60
+
+
+def test_retry_delay_longer_retry_after_wins(monkeypatch):
+    monkeypatch.setattr(sync, "RETRY_BASE", 60)
+    assert retry_delay(1, retry_after=3600) == 3600
+    assert retry_delay(1, retry_after=1) >= 30
+
+
+def test_token_cache_hit_and_version_change():
+    cache = TokenCache(ttl=60)
+    assert cache.get("usr_1", 1) is None
+    cache.put("usr_1", 1, b"token_abc")
+    assert cache.get("usr_1", 1) == "token_abc"
+    buf = cache._entries["usr_1"][1]
+    # rotated: the old plaintext is wiped and the caller decrypts again
+    assert cache.get("usr_1", 2) is None
+    assert buf == bytearray(9) and "usr_1" not in cache._entries
+
+
+def test_token_cache_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(sync.time, "monotonic", lambda: now[0])
+    cache = TokenCache(ttl=60)
+    cache.put("usr_1", 1, b"token_abc")
+    now[0] += 59
+    assert cache.get("usr_1", 1) == "token_abc"
+    now[0] += 1
+    assert cache.get("usr_1", 1) is None
+
+
+def test_token_cache_put_and_retain_wipe_what_they_drop():
+    cache = TokenCache(ttl=60)
+    cache.put("usr_1", 1, b"old")
+    old = cache._entries["usr_1"][1]
+    cache.put("usr_1", 2, b"new")
+    assert old == bytearray(3)
+    cache.put("usr_2", 1, b"other")
+    gone = cache._entries["usr_2"][1]
+    cache.retain({"usr_1": 2})
+    assert gone == bytearray(5)
+    assert list(cache._entries) == ["usr_1"] and cache.get("usr_1", 2) == "new"
+
+
+def test_load_tokens_decrypts_only_new_or_rotated(db, monkeypatch, capsys):
+    monkeypatch.setattr(sync, "ENV_TOKEN", None)
+    monkeypatch.setattr(sync, "FIN_ENC_KEY", "k")
+    monkeypatch.setattr(sync, "_TOKENS", TokenCache(ttl=60))
+    with db.cursor() as cur:
+        cur.execute("update provider_enrollments set status = 'inactive'")
+        cur.execute("""
+          insert into provider_enrollments(enrollment_id, environment, access_token_enc)
+          values ('usr_tok_1', 'sandbox', pgp_sym_encrypt('token_1', 'k')),
+                 ('usr_tok_2', 'sandbox', pgp_sym_encrypt('token_2', 'k'))
+        """)
+        assert sorted(sync._load_tokens(cur)) == [("usr_tok_1", "token_1"), ("usr_tok_2", "token_2")]
+        assert "decrypted 2 of 2" in capsys.readouterr().out
+        assert sorted(sync._load_tokens(cur)) == [("usr_tok_1", "token_1"), ("usr_tok_2", "token_2")]
+        assert "decrypted" not in capsys.readouterr().out
+        cur.execute("update provider_enrollments set access_token_enc = pgp_sym_encrypt('token_1b', 'k') "
+                    "where enrollment_id = 'usr_tok_1'")
+        cur.execute("update provider_enrollments set status = 'inactive' where enrollment_id = 'usr_tok_2'")
+        assert sync._load_tokens(cur) == [("usr_tok_1", "token_1b")]
+        assert "decrypted 1 of 1" in capsys.readouterr().out
+        assert list(sync._TOKENS._entries) == ["usr_tok_1"]
+
+
+def test_drain_jobs_failed_account_keeps_the_others(db, monkeypatch):
+    """A statement failing for one account rolls back that account only; its jobs back off."""
+    with db.cursor() as cur:
+        apis = ["acc_drain_1", "acc_drain_2", "acc_drain_3"]
+        ids = {api: teller_account(cur, api, f"80{i}") for i, api in enumerate(apis)}
+        for api in apis:
+            cur.execute("insert into teller_jobs(provider_account_id, account_api_id, start_date, end_date) "
+                        "values (%s, %s, %s, %s)", (ids[api][1], api, TODAY - timedelta(days=3), TODAY))
+        bad = ids["acc_drain_2"][0]
+
+        def fetch(cur, s, api_id, account_id, start, stop_at_known=True):
+            tx = {"id": f"tx_{api_id}", "date": str(TODAY), "amount": "-12.50", "description": "COFFEE",
+                  "status": "posted", "running_balance": "100.00"}
+            return [tx], 1, start
+
+        store = sync.store_transactions
+
+        def store_failing(cur, account_id, txs, new=None):
+            result = store(cur, account_id, txs, new)
+            if account_id == bad:
+                cur.execute("select 1 / 0")  # aborts the transaction, as any SQL error would
+            return result
+
+        monkeypatch.setattr(sync, "ENV_TOKEN", "token")
+        monkeypatch.setattr(sync, "http_for_token", lambda token, enrollment: None)
+        monkeypatch.setattr(sync, "jget", lambda s, path, params=None: {
+            "id": path.rsplit("/", 1)[1], "name": "Checking", "type": "depository", "subtype": "checking",
+            "last_four": "80" + str(apis.index(path.rsplit("/", 1)[1]))})
+        monkeypatch.setattr(sync, "fetch_transactions", fetch)
+        monkeypatch.setattr(sync, "store_transactions", store_failing)
+
+        inserted, drained = sync.drain_jobs(cur, teller_store.ensure_institution(cur), TODAY - timedelta(days=30), TODAY)
+        assert (inserted, drained) == (2, 3)
+
+        cur.execute("select account_id from transactions where account_id = any(%s) order by account_id",
+                    ([ids[a][0] for a in apis],))
+        assert [r[0] for r in cur.fetchall()] == [ids["acc_drain_1"][0], ids["acc_drain_3"][0]]
+        cur.execute("select account_api_id, status, attempts, error_class, last_error from teller_jobs "
+                    "where account_api_id = any(%s)", (apis,))
+        (api, status, attempts, error_class, last_error), = cur.fetchall()
+        assert (api, status, attempts, error_class) == ("acc_drain_2", "queued", 1, "transient")
+        assert "division by zero" in last_error
+        cur.execute("select account_id from teller_sync where account_id = %s", (bad,))
+        assert cur.fetchall() == []
+
+
+def payload(ext, amount="-12.50", description="COFFEE", status="pending", balance=None, day=TODAY):
+    return {"id": ext, "date": str(day), "amount": amount, "description": description, "status": status,
+            "running_balance": balance}
+
+
+class Recording:
+    """A cursor that keeps the statements it ran."""
+
+    def __init__(self, cur):
+        self.cur, self.executed = cur, []
+
+    def execute(self, sql, params=None):
+        self.executed.append(sql)
+        return self.cur.execute(sql, params)
+
+    def __getattr__(self, name):
+        return getattr(self.cur, name)
+
+
+def stored(cur, account_id):
+    cur.execute("select id, external_tx_id, amount, description, status, balance_after from transactions "
+                "where account_id = %s order by external_tx_id", (account_id,))
+    return cur.fetchall()
+
+
+def queued(cur, table, ids):
+    cur.execute(f"select transaction_id from {table} where transaction_id = any(%s) order by 1", (list(ids),))
+    return [r[0] for r in cur.fetchall()]
+
+
+@pytest.fixture
+def no_merchants(monkeypatch):
+    # merchants.resolve() writes on a connection of its own, outside the rolled-back transaction
+    monkeypatch.setattr(sync.merchants, "resolve", lambda norm: None)
+
+
+def test_store_transactions_posting_updates_only_what_changed(db, no_merchants):
+    with db.cursor() as cur:
+        account_id, _ = teller_account(cur, "acc_store_1", "7001")
+        new = []
+        assert sync.store_transactions(cur, account_id, [payload("tx_s1")], new) == (1, 0, 0)
+        (tx_id, *_), = stored(cur, account_id)
+        assert [n[0] for n in new] == [tx_id]
+        assert sync.store_transactions(cur, account_id, [payload("tx_s1"), payload("tx_s1")]) == (0, 0, 1)
+
+        cur.execute("delete from tx_recurring_queue")
+        rec = Recording(cur)
+        posted = payload("tx_s1", status="posted", balance="87.50")
+        assert sync.store_transactions(rec, account_id, [posted]) == (0, 1, 0)
+        update, = [sql for sql in rec.executed if sql.startswith("update transactions")]
+        assert update.startswith("update transactions set balance_after = %s, status = %s, fingerprint = %s,")
+        assert stored(cur, account_id) == [(tx_id, "tx_s1", D("-12.50"), "COFFEE", "posted", D("87.50"))]
+        # neither the amount nor the date moved: no pairing is looked at again
+        assert queued(cur, "tx_recurring_queue", [tx_id]) == []
+
+
+def test_store_transactions_new_amount_moves_rule_splits_and_releases_pairings(db, no_merchants):
+    with db.cursor() as cur:
+        account_id, _ = teller_account(cur, "acc_store_2", "7002")
+        sync.store_transactions(cur, account_id, [payload("tx_s2"), payload("tx_s3", amount="12.50")])
+        (tx_id, *_), (other, *_) = stored(cur, account_id)
+        cur.execute("insert into tx_splits(transaction_id, amount, note) values (%s, -12.50, 'rule:1'), "
+                    "(%s, -2.50, 'tip')", (tx_id, tx_id))
+        cur.execute("insert into tx_duplicates(transaction_id, duplicate_of, score, status) "
+                    "values (%s, %s, 1.0, 'suppressed')", (other, tx_id))
+        cur.execute("update transactions set duplicate_of = %s where id = %s", (tx_id, other))
+        cur.execute("insert into tx_transfers(transaction_id, counterpart_id, days, status) "
+                    "values (%s, %s, 0, 'matched')", (tx_id, other))
+        cur.execute("delete from tx_dedupe_queue; delete from tx_transfer_queue; delete from tx_recurring_queue")
+
+        assert sync.store_transactions(cur, account_id, [payload("tx_s2", amount="-14.75", status="posted")]) == (0, 1, 0)
+        cur.execute("select note, amount from tx_splits where transaction_id = %s order by note", (tx_id,))
+        assert cur.fetchall() == [("rule:1", D("-14.75")), ("tip", D("-2.50"))]
+        cur.execute("select count(*) from tx_duplicates where duplicate_of = %s", (tx_id,))
+        assert cur.fetchone()[0] == 0
+        cur.execute("select count(*) from tx_transfers where transaction_id = %s", (tx_id,))
+        assert cur.fetchone()[0] == 0
+        cur.execute("select duplicate_of from transactions where id = %s", (other,))
+        assert cur.fetchone()[0] is None
+        assert queued(cur, "tx_dedupe_queue", [tx_id, other]) == sorted([tx_id, other])
+        assert queued(cur, "tx_transfer_queue", [tx_id, other]) == sorted([tx_id, other])
+        assert queued(cur, "tx_recurring_queue", [tx_id, other]) == [tx_id]
+
+
+def test_store_transactions_new_description_drops_rule_splits(db, no_merchants):
+    with db.cursor() as cur:
+        account_id, _ = teller_account(cur, "acc_store_3", "7003")
+        sync.store_transactions(cur, account_id, [payload("tx_s4"), payload("tx_s5")])
+        (bare, *_), (manual, *_) = stored(cur, account_id)
+        cur.execute("insert into tx_splits(transaction_id, amount, note) values (%s, -12.50, 'ml:0.93'), "
+                    "(%s, -12.50, 'rule:1'), (%s, -12.50, 'mine')", (bare, manual, manual))
+        new = []
+        renamed = [payload(ext, description="BLUE BOTTLE", status="posted") for ext in ("tx_s4", "tx_s5")]
+        assert sync.store_transactions(cur, account_id, renamed, new) == (0, 2, 0)
+        cur.execute("select transaction_id, note from tx_splits where transaction_id = any(%s)", ([bare, manual],))
+        assert cur.fetchall() == [(manual, "mine")]
+        # only the row left without a split goes back to the rules
+        assert new == [(bare, "BLUE BOTTLE", D("-12.50"))]
+
+
+def test_store_account_drops_released_holds_but_not_on_an_empty_fetch(db, no_merchants):
+    with db.cursor() as cur:
+        account_id, _ = teller_account(cur, "acc_store_4", "7004")
+        old = TODAY - timedelta(days=10)
+        sync.store_transactions(cur, account_id, [payload("tx_s6"), payload("tx_s7"), payload("tx_s8", day=old),
+                                                  payload("tx_s9", status="posted", balance="50.00")])
+        assert [r[1] for r in stored(cur, account_id)] == ["tx_s6", "tx_s7", "tx_s8", "tx_s9"]
+
+        # nothing came back: the holds stay
+        assert sync.store_account(cur, account_id, [], TODAY - timedelta(days=3))[3] == 0
+        assert len(stored(cur, account_id)) == 4
+
+        # tx_s7 was released; tx_s8 is older than the fetch covered, tx_s9 is not pending
+        assert sync.store_account(cur, account_id, [payload("tx_s6")], TODAY - timedelta(days=3))[3] == 1
+        assert [r[1] for r in stored(cur, account_id)] == ["tx_s6", "tx_s8", "tx_s9"]
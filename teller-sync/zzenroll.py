@@ -172,6 +172,7 @@ def main():
                 continue
             prov_id = upsert_provider_account(cur, acct)
             app_acct_id = upsert_app_account(cur, inst_id, acct)
+            cur.execute("update provider_accounts set account_id = %s where id = %s", (app_acct_id, prov_id))
             seed_initial_job(cur, prov_id, api_id, window_start, window_end)
             count += 1
 
@@ -1,7 +1,9 @@
-import os, hmac, hashlib, json
+import os, hmac, hashlib, json, asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import JSONResponse
-import psycopg
+from fastapi.responses import JSONResponse, PlainTextResponse
+from psycopg_pool import AsyncConnectionPool
+import metrics
 
 DB_DSN = (
     f"host={os.environ['POSTGRES_HOST']} "
@@ -12,7 +14,128 @@ DB_DSN = (
 )
 WEBHOOK_SECRET = os.environ["TELLER_WEBHOOK_SECRET"].encode("utf-8")
 
-app = FastAPI(title="Teller Webhook", version="0.1.0")
+# Events are acked only once their batch is committed, so a flush window of a few ms
+# is the whole latency cost of coalescing a burst into one statement.
+FLUSH_SECONDS = float(os.getenv("WEBHOOK_FLUSH_MS", "5")) / 1000.0
+FLUSH_MAX = int(os.getenv("WEBHOOK_FLUSH_MAX", "500"))
+POOL_MAX = int(os.getenv("WEBHOOK_POOL_MAX", "4"))
+# Debounce: each event holds the account's job until it has been quiet this long,
+# but never longer than MAX_HOLD after the job was first queued.
+QUIET_SECONDS = int(os.getenv("TELLER_JOB_QUIET_SECONDS", "60"))
+MAX_HOLD_SECONDS = int(os.getenv("TELLER_JOB_MAX_HOLD_SECONDS", "900"))
+
+# One open webhook job per account (uq_teller_jobs_webhook_account, 0031). A new event
+# merges into it; greatest() keeps any retry backoff drain_jobs already set. A job that
+# was dead-lettered (status 'failed') no longer holds the slot, so the next event queues
+# a fresh job and the dead one waits for teller-sync/jobs.py.
+UPSERT_JOBS = """
+  insert into teller_jobs(account_api_id, enqueue_reason, coalesced_events, run_after)
+  select a, r, n - 1, now() + make_interval(secs => %(quiet)s)
+  from unnest(%(accounts)s::text[], %(reasons)s::text[], %(counts)s::int[]) as u(a, r, n)
+  on conflict (account_api_id) where start_date is null and status in ('queued', 'running') do update set
+    enqueue_reason   = merge_reasons(teller_jobs.enqueue_reason, excluded.enqueue_reason),
+    coalesced_events = teller_jobs.coalesced_events + excluded.coalesced_events + 1,
+    run_after        = greatest(teller_jobs.run_after,
+                                least(excluded.run_after,
+                                      teller_jobs.created_at + make_interval(secs => %(max_hold)s)))
+"""
+
+
+class JobBatcher:
+    """Collects enqueue requests and writes each burst as one multi-row upsert."""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.queue = asyncio.Queue()
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        rest = []
+        while not self.queue.empty():
+            rest.append(self.queue.get_nowait())
+        if rest:
+            await self._flush(rest)
+
+    async def submit(self, account_api_id, reason):
+        """Queue a job and wait until the batch holding it is committed."""
+        fut = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((account_api_id, reason, fut))
+        await fut
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + FLUSH_SECONDS
+            while len(batch) < FLUSH_MAX:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self._flush(batch)
+
+    async def _flush(self, batch):
+        reasons, counts = {}, {}
+        for account_api_id, reason, _ in batch:
+            reasons.setdefault(account_api_id, set()).add(reason)
+            counts[account_api_id] = counts.get(account_api_id, 0) + 1
+        params = {
+            "accounts": list(reasons),
+            "reasons": [",".join(sorted(r)) for r in reasons.values()],
+            "counts": [counts[a] for a in reasons],
+            "quiet": QUIET_SECONDS,
+            "max_hold": MAX_HOLD_SECONDS,
+        }
+        metrics.inc(metrics.ROWS, len(batch), stage="webhook", kind="event")
+        metrics.inc(metrics.ROWS, len(reasons), stage="webhook", kind="job_upsert")
+        try:
+            async with self.pool.connection() as conn:
+                await conn.execute(UPSERT_JOBS, params)
+        except Exception as e:
+            metrics.inc(metrics.ROWS, len(batch), stage="webhook", kind="flush_failed")
+            print(f"[webhook] flush of {len(batch)} events failed: {e}")
+            for *_, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        for *_, fut in batch:
+            if not fut.done():
+                fut.set_result(None)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    pool = AsyncConnectionPool(DB_DSN, min_size=1, max_size=POOL_MAX, open=False,
+                               kwargs={"cursor_factory": metrics.AsyncTimedCursor})
+    await pool.open()
+    app.state.batcher = JobBatcher(pool)
+    app.state.batcher.start()
+    try:
+        yield
+    finally:
+        await app.state.batcher.stop()
+        await pool.close()
+
+
+metrics.set_service("teller-webhook")
+app = FastAPI(title="Teller Webhook", version="0.1.0", lifespan=lifespan)
+app.middleware("http")(metrics.http_middleware)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
 
 def verify_sig(body: bytes, sig_header: str | None):
     if not sig_header:
@@ -28,6 +151,7 @@ def verify_sig(body: bytes, sig_header: str | None):
 @app.post("/teller/webhook")
 async def webhook(request: Request):
     raw = await request.body()
+    metrics.count_bytes(len(raw), "webhook")
     sig = request.headers.get("Teller-Signature") or request.headers.get("X-Teller-Signature")
     if not verify_sig(raw, sig):
         raise HTTPException(status_code=401, detail="bad signature")
@@ -44,12 +168,10 @@ async def webhook(request: Request):
         return JSONResponse({"status": "ignored"}, status_code=200)
 
     reason = evt.get("type") or "unknown"
-    with psycopg.connect(DB_DSN) as conn, conn.cursor() as cur:
-        cur.execute("""
-          insert into teller_jobs(account_api_id, enqueue_reason)
-          values (%s, %s)
-          on conflict (account_api_id) do nothing
-        """, (account_api_id, reason))
-        conn.commit()
+    try:
+        await request.app.state.batcher.submit(account_api_id, reason)
+    except Exception:
+        # non-2xx makes Teller redeliver, which is what we want if the write didn't land
+        raise HTTPException(status_code=503, detail="enqueue failed")
 
     return {"status": "enqueued", "account_api_id": account_api_id}
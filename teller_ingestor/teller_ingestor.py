@@ -3,6 +3,9 @@ from datetime import date, timedelta, datetime
 from decimal import Decimal, InvalidOperation
 import requests
 import psycopg
+import teller_store
+import merchants
+import rules
 
 DB_DSN = (
     f"host={os.environ['POSTGRES_HOST']} "
@@ -16,7 +19,9 @@ BASE_URL = os.getenv("TELLER_BASE_URL", "https://api.teller.io").rstrip("/")
 CERT_PATH = os.environ["TELLER_CERT"]
 KEY_PATH = os.environ["TELLER_KEY"]
 CA_PATH = os.getenv("TELLER_CA_PATH", "/etc/ssl/certs/ca-certificates.crt")
-SINCE_DAYS = int(os.getenv("TELLER_SINCE_DAYS", "30"))
+SINCE_DAYS = int(os.getenv("TELLER_SINCE_DAYS", "30"))      # first sync of an account with no cursor
+OVERLAP_DAYS = int(os.getenv("TELLER_OVERLAP_DAYS", "5"))    # re-read this much before the cursor (pending -> posted)
+PAGE_SIZE = int(os.getenv("TELLER_PAGE_SIZE", "100"))        # 0 = ask for everything in one call
 
 UA = "finance-os/0.1 (teller-ingestor)"
 
@@ -41,59 +46,6 @@ def get_json(s: requests.Session, path: str, params=None):
     except Exception as e:
         raise RuntimeError(f"Bad JSON from {path}: {e}; body[:200]={r.text[:200]}")
 
-def ensure_institution(cur) -> int:
-    cur.execute("""
-        insert into institutions(name, external_id)
-        values ('TELLER', 'teller')
-        on conflict (name) do nothing
-        returning id
-    """)
-    row = cur.fetchone()
-    if row:
-        return row[0]
-    cur.execute("select id from institutions where external_id = 'teller'")
-    return cur.fetchone()[0]
-
-def map_type(teller_type: str, subtype: str | None) -> str | None:
-    t = (teller_type or "").lower()
-    st = (subtype or "").lower() if subtype else ""
-    # shove into our enum: checking|savings|credit|loan|investment|cash
-    if t in ("depository", "bank", "cash"):
-        if "checking" in st:
-            return "checking"
-        if "savings" in st:
-            return "savings"
-        return "checking"
-    if t in ("credit", "card", "credit_card"):
-        return "credit"
-    if t in ("loan", "mortgage"):
-        return "loan"
-    if t in ("investment", "brokerage"):
-        return "investment"
-    return None
-
-def upsert_account(cur, inst_id: int, acct: dict) -> int:
-    # Teller typical fields
-    acc_id = acct.get("id")
-    name = acct.get("name") or acct.get("official_name") or acct.get("account") or "Account"
-    last4 = acct.get("last_four") or acct.get("last4") or acct.get("last4_digits")
-    a_type = map_type(acct.get("type"), acct.get("subtype"))
-    currency = (acct.get("currency") or "USD").upper()[:3]
-
-    cur.execute("""
-      insert into accounts(institution_id, name, type, currency, mask, external_id, is_active)
-      values (%s, %s, %s, %s, %s, %s, true)
-      on conflict (external_id) do update
-        set institution_id = excluded.institution_id,
-            name = excluded.name,
-            type = coalesce(excluded.type, accounts.type),
-            currency = excluded.currency,
-            mask = excluded.mask,
-            is_active = true
-      returning id
-    """, (inst_id, name, a_type, currency, last4, f"teller:{acc_id}"))
-    return cur.fetchone()[0]
-
 def parse_amount(v) -> Decimal:
     if isinstance(v, (int, float)):
         return Decimal(str(v)).quantize(Decimal("0.01"))
@@ -106,12 +58,7 @@ def parse_amount(v) -> Decimal:
                 return (Decimal(v) / Decimal(100)).quantize(Decimal("0.01"))
     raise ValueError(f"bad amount: {v!r}")
 
-def normalize_desc(s: str | None) -> str:
-    if not s:
-        return ""
-    return " ".join(s.strip().split()).upper()
-
-def upsert_tx(cur, account_id: int, tx: dict) -> bool:
+def upsert_tx(cur, account_id: int, tx: dict, new: list = None) -> bool:
     # Common Teller fields
     ext_id = tx.get("id")
     # date field names vary; try a few
@@ -127,35 +74,64 @@ def upsert_tx(cur, account_id: int, tx: dict) -> bool:
         or "Transaction"
     amount = parse_amount(tx.get("amount"))
     curr = (tx.get("currency") or "USD").upper()[:3]
+    norm = merchants.normalize_desc(desc)
 
     cur.execute("""
-      insert into transactions (account_id, posted_at, amount, currency, description, normalized_desc, external_tx_id)
-      values (%s, %s, %s, %s, %s, %s, %s)
-      on conflict (account_id, external_tx_id) do nothing
+      insert into transactions (account_id, posted_at, amount, currency, description, normalized_desc, external_tx_id, merchant_id)
+      values (%s, %s, %s, %s, %s, %s, %s, %s)
       returning id
-    """, (account_id, posted, amount, curr, desc, normalize_desc(desc), ext_id))
-    return cur.fetchone() is not None
+    """, (account_id, posted, amount, curr, desc, norm, ext_id, merchants.resolve(norm)))
+    row = cur.fetchone()
+    if row and new is not None:
+        new.append((row[0], norm, amount))  # for rules.categorize()
+    return row is not None
+
+def sync_window_start(cur, account_id: int, default_start: date) -> date:
+    # resume from the last successful window, minus an overlap for pending -> posted changes
+    cur.execute("select last_window_end from teller_sync where account_id = %s", (account_id,))
+    row = cur.fetchone()
+    if not row or row[0] is None:
+        return default_start
+    return row[0] - timedelta(days=OVERLAP_DAYS)
+
+def known_tx_ids(cur, account_id: int, ext_ids: list) -> set:
+    cur.execute("select external_tx_id from tx_keys where account_id = %s and external_tx_id = any(%s)",
+                (account_id, ext_ids))
+    return {r[0] for r in cur.fetchall()}
 
-def fetch_transactions(s: requests.Session, account_api_id: str, window_start: date):
+def fetch_transactions(s: requests.Session, cur, account_api_id: str, account_id: int, window_start: date):
     # Prefer query param "from" YYYY-MM-DD; if API complains, adjust to your version.
+    # Pages come newest-first (count + from_id); stop at the first page we already fully have.
     params = {"from": window_start.isoformat()}
+    if PAGE_SIZE:
+        params["count"] = PAGE_SIZE
     path = f"/accounts/{account_api_id}/transactions"
-    data = get_json(s, path, params=params)
-    if isinstance(data, dict) and "data" in data:
-        data = data["data"]
-    if not isinstance(data, list):
-        raise RuntimeError(f"unexpected tx payload for {account_api_id}: {type(data)}")
-    return data
+    out = []
+    while True:
+        data = get_json(s, path, params=params)
+        if isinstance(data, dict) and "data" in data:
+            data = data["data"]
+        if not isinstance(data, list):
+            raise RuntimeError(f"unexpected tx payload for {account_api_id}: {type(data)}")
+        out.extend(data)
+        if not PAGE_SIZE or len(data) < PAGE_SIZE:
+            break
+        ids = [tx.get("id") for tx in data if tx.get("id")]
+        if not ids or ids[-1] == params.get("from_id"):
+            break
+        if len(known_tx_ids(cur, account_id, ids)) == len(ids):
+            break
+        oldest = min(str(tx.get("date") or "")[:10] for tx in data)
+        if oldest and oldest < window_start.isoformat():
+            break
+        params["from_id"] = ids[-1]
+    return out
 
 def main():
     s = http()
     window_end = date.today()
     window_start = window_end - timedelta(days=SINCE_DAYS)
 
-    with pg() as conn, conn.cursor() as cur:
-        inst_id = ensure_institution(cur)
-        conn.commit()
-
     accounts = get_json(s, "/accounts")
     if isinstance(accounts, dict) and "data" in accounts:
         accounts = accounts["data"]
@@ -164,33 +140,37 @@ def main():
     touched_accounts = 0
 
     with pg() as conn, conn.cursor() as cur:
-        inst_id = ensure_institution(cur)
+        inst_id = teller_store.ensure_institution(cur)
+        ids = teller_store.upsert_accounts(cur, inst_id, accounts)
 
         for acct in accounts:
             api_id = acct.get("id")
             if not api_id:
                 continue
 
-            db_acct_id = upsert_account(cur, inst_id, acct)
+            db_acct_id = ids[api_id][0]
             touched_accounts += 1
 
-            # Pull a rolling window; dedupe on insert with unique index
+            # Pull from the account's cursor; dedupe on insert with unique index
+            start = sync_window_start(cur, db_acct_id, window_start)
             try:
-                txs = fetch_transactions(s, api_id, window_start)
+                txs = fetch_transactions(s, cur, api_id, db_acct_id, start)
             except Exception as e:
                 print(f"[teller] warn: account {api_id} fetch failed: {e}", file=sys.stderr)
                 continue
 
             inserted = 0
+            new = []
             for tx in txs:
                 try:
-                    if upsert_tx(cur, db_acct_id, tx):
+                    if upsert_tx(cur, db_acct_id, tx, new):
                         inserted += 1
                         created += 1
                 except Exception as e:
                     # keep going; one bad tx shouldn't nuke the batch
                     print(f"[teller] skip tx error: {e}", file=sys.stderr)
                     continue
+            categorized = rules.categorize(cur, new)
 
             # sync metadata
             cur.execute("""
@@ -200,8 +180,8 @@ def main():
                 set last_polled_at = excluded.last_polled_at,
                     last_window_start = excluded.last_window_start,
                     last_window_end = excluded.last_window_end
-            """, (db_acct_id, window_start, window_end))
-            print(f"[teller] account {api_id}: +{inserted} new")
+            """, (db_acct_id, start, window_end))
+            print(f"[teller] account {api_id}: from={start} seen={len(txs)} +{inserted} new, {categorized} categorized")
 
         conn.commit()
 